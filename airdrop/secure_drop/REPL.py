@@ -1,8 +1,11 @@
 import os
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
-from secure_drop import commands, utils
+from secure_drop import commands, constants, utils
+from secure_drop.networking.compression import Compression
+from secure_drop.singletons.BandwidthManager import Direction
 from secure_drop.singletons.NetworkManager import NetworkManager
+from secure_drop.singletons.TransferScheduler import TransferScheduler
 
 
 class REPL:
@@ -54,20 +57,28 @@ class REPL:
         elif command == "list":
             commands.list_contacts()
         elif command == "send":
-            if len(args) != 2:
-                print("Usage: send <contact-email> <file>")
+            self.__execute_send(args)
+        elif command == "queue":
+            commands.list_queue()
+        elif command == "status":
+            self.__execute_status(args)
+        elif command == "cancel":
+            if args == ["all"]:
+                commands.cancel_all_transfers()
                 return
-            email, file_path = args
-            arguments_valid = True
-            if not utils.is_valid_email(email):
-                print("Please enter a valid email address.")
-                arguments_valid = False
-            if not os.path.isfile(file_path):
-                print(f"Unable to find specified file: {file_path}")
-                arguments_valid = False
-            if not arguments_valid:
+            if len(args) != 1 or not args[0].isdigit():
+                print("Usage: cancel <transfer-id> | cancel all")
                 return
-            commands.send_file(email, file_path)
+            commands.cancel_transfer(int(args[0]))
+        elif command == "limit":
+            self.__execute_limit(args)
+        elif command == "cache":
+            if args == ["clear"]:
+                commands.clear_cache()
+            elif not args:
+                commands.show_cache()
+            else:
+                print("Usage: cache [clear]")
         elif command in ["y", "n"] and NetworkManager().is_waiting_for_send_file_consent():
             if command == "y":
                 NetworkManager().consent_to_receive_file()
@@ -82,10 +93,151 @@ class REPL:
             self.__print_help_command_prompt()
 
 
+    @staticmethod
+    def __execute_send(args: List[str]):
+        """Queues a file, directory or glob pattern to be sent to one or more contacts.
+
+        Args:
+            args (List[str]): The path followed by the emails of the contacts, or "all" for every contact that is
+                online, and optionally "--swarm", "--udp", "--delta", "--compress" and a compression, and
+                "--streams" or "--priority" and a number. A single email may also come before the path.
+        """
+
+        # A file swarmed to many contacts is passed on among them instead of being sent to each by this host
+        swarm = "--swarm" in args
+        # A file sent over UDP is meant to keep a lossy link busy where the connection would back off. It's
+        # experimental, since it has only been measured against the connection on an emulated lossy link.
+        datagrams = "--udp" in args
+        # A file sent as a delta only sends what changed since the version the contact received last
+        delta = "--delta" in args
+        args = [arg for arg in args if arg not in ["--swarm", "--udp", "--delta"]]
+        args, priority_string = REPL.__pop_option(args, "--priority")
+        args, compress = REPL.__pop_option(args, "--compress")
+        # A file striped across several connections keeps a long fat link busy where one connection can't
+        args, streams_string = REPL.__pop_option(args, "--streams")
+        priority = 0
+        if priority_string is not None:
+            try:
+                priority = int(priority_string)
+            except ValueError:
+                print(f"Please enter a whole number as the priority: {priority_string}")
+                return
+        num_streams = 1
+        if streams_string is not None:
+            if not streams_string.isdigit():
+                print(f"Please enter a whole number as the number of streams: {streams_string}")
+                return
+            num_streams = int(streams_string)
+        if len(args) < 2:
+            print("Usage: send <file|directory|glob> <contact-email|all>... [--swarm] [--udp] [--delta] "
+                  "[--compress <zlib|lzma>[:<level>]] [--streams <number>] [--priority <number>]")
+            return
+        if len(args) == 2 and utils.is_valid_email(args[0]):
+            targets, file_path = [args[0]], args[1]
+        else:
+            file_path, targets = args[0], args[1:]
+        arguments_valid = True
+        if invalid_targets := [target for target in targets if target != "all" and not utils.is_valid_email(target)]:
+            print(f"Please enter valid email addresses or \"all\": {' '.join(invalid_targets)}")
+            arguments_valid = False
+        compression, compression_level = Compression.NONE, constants.DEFAULT_COMPRESSION_LEVEL
+        if compress is not None:
+            name, _, level = compress.partition(":")
+            if name not in [Compression.ZLIB.value, Compression.LZMA.value] or (level and not level.isdigit()):
+                print(f"Please enter zlib or lzma as the compression, optionally with a level such as zlib:9: "
+                      f"{compress}")
+                arguments_valid = False
+            else:
+                compression = Compression(name)
+                compression_level = int(level) if level else compression_level
+        # Directories and glob patterns are sent as a single archive under a single consent
+        is_archive = os.path.isdir(file_path) or utils.is_glob_pattern(file_path)
+        if is_archive and len(utils.get_files_to_send(file_path)) == 0:
+            print(f"No files to send found at: {file_path}")
+            arguments_valid = False
+        elif not is_archive and not os.path.isfile(file_path):
+            print(f"Unable to find specified file: {file_path}")
+            arguments_valid = False
+        single_file_options = [option for option, is_given in [("--swarm", swarm), ("--udp", datagrams),
+                                                               ("--delta", delta), ("--compress", compress is not None),
+                                                               ("--streams", streams_string is not None)]
+                               if is_given]
+        # The pieces of a swarm are passed on as they are
+        swarm_conflicts = [option for option in single_file_options if option in ["--delta", "--compress",
+                                                                                  "--streams"]]
+        if is_archive and single_file_options:
+            print(f"Only a single file can be sent with {', '.join(single_file_options)}")
+            arguments_valid = False
+        elif swarm and swarm_conflicts:
+            print(f"A swarm can't be combined with {', '.join(swarm_conflicts)}")
+            arguments_valid = False
+        if not arguments_valid:
+            return
+        if is_archive:
+            commands.send_files(targets, file_path, priority)
+        else:
+            commands.send_file(targets, file_path, priority, swarm, datagrams, compression, compression_level, delta,
+                               num_streams)
+
+    @staticmethod
+    def __pop_option(args: List[str], option: str) -> Tuple[List[str], Optional[str]]:
+        """Takes an option and the value that follows it out of the arguments.
+
+        Returns:
+            Tuple[List[str], Optional[str]]: The remaining arguments and the value, which is "" if the option is the
+                last argument, or None if the option isn't given.
+        """
+
+        if option not in args:
+            return args, None
+        index = args.index(option)
+        return args[:index] + args[index + 2:], args[index + 1] if index + 1 < len(args) else ""
+
+    @staticmethod
+    def __execute_status(args: List[str]):
+        if len(args) > 1 or (len(args) == 1 and not args[0].isdigit()):
+            print("Usage: status [transfer-id]")
+            return
+        commands.show_status(int(args[0]) if args else None)
+
+    @staticmethod
+    def __execute_limit(args: List[str]):
+        """Shows the bandwidth caps, or changes one of them.
+
+        Args:
+            args (List[str]): Nothing, or the target ("global" or a contact's email), the rate ("off" to lift the cap)
+                and optionally the direction ("send" or "receive").
+        """
+
+        if len(args) == 0:
+            commands.list_limits()
+            return
+        if len(args) not in [2, 3]:
+            print("Usage: limit [<global|contact-email> <rate|off> [send|receive]]")
+            return
+        target, rate_string = args[0], args[1]
+        if target != "global" and not utils.is_valid_email(target):
+            print("Please enter \"global\" or a valid email address.")
+            return
+        rate = None
+        if rate_string != "off" and (rate := utils.parse_byte_rate(rate_string)) is None:
+            print(f"Please enter a rate in bytes per second, such as 512k or 10m, or \"off\": {rate_string}")
+            return
+        direction = None
+        if len(args) == 3:
+            if args[2] not in [direction.value for direction in Direction]:
+                print(f"Please enter \"send\" or \"receive\": {args[2]}")
+                return
+            direction = Direction(args[2])
+        commands.set_limit(target, rate, direction)
+
+
 def exit_app():
     """Exits the SecureDrop application and informs the user.
     """
 
+    print("Cancelling all transfers...")
+    TransferScheduler().cancel_all()
     print("Stopping all network resources...")
     NetworkManager().stop()
     print("Network resources stopped.")
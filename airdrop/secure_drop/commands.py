@@ -1,8 +1,20 @@
-from secure_drop import exceptions, input_helpers
+import copy
+import os
+import threading
+import time
+from typing import List, Optional
+
+from secure_drop import constants, exceptions, input_helpers, utils
+from secure_drop.networking.compression import Compression
+from secure_drop.networking.TransferOptions import TransferOptions
+from secure_drop.singletons.BandwidthManager import BandwidthManager, Direction
+from secure_drop.singletons.ChunkCache import ChunkCache
 from secure_drop.singletons.ContactManager import ContactManager
 from secure_drop.singletons.NetworkManager import NetworkManager
+from secure_drop.singletons.TransferScheduler import TransferScheduler
 from secure_drop.types.Contact import Contact
 from secure_drop.types.ContactList import ContactList
+from secure_drop.types.ScheduledTransfer import ScheduledTransfer, TransferStatus
 
 
 def help():
@@ -11,7 +23,16 @@ def help():
 
     print("\"add\"  -> Add a new contact")
     print("\"list\" -> List all online contacts")
-    print("\"send\" -> Transfer file to contact")
+    print("\"send\" -> Transfer a file, directory or glob pattern to one or more contacts, or \"all\" of them")
+    print("         \"--udp\" sends a file over UDP, which is experimental and only tested on emulated lossy links")
+    print("         \"--compress zlib|lzma[:level]\" compresses a file before it is encrypted")
+    print("         \"--delta\" only sends what changed since the contact received the file last")
+    print("         \"--streams n\" stripes a file across n connections")
+    print("\"queue\" -> List the transfers that are running or waiting to run")
+    print("\"status\" -> Show how every transfer, or a given one, went")
+    print("\"cancel\" -> Cancel a queued or running transfer, or \"all\" of them")
+    print("\"limit\" -> Show or change the bandwidth caps, globally or per contact")
+    print("\"cache\" -> Show how well the cache of prepared chunks is doing, or \"clear\" it")
     print("\"exit\" -> Exit SecureDrop")
 
 
@@ -34,11 +55,11 @@ def list_contacts():
     # 1. Retrieve contacts that have already been added
     contacts = ContactManager().get_contacts()
 
-    # 2. For each contact, determine if they should be listed
+    # 2. For each contact, determine if they should be listed. All contacts are asked at once, so a contact that is
+    # slow to answer holds up the list by at most a request's timeout.
     contacts_to_list = ContactList()
-    network_manager = NetworkManager()
-    for contact in contacts:
-        if network_manager.contact_has_reciprocated(contact):
+    for contact, has_reciprocated in zip(contacts, NetworkManager().contacts_have_reciprocated(list(contacts))):
+        if has_reciprocated:
             contacts_to_list.add_contact(contact)
     
     # 3. Display the relevant contacts
@@ -50,15 +71,237 @@ def list_contacts():
         print("No contacts are currently online.")
 
 
-def send_file(email: str, file_path: str):
+def send_file(targets: List[str], file_path: str, priority: int = 0, swarm: bool = False, datagrams: bool = False,
+              compression: Compression = Compression.NONE,
+              compression_level: int = constants.DEFAULT_COMPRESSION_LEVEL, delta: bool = False, num_streams: int = 1):
+    """Queues a file to be sent to one or more contacts in the background. A file sent to many contacts is read from
+    disk only once.
+
+    Args:
+        targets (List[str]): The emails of the contacts, or "all" for every contact that is online.
+        file_path (str): The path to the file to send.
+        priority (int, optional): Transfers with a higher priority run first. Defaults to 0.
+        swarm (bool, optional): Whether the contacts pass the file on to one another, so that it only leaves this host
+            about once. The pieces of a swarm are verified and encrypted like any other transfer. Defaults to False.
+        datagrams (bool, optional): Whether the file is sent as UDP datagrams, which is experimental: it is meant for
+            lossy links but has only been shown to beat the connection on an emulated one. Contacts on the same host
+            are handed the file all the same. Defaults to False.
+        compression (Compression, optional): How the file is compressed before it is encrypted. Defaults to
+            Compression.NONE.
+        compression_level (int, optional): The zlib level or lzma preset, from 0 to 9.
+        delta (bool, optional): Whether only the difference to the version each contact received last is sent.
+            Defaults to False.
+        num_streams (int, optional): The number of connections the file is striped across. Defaults to 1.
+    """
+
+    try:
+        options = TransferOptions(encrypt=True, datagrams=datagrams, compression=compression,
+                                  compression_level=compression_level, delta=delta, num_streams=num_streams,
+                                  chunk_cache=ChunkCache())
+    except ValueError as e:
+        print(f"Unable to send file: {e}")
+        return
+    if not (contacts := __get_target_contacts(targets, "send file")):
+        return
+
+    def send(cancelled: threading.Event) -> List[bool]:
+        transfer_options = copy.copy(options)
+        transfer_options.cancelled = cancelled
+        if swarm and len(contacts) > 1:
+            return NetworkManager().swarm_file_to_many(contacts, file_path, transfer_options)
+        if len(contacts) == 1:
+            return [NetworkManager().send_file(contacts[0], file_path, transfer_options)]
+        return NetworkManager().send_file_to_many(contacts, file_path, transfer_options)
+
+    __queue_transfer(ScheduledTransfer(file_path, contacts, os.path.getsize(file_path), send, priority,
+                                       lambda transfer: __print_send_results(transfer, "file")))
+
+
+def send_files(targets: List[str], path: str, priority: int = 0):
+    """Queues the files in a directory or matching a glob pattern to be sent to one or more contacts in the
+    background as a single archive.
+
+    Args:
+        targets (List[str]): The emails of the contacts, or "all" for every contact that is online.
+        path (str): The directory or glob pattern.
+        priority (int, optional): Transfers with a higher priority run first. Defaults to 0.
+    """
+
+    if not (contacts := __get_target_contacts(targets, "send files")):
+        return
+    files = utils.get_files_to_send(path)
+
+    def send(cancelled: threading.Event) -> List[bool]:
+        options = TransferOptions(encrypt=True, cancelled=cancelled)
+        if len(contacts) == 1:
+            return [NetworkManager().send_archive(contacts[0], files, options)]
+        return NetworkManager().send_archive_to_many(contacts, files, options)
+
+    size = sum(os.path.getsize(file_path) for file_path, _ in files)
+    __queue_transfer(ScheduledTransfer(path, contacts, size, send, priority,
+                                       lambda transfer: __print_send_results(transfer, f"{len(files)} files")))
+
+
+def list_queue():
+    """Displays the transfers that are running, followed by those that are queued in the order they will run in.
+    """
+
+    if not (transfers := TransferScheduler().get_queue()):
+        print("No transfers are running or queued.")
+        return
+    print("The following transfers are running or queued:")
+    for transfer in transfers:
+        print(f"* {__describe_transfer(transfer)}")
+
+
+def show_status(transfer_id: Optional[int] = None):
+    """Displays the status of a transfer, or of every transfer since SecureDrop started.
+
+    Args:
+        transfer_id (Optional[int], optional): The ID of the transfer. Defaults to None, which displays every transfer.
+    """
+
+    transfers = TransferScheduler().get_transfers()
+    if transfer_id is not None:
+        transfers = [transfer for transfer in transfers if transfer.transfer_id == transfer_id]
+        if not transfers:
+            print(f"There is no transfer {transfer_id}.")
+            return
+    if not transfers:
+        print("No transfers have been sent.")
+        return
+    for transfer in transfers:
+        print(f"* {__describe_transfer(transfer)}")
+        if transfer.is_finished() and len(transfer.contacts) > 1:
+            for contact, result in zip(transfer.contacts, transfer.results):
+                print(f"    {contact}: {'sent' if result else 'not sent'}")
+
+
+def cancel_transfer(transfer_id: int):
+    """Cancels a queued or running transfer. A running transfer gives up at the next chunk it sends, or while it
+    waits on the contact, such as for their consent.
+
+    Args:
+        transfer_id (int): The ID of the transfer.
+    """
+
+    if TransferScheduler().cancel(transfer_id):
+        print(f"Cancelled transfer {transfer_id}.")
+    else:
+        print(f"Unable to cancel transfer {transfer_id}: there is no such transfer or it is already over.")
+
+
+def cancel_all_transfers():
+    """Cancels every queued or running transfer.
+    """
+
+    num_cancelled = TransferScheduler().cancel_all()
+    print(f"Cancelled {num_cancelled} transfer{'' if num_cancelled == 1 else 's'}.")
+
+
+def __queue_transfer(transfer: ScheduledTransfer):
+    transfer_id = TransferScheduler().submit(transfer)
+    print(f"Queued transfer {transfer_id}: {transfer.path} ({utils.format_size(transfer.size)}) to "
+          f"{', '.join(str(contact) for contact in transfer.contacts)}.")
+
+
+def __describe_transfer(transfer: ScheduledTransfer) -> str:
+    description = f"{transfer.transfer_id}: {transfer.path} ({utils.format_size(transfer.size)}) to " \
+        f"{', '.join(contact.email for contact in transfer.contacts)} - {transfer.status.value}"
+    if transfer.priority != 0:
+        description += f", priority {transfer.priority}"
+    if transfer.started_time is not None:
+        elapsed = (transfer.finished_time or time.monotonic()) - transfer.started_time
+        description += f", {elapsed:.1f}s"
+    return description
+
+
+def __get_target_contacts(targets: List[str], action: str) -> List[Contact]:
+    """Looks up the contacts to send to, skipping and reporting those that can't be sent to.
+
+    Args:
+        targets (List[str]): The emails of the contacts, or "all" for every contact that is online.
+        action (str): What is being done, for the messages about contacts that are skipped.
+
+    Returns:
+        List[Contact]: The contacts that are online and have added the user, without duplicates.
+    """
+
     contacts = ContactManager().get_contacts()
-    if (target_contact := contacts.get_contact_by_email(email)) is None:
-        print(f"Unable to send file: you haven't added {email} as a contact.")
+    network_manager = NetworkManager()
+    if "all" in targets:
+        all_contacts = list(contacts)
+        target_contacts = [contact for contact, has_reciprocated in
+                           zip(all_contacts, network_manager.contacts_have_reciprocated(all_contacts)) if has_reciprocated]
+        if not target_contacts:
+            print(f"Unable to {action}: no contacts are currently online.")
+        return target_contacts
+    target_contacts: List[Contact] = []
+    for email in dict.fromkeys(targets):
+        if (target_contact := contacts.get_contact_by_email(email)) is None:
+            print(f"Unable to {action}: you haven't added {email} as a contact.")
+        elif not network_manager.contact_has_reciprocated(target_contact):
+            print(f"Unable to {action}: {target_contact} has not added you as a contact or is not online.")
+        else:
+            target_contacts.append(target_contact)
+    return target_contacts
+
+
+def __print_send_results(transfer: ScheduledTransfer, what: str):
+    # Transfers finish in the background, so their results are reported along with the ID they were queued under
+    if transfer.status == TransferStatus.CANCELLED:
+        print(f"Transfer {transfer.transfer_id} was cancelled.")
         return
-    if not NetworkManager().contact_has_reciprocated(target_contact):
-        print(f"Unable to send file: {target_contact} has not added you as a contact or is not online.")
+    for contact, result in zip(transfer.contacts, transfer.results):
+        if result:
+            print(f"Transfer {transfer.transfer_id}: sent {what} to {contact} successfully.")
+        else:
+            print(f"Transfer {transfer.transfer_id}: failed to send {what} to {contact}.")
+
+
+def list_limits():
+    """Displays the bandwidth caps that are in place.
+    """
+
+    limits = BandwidthManager().get_limits()
+    if not limits:
+        print("No bandwidth caps are in place.")
         return
-    if NetworkManager().send_file(target_contact, file_path):
-        print("Sent file successfully.")
+    print("The following bandwidth caps are in place:")
+    for (email, direction), rate in sorted(limits.items(), key=lambda item: (item[0][0] or "", item[0][1].value)):
+        print(f"* {email or 'global'} ({direction.value}): {utils.format_byte_rate(rate)}")
+
+
+def set_limit(target: str, rate: Optional[float], direction: Optional[Direction]):
+    """Changes a bandwidth cap. Transfers that are already running follow the new cap right away.
+
+    Args:
+        target (str): "global", or the email of a contact.
+        rate (Optional[float]): The cap in bytes per second, or None to lift it.
+        direction (Optional[Direction]): The direction to cap, or None for both.
+    """
+
+    email = None if target == "global" else target
+    BandwidthManager().set_limit(email, rate, direction)
+    directions = direction.value if direction is not None else "send and receive"
+    if rate is None:
+        print(f"Lifted the {directions} cap for {target}.")
     else:
-        print("Failed to send file.")
+        print(f"Capped {target} at {utils.format_byte_rate(rate)} ({directions}).")
+
+
+def show_cache():
+    """Displays how many lookups the cache of prepared chunks answered, and how much it holds.
+    """
+
+    stats = ChunkCache().get_stats()
+    print(f"The chunk cache holds {stats.num_entries} chunks ({utils.format_size(stats.size)}).")
+    print(f"Hits: {stats.num_hits}, misses: {stats.num_misses} ({stats.get_hit_ratio():.0%} hit ratio)")
+
+
+def clear_cache():
+    """Removes every chunk from the cache of prepared chunks.
+    """
+
+    ChunkCache().clear()
+    print("Cleared the chunk cache.")
@@ -1,4 +1,6 @@
+import os
 import socket
+import tempfile
 import uuid
 
 
@@ -11,6 +13,18 @@ def __get_local_ip() -> str:
         return "127.0.0.1"
 
 
+def __get_host_id() -> str:
+    # Instances on the same host read the same machine ID, which doesn't change across reboots
+    for path in ["/etc/machine-id", "/var/lib/dbus/machine-id"]:
+        try:
+            with open(path, "r") as f:
+                if machine_id := f.read().strip():
+                    return machine_id
+        except OSError:
+            pass
+    return f"{socket.gethostname()}:{uuid.getnode():012x}"
+
+
 USER_FILE_PATH = "user.json"
 PUBLIC_KEY_FILE_PATH = "public_key.pem"
 PRIVATE_KEY_FILE_PATH = "private_key.pem"
@@ -27,5 +41,85 @@ MULTICAST_GROUP = "224.1.1.1"
 SERVER_IP = __get_local_ip()
 SERVER_PORT_RANGE = range(1100, 1120)
 APP_UUID = uuid.uuid4()
+HOST_ID = __get_host_id()
+LOCAL_SOCKET_PATH = os.path.join(tempfile.gettempdir(), f"secure_drop-{APP_UUID}.sock")
 FILE_CHUNK_SIZE = 4096
 RECEIVED_FILES_DIR = "received_files"
+TRANSFER_WINDOW_SIZE = 64
+TRANSFER_ACK_INTERVAL = 16
+ZERO_COPY_CHUNK_SIZE = 1024 * 1024
+RECEIVE_BUFFER_SIZE = 256 * 1024
+MAX_CONTROL_FRAME_SIZE = 64 * 1024
+SERVER_POLL_INTERVAL_SECONDS = 0.1
+MIN_FREE_DISK_SPACE_BYTES = 64 * 1024 * 1024
+FSYNC_INTERVAL_BYTES = 64 * 1024 * 1024
+RESUMABLE_TRANSFER_EXPIRY_SECONDS = 7 * 24 * 60 * 60
+MAX_TRANSFER_STREAMS = 16
+DELTA_MIN_BLOCK_SIZE = 2048
+DELTA_STRONG_HASH_SIZE = 16
+DELTA_READ_SIZE = 1024 * 1024
+COMPRESSION_SAMPLE_SIZE = 256 * 1024
+COMPRESSION_MAX_ENTROPY_BITS = 7.5
+COMPRESSION_READ_SIZE = 256 * 1024
+DEFAULT_COMPRESSION_LEVEL = 6
+MERKLE_LEAF_SIZE = 1024 * 1024
+MERKLE_READ_SIZE = 256 * 1024
+MAX_CHUNK_REPAIR_ATTEMPTS = 3
+ENCRYPTION_CHUNK_SIZE = 64 * 1024
+TRANSFER_KEY_SIZE = 32
+TOKEN_BUCKET_BURST_SECONDS = 0.05
+SHARED_READ_BLOCK_SIZE = 256 * 1024
+MAX_SHARED_READ_BLOCKS_QUEUED = 32
+MAX_CONCURRENT_TRANSFERS = 4
+# A contact's user is asked to consent to one transfer at a time
+MAX_TRANSFERS_PER_CONTACT = 1
+SWARM_POLL_INTERVAL_SECONDS = 0.05
+SWARM_PEER_RETRY_SECONDS = 0.2
+# A receiver that got no piece for this long is seeded the rarest pieces it lacks, in case no peer can reach it
+SWARM_STALL_SECONDS = 1
+SWARM_RAREST_FIRST_SAMPLE_SIZE = 64
+# Datagrams carry at most a standard Ethernet MTU's worth, less the IPv4 and UDP headers, so they are never fragmented
+MAX_DATAGRAM_SIZE = 1472
+DATAGRAM_SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+DATAGRAM_WINDOW_SIZE = 2048
+DATAGRAM_ACK_INTERVAL_SECONDS = 0.01
+DATAGRAM_RECEIVE_BATCH_SIZE = 256
+DATAGRAM_INITIAL_RATE = 32 * 1024 * 1024
+DATAGRAM_MIN_RATE = 256 * 1024
+DATAGRAM_MAX_RATE = 1024 * 1024 * 1024
+DATAGRAM_RATE_INTERVAL_SECONDS = 0.1
+DATAGRAM_RATE_GROWTH = 1.25
+# Random loss on a wireless link costs a few percent; losing more than this means the rate is too high
+DATAGRAM_MIN_DELIVERY_RATIO = 0.85
+DATAGRAM_INITIAL_RETRANSMIT_TIMEOUT_SECONDS = 0.2
+DATAGRAM_MIN_RETRANSMIT_TIMEOUT_SECONDS = 0.05
+DATAGRAM_STALL_TIMEOUT_SECONDS = 10
+# The size to fix the buffers of sockets that carry files at, or None to leave them to the system's autotuning, which
+# fixing them turns off on Linux. A fixed size must cover a fast link's bandwidth-delay product.
+TCP_SOCKET_BUFFER_SIZE = None
+MAX_FILE_CHUNK_SIZE = 1024 * 1024
+# Chunks are sized to take about this long to send at the measured throughput, so per-chunk overhead stays negligible
+# while cancellation and bandwidth caps still act within a fraction of a second
+CHUNK_SIZING_TARGET_SECONDS = 0.002
+CHUNK_SIZING_INTERVAL_SECONDS = 0.05
+# A sender that spends at least this share of its time waiting on acknowledgements is held back by its window
+CHUNK_SIZING_WINDOW_LIMITED_RATIO = 0.25
+CONNECT_TIMEOUT_SECONDS = 5
+# How long a server has to answer a request that it answers right away, such as a ping
+PING_TIMEOUT_SECONDS = 2
+CONTROL_REQUEST_TIMEOUT_SECONDS = 5
+# How long a server has to answer a request that starts a transfer, which it may first have to make room for
+TRANSFER_REQUEST_TIMEOUT_SECONDS = 30
+# How long the user has to accept or reject a file before it is rejected for them
+SEND_FILE_CONSENT_TIMEOUT_SECONDS = 60
+# How long a client has to finish a request it started sending, and to take in the response to it
+SERVER_REQUEST_TIMEOUT_SECONDS = 5
+# A transfer that makes no progress at all for this long gives up, such as once the receiver's host went away
+TRANSFER_STALL_TIMEOUT_SECONDS = 120
+CANCELLATION_POLL_INTERVAL_SECONDS = 0.1
+CHUNK_CACHE_DIR = "chunk_cache"
+# Chunks of sent files that were prepared for sending are kept on disk up to this size, for when they are sent again
+CHUNK_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+# A file modified more recently than this may still change without its size or modification time changing, so it isn't
+# given a content key that is kept for it
+CONTENT_KEY_MIN_FILE_AGE_SECONDS = 2
@@ -1,10 +1,15 @@
+import hashlib
 import os
 
-from Crypto.Cipher import PKCS1_OAEP, AES
+from Crypto.Cipher import AES, PKCS1_OAEP
 from Crypto.PublicKey import RSA
 from Crypto.Random import get_random_bytes
 from secure_drop import constants
 
+# Data of any size is encrypted under a fresh AES key, which is itself encrypted with RSA
+__HYBRID_NONCE_SIZE = 12
+__HYBRID_TAG_SIZE = 16
+
 
 def encrypt_RSA(data: bytes) -> bytes:
     """Encrypts data using RSA.
@@ -33,71 +38,87 @@ def decrypt_RSA(data: bytes) -> bytes:
     rsa_enc_obj = PKCS1_OAEP.new(private_key)
     return rsa_enc_obj.decrypt(data)
 
-#AES is used to encrypt large files and than the key is encrypted with RSA and sent to the reciever.
-def encrypt_AES(file_path: str) -> (bytes, str):
-    """Encrypts a file using the AES encryption algorithm and encrypts key using encrypt_RSA
-    returns the encrypted AES key and the path to the encrypted file .
+
+def encrypt_hybrid(data: bytes) -> bytes:
+    """Encrypts data of any size, which RSA alone can't, using AES-GCM under a key encrypted with RSA.
 
     Args:
-        file_path (str): The path to the file you want to encrypt.
+        data (bytes): The plaintext to encrypt.
 
     Returns:
-        Tuple[bytes, str]: A tuple containing the encrypted AES key and the path to the encrypted file.
+        bytes: The encrypted key, nonce, ciphertext and tag.
     """
 
-    # Checks if File path exists
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"The file '{file_path}' does not exist.")
-    
-    # Generates a random AES key for 128 bit encryption
-    aes_key = get_random_bytes(16) 
+    key = get_random_bytes(constants.TRANSFER_KEY_SIZE)
+    cipher = AES.new(key, AES.MODE_GCM, nonce=get_random_bytes(__HYBRID_NONCE_SIZE))
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+    return encrypt_RSA(key) + cipher.nonce + ciphertext + tag
+
 
-    # Encrypt the AES key with RSA
-    encrypted_aes_key = encrypt_RSA(aes_key)
+def decrypt_hybrid(data: bytes) -> bytes:
+    """Decrypts data encrypted with encrypt_hybrid, or with encrypt_RSA alone as earlier versions of SecureDrop did.
+
+    Args:
+        data (bytes): The ciphertext to decrypt.
+
+    Raises:
+        ValueError: Raised if the ciphertext was tampered with or wasn't encrypted with this user's key.
+
+    Returns:
+        bytes: Plaintext.
+    """
 
-    # Encrypt the file
-    cipher = AES.new(aes_key, AES.MODE_CFB)
-    encrypted_file_path = file_path + '.aes'
-    with open(file_path, 'rb') as input_file:
-        with open(encrypted_file_path, 'wb') as output_file:
-            output_file.write(cipher.iv)
-            while chunk := input_file.read(64 * 1024):  # Reads in 64KB in chunks
-                output_file.write(cipher.encrypt(chunk))
+    key_size = __get_private_key().size_in_bytes()
+    if len(data) <= key_size:
+        return decrypt_RSA(data)
+    key = decrypt_RSA(data[:key_size])
+    nonce = data[key_size:key_size + __HYBRID_NONCE_SIZE]
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    return cipher.decrypt_and_verify(data[key_size + __HYBRID_NONCE_SIZE:-__HYBRID_TAG_SIZE],
+                                     data[-__HYBRID_TAG_SIZE:])
 
-    return encrypted_aes_key, encrypted_file_path
 
-def decrypt_AES(encrypted_file_path: str, encrypted_aes_key: bytes) -> str:
-    """Decrypts an AES-encrypted file using a decrypted AES key and 
-    returns the path to the decrypted file.
+def get_public_key_pem() -> bytes:
+    """Exports the public key that SecureDrop generated, so that senders can wrap the keys of transfers to it.
+
+    Returns:
+        bytes: The public key in PEM format.
+    """
+
+    return __get_public_key().export_key("PEM")
+
+
+def get_public_key_fingerprint(public_key_pem: bytes) -> str:
+    """Gets the fingerprint of a public key in PEM format, by which it is pinned to a contact.
 
     Args:
-        encrypted_file_path (str): The path to the AES-encrypted file.
-        encrypted_aes_key (bytes): The encrypted AES key to decrypt the file.
+        public_key_pem (bytes): The public key in PEM format.
 
     Returns:
-        str: The path to the decrypted file.
+        str: The SHA-256 of the key, in hex.
     """
 
-     # Check if the encrypted file exists at the given path
-    if not os.path.exists(encrypted_file_path):
-        raise FileNotFoundError(f"The encrypted file '{encrypted_file_path}' does not exist.")
+    return hashlib.sha256(public_key_pem.strip()).hexdigest()
 
-    # Decrypt the AES key with RSA
-    aes_key = decrypt_RSA(encrypted_aes_key)
 
+def wrap_key(key: bytes, public_key_pem: bytes) -> bytes:
+    """Encrypts a symmetric key with another user's RSA public key, so that only that user can recover it with
+    decrypt_RSA.
 
-    decrypted_file_path = encrypted_file_path + '_decrypted'  # Append '_decrypted' to the file name
+    Args:
+        key (bytes): The symmetric key to wrap.
+        public_key_pem (bytes): The recipient's public key in PEM format.
+
+    Raises:
+        ValueError: Raised if the public key is malformed.
+
+    Returns:
+        bytes: The wrapped key.
+    """
 
-    # Decrypt the file
-    with open(encrypted_file_path, 'rb') as input_file:
-        iv = input_file.read(AES.block_size)
-        cipher = AES.new(aes_key, AES.MODE_CFB, iv)
-        decrypted_file_path = encrypted_file_path.rstrip('.aes')
-        with open(decrypted_file_path, 'wb') as output_file:
-            while chunk := input_file.read(64 * 1024):  # Reading in 64KB chunks
-                output_file.write(cipher.decrypt(chunk))
+    rsa_enc_obj = PKCS1_OAEP.new(RSA.import_key(public_key_pem))
+    return rsa_enc_obj.encrypt(key)
 
-    return decrypted_file_path
 
 def __get_public_key() -> RSA.RsaKey:
     """Retrives the public key that SecureDrop generated. If a key pair has not yet been generated, this will first generated the key pair.
@@ -8,3 +8,19 @@ class MissingCredentialsException(Exception):
 
 class MissingFieldsException(Exception):
     """Raised when a received message is missing expected fields."""
+
+
+class MalformedFrameException(Exception):
+    """Raised when a frame received over a connection is malformed or arrives out of order."""
+
+
+class UnexpectedFileSizeException(Exception):
+    """Raised when the amount of data received for a file doesn't match the size its sender announced."""
+
+
+class CorruptChunkException(Exception):
+    """Raised when a chunk of a file keeps failing verification against its sender's manifest."""
+
+
+class TransferCancelledException(Exception):
+    """Raised when a transfer is cancelled while it is being sent."""
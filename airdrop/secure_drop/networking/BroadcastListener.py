@@ -1,15 +1,22 @@
+import copy
 import platform
 import socket
 import threading
 import time
 import uuid
-from typing import List, Optional
+from typing import Callable, List, Optional, Set, Tuple
+
+from Crypto.Random import get_random_bytes
 
 from secure_drop import constants, exceptions
-from secure_drop.networking import socket_helpers
+from secure_drop.networking import socket_helpers, socket_tuning, swarm_transfers, transfer_helpers
 from secure_drop.networking.Connection import Connection
 from secure_drop.networking.messages.BroadcastMessage import BroadcastMessage
 from secure_drop.networking.NetworkResource import NetworkResource
+from secure_drop.networking.SharedFileReader import SharedFileReader, SharedFileView
+from secure_drop.networking.TransferOptions import TransferOptions
+from secure_drop.singletons.BandwidthManager import BandwidthManager, Direction
+from secure_drop.singletons.ContactManager import ContactManager
 from secure_drop.singletons.LoginManager import LoginManager
 from secure_drop.types.Contact import Contact
 
@@ -19,6 +26,9 @@ class BroadcastListener(NetworkResource):
         super().__init__()
         self.__connections: List[Connection] = []
         self.__connections_lock: threading.Lock = threading.Lock()
+        # The connections that carry the transfers that are running, which are cut off when the listener stops
+        self.__data_socks: Set[socket.socket] = set()
+        self.__data_socks_lock: threading.Lock = threading.Lock()
         self._add_thread(threading.Thread(target=self.__listen))
         self._add_thread(threading.Thread(target=self.__update_connections))
 
@@ -27,24 +37,164 @@ class BroadcastListener(NetworkResource):
         # Close all connected sockets
         with self.__connections_lock:
             for connection in self.__connections:
-                connection.sock.close() 
+                connection.sock.close()
+        with self.__data_socks_lock:
+            for data_sock in self.__data_socks:
+                # Shutting the socket down wakes up the transfer blocked on it, which then closes it itself
+                try:
+                    data_sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
 
     def contact_has_reciprocated(self, contact: Contact) -> bool:
         if (connection := self.__get_connection_by_email(contact.email)) is None:
             return False
         if (logged_in_user_credentials := LoginManager().get_logged_in_user_credentials()) is None:
             raise exceptions.MissingCredentialsException()
-        if (ret := socket_helpers.has_added_user(connection.sock, logged_in_user_credentials.email)) is None:
-            self.__remove_connections([connection])
+        with connection.lock:
+            ret = socket_helpers.has_added_user(connection.sock, logged_in_user_credentials.email)
+        if ret is None:
+            self.__remove_connections([connection.app_uuid])
             return False
         return ret
 
-    def send_file(self, contact: Contact, file_path: str) -> bool:
-        if (connection := self.__get_connection_by_email(contact.email)) is None or \
-            not socket_helpers.consents_to_receive_file(connection.sock) or \
-            not socket_helpers.send_file(connection.sock, file_path):
+    def contacts_have_reciprocated(self, contacts: List[Contact]) -> List[bool]:
+        """Checks whether each of many contacts is online and has added the user, all at once, so that it takes no
+        longer than the slowest contact to answer.
+
+        Returns:
+            List[bool]: Whether each contact has reciprocated, in the order of the contacts.
+        """
+
+        results = [False] * len(contacts)
+
+        def check(contact_index: int):
+            results[contact_index] = self.contact_has_reciprocated(contacts[contact_index])
+
+        self.__run_for_each(check, len(contacts))
+        return results
+
+    def send_file(self, contact: Contact, file_path: str, options: Optional[TransferOptions] = None,
+                  shared_file: Optional[SharedFileView] = None) -> bool:
+        options = BroadcastListener.__get_capped_options(contact, options)
+        if (connection := self.__get_connection_by_email(contact.email)) is None:
+            return False
+        # A contact on the same host is handed the file instead of being sent it
+        options.local = connection.is_local
+        if (data_sock := self.__open_data_connection(connection, stall_timeout=True)) is None:
+            return False
+        try:
+            return socket_helpers.consents_to_receive_file(data_sock, cancelled=options.cancelled) and \
+                socket_helpers.send_file(data_sock, file_path, options, shared_file=shared_file)
+        finally:
+            self.__close_data_connection(data_sock)
+
+    def send_archive(self, contact: Contact, files: List[Tuple[str, str]], options: Optional[TransferOptions] = None) -> bool:
+        options = BroadcastListener.__get_capped_options(contact, options)
+        if (connection := self.__get_connection_by_email(contact.email)) is None:
+            return False
+        if (data_sock := self.__open_data_connection(connection, stall_timeout=True)) is None:
             return False
-        return True
+        try:
+            return socket_helpers.consents_to_receive_file(data_sock, cancelled=options.cancelled) and \
+                socket_helpers.send_archive(data_sock, files, options)
+        finally:
+            self.__close_data_connection(data_sock)
+
+    def send_file_to_many(self, contacts: List[Contact], file_path: str,
+                          options: Optional[TransferOptions] = None) -> List[bool]:
+        """Sends a file to many contacts at once, each over its own connection. The file is read from disk once for
+        all of them, and a contact that is slow to receive it is left to catch up on its own instead of holding the
+        others back. An encrypted file is also encrypted once, under a content key that is wrapped for each contact.
+
+        Args:
+            contacts (List[Contact]): The contacts to send the file to.
+            file_path (str): The path to the file to send.
+            options (Optional[TransferOptions], optional): The protocol to follow. Defaults to a pipelined transfer.
+
+        Returns:
+            List[bool]: Whether the file was sent successfully to each contact, in the order of the contacts.
+        """
+
+        # Sealed frames are numbered per transfer and stripes get a key of their own, so only the chunks of a single
+        # stream can share a content key
+        shares_key = options is not None and options.encrypt and not options.seals_frames() and \
+            not options.is_striped()
+        content_key = get_random_bytes(constants.TRANSFER_KEY_SIZE) if shares_key else None
+        reader = SharedFileReader(file_path, len(contacts), content_key)
+        results = [False] * len(contacts)
+
+        def send(contact_index: int):
+            with reader.views[contact_index] as view:
+                results[contact_index] = self.send_file(contacts[contact_index], file_path, options, view)
+
+        try:
+            reader.start()
+            self.__run_for_each(send, len(contacts))
+        finally:
+            reader.close()
+        return results
+
+    def swarm_file_to_many(self, contacts: List[Contact], file_path: str,
+                           options: Optional[TransferOptions] = None) -> List[bool]:
+        """Sends a file to many contacts at once as a swarm, in which the contacts pass the pieces of the file on to
+        one another, so that the file only has to leave this host about once. The pieces seeded to all contacts pass
+        through the global bucket, since they share this host's uplink.
+
+        Args:
+            contacts (List[Contact]): The contacts to send the file to.
+            file_path (str): The path to the file to send.
+            options (Optional[TransferOptions], optional): The cancellation of the transfer. Defaults to None.
+
+        Returns:
+            List[bool]: Whether the file was sent successfully to each contact, in the order of the contacts.
+        """
+
+        options = copy.copy(options) if options is not None else TransferOptions()
+        options.bucket = BandwidthManager().get_bucket(None, Direction.SEND)
+        data_socks: List[Optional[socket.socket]] = [None] * len(contacts)
+        options.check_public_key = lambda sock, public_key_pem: ContactManager().trust_public_key(
+            contacts[data_socks.index(sock)].email, public_key_pem)
+
+        def ask_for_consent(contact_index: int):
+            if (connection := self.__get_connection_by_email(contacts[contact_index].email)) is None or \
+                    (data_sock := self.__open_data_connection(connection)) is None:
+                return
+            # The data connection stays open for the swarm only if the contact consents
+            data_socks[contact_index] = data_sock
+            if not socket_helpers.consents_to_receive_file(data_sock, cancelled=options.cancelled):
+                data_socks[contact_index] = None
+                self.__close_data_connection(data_sock)
+
+        results = [False] * len(contacts)
+        try:
+            self.__run_for_each(ask_for_consent, len(contacts))
+            consenting_indices = [index for index, data_sock in enumerate(data_socks) if data_sock is not None]
+            if consenting_indices:
+                socks = [data_socks[index] for index in consenting_indices]
+                for index, result in zip(consenting_indices, swarm_transfers.send_swarm(socks, file_path, options)):
+                    results[index] = result
+        finally:
+            for data_sock in data_socks:
+                if data_sock is not None:
+                    self.__close_data_connection(data_sock)
+        return results
+
+    def send_archive_to_many(self, contacts: List[Contact], files: List[Tuple[str, str]],
+                             options: Optional[TransferOptions] = None) -> List[bool]:
+        """Sends an archive to many contacts at once, each over its own connection.
+
+        Returns:
+            List[bool]: Whether the archive was sent successfully to each contact, in the order of the contacts.
+        """
+
+        results = [False] * len(contacts)
+
+        def send(contact_index: int):
+            results[contact_index] = self.send_archive(contacts[contact_index], files, options)
+
+        self.__run_for_each(send, len(contacts))
+        return results
 
     def __listen(self):
         with self.__create_listener_socket() as listener_socket:
@@ -57,16 +207,40 @@ class BroadcastListener(NetworkResource):
                 # Do nothing if the broadcast is this app instance's own or if it's already connected to the other instance
                 if broadcast_message.app_uuid == constants.APP_UUID or self.__contains_connection(broadcast_message.app_uuid):
                     continue
-                self.__connect(broadcast_message.app_uuid, broadcast_message.server_ip, broadcast_message.server_port)
+                local_socket_path = broadcast_message.local_socket_path \
+                    if broadcast_message.host_id == constants.HOST_ID else None
+                self.__connect(broadcast_message.app_uuid, broadcast_message.server_ip, broadcast_message.server_port,
+                               local_socket_path)
+
+    def __connect(self, app_uuid: uuid.UUID, server_ip: str, server_port: int, local_socket_path: Optional[str] = None):
+        """Connects to another instance's server, over its Unix domain socket if it runs on the same host, which skips
+        the network stack and lets files be handed over, or over TCP otherwise. A server that can't be reached or
+        doesn't answer in time is skipped until it broadcasts again.
+        """
 
-    def __connect(self, app_uuid: uuid.UUID, server_ip: str, server_port: int):
-        conn_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        conn_socket.connect((server_ip, server_port))
+        conn_socket = None
+        if local_socket_path is not None:
+            conn_socket = BroadcastListener.__connect_locally(local_socket_path)
+        is_local = conn_socket is not None
+        if conn_socket is None:
+            conn_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Large buffers have to be in place before connecting, since the TCP window scale is agreed on then
+            socket_tuning.tune_connection(conn_socket)
+            try:
+                conn_socket.settimeout(constants.CONNECT_TIMEOUT_SECONDS)
+                conn_socket.connect((server_ip, server_port))
+            except OSError:
+                conn_socket.close()
+                return
+            conn_socket.settimeout(None)
+        else:
+            socket_tuning.tune_connection(conn_socket)
         conn_email = socket_helpers.get_email(conn_socket)
         if conn_email is None:
             conn_socket.close()
             return
-        connection = Connection(app_uuid, conn_email, conn_socket)
+        address = local_socket_path if is_local else (server_ip, server_port)
+        connection = Connection(app_uuid, conn_email, conn_socket, address, is_local)
         self.__add_connection(connection)
 
     def __update_connections(self):
@@ -74,9 +248,12 @@ class BroadcastListener(NetworkResource):
             with self._should_stop_lock:
                 if self._should_stop:
                     break
+            # Pinging a contact that is slow to answer mustn't hold up looking up the others
             with self.__connections_lock:
-                connections_to_remove: List[uuid.UUID] = []
-                for connection in self.__connections:
+                connections = list(self.__connections)
+            connections_to_remove: List[uuid.UUID] = []
+            for connection in connections:
+                with connection.lock:
                     if not socket_helpers.is_connected_to(connection.sock):
                         connections_to_remove.append(connection.app_uuid)
             self.__remove_connections(connections_to_remove)
@@ -86,9 +263,14 @@ class BroadcastListener(NetworkResource):
         with self.__connections_lock:
             self.__connections.append(connection)
 
-    def __remove_connections(self, connections: List[Connection]):
+    def __remove_connections(self, app_uuids: List[uuid.UUID]):
         with self.__connections_lock:
-            self.__connections = list(filter(lambda c: c.app_uuid not in connections, self.__connections))
+            removed_connections = [c for c in self.__connections if c.app_uuid in app_uuids]
+            self.__connections = list(filter(lambda c: c.app_uuid not in app_uuids, self.__connections))
+        # A connection is only removed once it failed to answer, so it can't be used any further
+        for connection in removed_connections:
+            with connection.lock:
+                connection.sock.close()
 
     def __contains_connection(self, app_uuid: uuid.UUID):
         with self.__connections_lock:
@@ -104,6 +286,76 @@ class BroadcastListener(NetworkResource):
                     return connection
         return None
 
+    def __open_data_connection(self, connection: Connection, stall_timeout: bool = False) -> Optional[socket.socket]:
+        """Opens a connection to a contact's server for a single transfer, which leaves the connection that is kept to
+        the server free for the requests that are answered right away.
+
+        Args:
+            connection (Connection): The connection kept to the server.
+            stall_timeout (bool, optional): Whether the transfer gives up once it makes no progress for
+                constants.TRANSFER_STALL_TIMEOUT_SECONDS. Swarms can't, since their servers may go quiet while they
+                fetch pieces from one another. Defaults to False.
+
+        Returns:
+            Optional[socket.socket]: The connected socket, or None if the server can't be reached.
+        """
+
+        try:
+            data_sock = transfer_helpers.connect_to_server(connection.address)
+        except OSError:
+            return None
+        if stall_timeout:
+            data_sock.settimeout(constants.TRANSFER_STALL_TIMEOUT_SECONDS)
+        with self.__data_socks_lock:
+            self.__data_socks.add(data_sock)
+        return data_sock
+
+    def __close_data_connection(self, data_sock: socket.socket):
+        with self.__data_socks_lock:
+            self.__data_socks.discard(data_sock)
+        data_sock.close()
+
+    @staticmethod
+    def __connect_locally(local_socket_path: str) -> Optional[socket.socket]:
+        """Connects to a server's Unix domain socket.
+
+        Returns:
+            Optional[socket.socket]: The connected socket, or None if the socket can't be reached, such as from
+                another container on the same host.
+        """
+
+        conn_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn_socket.settimeout(constants.CONNECT_TIMEOUT_SECONDS)
+            conn_socket.connect(local_socket_path)
+        except OSError:
+            conn_socket.close()
+            return None
+        conn_socket.settimeout(None)
+        return conn_socket
+
+    @staticmethod
+    def __run_for_each(target: Callable[[int], None], num_contacts: int):
+        """Runs a function for every contact on a thread of its own and waits for all of them to finish."""
+
+        threads = [threading.Thread(target=target, args=[contact_index]) for contact_index in range(num_contacts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    @staticmethod
+    def __get_capped_options(contact: Contact, options: Optional[TransferOptions]) -> TransferOptions:
+        """Copies the options of a transfer to a contact, capped by the contact's bandwidth caps and bound to the
+        contact's public key."""
+
+        options = copy.copy(options) if options is not None else TransferOptions()
+        options.bucket = BandwidthManager().get_bucket(contact.email, Direction.SEND)
+        # Only the contact the file is meant for gets to unwrap its key
+        options.check_public_key = lambda _, public_key_pem: ContactManager().trust_public_key(contact.email,
+                                                                                              public_key_pem)
+        return options
+
     @staticmethod
     def __create_listener_socket() -> socket.socket:
         listener_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
@@ -0,0 +1,93 @@
+import logging
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from secure_drop import constants, utils
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkSizer:
+    """Sizes the chunks a file is sent in from the throughput and round-trip time measured from acknowledgements.
+    """
+
+    def __init__(self, window_size: int):
+        """Initializes the chunk sizer.
+
+        Args:
+            window_size (int): The maximum number of unacknowledged chunks in flight.
+        """
+
+        self.chunk_size: int = constants.FILE_CHUNK_SIZE
+        self.__window_size: int = window_size
+        # The chunks that weren't acknowledged yet, along with how many bytes were sent up to them and when they were
+        self.__chunks_in_flight: Deque[Tuple[int, int, float]] = deque()
+        self.__num_chunks_sent: int = 0
+        self.__num_bytes_sent: int = 0
+        self.__num_bytes_acked: int = 0
+        # The sender only reads acknowledgements once the window is full, so the smallest round trip is the truest
+        self.__min_rtt: Optional[float] = None
+        self.__smoothed_throughput: Optional[float] = None
+        self.__last_event_time: float = time.monotonic()
+        self.__interval_start_time: float = self.__last_event_time
+        self.__interval_start_num_bytes_acked: int = 0
+        self.__interval_wait_seconds: float = 0
+
+    def on_sent(self, num_bytes: int):
+        """Records that a frame was sent.
+
+        Args:
+            num_bytes (int): How much of the file the frame carried.
+        """
+
+        self.__num_chunks_sent += 1
+        self.__num_bytes_sent += num_bytes
+        self.__last_event_time = time.monotonic()
+        self.__chunks_in_flight.append((self.__num_chunks_sent, self.__num_bytes_sent, self.__last_event_time))
+
+    def on_acked(self, num_chunks_acked: int):
+        """Records an acknowledgement of every frame up to a given one, resizing chunks once per interval.
+
+        Args:
+            num_chunks_acked (int): The number of frames the receiver acknowledged so far.
+        """
+
+        now = time.monotonic()
+        self.__interval_wait_seconds += now - self.__last_event_time
+        self.__last_event_time = now
+        acked_chunk = None
+        while self.__chunks_in_flight and self.__chunks_in_flight[0][0] <= num_chunks_acked:
+            acked_chunk = self.__chunks_in_flight.popleft()
+        if acked_chunk is None:
+            return
+        _, self.__num_bytes_acked, send_time = acked_chunk
+        rtt = now - send_time
+        self.__min_rtt = rtt if self.__min_rtt is None else min(self.__min_rtt, rtt)
+        elapsed = now - self.__interval_start_time
+        if elapsed >= constants.CHUNK_SIZING_INTERVAL_SECONDS:
+            self.__resize((self.__num_bytes_acked - self.__interval_start_num_bytes_acked) / elapsed,
+                          self.__interval_wait_seconds / elapsed)
+            self.__interval_start_time = now
+            self.__interval_start_num_bytes_acked = self.__num_bytes_acked
+            self.__interval_wait_seconds = 0
+
+    def __resize(self, throughput: float, wait_ratio: float):
+        # Acknowledgements are read in bursts, so a single interval's throughput is noisy
+        if self.__smoothed_throughput is not None:
+            throughput = 0.75 * self.__smoothed_throughput + 0.25 * throughput
+        self.__smoothed_throughput = throughput
+        target_size = throughput * constants.CHUNK_SIZING_TARGET_SECONDS
+        # A sender held back by a bandwidth cap finds the acknowledgements already waiting once its window is full
+        if wait_ratio >= constants.CHUNK_SIZING_WINDOW_LIMITED_RATIO:
+            target_size = max(target_size, 2 * self.chunk_size)
+        # Powers of two keep reads aligned with the pages of the file
+        chunk_size = constants.FILE_CHUNK_SIZE
+        while chunk_size * 2 <= min(target_size, constants.MAX_FILE_CHUNK_SIZE):
+            chunk_size *= 2
+        # Chunks only shrink once they are well past the target, so that they don't flap between two sizes
+        if chunk_size > self.chunk_size or 2 * chunk_size < self.chunk_size:
+            logger.debug(f"Chunk size {utils.format_size(self.chunk_size)} -> {utils.format_size(chunk_size)} at "
+                         f"{utils.format_size(throughput)}/s, RTT {self.__min_rtt * 1000:.2f} ms, window "
+                         f"{self.__window_size} chunks, waited on acknowledgements {wait_ratio:.0%} of the time")
+            self.chunk_size = chunk_size
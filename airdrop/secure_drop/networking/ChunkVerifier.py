@@ -0,0 +1,183 @@
+import socket
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from secure_drop import constants, exceptions
+from secure_drop.networking import framing, merkle
+from secure_drop.networking.framing import FrameType
+from secure_drop.networking.IncomingFile import IncomingFile
+
+
+class ChunkVerifier:
+    """Verifies an incoming file against the Merkle manifest its sender streams alongside it. Every leaf of the
+    manifest is hashed as its data arrives and checked as soon as the sender's hash of it follows, so a corrupt leaf
+    is requested again right away instead of the whole file being rehashed once the transfer is over.
+
+    Data is hashed on a background thread while the receiving thread writes it to disk and receives the next piece.
+    Each piece must therefore stay untouched until the piece after it is passed to `update`.
+    """
+
+    def __init__(self, sock: socket.socket, incoming_file: IncomingFile):
+        """Initializes the verifier.
+
+        Args:
+            sock (socket.socket): The socket connected to the sender, which corrupt leaves are requested over.
+            incoming_file (IncomingFile): The file being received. Repaired leaves are written straight into it.
+        """
+
+        self.__sock: socket.socket = sock
+        self.__incoming_file: IncomingFile = incoming_file
+        self.__num_leaves: int = merkle.get_num_leaves(incoming_file.offset, incoming_file.file_size)
+        self.__received_hashes: List[bytes] = []
+        self.__expected_hashes: List[bytes] = []
+        self.__expected_root: Optional[bytes] = None
+        # Leaves that failed verification, with the number of times each was requested again
+        self.__corrupt_leaves: Dict[int, int] = {}
+        self.__position: int = incoming_file.offset
+        self.__hasher: Any = merkle.create_leaf_hasher()
+        self.__executor: ThreadPoolExecutor = ThreadPoolExecutor(1, thread_name_prefix="ChunkVerifier")
+        self.__hashing: Optional[Future] = None
+        # The leaf that is currently being received again, if any
+        self.__repair_index: int = -1
+        self.__repair_position: int = 0
+        self.__repair_hasher: Any = None
+
+    def update(self, data: memoryview):
+        """Hashes the next piece of the file in the background.
+
+        Args:
+            data (memoryview): The piece, which must not be modified until the next call.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if the data extends past the announced file size.
+        """
+
+        while len(data) > 0:
+            if len(self.__received_hashes) == self.__num_leaves:
+                raise exceptions.UnexpectedFileSizeException(
+                    f"Received more than the announced {self.__incoming_file.file_size} bytes")
+            _, leaf_end = merkle.get_leaf(self.__incoming_file.offset, self.__incoming_file.file_size,
+                                          len(self.__received_hashes))
+            piece = data[:leaf_end - self.__position]
+            self.__wait_for_hashing()
+            self.__hashing = self.__executor.submit(self.__hasher.update, piece)
+            self.__position += len(piece)
+            data = data[len(piece):]
+            if self.__position == leaf_end:
+                self.__wait_for_hashing()
+                self.__received_hashes.append(self.__hasher.digest())
+                self.__hasher = merkle.create_leaf_hasher()
+
+    def check_leaf(self, leaf_hash: memoryview):
+        """Checks a leaf against the payload of the HASH frame that follows its data, and requests it again if it is
+        corrupt.
+
+        Raises:
+            exceptions.MalformedFrameException: Raised if the frame is malformed or doesn't follow the leaf's data.
+        """
+
+        if len(leaf_hash) != merkle.LEAF_HASH.size:
+            raise exceptions.MalformedFrameException("Malformed HASH frame")
+        leaf_index, expected_hash = merkle.LEAF_HASH.unpack(leaf_hash)
+        if leaf_index != len(self.__expected_hashes) or leaf_index >= len(self.__received_hashes):
+            raise exceptions.MalformedFrameException(f"Unexpected hash of leaf {leaf_index}")
+        self.__expected_hashes.append(expected_hash)
+        if self.__received_hashes[leaf_index] != expected_hash:
+            self.__request_repair(leaf_index)
+
+    def set_root(self, root: memoryview):
+        """Records the root of the sender's manifest from the payload of a ROOT frame.
+        """
+
+        if len(root) != merkle.HASH_SIZE:
+            raise exceptions.MalformedFrameException("Malformed ROOT frame")
+        self.__expected_root = bytes(root)
+
+    def start_repair(self, leaf_index: memoryview) -> int:
+        """Starts receiving a leaf that was requested again.
+
+        Args:
+            leaf_index (memoryview): The header of the REPAIR frame.
+
+        Raises:
+            exceptions.MalformedFrameException: Raised if the leaf wasn't requested.
+
+        Returns:
+            int: The number of bytes of the leaf that follow.
+        """
+
+        (index,) = merkle.LEAF_INDEX.unpack(leaf_index)
+        if index not in self.__corrupt_leaves:
+            raise exceptions.MalformedFrameException(f"Received leaf {index}, which wasn't requested")
+        start, end = merkle.get_leaf(self.__incoming_file.offset, self.__incoming_file.file_size, index)
+        self.__repair_index = index
+        self.__repair_position = start
+        self.__repair_hasher = merkle.create_leaf_hasher()
+        return end - start
+
+    def repair(self, data: memoryview):
+        """Hashes the next piece of a leaf that was requested again and writes it over the corrupt data.
+        """
+
+        self.__repair_hasher.update(data)
+        self.__incoming_file.overwrite_at(self.__repair_position, data)
+        self.__repair_position += len(data)
+
+    def finish_repair(self):
+        """Checks a leaf that was requested again once all of it arrived, and requests it once more if it is still
+        corrupt.
+
+        Raises:
+            exceptions.CorruptChunkException: Raised if the leaf was already requested too many times.
+        """
+
+        if self.__repair_hasher.digest() == self.__expected_hashes[self.__repair_index]:
+            self.__received_hashes[self.__repair_index] = self.__expected_hashes[self.__repair_index]
+            del self.__corrupt_leaves[self.__repair_index]
+        else:
+            self.__request_repair(self.__repair_index)
+
+    def has_pending_repairs(self) -> bool:
+        return len(self.__corrupt_leaves) > 0
+
+    def get_num_bytes_verified(self) -> int:
+        """Gets how much of the file, counting from its start, has been received and verified, which is all of it that
+        can safely be kept to resume the transfer from.
+        """
+
+        num_leaves_verified = len(self.__expected_hashes)
+        if self.__corrupt_leaves:
+            num_leaves_verified = min(self.__corrupt_leaves)
+        return self.__incoming_file.offset + num_leaves_verified * constants.MERKLE_LEAF_SIZE \
+            if num_leaves_verified < self.__num_leaves else self.__incoming_file.file_size
+
+    def finish(self):
+        """Checks that every leaf was verified and that the root of the received file matches the sender's.
+
+        Raises:
+            exceptions.CorruptChunkException: Raised if a leaf wasn't verified or the roots don't match.
+        """
+
+        self.close()
+        if len(self.__expected_hashes) != self.__num_leaves or self.__corrupt_leaves:
+            raise exceptions.CorruptChunkException(
+                f"Verified {len(self.__expected_hashes) - len(self.__corrupt_leaves)} of {self.__num_leaves} leaves")
+        if merkle.get_root(self.__received_hashes) != self.__expected_root:
+            raise exceptions.CorruptChunkException("The received file doesn't match the sender's manifest")
+
+    def close(self):
+        self.__wait_for_hashing()
+        self.__executor.shutdown()
+
+    def __request_repair(self, leaf_index: int):
+        num_attempts = self.__corrupt_leaves.get(leaf_index, 0)
+        if num_attempts >= constants.MAX_CHUNK_REPAIR_ATTEMPTS:
+            raise exceptions.CorruptChunkException(
+                f"Leaf {leaf_index} is still corrupt after {num_attempts} attempts to repair it")
+        self.__corrupt_leaves[leaf_index] = num_attempts + 1
+        framing.send_frame(self.__sock, FrameType.NACK, merkle.LEAF_INDEX.pack(leaf_index))
+
+    def __wait_for_hashing(self):
+        if self.__hashing is not None:
+            self.__hashing.result()
+            self.__hashing = None
@@ -1,9 +1,20 @@
 import socket
+import threading
 import uuid
 
+from secure_drop.networking.SwarmTransfer import PeerAddress
+
 
 class Connection:
-    def __init__(self, app_uuid: uuid.UUID, email: str, sock: socket.socket):
+    def __init__(self, app_uuid: uuid.UUID, email: str, sock: socket.socket, address: PeerAddress,
+                 is_local: bool = False):
         self.app_uuid: uuid.UUID = app_uuid
         self.email: str = email
+        # Only carries requests that are answered right away, such as presence checks; every transfer opens a data
+        # connection of its own to the address of the other instance's server
         self.sock: socket.socket = sock
+        self.address: PeerAddress = address
+        # Held for the whole of a request and its response, which would otherwise interleave with another's
+        self.lock: threading.Lock = threading.Lock()
+        # Whether the other instance runs on the same host and is reached over a Unix domain socket
+        self.is_local: bool = is_local
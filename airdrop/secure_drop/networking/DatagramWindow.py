@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Iterable, List, Optional, Tuple
+
+from secure_drop import constants
+from secure_drop.networking.TokenBucket import TokenBucket
+
+
+class DatagramWindow:
+    """Decides which datagram of a datagram transfer the sender sends next, and how fast. The receiver acknowledges
+    every datagram it gets with SACK frames, so a datagram that goes missing is sent again on its own, as soon as a
+    datagram sent after it is acknowledged or, failing that, once it times out.
+
+    Datagrams are paced at a rate instead of being held back by a congestion window. The rate grows for as long as
+    almost everything sent gets through, and drops to what actually got through once a lot stops doing so, such as
+    when the receiver or the link can't keep up. A few lost datagrams, as on a wireless link, don't slow it down.
+    """
+
+    def __init__(self, num_datagrams: int, data_size: int, bucket: Optional[TokenBucket] = None):
+        """Initializes the window.
+
+        Args:
+            num_datagrams (int): The number of datagrams of the file.
+            data_size (int): How much of the file each datagram carries.
+            bucket (Optional[TokenBucket], optional): The token bucket that caps the transfer, which the pacing passes
+                every datagram on to. Defaults to None.
+        """
+
+        self.num_datagrams: int = num_datagrams
+        self.num_datagrams_sent: int = 0
+        self.num_retransmissions: int = 0
+        self.__data_size: int = data_size
+        self.__pacer: TokenBucket = TokenBucket(constants.DATAGRAM_INITIAL_RATE, parent=bucket)
+        self.__condition: threading.Condition = threading.Condition()
+        self.__acked: bytearray = bytearray(num_datagrams)
+        self.__retransmitted: bytearray = bytearray(num_datagrams)
+        self.__num_acked: int = 0
+        self.__send_times: List[float] = [0.0] * num_datagrams
+        # The datagrams that were sent but not acknowledged yet, oldest first, along with when they were sent
+        self.__in_flight: Deque[Tuple[float, int]] = deque()
+        self.__retransmissions: Deque[int] = deque()
+        self.__next_new_datagram: int = 0
+        # Datagrams arrive in the order they are sent => any sent before the latest one that was acknowledged are lost
+        self.__latest_acked_send_time: float = 0
+        self.__smoothed_rtt: Optional[float] = None
+        self.__rtt_variation: float = 0
+        self.__is_failed: bool = False
+        self.__last_progress_time: float = time.monotonic()
+        self.__interval_start_time: float = time.monotonic()
+        self.__num_bytes_sent_in_interval: int = 0
+        self.__num_bytes_acked_in_interval: int = 0
+
+    def next_datagram(self) -> Optional[int]:
+        """Waits until the pacing allows another datagram to be sent and there is one to send.
+
+        Returns:
+            Optional[int]: The index of the datagram to send, or None once every datagram was acknowledged or the
+                transfer failed, including when nothing was acknowledged for too long.
+        """
+
+        self.__pacer.consume(self.__data_size)
+        with self.__condition:
+            while not self.__is_failed and self.__num_acked < self.num_datagrams:
+                now = time.monotonic()
+                if now - self.__last_progress_time > constants.DATAGRAM_STALL_TIMEOUT_SECONDS:
+                    self.__is_failed = True
+                    break
+                if (datagram_index := self.__pick_datagram(now)) is not None:
+                    self.__send_times[datagram_index] = now
+                    self.__in_flight.append((now, datagram_index))
+                    self.__num_bytes_sent_in_interval += self.__data_size
+                    self.num_datagrams_sent += 1
+                    return datagram_index
+                self.__condition.wait(self.__get_wait_time(now))
+            return None
+
+    def ack(self, runs: Iterable[range]):
+        """Records the datagrams a SACK frame acknowledged, and adapts the rate to how much is getting through.
+        """
+
+        with self.__condition:
+            now = time.monotonic()
+            for run in runs:
+                for datagram_index in run:
+                    if not 0 <= datagram_index < self.num_datagrams or self.__acked[datagram_index]:
+                        continue
+                    self.__acked[datagram_index] = 1
+                    self.__num_acked += 1
+                    self.__num_bytes_acked_in_interval += self.__data_size
+                    send_time = self.__send_times[datagram_index]
+                    self.__latest_acked_send_time = max(self.__latest_acked_send_time, send_time)
+                    # Only a datagram sent once tells how long the round trip took
+                    if not self.__retransmitted[datagram_index]:
+                        self.__update_rtt(now - send_time)
+                    self.__last_progress_time = now
+            self.__adapt_rate(now)
+            self.__condition.notify_all()
+
+    def reject(self, first_datagram: int, last_datagram: int):
+        """Records that the receiver found datagrams it had acknowledged to be corrupt, so that they are sent again
+        right away.
+
+        Args:
+            first_datagram (int): The index of the first datagram.
+            last_datagram (int): The index past the last datagram.
+        """
+
+        with self.__condition:
+            for datagram_index in range(max(first_datagram, 0), min(last_datagram, self.num_datagrams)):
+                if self.__acked[datagram_index]:
+                    self.__acked[datagram_index] = 0
+                    self.__num_acked -= 1
+                self.__retransmissions.append(datagram_index)
+            self.__condition.notify_all()
+
+    def fail(self):
+        """Gives up on the transfer, such as once the receiver disconnected.
+        """
+
+        with self.__condition:
+            self.__is_failed = True
+            self.__condition.notify_all()
+
+    def is_complete(self) -> bool:
+        with self.__condition:
+            return self.__num_acked == self.num_datagrams
+
+    def get_rate(self) -> Optional[float]:
+        return self.__pacer.get_rate()
+
+    def __pick_datagram(self, now: float) -> Optional[int]:
+        while self.__retransmissions:
+            datagram_index = self.__retransmissions.popleft()
+            if not self.__acked[datagram_index]:
+                return self.__retransmit(datagram_index)
+        while self.__in_flight:
+            send_time, datagram_index = self.__in_flight[0]
+            if self.__acked[datagram_index] or self.__send_times[datagram_index] != send_time:
+                # Acknowledged, or sent again since
+                self.__in_flight.popleft()
+                continue
+            if send_time < self.__latest_acked_send_time or now - send_time > self.__get_retransmit_timeout():
+                self.__in_flight.popleft()
+                return self.__retransmit(datagram_index)
+            break
+        if self.__next_new_datagram < self.num_datagrams and len(self.__in_flight) < constants.DATAGRAM_WINDOW_SIZE:
+            self.__next_new_datagram += 1
+            return self.__next_new_datagram - 1
+        return None
+
+    def __retransmit(self, datagram_index: int) -> int:
+        self.__retransmitted[datagram_index] = 1
+        self.num_retransmissions += 1
+        return datagram_index
+
+    def __get_wait_time(self, now: float) -> float:
+        if not self.__in_flight:
+            return constants.DATAGRAM_ACK_INTERVAL_SECONDS
+        return max(self.__in_flight[0][0] + self.__get_retransmit_timeout() - now, 0.001)
+
+    def __get_retransmit_timeout(self) -> float:
+        if self.__smoothed_rtt is None:
+            return constants.DATAGRAM_INITIAL_RETRANSMIT_TIMEOUT_SECONDS
+        # The receiver holds acknowledgements back for up to an interval
+        return max(self.__smoothed_rtt + 4 * self.__rtt_variation + constants.DATAGRAM_ACK_INTERVAL_SECONDS,
+                   constants.DATAGRAM_MIN_RETRANSMIT_TIMEOUT_SECONDS)
+
+    def __update_rtt(self, rtt: float):
+        # As TCP estimates its retransmission timeout in RFC 6298
+        if self.__smoothed_rtt is None:
+            self.__smoothed_rtt = rtt
+            self.__rtt_variation = rtt / 2
+        else:
+            self.__rtt_variation = 0.75 * self.__rtt_variation + 0.25 * abs(self.__smoothed_rtt - rtt)
+            self.__smoothed_rtt = 0.875 * self.__smoothed_rtt + 0.125 * rtt
+
+    def __adapt_rate(self, now: float):
+        elapsed = now - self.__interval_start_time
+        if elapsed < constants.DATAGRAM_RATE_INTERVAL_SECONDS:
+            return
+        rate = self.__pacer.get_rate()
+        num_bytes_sent, num_bytes_acked = self.__num_bytes_sent_in_interval, self.__num_bytes_acked_in_interval
+        if num_bytes_acked < constants.DATAGRAM_MIN_DELIVERY_RATIO * num_bytes_sent:
+            # Too much is getting lost => fall back to what got through
+            rate = max(num_bytes_acked / elapsed, constants.DATAGRAM_MIN_RATE)
+        elif num_bytes_sent >= rate * elapsed / 2:
+            # Only a rate that is actually used is raised, or it would grow without bound while the file is read
+            rate = min(rate * constants.DATAGRAM_RATE_GROWTH, constants.DATAGRAM_MAX_RATE)
+        self.__pacer.set_rate(rate)
+        self.__interval_start_time = now
+        self.__num_bytes_sent_in_interval = 0
+        self.__num_bytes_acked_in_interval = 0
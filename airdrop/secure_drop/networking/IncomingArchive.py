@@ -0,0 +1,132 @@
+import os
+import shutil
+import struct
+from pathlib import PurePosixPath
+from typing import List, Optional, Set
+
+from secure_drop import constants, exceptions
+from secure_drop.networking.IncomingFile import IncomingFile
+
+# Every entry of an archive starts with the size of its file, followed by its UTF-8 encoded relative path
+ENTRY_HEADER = struct.Struct("!Q")
+
+
+class IncomingArchive:
+    """Many files that are being received as one streamed archive. Each entry is unpacked into its own `IncomingFile`
+    as soon as its header arrives, so the archive is never stored as a whole. Entries that were completely received
+    are kept even if a later one fails.
+    """
+
+    def __init__(self, directory: str, num_files: int, total_size: int):
+        """Initializes the incoming archive. Nothing is created on disk until `reserve` is called.
+
+        Args:
+            directory (str): The directory to unpack the archive into.
+            num_files (int): The number of files the sender announced.
+            total_size (int): The total size of the files the sender announced.
+        """
+
+        self.directory: str = directory
+        self.num_files: int = num_files
+        self.total_size: int = total_size
+        self.final_paths: List[str] = []
+        self.__incoming_file: Optional[IncomingFile] = None
+
+    def reserve(self) -> bool:
+        """Checks that the disk has room for every file in the archive before any of it is sent.
+
+        Returns:
+            bool: True if the archive fits; False if it should be rejected.
+        """
+
+        if self.num_files < 0 or self.total_size < 0:
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        return shutil.disk_usage(self.directory).free >= self.total_size + constants.MIN_FREE_DISK_SPACE_BYTES
+
+    def start_entry(self, entry_header: memoryview):
+        """Commits the previous entry and starts receiving the file described by an entry header.
+
+        Args:
+            entry_header (memoryview): The payload of an ENTRY frame.
+
+        Raises:
+            exceptions.MalformedFrameException: Raised if the header is malformed, names an unsafe path, or the archive
+                has more entries than announced.
+            exceptions.UnexpectedFileSizeException: Raised if the previous entry is incomplete.
+            OSError: Raised if the disk has no room for the file.
+        """
+
+        self.__commit_entry()
+        if len(self.final_paths) >= self.num_files:
+            raise exceptions.MalformedFrameException(f"Received more than the announced {self.num_files} files")
+        if len(entry_header) <= ENTRY_HEADER.size:
+            raise exceptions.MalformedFrameException("Malformed archive entry header")
+        (file_size,) = ENTRY_HEADER.unpack_from(entry_header)
+        try:
+            parts = PurePosixPath(bytes(entry_header[ENTRY_HEADER.size:]).decode()).parts
+        except UnicodeDecodeError:
+            raise exceptions.MalformedFrameException("Archive entry name is not valid UTF-8")
+        if not IncomingArchive.__is_safe_path(parts):
+            raise exceptions.MalformedFrameException(f"Unsafe archive entry name: {'/'.join(parts)}")
+        directory = os.path.join(self.directory, *parts[:-1])
+        os.makedirs(directory, exist_ok=True)
+        self.__incoming_file = IncomingFile(directory, parts[-1], file_size)
+        if not self.__incoming_file.reserve():
+            self.__incoming_file = None
+            raise OSError(f"Unable to reserve space for {'/'.join(parts)}")
+
+    def write(self, data: memoryview):
+        """Appends data to the file of the current entry.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if data arrives before the first entry header.
+        """
+
+        if self.__incoming_file is None:
+            raise exceptions.UnexpectedFileSizeException("Received data before the first archive entry")
+        self.__incoming_file.write(data)
+
+    def commit(self) -> List[str]:
+        """Commits the last entry and forces every received file to disk.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if fewer files than announced were received.
+
+        Returns:
+            List[str]: The paths of the received files.
+        """
+
+        self.__commit_entry()
+        if len(self.final_paths) != self.num_files:
+            raise exceptions.UnexpectedFileSizeException(
+                f"Received {len(self.final_paths)} of the announced {self.num_files} files")
+        # Syncing once at the end lets the file system batch the writes of many small files
+        directories: Set[str] = set()
+        for path in self.final_paths:
+            IncomingFile.sync_to_disk(path)
+            directories.add(os.path.dirname(path))
+        for directory in directories:
+            IncomingFile.sync_to_disk(directory)
+        return self.final_paths
+
+    def discard(self):
+        """Discards the entry that was being received, if any. Entries that were already committed are kept.
+        """
+
+        if self.__incoming_file is not None:
+            self.__incoming_file.discard()
+            self.__incoming_file = None
+
+    def __commit_entry(self):
+        if self.__incoming_file is not None:
+            self.final_paths.append(self.__incoming_file.commit(sync=False))
+            self.__incoming_file = None
+
+    @staticmethod
+    def __is_safe_path(parts: tuple) -> bool:
+        """Determines whether a relative path stays inside the directory the archive is unpacked into.
+        """
+
+        return len(parts) > 0 and all(part not in ["", ".", "..", "/"] and "\\" not in part and "\0" not in part
+                                      for part in parts)
@@ -0,0 +1,104 @@
+from typing import List, Optional, Tuple
+
+from secure_drop import constants
+from secure_drop.networking import datagrams, merkle
+from secure_drop.networking.IncomingFile import IncomingFile
+
+
+class IncomingDatagrams:
+    """A file that is received as UDP datagrams, which may arrive in any order, more than once, or not at all. Each
+    datagram is written straight to its place in the file. Unless the transfer is encrypted, in which case every
+    datagram is authenticated on its own, each leaf of the file's Merkle manifest is verified as soon as all the
+    datagrams that carry it have arrived.
+    """
+
+    def __init__(self, incoming_file: IncomingFile, data_size: int, leaf_hashes: Optional[List[bytes]] = None):
+        """Initializes the incoming datagrams.
+
+        Args:
+            incoming_file (IncomingFile): The file the datagrams are written to. Space must already be reserved for it.
+            data_size (int): How much of the file each datagram carries.
+            leaf_hashes (Optional[List[bytes]], optional): The hashes of the leaves of the file's manifest to verify
+                the file against. Defaults to None, which doesn't verify it.
+        """
+
+        self.incoming_file: IncomingFile = incoming_file
+        self.data_size: int = data_size
+        self.num_datagrams: int = datagrams.get_num_datagrams(incoming_file.file_size, data_size)
+        self.__received: bytearray = bytearray(self.num_datagrams)
+        self.__written: bytearray = bytearray(self.num_datagrams)
+        self.__num_received: int = 0
+        self.__newly_received: List[int] = []
+        self.__leaf_hashes: Optional[List[bytes]] = leaf_hashes
+        self.__num_missing_by_leaf: List[int] = []
+        if leaf_hashes is not None:
+            for leaf_index in range(len(leaf_hashes)):
+                first_datagram, last_datagram = self.__get_datagrams_of_leaf(leaf_index)
+                self.__num_missing_by_leaf.append(last_datagram - first_datagram)
+
+    def write(self, datagram_index: int, data: memoryview) -> Optional[int]:
+        """Writes a datagram to its place in the file, unless it was already received.
+
+        Args:
+            datagram_index (int): The index of the datagram, which must be in range.
+            data (memoryview): The part of the file the datagram carries.
+
+        Returns:
+            Optional[int]: The index of a leaf that this datagram completed and that turned out to be corrupt, which
+                has to be rejected, or None.
+        """
+
+        if self.__received[datagram_index]:
+            return None
+        position = datagram_index * self.data_size
+        self.incoming_file.write_at(position, data, rewrite=self.__written[datagram_index] == 1)
+        self.__received[datagram_index] = self.__written[datagram_index] = 1
+        self.__num_received += 1
+        self.__newly_received.append(datagram_index)
+        if self.__leaf_hashes is None:
+            return None
+        corrupt_leaf_index = None
+        for leaf_index in self.__get_leaves_of_range(position, position + len(data)):
+            self.__num_missing_by_leaf[leaf_index] -= 1
+            if self.__num_missing_by_leaf[leaf_index] == 0 and corrupt_leaf_index is None and \
+                    not self.__is_leaf_intact(leaf_index):
+                corrupt_leaf_index = leaf_index
+        return corrupt_leaf_index
+
+    def reject_leaf(self, leaf_index: int):
+        """Forgets the datagrams that carry a corrupt leaf, so that they are received again.
+        """
+
+        first_datagram, last_datagram = self.__get_datagrams_of_leaf(leaf_index)
+        for datagram_index in range(first_datagram, last_datagram):
+            if not self.__received[datagram_index]:
+                continue
+            self.__received[datagram_index] = 0
+            self.__num_received -= 1
+            start, end = datagrams.get_datagram(self.incoming_file.file_size, self.data_size, datagram_index)
+            for other_leaf_index in self.__get_leaves_of_range(start, end):
+                self.__num_missing_by_leaf[other_leaf_index] += 1
+
+    def pop_newly_received(self) -> List[int]:
+        """Gets the indices of the datagrams received since this was last called, which are yet to be acknowledged.
+        """
+
+        newly_received, self.__newly_received = self.__newly_received, []
+        return newly_received
+
+    def is_complete(self) -> bool:
+        return self.__num_received == self.num_datagrams
+
+    def __get_datagrams_of_leaf(self, leaf_index: int) -> Tuple[int, int]:
+        start, end = merkle.get_leaf(0, self.incoming_file.file_size, leaf_index)
+        return datagrams.get_datagrams_of_range(start, end, self.data_size)
+
+    @staticmethod
+    def __get_leaves_of_range(start: int, end: int) -> range:
+        return range(start // constants.MERKLE_LEAF_SIZE, -(-end // constants.MERKLE_LEAF_SIZE))
+
+    def __is_leaf_intact(self, leaf_index: int) -> bool:
+        start, end = merkle.get_leaf(0, self.incoming_file.file_size, leaf_index)
+        hasher = merkle.create_leaf_hasher()
+        hasher.update(self.incoming_file.read_at(start, end - start))
+        return hasher.digest() == self.__leaf_hashes[leaf_index]
@@ -0,0 +1,424 @@
+import errno
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import BinaryIO, List, Optional, Set
+
+from secure_drop import constants, exceptions
+
+
+class IncomingFile:
+    """A file that is being received into a hidden temporary file, which is renamed into place once complete.
+    Transfers with a transfer ID journal their progress so that they can be resumed.
+    """
+
+    JOURNAL_FILE_NAME_FIELD_NAME = "file_name"
+    JOURNAL_FILE_SIZE_FIELD_NAME = "file_size"
+    JOURNAL_RANGES_FIELD_NAME = "ranges"
+
+    # Transfer IDs name files on disk, so anything other than a hex digest is refused
+    __TRANSFER_ID_REGEX = re.compile(r"[0-9a-f]{1,64}")
+    # Transfer IDs that are currently being received, so two concurrent transfers never share a journal
+    __active_transfer_ids: Set[str] = set()
+    __active_transfer_ids_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, directory: str, file_name: str, file_size: int, transfer_id: str = ""):
+        """Initializes the incoming file. Nothing is created on disk until `reserve` is called.
+
+        Args:
+            directory (str): The directory to receive the file into.
+            file_name (str): The name the sender gave the file.
+            file_size (int): The number of bytes the sender announced.
+            transfer_id (str, optional): The ID of a resumable transfer. Defaults to "".
+        """
+
+        self.directory: str = directory
+        self.file_name: str = os.path.basename(file_name)
+        self.file_size: int = file_size
+        self.transfer_id: str = transfer_id if IncomingFile.__TRANSFER_ID_REGEX.fullmatch(transfer_id) else ""
+        self.offset: int = 0
+        self.final_path: Optional[str] = None
+        self.__temp_path: Optional[str] = None
+        self.__file: Optional[BinaryIO] = None
+        self.__num_bytes_written: int = 0
+        self.__num_bytes_since_sync: int = 0
+        # Stripes of a striped transfer are written from several threads at once
+        self.__file_lock: threading.Lock = threading.Lock()
+
+    def reserve(self, preallocate: bool = True) -> bool:
+        """Reserves disk space for the file, or resumes an interrupted transfer of it from `offset`.
+
+        Args:
+            preallocate (bool, optional): Whether to preallocate the file. Defaults to True.
+
+        Returns:
+            bool: True if space was reserved for the file; False if the file should be rejected.
+        """
+
+        if self.file_size < 0 or self.file_name in ["", ".", ".."]:
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        if self.transfer_id:
+            IncomingFile.__prune_stale_transfers(self.directory)
+        if self.transfer_id and not self.__activate_transfer_id():
+            # The same file is already being received => receive this copy without a journal
+            self.transfer_id = ""
+        if self.transfer_id and self.__resume():
+            return True
+        if shutil.disk_usage(self.directory).free < self.file_size + constants.MIN_FREE_DISK_SPACE_BYTES:
+            self.__deactivate_transfer_id()
+            return False
+        if self.transfer_id:
+            self.__temp_path = self.__get_transfer_path(".part")
+            fd = os.open(self.__temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        else:
+            fd, self.__temp_path = tempfile.mkstemp(prefix=f".{self.file_name}.", suffix=".part", dir=self.directory)
+        self.__file = os.fdopen(fd, "wb")
+        try:
+            if preallocate and self.file_size > 0 and hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, self.file_size)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                self.discard()
+                return False
+            # The file system can't preallocate => the data is simply written without a reservation
+        return True
+
+    def write(self, data: memoryview):
+        """Appends data to the file, periodically forcing it to disk.
+
+        Args:
+            data (memoryview): The data to append.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if the data would exceed the announced file size.
+        """
+
+        if self.__num_bytes_written + len(data) > self.file_size:
+            raise exceptions.UnexpectedFileSizeException(f"Received more than the announced {self.file_size} bytes")
+        self.__file.write(data)
+        self.__num_bytes_written += len(data)
+        self.__num_bytes_since_sync += len(data)
+        if self.__num_bytes_since_sync >= constants.FSYNC_INTERVAL_BYTES:
+            self.__sync()
+
+    def skip(self, num_bytes: int):
+        """Leaves a hole in the file in place of a run of zeros.
+
+        Args:
+            num_bytes (int): The length of the hole.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if the hole would exceed the announced file size.
+        """
+
+        if num_bytes < 0 or self.__num_bytes_written + num_bytes > self.file_size:
+            raise exceptions.UnexpectedFileSizeException(f"Received more than the announced {self.file_size} bytes")
+        self.__file.seek(num_bytes, os.SEEK_CUR)
+        self.__num_bytes_written += num_bytes
+        if self.__file.tell() > os.fstat(self.__file.fileno()).st_size:
+            # A hole at the end of the file is only there once the file is extended over it
+            self.__file.truncate()
+
+    def copy_from(self, source_fd: int, position: int, num_bytes: int):
+        """Appends a byte range of another file by copying it inside the kernel.
+
+        Args:
+            source_fd (int): The descriptor of the file to copy from.
+            position (int): The start of the range in that file.
+            num_bytes (int): The length of the range.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if the range would exceed the announced file size, or if
+                the other file ends before the range does.
+        """
+
+        if num_bytes < 0 or self.__num_bytes_written + num_bytes > self.file_size:
+            raise exceptions.UnexpectedFileSizeException(f"Received more than the announced {self.file_size} bytes")
+        # Appended data may still be buffered => flush it first so that the copy lands after it
+        self.__file.flush()
+        destination = self.__file.tell()
+        while num_bytes > 0:
+            num_bytes_copied = IncomingFile.__copy_range(source_fd, position, self.__file.fileno(), destination,
+                                                         min(num_bytes, constants.FSYNC_INTERVAL_BYTES))
+            if num_bytes_copied == 0:
+                raise exceptions.UnexpectedFileSizeException("The file shrank while it was being copied")
+            position += num_bytes_copied
+            destination += num_bytes_copied
+            num_bytes -= num_bytes_copied
+            self.__num_bytes_written += num_bytes_copied
+            self.__num_bytes_since_sync += num_bytes_copied
+            if self.__num_bytes_since_sync >= constants.FSYNC_INTERVAL_BYTES:
+                self.__sync()
+        self.__file.seek(destination)
+
+    def write_at(self, position: int, data: memoryview, rewrite: bool = False):
+        """Writes data at a given position in the file, such as a stripe of a striped transfer.
+
+        Args:
+            position (int): The position in the file to write the data at.
+            data (memoryview): The data to write.
+            rewrite (bool, optional): Whether the data replaces data already written there. Defaults to False.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if the data would extend past the announced file size.
+            OSError: Raised if the file was already closed because the transfer failed.
+        """
+
+        if position < 0 or position + len(data) > self.file_size:
+            raise exceptions.UnexpectedFileSizeException(f"Received data outside the announced {self.file_size} bytes")
+        num_bytes_to_write = len(data)
+        with self.__file_lock:
+            if self.__file is None or self.__file.closed:
+                raise OSError(errno.EBADF, "The incoming file has already been closed")
+            if hasattr(os, "pwrite"):
+                while len(data) > 0:
+                    num_bytes_written = os.pwrite(self.__file.fileno(), data, position)
+                    data = data[num_bytes_written:]
+                    position += num_bytes_written
+            else:
+                # Not every platform has positional writes => seek under the lock instead
+                self.__file.seek(position)
+                self.__file.write(data)
+            if not rewrite:
+                self.__num_bytes_written += num_bytes_to_write
+            self.__num_bytes_since_sync += num_bytes_to_write
+            if self.__num_bytes_since_sync >= constants.FSYNC_INTERVAL_BYTES:
+                self.__sync()
+
+    def read_at(self, position: int, num_bytes: int) -> bytes:
+        """Reads back data that was written with `write_at`.
+
+        Args:
+            position (int): The position in the file to read from.
+            num_bytes (int): The number of bytes to read.
+
+        Raises:
+            OSError: Raised if the file was already closed because the transfer is over.
+
+        Returns:
+            bytes: The data, which is shorter than asked for if it extends past the end of the file.
+        """
+
+        with self.__file_lock:
+            if self.__file is None or self.__file.closed:
+                raise OSError(errno.EBADF, "The incoming file has already been closed")
+            return os.pread(self.__file.fileno(), num_bytes, position)
+
+    def overwrite_at(self, position: int, data: memoryview):
+        """Writes data over part of the file that was already written, such as a repaired chunk.
+
+        Args:
+            position (int): The position in the file to write the data at.
+            data (memoryview): The data to write.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if the data extends past what was already written.
+        """
+
+        if position < 0 or position + len(data) > self.__num_bytes_written:
+            raise exceptions.UnexpectedFileSizeException("Received data outside what was already written")
+        with self.__file_lock:
+            # Appended data may still be buffered => flush it first so that it can't land on top of the new data
+            self.__file.flush()
+            end = self.__file.tell()
+            self.__file.seek(position)
+            self.__file.write(data)
+            self.__file.flush()
+            self.__file.seek(end)
+
+    def commit(self, sync: bool = True, replace: bool = False) -> str:
+        """Forces the file to disk and atomically renames it into place under a name that isn't taken yet.
+
+        Args:
+            sync (bool, optional): Whether to force the file and its directory to disk. Defaults to True.
+            replace (bool, optional): Whether to replace the file of the same name instead, such as an earlier version
+                of the file that a delta was applied to. Defaults to False.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if fewer bytes than announced were received.
+
+        Returns:
+            str: The path of the received file.
+        """
+
+        if self.__num_bytes_written != self.file_size:
+            raise exceptions.UnexpectedFileSizeException(
+                f"Received {self.__num_bytes_written} of the announced {self.file_size} bytes")
+        if sync:
+            self.__sync()
+        self.__file.close()
+        if replace:
+            self.final_path = os.path.join(self.directory, self.file_name)
+            os.replace(self.__temp_path, self.final_path)
+        else:
+            self.final_path = self.__move_to_unused_path()
+        self.__temp_path = None
+        self.__remove_journal()
+        if sync:
+            IncomingFile.sync_to_disk(self.directory)
+        self.__deactivate_transfer_id()
+        return self.final_path
+
+    def suspend(self, num_bytes_kept: Optional[int] = None):
+        """Keeps what was received of a resumable transfer so that it can be resumed later, or discards the rest.
+
+        Args:
+            num_bytes_kept (Optional[int], optional): How much of the file to keep. Defaults to all of it.
+        """
+
+        if not self.transfer_id or self.__file is None:
+            self.discard()
+            return
+        try:
+            if num_bytes_kept is not None and num_bytes_kept < self.__num_bytes_written:
+                self.__file.flush()
+                self.__file.truncate(num_bytes_kept)
+                self.__num_bytes_written = num_bytes_kept
+            self.__sync()
+            self.__file.close()
+        except OSError:
+            self.discard()
+        self.__deactivate_transfer_id()
+
+    def discard(self):
+        """Closes and deletes the temporary file and the journal if they still exist.
+        """
+
+        with self.__file_lock:
+            if self.__file is not None:
+                self.__file.close()
+        if self.__temp_path is not None and os.path.exists(self.__temp_path):
+            os.remove(self.__temp_path)
+        self.__temp_path = None
+        self.__remove_journal()
+        self.__deactivate_transfer_id()
+
+    def __resume(self) -> bool:
+
+        temp_path = self.__get_transfer_path(".part")
+        if (ranges := self.__read_journal()) is None or not os.path.isfile(temp_path):
+            return False
+        # Data is sent in order, so the transfer resumes at the end of the range that starts at the beginning
+        self.offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        self.__temp_path = temp_path
+        self.__file = open(temp_path, "r+b")
+        self.__file.seek(self.offset)
+        self.__num_bytes_written = self.offset
+        return True
+
+    def __sync(self):
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__num_bytes_since_sync = 0
+        if self.transfer_id:
+            self.__write_journal([[0, self.__num_bytes_written]])
+
+    def __read_journal(self) -> Optional[List[List[int]]]:
+        try:
+            with open(self.__get_transfer_path(".journal"), "r") as f:
+                json_data = json.load(f)
+            if json_data[self.JOURNAL_FILE_NAME_FIELD_NAME] != self.file_name or \
+                json_data[self.JOURNAL_FILE_SIZE_FIELD_NAME] != self.file_size:
+                return None
+            return sorted([int(start), int(end)] for start, end in json_data[self.JOURNAL_RANGES_FIELD_NAME])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def __write_journal(self, ranges: List[List[int]]):
+        journal_path = self.__get_transfer_path(".journal")
+        with open(journal_path + ".tmp", "w") as f:
+            json.dump({
+                f"{self.JOURNAL_FILE_NAME_FIELD_NAME}": self.file_name,
+                f"{self.JOURNAL_FILE_SIZE_FIELD_NAME}": self.file_size,
+                f"{self.JOURNAL_RANGES_FIELD_NAME}": ranges
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(journal_path + ".tmp", journal_path)
+
+    def __remove_journal(self):
+        if self.transfer_id and os.path.exists(journal_path := self.__get_transfer_path(".journal")):
+            os.remove(journal_path)
+
+    def __get_transfer_path(self, suffix: str) -> str:
+        return os.path.join(self.directory, f".{self.transfer_id}{suffix}")
+
+    def __activate_transfer_id(self) -> bool:
+        with IncomingFile.__active_transfer_ids_lock:
+            if self.transfer_id in IncomingFile.__active_transfer_ids:
+                return False
+            IncomingFile.__active_transfer_ids.add(self.transfer_id)
+            return True
+
+    def __deactivate_transfer_id(self):
+        with IncomingFile.__active_transfer_ids_lock:
+            IncomingFile.__active_transfer_ids.discard(self.transfer_id)
+
+    def __move_to_unused_path(self) -> str:
+        # Hard links fail rather than replace an existing file, which makes picking an unused name race-free
+        stem, extension = os.path.splitext(self.file_name)
+        copy_number = 0
+        while True:
+            name = self.file_name if copy_number == 0 else f"{stem} ({copy_number}){extension}"
+            path = os.path.join(self.directory, name)
+            try:
+                os.link(self.__temp_path, path)
+                os.remove(self.__temp_path)
+                return path
+            except FileExistsError:
+                copy_number += 1
+            except OSError:
+                # The file system doesn't support hard links => fall back to a plain rename
+                if not os.path.exists(path):
+                    os.replace(self.__temp_path, path)
+                    return path
+                copy_number += 1
+
+    @staticmethod
+    def __copy_range(source_fd: int, source_position: int, fd: int, position: int, num_bytes: int) -> int:
+        if hasattr(os, "copy_file_range"):
+            try:
+                return os.copy_file_range(source_fd, fd, num_bytes, source_position, position)
+            except OSError as e:
+                # Older kernels can't copy across file systems => copy through user space instead
+                if e.errno not in [errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP]:
+                    raise
+        data = os.pread(source_fd, min(num_bytes, constants.RECEIVE_BUFFER_SIZE), source_position)
+        return os.pwrite(fd, data, position)
+
+    @staticmethod
+    def __prune_stale_transfers(directory: str):
+        expiry_time = time.time() - constants.RESUMABLE_TRANSFER_EXPIRY_SECONDS
+        for name in os.listdir(directory):
+            if not name.startswith(".") or not name.endswith((".part", ".journal")):
+                continue
+            try:
+                if os.path.getmtime(path := os.path.join(directory, name)) < expiry_time:
+                    os.remove(path)
+            except OSError:
+                # Another transfer removed it first
+                pass
+
+    @staticmethod
+    def sync_to_disk(path: str):
+        """Forces a file or directory to disk.
+
+        Args:
+            path (str): The path of the file or directory.
+        """
+
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
@@ -19,10 +19,12 @@ class NetworkResource(ABC):
     def stop(self):
         with self._should_stop_lock:
             self._should_stop = True
+        # Join outside the lock since running threads may still be adding threads of their own
         with self.__threads_lock:
-            for thread in self.__threads:
-                if thread.is_alive():
-                    thread.join()
+            threads = list(self.__threads)
+        for thread in threads:
+            if thread.is_alive():
+                thread.join()
 
     def _add_thread(self, thread: threading.Thread):
         with self.__threads_lock:
@@ -0,0 +1,276 @@
+import collections
+import os
+import threading
+from typing import Any, BinaryIO, Deque, Dict, List, Optional, Tuple
+
+from secure_drop import constants
+from secure_drop.networking import encryption, merkle
+
+
+class SharedFileReader:
+    """Reads a file from disk once for many concurrent transfers of it, each of which reads through a
+    `SharedFileView`. A transfer that falls a full queue behind is cut loose and reads the file itself.
+    """
+
+    def __init__(self, file_path: str, num_views: int, encryption_key: Optional[bytes] = None):
+        """Initializes the reader. The file isn't read until `start` is called.
+
+        Args:
+            file_path (str): The path to the file to read.
+            num_views (int): The number of transfers the file is read for.
+            encryption_key (Optional[bytes], optional): The content key shared by every recipient. Defaults to None.
+
+        Raises:
+            FileNotFoundError: Raised if the file does not exist.
+        """
+
+        self.file_path: str = file_path
+        self.encryption_key: Optional[bytes] = encryption_key
+        self.__file: BinaryIO = open(file_path, "rb")
+        self.file_size: int = os.fstat(self.__file.fileno()).st_size
+        self.views: List[SharedFileView] = [SharedFileView(self, view_index) for view_index in range(num_views)]
+        self.__condition: threading.Condition = threading.Condition()
+        # Each block is queued at its position, along with its encrypted chunks if the file is encrypted
+        self.__queued_blocks: List[Deque[Tuple[int, memoryview, Optional[memoryview]]]] = \
+            [collections.deque() for _ in range(num_views)]
+        self.__is_attached: List[bool] = [True] * num_views
+        # The shared reads wait until some transfer is ready to take the first block
+        self.__is_started: List[bool] = [False] * num_views
+        self.__is_done: bool = False
+        # The hashes of the leaves of the manifest of the whole file, which are computed as the blocks are read
+        self.__leaf_hashes: Dict[int, bytes] = {}
+        self.__thread: threading.Thread = threading.Thread(target=self.__read, name="SharedFileReader")
+
+    def start(self):
+        self.__thread.start()
+
+    def close(self):
+        """Stops the shared reads and waits for the background thread to finish. Every view must be closed first.
+        """
+
+        for view_index in range(len(self.views)):
+            self.detach(view_index)
+        if self.__thread.is_alive():
+            self.__thread.join()
+        self.__file.close()
+
+    def read_into(self, view_index: int, position: int, buffer: memoryview) -> Optional[int]:
+        """Copies data from the blocks queued for a view, dropping the blocks the view has moved past.
+
+        Args:
+            view_index (int): The index of the view.
+            position (int): The position in the file to read from.
+            buffer (memoryview): The buffer to copy the data into.
+
+        Returns:
+            Optional[int]: The number of bytes copied, or None if the view has to read the data itself.
+        """
+
+        with self.__condition:
+            if (queued_block := self.__get_queued_block(view_index, position)) is None:
+                return None
+            start, block, _ = queued_block
+            num_bytes = min(len(buffer), start + len(block) - position)
+            buffer[:num_bytes] = block[position - start:position - start + num_bytes]
+            return num_bytes
+
+    def read_encrypted_chunk(self, view_index: int, position: int) -> Optional[memoryview]:
+        """Gets the encrypted chunk at a position from the blocks queued for a view.
+
+        Args:
+            view_index (int): The index of the view.
+            position (int): The position in the file of the chunk.
+
+        Returns:
+            Optional[memoryview]: The encrypted chunk and its tag, or None if the view has to encrypt it itself.
+        """
+
+        if self.encryption_key is None or position % constants.ENCRYPTION_CHUNK_SIZE != 0:
+            return None
+        with self.__condition:
+            if (queued_block := self.__get_queued_block(view_index, position)) is None:
+                return None
+            start, block, encrypted_block = queued_block
+        chunk_index = (position - start) // constants.ENCRYPTION_CHUNK_SIZE
+        encrypted_start = chunk_index * (constants.ENCRYPTION_CHUNK_SIZE + encryption.TAG_SIZE)
+        encrypted_size = min(constants.ENCRYPTION_CHUNK_SIZE, start + len(block) - position) + encryption.TAG_SIZE
+        return encrypted_block[encrypted_start:encrypted_start + encrypted_size]
+
+    def hash_leaf(self, view_index: int, start: int, end: int) -> Optional[bytes]:
+        """Gets the hash of a leaf of the file's manifest from the shared reads, waiting for them to reach it.
+
+        Returns:
+            Optional[bytes]: The hash of the leaf, or None if the view has to hash it itself.
+        """
+
+        if start % constants.MERKLE_LEAF_SIZE != 0 or end != min(start + constants.MERKLE_LEAF_SIZE, self.file_size):
+            return None
+        with self.__condition:
+            self.__condition.wait_for(lambda: start in self.__leaf_hashes or self.__is_done or
+                                      not self.__is_attached[view_index])
+            return self.__leaf_hashes.get(start)
+
+    def detach(self, view_index: int):
+        """Cuts a view loose from the shared reads, after which it reads the file itself.
+        """
+
+        with self.__condition:
+            self.__is_started[view_index] = True
+            self.__is_attached[view_index] = False
+            self.__queued_blocks[view_index].clear()
+            self.__condition.notify_all()
+
+    def __get_queued_block(self, view_index: int,
+                           position: int) -> Optional[Tuple[int, memoryview, Optional[memoryview]]]:
+        """Waits for the block at a position to be queued for a view. Must be called with the condition held.
+        """
+
+        if not self.__is_started[view_index]:
+            self.__is_started[view_index] = True
+            self.__condition.notify_all()
+        queued_blocks = self.__queued_blocks[view_index]
+        while self.__is_attached[view_index]:
+            while queued_blocks and queued_blocks[0][0] + len(queued_blocks[0][1]) <= position:
+                queued_blocks.popleft()
+                # The queue has room again => the shared reads may go on
+                self.__condition.notify_all()
+            if queued_blocks:
+                return queued_blocks[0] if queued_blocks[0][0] <= position else None
+            if self.__is_done:
+                return None
+            self.__condition.wait()
+        return None
+
+    def __encrypt_block(self, position: int, block: bytes) -> memoryview:
+        encrypted_block = memoryview(bytearray(len(block) + encryption.get_num_chunks(0, len(block)) *
+                                               encryption.TAG_SIZE))
+        for chunk_start in range(0, len(block), constants.ENCRYPTION_CHUNK_SIZE):
+            chunk_size = min(constants.ENCRYPTION_CHUNK_SIZE, len(block) - chunk_start)
+            encrypted_start = chunk_start // constants.ENCRYPTION_CHUNK_SIZE * \
+                (constants.ENCRYPTION_CHUNK_SIZE + encryption.TAG_SIZE)
+            chunk = encrypted_block[encrypted_start:encrypted_start + chunk_size + encryption.TAG_SIZE]
+            chunk[:chunk_size] = block[chunk_start:chunk_start + chunk_size]
+            encryption.encrypt_chunk(self.encryption_key, position + chunk_start, chunk)
+        return encrypted_block
+
+    def __read(self):
+        position = 0
+        leaf_hasher: Any = merkle.create_leaf_hasher()
+        try:
+            while position < self.file_size:
+                with self.__condition:
+                    self.__condition.wait_for(self.__can_read)
+                    if not any(self.__is_attached):
+                        break
+                # Blocks never straddle two leaves, so every leaf is hashed from the blocks it is made of
+                leaf_start = position - position % constants.MERKLE_LEAF_SIZE
+                leaf_end = min(leaf_start + constants.MERKLE_LEAF_SIZE, self.file_size)
+                if not (block := self.__file.read(min(constants.SHARED_READ_BLOCK_SIZE, leaf_end - position))):
+                    # The file shrank => every view finds out for itself once it reads past the end
+                    break
+                leaf_hasher.update(block)
+                encrypted_block = self.__encrypt_block(position, block) if self.encryption_key is not None else None
+                with self.__condition:
+                    for view_index, queued_blocks in enumerate(self.__queued_blocks):
+                        if not self.__is_attached[view_index]:
+                            continue
+                        if len(queued_blocks) >= constants.MAX_SHARED_READ_BLOCKS_QUEUED:
+                            # This view is a full queue behind the fastest one => cut it loose instead of waiting
+                            self.__is_attached[view_index] = False
+                            queued_blocks.clear()
+                        else:
+                            queued_blocks.append((position, memoryview(block), encrypted_block))
+                    position += len(block)
+                    if position == leaf_end:
+                        self.__leaf_hashes[leaf_start] = leaf_hasher.digest()
+                        leaf_hasher = merkle.create_leaf_hasher()
+                    self.__condition.notify_all()
+        except OSError:
+            # Views read the file themselves from here on, and run into the same error if it persists
+            pass
+        finally:
+            with self.__condition:
+                self.__is_done = True
+                self.__condition.notify_all()
+
+    def __can_read(self) -> bool:
+        if not any(self.__is_started):
+            return False
+        attached_queues = [queued_blocks for view_index, queued_blocks in enumerate(self.__queued_blocks)
+                           if self.__is_attached[view_index]]
+        return not attached_queues or \
+            any(len(queued_blocks) < constants.MAX_SHARED_READ_BLOCKS_QUEUED for queued_blocks in attached_queues)
+
+
+class SharedFileView:
+    """A file-like view of a file that a `SharedFileReader` reads once for many transfers.
+    """
+
+    def __init__(self, reader: SharedFileReader, view_index: int):
+        self.name: str = reader.file_path
+        self.encryption_key: Optional[bytes] = reader.encryption_key
+        self.__reader: SharedFileReader = reader
+        self.__view_index: int = view_index
+        self.__file: BinaryIO = open(reader.file_path, "rb")
+        self.__position: int = 0
+
+    def __enter__(self) -> "SharedFileView":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def fileno(self) -> int:
+        return self.__file.fileno()
+
+    def seek(self, position: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            position += self.__position
+        elif whence == os.SEEK_END:
+            position += self.__reader.file_size
+        self.__position = position
+        return position
+
+    def tell(self) -> int:
+        return self.__position
+
+    def readinto(self, buffer: Any) -> int:
+        buffer = memoryview(buffer).cast("B")
+        if len(buffer) == 0 or self.__position >= self.__reader.file_size:
+            return 0
+        if (num_bytes := self.__reader.read_into(self.__view_index, self.__position, buffer)) is None:
+            self.__file.seek(self.__position)
+            num_bytes = self.__file.readinto(buffer)
+        self.__position += num_bytes
+        return num_bytes
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = max(self.__reader.file_size - self.__position, 0)
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        num_bytes = 0
+        while num_bytes < size and (num_bytes_read := self.readinto(view[num_bytes:])) > 0:
+            num_bytes += num_bytes_read
+        del view
+        del buffer[num_bytes:]
+        return bytes(buffer)
+
+    def read_encrypted_chunk(self, position: int) -> Optional[memoryview]:
+        """Gets the chunk at a position as encrypted by the shared reads, if they cover it.
+        """
+
+        return self.__reader.read_encrypted_chunk(self.__view_index, position)
+
+    def hash_leaf(self, start: int, end: int) -> bytes:
+        """Hashes a leaf of the file's manifest, taking the hash from the shared reads if they cover the leaf.
+        """
+
+        if (leaf_hash := self.__reader.hash_leaf(self.__view_index, start, end)) is not None:
+            return leaf_hash
+        with open(self.name, "rb") as f:
+            return merkle.hash_leaf(f, start, end)
+
+    def close(self):
+        self.__reader.detach(self.__view_index)
+        self.__file.close()
@@ -0,0 +1,93 @@
+import secrets
+import threading
+from typing import List, Optional, Set, Tuple
+
+from secure_drop import constants
+from secure_drop.networking.IncomingFile import IncomingFile
+from secure_drop.networking.TransferOptions import TransferOptions
+
+
+class StripedTransfer:
+    """A file that is received as several byte ranges, or stripes, in parallel. The connection that requested the
+    transfer is given a token, which each extra connection presents to claim one of the stripes. Every stripe is
+    written straight to its place in the file, so the file is reassembled as the stripes arrive.
+    """
+
+    def __init__(self, incoming_file: IncomingFile, options: TransferOptions):
+        """Initializes the striped transfer.
+
+        Args:
+            incoming_file (IncomingFile): The file the stripes are written to. Space must already be reserved for it.
+            options (TransferOptions): The options the sender requested the transfer with.
+        """
+
+        self.token: str = secrets.token_hex(16)
+        self.incoming_file: IncomingFile = incoming_file
+        self.options: TransferOptions = options
+        self.stripes: List[Tuple[int, int]] = StripedTransfer.get_stripes(incoming_file.file_size,
+                                                                          options.num_streams)
+        self.__claimed_stripe_indices: Set[int] = set()
+        self.__completed_stripe_indices: Set[int] = set()
+        self.__stripe_indices_lock: threading.Lock = threading.Lock()
+        self.__key: Optional[bytes] = None
+        self.__key_exchanged: threading.Event = threading.Event()
+
+    def claim_stripe(self, stripe_index: int) -> Optional[Tuple[int, int]]:
+        """Claims a stripe for a connection. Each stripe can only be claimed once.
+
+        Args:
+            stripe_index (int): The index of the stripe.
+
+        Returns:
+            Optional[Tuple[int, int]]: The [start, end) byte range of the stripe, or None if there is no such stripe or
+                it was already claimed.
+        """
+
+        with self.__stripe_indices_lock:
+            if not 0 <= stripe_index < len(self.stripes) or stripe_index in self.__claimed_stripe_indices:
+                return None
+            self.__claimed_stripe_indices.add(stripe_index)
+        return self.stripes[stripe_index]
+
+    def complete_stripe(self, stripe_index: int):
+        with self.__stripe_indices_lock:
+            self.__completed_stripe_indices.add(stripe_index)
+
+    def is_complete(self) -> bool:
+        with self.__stripe_indices_lock:
+            return len(self.__completed_stripe_indices) == len(self.stripes)
+
+    def set_key(self, key: Optional[bytes]):
+        """Hands the transfer key to the stripes of an encrypted transfer, or None to refuse them."""
+
+        self.__key = key
+        self.__key_exchanged.set()
+
+    def wait_for_key(self) -> Optional[bytes]:
+        """Waits for the connection that requested an encrypted transfer to exchange its key.
+
+        Returns:
+            Optional[bytes]: The transfer key, or None if the exchange failed or took too long.
+        """
+
+        if not self.__key_exchanged.wait(constants.CONTROL_REQUEST_TIMEOUT_SECONDS):
+            return None
+        return self.__key
+
+    @staticmethod
+    def get_stripes(file_size: int, num_streams: int) -> List[Tuple[int, int]]:
+        """Splits a file into at most `num_streams` contiguous byte ranges of roughly equal size. Both ends of a
+        transfer derive the stripes from the announced file size, so they never have to be sent.
+
+        Args:
+            file_size (int): The size of the file.
+            num_streams (int): The maximum number of stripes.
+
+        Returns:
+            List[Tuple[int, int]]: The [start, end) byte ranges of the stripes in order. Empty files have no stripes.
+        """
+
+        # Stripes start on chunk boundaries so that every stream sends whole chunks
+        num_chunks = -(-file_size // constants.FILE_CHUNK_SIZE)
+        stripe_size = -(-num_chunks // num_streams) * constants.FILE_CHUNK_SIZE if num_chunks > 0 else 0
+        return [(start, min(start + stripe_size, file_size)) for start in range(0, file_size, stripe_size or 1)]
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from secure_drop import constants
+from secure_drop.networking import merkle
+
+
+class SwarmSeeder:
+    """Keeps track of which pieces of a file each receiver of a swarm has, and picks the pieces the sender seeds. Each
+    piece is seeded to a single receiver, and the receivers pass pieces on to one another, so the sender's uplink only
+    carries the file about once no matter how many receivers there are.
+
+    Pieces that no receiver has yet are seeded first. A receiver that drops out takes its pieces with it, so any of
+    them that no one else has are seeded again. A receiver that goes without a piece for too long, such as one that
+    can't reach its peers, is seeded the rarest pieces it lacks itself.
+    """
+
+    def __init__(self, file_size: int, num_receivers: int):
+        """Initializes the seeder.
+
+        Args:
+            file_size (int): The size of the file, whose pieces are the leaves of its Merkle manifest.
+            num_receivers (int): The number of receivers in the swarm.
+        """
+
+        self.file_size: int = file_size
+        self.num_pieces: int = merkle.get_num_leaves(0, file_size)
+        self.__condition: threading.Condition = threading.Condition()
+        self.__pieces_by_receiver: List[Set[int]] = [set() for _ in range(num_receivers)]
+        self.__failed_receivers: Set[int] = set()
+        # Pieces that were seeded but that the receiver hasn't confirmed yet, by the receiver they were seeded to
+        self.__pieces_in_flight: Dict[int, int] = {}
+        self.__unseeded_pieces: Deque[int] = deque(range(self.num_pieces))
+        self.__last_progress_times: List[float] = [time.monotonic()] * num_receivers
+
+    def next_piece(self, receiver_index: int) -> Optional[int]:
+        """Waits until there is a piece to seed to a receiver.
+
+        Args:
+            receiver_index (int): The index of the receiver.
+
+        Returns:
+            Optional[int]: The index of the piece to seed, or None once every receiver has the whole file or dropped
+                out, or the receiver itself dropped out.
+        """
+
+        with self.__condition:
+            while receiver_index not in self.__failed_receivers and not self.__is_finished():
+                if self.__unseeded_pieces:
+                    piece_index = self.__unseeded_pieces.popleft()
+                elif time.monotonic() - self.__last_progress_times[receiver_index] > constants.SWARM_STALL_SECONDS:
+                    piece_index = self.__get_rarest_missing_piece(receiver_index)
+                    # Give the receiver's peers another chance before seeding it the next piece
+                    self.__last_progress_times[receiver_index] = time.monotonic()
+                else:
+                    piece_index = None
+                if piece_index is not None:
+                    self.__pieces_in_flight[piece_index] = receiver_index
+                    return piece_index
+                self.__condition.wait(constants.SWARM_POLL_INTERVAL_SECONDS)
+            return None
+
+    def add_piece(self, receiver_index: int, piece_index: int):
+        """Records that a receiver has a piece, whoever it got it from.
+        """
+
+        with self.__condition:
+            self.__pieces_by_receiver[receiver_index].add(piece_index)
+            if self.__pieces_in_flight.get(piece_index) == receiver_index:
+                del self.__pieces_in_flight[piece_index]
+            self.__last_progress_times[receiver_index] = time.monotonic()
+            self.__condition.notify_all()
+
+    def reject_piece(self, receiver_index: int, piece_index: int):
+        """Records that a piece seeded to a receiver arrived corrupt, so that it is seeded again.
+        """
+
+        with self.__condition:
+            if self.__pieces_in_flight.get(piece_index) == receiver_index:
+                del self.__pieces_in_flight[piece_index]
+                self.__unseeded_pieces.appendleft(piece_index)
+            self.__condition.notify_all()
+
+    def fail(self, receiver_index: int):
+        """Records that a receiver dropped out of the swarm. The pieces that only it had or was being seeded are
+        seeded again.
+        """
+
+        with self.__condition:
+            if receiver_index in self.__failed_receivers:
+                return
+            self.__failed_receivers.add(receiver_index)
+            lost_pieces = self.__pieces_by_receiver[receiver_index] | \
+                {piece_index for piece_index, index in self.__pieces_in_flight.items() if index == receiver_index}
+            self.__pieces_by_receiver[receiver_index] = set()
+            for piece_index in sorted(lost_pieces):
+                if self.__pieces_in_flight.get(piece_index) == receiver_index:
+                    del self.__pieces_in_flight[piece_index]
+                if piece_index not in self.__pieces_in_flight and self.__get_availability(piece_index) == 0:
+                    self.__unseeded_pieces.append(piece_index)
+            self.__condition.notify_all()
+
+    def get_piece(self, piece_index: int) -> Tuple[int, int]:
+        """Gets the [start, end) byte range of a piece.
+        """
+
+        return merkle.get_leaf(0, self.file_size, piece_index)
+
+    def __is_finished(self) -> bool:
+        return all(receiver_index in self.__failed_receivers or len(pieces) == self.num_pieces
+                   for receiver_index, pieces in enumerate(self.__pieces_by_receiver))
+
+    def __get_availability(self, piece_index: int) -> int:
+        return sum(piece_index in pieces for pieces in self.__pieces_by_receiver)
+
+    def __get_rarest_missing_piece(self, receiver_index: int) -> Optional[int]:
+        missing_pieces = [piece_index for piece_index in range(self.num_pieces)
+                          if piece_index not in self.__pieces_by_receiver[receiver_index] and
+                          piece_index not in self.__pieces_in_flight]
+        return min(missing_pieces, key=self.__get_availability, default=None)
@@ -0,0 +1,242 @@
+import ipaddress
+import json
+import random
+import socket
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+from secure_drop import constants, exceptions
+from secure_drop.networking import encryption, framing, merkle
+from secure_drop.networking.framing import FrameType
+from secure_drop.networking.IncomingFile import IncomingFile
+
+# A peer is reached at the address of its server, which is a Unix domain socket path for a peer on the same host
+PeerAddress = Union[str, Tuple[str, int]]
+
+
+def parse_peer_addresses(peer_addresses_json: str, allow_paths: bool) -> Optional[List[PeerAddress]]:
+    """Parses the addresses of the other receivers in a swarm, as sent by the sender.
+
+    Args:
+        peer_addresses_json (str): The JSON list of addresses, each an [IP, port] pair or a Unix domain socket path.
+        allow_paths (bool): Whether the sender is on the same host, without which the paths can't be reached and are
+            dropped.
+
+    Returns:
+        Optional[List[PeerAddress]]: The addresses, or None if the list is malformed.
+    """
+
+    try:
+        addresses = json.loads(peer_addresses_json)
+    except ValueError:
+        return None
+    if not isinstance(addresses, list):
+        return None
+    peer_addresses: List[PeerAddress] = []
+    for address in addresses:
+        if isinstance(address, str):
+            if allow_paths:
+                peer_addresses.append(address)
+            continue
+        if not isinstance(address, list) or len(address) != 2 or not isinstance(address[0], str) or \
+                type(address[1]) is not int or not 0 < address[1] < 65536:
+            return None
+        try:
+            ipaddress.ip_address(address[0])
+        except ValueError:
+            return None
+        peer_addresses.append((address[0], address[1]))
+    return peer_addresses
+
+
+class SwarmTransfer:
+    """A file that is received as part of a swarm. The sender seeds each piece of the file to one of the receivers,
+    and the receivers fetch the pieces they lack from one another. The pieces are the leaves of the file's Merkle
+    manifest, which the sender sends up front, so every piece is verified against the sender's hash of it no matter
+    which receiver it came from.
+
+    Pieces are written straight to their place in the file, and what was received is served to other receivers from
+    there until the sender ends the swarm.
+    """
+
+    __MISSING = 0
+    __FETCHING = 1
+    __WRITING = 2
+    __RECEIVED = 3
+
+    def __init__(self, swarm_id: str, incoming_file: IncomingFile, peer_addresses: List[PeerAddress],
+                 sender_sock: socket.socket, encrypt: bool = False):
+        """Initializes the swarm transfer.
+
+        Args:
+            swarm_id (str): The ID the sender gave the swarm, which receivers present to fetch pieces from each other.
+            incoming_file (IncomingFile): The file the pieces are written to. Space must already be reserved for it.
+            peer_addresses (List[PeerAddress]): The addresses of the servers of the other receivers.
+            sender_sock (socket.socket): The socket connected to the sender, which is told about every piece received.
+            encrypt (bool, optional): Whether the pieces travel encrypted under a content key that the sender shares
+                with every receiver. Defaults to False.
+        """
+
+        self.swarm_id: str = swarm_id
+        self.incoming_file: IncomingFile = incoming_file
+        self.peer_addresses: List[PeerAddress] = peer_addresses
+        self.encrypt: bool = encrypt
+        # The content key of an encrypted swarm, which the sender sends once the swarm is accepted
+        self.key: Optional[bytes] = None
+        self.num_pieces: int = merkle.get_num_leaves(0, incoming_file.file_size)
+        self.__piece_hashes: List[Optional[bytes]] = [None] * self.num_pieces
+        self.__piece_states: bytearray = bytearray(self.num_pieces)
+        self.__num_pieces_received: int = 0
+        # The pieces each peer had when it was last asked, which tells which pieces are the rarest
+        self.__peer_bitfields: Dict[int, bytes] = {}
+        self.__pieces_lock: threading.Lock = threading.Lock()
+        self.__sender_sock: socket.socket = sender_sock
+        self.__sender_sock_lock: threading.Lock = threading.Lock()
+        self.__ended: threading.Event = threading.Event()
+
+    def set_piece_hash(self, piece_index: int, piece_hash: bytes):
+        self.__piece_hashes[piece_index] = piece_hash
+
+    def get_piece_hashes(self) -> List[Optional[bytes]]:
+        return list(self.__piece_hashes)
+
+    def get_bitfield(self) -> bytes:
+        """Gets the pieces that were received so far, with the bit of each piece set if it was received, starting
+        from the most significant bit of the first byte.
+        """
+
+        bitfield = bytearray(-(-self.num_pieces // 8))
+        with self.__pieces_lock:
+            for piece_index, state in enumerate(self.__piece_states):
+                if state == SwarmTransfer.__RECEIVED:
+                    bitfield[piece_index >> 3] |= 0x80 >> (piece_index & 7)
+        return bytes(bitfield)
+
+    def claim_piece(self, peer_index: int, peer_bitfield: bytes) -> Optional[int]:
+        """Claims a piece to fetch from a peer, so that no other peer is asked for it at the same time. The rarest of
+        a sample of the pieces that the peer has and this receiver lacks is picked, so that rare pieces spread
+        before the peers that have them drop out.
+
+        Args:
+            peer_index (int): The index of the peer.
+            peer_bitfield (bytes): The pieces the peer has, as returned by its `get_bitfield`.
+
+        Returns:
+            Optional[int]: The index of the claimed piece, or None if the peer has no piece this receiver lacks.
+        """
+
+        with self.__pieces_lock:
+            self.__peer_bitfields[peer_index] = peer_bitfield
+            candidates: List[int] = []
+            start = random.randrange(self.num_pieces) if self.num_pieces > 0 else 0
+            for offset in range(self.num_pieces):
+                piece_index = (start + offset) % self.num_pieces
+                if self.__piece_states[piece_index] == SwarmTransfer.__MISSING and \
+                        SwarmTransfer.__has_piece(peer_bitfield, piece_index):
+                    candidates.append(piece_index)
+                    if len(candidates) == constants.SWARM_RAREST_FIRST_SAMPLE_SIZE:
+                        break
+            if not candidates:
+                return None
+            piece_index = min(candidates, key=lambda index: sum(SwarmTransfer.__has_piece(bitfield, index)
+                                                                for bitfield in self.__peer_bitfields.values()))
+            self.__piece_states[piece_index] = SwarmTransfer.__FETCHING
+            return piece_index
+
+    def release_piece(self, piece_index: int):
+        """Gives up a claim on a piece that couldn't be fetched, so that it can be fetched elsewhere.
+        """
+
+        with self.__pieces_lock:
+            if self.__piece_states[piece_index] == SwarmTransfer.__FETCHING:
+                self.__piece_states[piece_index] = SwarmTransfer.__MISSING
+
+    def write_piece(self, piece_index: int, data: memoryview) -> bool:
+        """Verifies a piece against its hash and writes it to its place in the file, unless the same piece already
+        arrived from elsewhere. The sender is told about every piece received.
+
+        Args:
+            piece_index (int): The index of the piece.
+            data (memoryview): The data of the piece, which is encrypted in an encrypted swarm and decrypted in place.
+
+        Returns:
+            bool: True if the piece is intact; False if it is corrupt.
+        """
+
+        hasher = merkle.create_leaf_hasher()
+        hasher.update(data)
+        if hasher.digest() != self.__piece_hashes[piece_index]:
+            return False
+        if self.key is not None:
+            try:
+                encryption.decrypt_chunk(self.key, self.get_piece(piece_index)[0], data)
+            except exceptions.CorruptChunkException:
+                return False
+            data = data[:-encryption.TAG_SIZE]
+        with self.__pieces_lock:
+            state = self.__piece_states[piece_index]
+            if state == SwarmTransfer.__WRITING:
+                # Whoever is writing the piece tells the sender about it
+                return True
+            if state != SwarmTransfer.__RECEIVED:
+                self.__piece_states[piece_index] = SwarmTransfer.__WRITING
+        if state != SwarmTransfer.__RECEIVED:
+            try:
+                self.incoming_file.write_at(self.get_piece(piece_index)[0], data)
+            except BaseException:
+                with self.__pieces_lock:
+                    self.__piece_states[piece_index] = SwarmTransfer.__MISSING
+                raise
+            with self.__pieces_lock:
+                self.__piece_states[piece_index] = SwarmTransfer.__RECEIVED
+                self.__num_pieces_received += 1
+        # A duplicate is confirmed too, since the sender may be waiting to hear about the piece it seeded
+        self.send_to_sender(FrameType.HAVE, merkle.LEAF_INDEX.pack(piece_index))
+        return True
+
+    def read_piece(self, piece_index: int) -> Optional[bytes]:
+        """Reads a piece that was received, to serve it to another receiver.
+
+        Returns:
+            Optional[bytes]: The data of the piece, encrypted again in an encrypted swarm, or None if it hasn't been
+                received.
+        """
+
+        with self.__pieces_lock:
+            if not 0 <= piece_index < self.num_pieces or \
+                    self.__piece_states[piece_index] != SwarmTransfer.__RECEIVED:
+                return None
+        start, end = self.get_piece(piece_index)
+        data = self.incoming_file.read_at(start, end - start)
+        # The position of a piece is its nonce, so sealing it again gives the very ciphertext the sender hashed
+        return bytes(encryption.seal_chunk(self.key, start, data)) if self.key is not None else data
+
+    def get_piece(self, piece_index: int) -> Optional[Tuple[int, int]]:
+        """Gets the [start, end) byte range of a piece, or None if there is no such piece.
+        """
+
+        return merkle.get_leaf(0, self.incoming_file.file_size, piece_index)
+
+    def send_to_sender(self, frame_type: FrameType, payload: bytes):
+        """Sends a frame to the sender, which the receiving thread and the threads fetching from peers all do.
+        """
+
+        with self.__sender_sock_lock:
+            framing.send_frame(self.__sender_sock, frame_type, payload)
+
+    def is_complete(self) -> bool:
+        with self.__pieces_lock:
+            return self.__num_pieces_received == self.num_pieces
+
+    def end(self):
+        self.__ended.set()
+
+    def is_ended(self) -> bool:
+        return self.__ended.is_set()
+
+    def wait_until_ended(self, timeout: float) -> bool:
+        return self.__ended.wait(timeout)
+
+    @staticmethod
+    def __has_piece(bitfield: bytes, piece_index: int) -> bool:
+        return (piece_index >> 3) < len(bitfield) and bool(bitfield[piece_index >> 3] & (0x80 >> (piece_index & 7)))
@@ -1,34 +1,59 @@
 import os
+import select
 import socket
 import threading
 import time
-from typing import Optional
+from contextlib import nullcontext
+from typing import Dict, List, Optional
 
 from secure_drop import constants, exceptions
-from secure_drop.networking import socket_helpers
+from secure_drop.networking import socket_helpers, socket_tuning, striped_transfers, swarm_transfers
+from secure_drop.networking.IncomingArchive import IncomingArchive
+from secure_drop.networking.IncomingFile import IncomingFile
 from secure_drop.networking.messages.ClientRequest import (ClientRequest,
                                                            ClientRequestType)
 from secure_drop.networking.NetworkResource import NetworkResource
+from secure_drop.networking.StripedTransfer import StripedTransfer
+from secure_drop.networking.SwarmTransfer import SwarmTransfer, parse_peer_addresses
+from secure_drop.networking.TransferOptions import TransferOptions
+from secure_drop.singletons.BandwidthManager import BandwidthManager, Direction
 from secure_drop.singletons.ContactManager import ContactManager
 from secure_drop.singletons.LoginManager import LoginManager
 from secure_drop.types.Contact import Contact
 
 
 class TCPServer(NetworkResource):
+    # Requests that are answered right away, unlike those that start a transfer, which goes at the sender's pace
+    __CONTROL_REQUEST_TYPES = [ClientRequestType.PING, ClientRequestType.EMAIL, ClientRequestType.HAS_ADDED,
+                               ClientRequestType.SEND_FILE_CONSENT]
+
     def __init__(self):
         super().__init__()
         self.__port: Optional[int] = None
         self.__port_lock: threading.Lock = threading.Lock()
+        self.__local_socket_path: Optional[str] = None
         self.__is_waiting_for_send_file_consent: bool = False
         self.__is_waiting_for_send_file_consent_lock: threading.Lock = threading.Lock()
         self.__consents_to_receive_file: bool = False
         self.__consents_to_receive_file_lock: threading.Lock = threading.Lock()
+        self.__striped_transfers: Dict[str, StripedTransfer] = {}
+        self.__striped_transfers_lock: threading.Lock = threading.Lock()
+        self.__swarm_transfers: Dict[str, SwarmTransfer] = {}
+        self.__swarm_transfers_lock: threading.Lock = threading.Lock()
         self._add_thread(threading.Thread(target=self.__serve))
 
     def get_port(self) -> Optional[int]:
         with self.__port_lock:
             return self.__port
 
+    def get_local_socket_path(self) -> Optional[str]:
+        """Gets the path of the Unix domain socket that instances on the same host can connect to instead of the TCP
+        port, or None if the platform has no Unix domain sockets or binding one failed.
+        """
+
+        with self.__port_lock:
+            return self.__local_socket_path
+
     def is_waiting_for_send_file_consent(self) -> bool:
         with self.__is_waiting_for_send_file_consent_lock:
             return self.__is_waiting_for_send_file_consent
@@ -46,28 +71,58 @@ class TCPServer(NetworkResource):
             self.__is_waiting_for_send_file_consent = False
 
     def __serve(self):
-        with self.__create_server_socket() as server_socket:
-            while True:
-                with self._should_stop_lock:
-                    if self._should_stop:
-                        break
-                try:
-                    conn_socket, _ = server_socket.accept()
-                    conn_thread = threading.Thread(target=self.__handle_client_connection, args=[conn_socket])
-                    self._add_thread(conn_thread)
-                    conn_thread.start()
-                except BlockingIOError:
-                    # No client attempted to connect => do nothing
-                    pass
+        # The local socket is bound first so that its path is known by the time the port is
+        with self.__create_local_server_socket() or nullcontext() as local_server_socket, \
+                self.__create_server_socket() as server_socket:
+            server_sockets: List[socket.socket] = [server_socket]
+            if local_server_socket is not None:
+                server_sockets.append(local_server_socket)
+            try:
+                while True:
+                    with self._should_stop_lock:
+                        if self._should_stop:
+                            break
+                    for listening_socket in server_sockets:
+                        try:
+                            conn_socket, _ = listening_socket.accept()
+                            conn_thread = threading.Thread(target=self.__handle_client_connection, args=[conn_socket])
+                            self._add_thread(conn_thread)
+                            conn_thread.start()
+                        except BlockingIOError:
+                            # No client attempted to connect => do nothing
+                            pass
+            finally:
+                if local_server_socket is not None:
+                    os.remove(self.__local_socket_path)
 
     def __create_server_socket(self) -> socket.socket:
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setblocking(False)
+        socket_tuning.tune_listening_socket(server_socket)
         self.__bind_server_socket(server_socket)
         max_num_connections = constants.SERVER_PORT_RANGE.stop - constants.SERVER_PORT_RANGE.start
         server_socket.listen(max_num_connections)
         return server_socket
 
+    def __create_local_server_socket(self) -> Optional[socket.socket]:
+        if not hasattr(socket, "AF_UNIX"):
+            return None
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server_socket.bind(constants.LOCAL_SOCKET_PATH)
+            # Only this user's instances may connect, since files are handed over to them as descriptors
+            os.chmod(constants.LOCAL_SOCKET_PATH, 0o600)
+        except OSError:
+            # Same-host peers simply connect over TCP instead
+            server_socket.close()
+            return None
+        server_socket.setblocking(False)
+        socket_tuning.tune_listening_socket(server_socket)
+        server_socket.listen(constants.SERVER_PORT_RANGE.stop - constants.SERVER_PORT_RANGE.start)
+        with self.__port_lock:
+            self.__local_socket_path = constants.LOCAL_SOCKET_PATH
+        return server_socket
+
     def __bind_server_socket(self, server_socket: socket.socket):
         with self.__port_lock:
             for port in constants.SERVER_PORT_RANGE:
@@ -83,28 +138,47 @@ class TCPServer(NetworkResource):
 
     def __handle_client_connection(self, conn_socket: socket.socket):
         with conn_socket:
-            conn_socket.setblocking(False)
+            conn_socket.setblocking(True)
+            # Stripes and swarm pieces arrive over connections of their own, which are retuned once they say so
+            socket_tuning.tune_connection(conn_socket)
+            # Transfers are capped by the contact who asked for consent to send them over this connection
+            sender_email: Optional[str] = None
             while True:
                 with self._should_stop_lock:
                     if self._should_stop:
                         break
                 try:
-                    data = conn_socket.recv(1024)
-                    if not data:
-                        # Empty data means the connection was closed
+                    # Wait for the start of the next frame for a bounded time so the stop flag is still checked
+                    readable, _, _ = select.select([conn_socket], [], [], constants.SERVER_POLL_INTERVAL_SECONDS)
+                    if not readable:
+                        continue
+                    # A client that stalls halfway through a request mustn't hold on to this thread forever
+                    conn_socket.settimeout(constants.SERVER_REQUEST_TIMEOUT_SECONDS)
+                    req = socket_helpers.recv_req(conn_socket)
+                    if req is None:
+                        # The connection was closed
                         break
-                    req = ClientRequest.from_bytes(data)
-                    if not self.__handle_client_req(conn_socket, req):
+                    if ClientRequestType(req.type) not in TCPServer.__CONTROL_REQUEST_TYPES:
+                        conn_socket.settimeout(None)
+                    if ClientRequestType(req.type) == ClientRequestType.SEND_FILE_CONSENT:
+                        sender_email = req.args[0]
+                    if not self.__handle_client_req(conn_socket, req, sender_email):
                         # Unable to successfully handle the request => disconnect from the client
                         break
-                except BlockingIOError:
-                    # No data was received => do nothing
-                    pass
+                except exceptions.MalformedFrameException:
+                    # The stream can no longer be parsed => disconnect from the client
+                    break
+                except (ValueError, IndexError):
+                    # The request has malformed arguments, but the stream is intact => refuse just the request
+                    try:
+                        socket_helpers.send_bool_res(conn_socket, False)
+                    except OSError:
+                        break
                 except OSError:
                     # The socket was disconnected
                     break
 
-    def __handle_client_req(self, sock: socket.socket, req: ClientRequest) -> bool:
+    def __handle_client_req(self, sock: socket.socket, req: ClientRequest, sender_email: Optional[str]) -> bool:
         ret = False
         req_type = ClientRequestType(req.type)
         if req_type == ClientRequestType.PING:
@@ -125,28 +199,120 @@ class TCPServer(NetworkResource):
             if contact is None:
                 ret = socket_helpers.send_bool_res(sock, False)
             else:
-                self.__wait_for_send_file_consent(contact)
-                with self.__consents_to_receive_file_lock:
-                    ret = socket_helpers.send_bool_res(sock, self.__consents_to_receive_file)
+                ret = socket_helpers.send_bool_res(sock, self.__wait_for_send_file_consent(contact, sock))
         elif req_type == ClientRequestType.SEND_FILE:
-            sock.setblocking(True)
-            file_path = req.args[0]
-            file_name = os.path.basename(file_path)
-            if not os.path.isdir(constants.RECEIVED_FILES_DIR):
-                os.makedirs(constants.RECEIVED_FILES_DIR)
-            target_path = os.path.join(constants.RECEIVED_FILES_DIR, file_name)
-            ret = socket_helpers.receive_file(sock, target_path)
-            sock.setblocking(False)
+            file_name, file_size, transfer_id = req.args[0], int(req.args[1]), req.args[2]
+            options = TransferOptions.from_args(req.args[3:])
+            options.bucket = BandwidthManager().get_bucket(sender_email, Direction.RECEIVE)
+            incoming_file = IncomingFile(constants.RECEIVED_FILES_DIR, file_name, file_size, transfer_id)
+            if not incoming_file.reserve(preallocate=not options.uses_sparse() and not options.uses_handover()):
+                # Reject the file before any of it is sent
+                ret = socket_helpers.send_bool_res(sock, False)
+            elif options.is_striped():
+                ret = self.__receive_striped_file(sock, StripedTransfer(incoming_file, options))
+            else:
+                ret = socket_helpers.receive_file(sock, incoming_file, options)
+        elif req_type == ClientRequestType.SEND_ARCHIVE:
+            num_files, total_size = int(req.args[0]), int(req.args[1])
+            options = TransferOptions.from_args(req.args[2:])
+            options.bucket = BandwidthManager().get_bucket(sender_email, Direction.RECEIVE)
+            incoming_archive = IncomingArchive(constants.RECEIVED_FILES_DIR, num_files, total_size)
+            if not incoming_archive.reserve():
+                # Reject the archive before any of it is sent
+                ret = socket_helpers.send_bool_res(sock, False)
+            else:
+                ret = socket_helpers.receive_archive(sock, incoming_archive, options)
+        elif req_type == ClientRequestType.SEND_FILE_STRIPE:
+            token, stripe_index = req.args[0], int(req.args[1])
+            with self.__striped_transfers_lock:
+                striped_transfer = self.__striped_transfers.get(token)
+            if striped_transfer is None:
+                ret = socket_helpers.send_bool_res(sock, False)
+            else:
+                socket_tuning.tune_bulk_connection(sock)
+                ret = striped_transfers.receive_file_stripe(sock, striped_transfer, stripe_index)
+        elif req_type == ClientRequestType.SEND_SWARM:
+            file_name, file_size, swarm_id = req.args[0], int(req.args[1]), req.args[2]
+            encrypt = len(req.args) > 4 and req.args[4] == "1"
+            # Unix domain socket paths only lead to the other receivers if the sender is on this host too
+            peer_addresses = parse_peer_addresses(req.args[3], sock.family == getattr(socket, "AF_UNIX", None))
+            incoming_file = IncomingFile(constants.RECEIVED_FILES_DIR, file_name, file_size)
+            if peer_addresses is None or not incoming_file.reserve():
+                # Reject the file before any of it is sent
+                ret = socket_helpers.send_bool_res(sock, False)
+            else:
+                swarm_transfer = SwarmTransfer(swarm_id, incoming_file, peer_addresses, sock, encrypt)
+                ret = self.__receive_swarm(sock, swarm_transfer)
+        elif req_type == ClientRequestType.FETCH_SWARM_PIECES:
+            with self.__swarm_transfers_lock:
+                swarm_transfer = self.__swarm_transfers.get(req.args[0])
+            if swarm_transfer is None:
+                ret = socket_helpers.send_bool_res(sock, False)
+            else:
+                socket_tuning.tune_bulk_connection(sock)
+                bucket = BandwidthManager().get_bucket(None, Direction.SEND)
+                ret = swarm_transfers.serve_swarm_pieces(sock, swarm_transfer, bucket)
         else:
             raise ValueError(f"Received unexpected enum value: {req.type}")
         return ret
 
-    def __wait_for_send_file_consent(self, contact: Contact):
+    def __receive_striped_file(self, sock: socket.socket, striped_transfer: StripedTransfer) -> bool:
+        # Make the transfer claimable by the sender's extra connections for as long as it's being received
+        with self.__striped_transfers_lock:
+            self.__striped_transfers[striped_transfer.token] = striped_transfer
+        try:
+            return striped_transfers.receive_striped_file(sock, striped_transfer)
+        finally:
+            with self.__striped_transfers_lock:
+                del self.__striped_transfers[striped_transfer.token]
+
+    def __receive_swarm(self, sock: socket.socket, swarm_transfer: SwarmTransfer) -> bool:
+        # Serve the pieces received to the other receivers in the swarm for as long as it lasts
+        with self.__swarm_transfers_lock:
+            self.__swarm_transfers[swarm_transfer.swarm_id] = swarm_transfer
+        try:
+            return swarm_transfers.receive_swarm(sock, swarm_transfer)
+        finally:
+            with self.__swarm_transfers_lock:
+                del self.__swarm_transfers[swarm_transfer.swarm_id]
+
+    def __wait_for_send_file_consent(self, contact: Contact, sock: socket.socket) -> bool:
+        """Asks the user whether to accept a file from a contact and waits for the answer. The file is rejected for the
+        user if they don't answer within constants.SEND_FILE_CONSENT_TIMEOUT_SECONDS, if the contact stops waiting
+        for the answer, or if the server stops.
+
+        Args:
+            contact (Contact): The contact sending the file.
+            sock (socket.socket): The socket connected to the contact, which can be read from once it hangs up.
+
+        Returns:
+            bool: True if the user accepted the file; False otherwise.
+        """
+
+        with self.__consents_to_receive_file_lock:
+            self.__consents_to_receive_file = False
         with self.__is_waiting_for_send_file_consent_lock:
             self.__is_waiting_for_send_file_consent = True
         print(f"Contact {contact} is sending a file. Accept (y/n)?")
+        deadline = time.monotonic() + constants.SEND_FILE_CONSENT_TIMEOUT_SECONDS
         while True:
             with self.__is_waiting_for_send_file_consent_lock:
                 if not self.__is_waiting_for_send_file_consent:
                     break
-            time.sleep(0.1)
+                if time.monotonic() >= deadline or self.__should_stop() or self.__has_hung_up(sock):
+                    self.__is_waiting_for_send_file_consent = False
+                    print(f"The file from contact {contact} was rejected since it wasn't accepted in time.")
+                    return False
+            time.sleep(constants.SERVER_POLL_INTERVAL_SECONDS)
+        with self.__consents_to_receive_file_lock:
+            return self.__consents_to_receive_file
+
+    def __should_stop(self) -> bool:
+        with self._should_stop_lock:
+            return self._should_stop
+
+    @staticmethod
+    def __has_hung_up(sock: socket.socket) -> bool:
+        # The client sends nothing else while it waits for the response => anything to read means it hung up
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable)
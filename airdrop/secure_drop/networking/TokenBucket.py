@@ -0,0 +1,87 @@
+import threading
+import time
+from typing import Optional
+
+from secure_drop import constants
+
+
+class TokenBucket:
+    """Caps the rate at which bytes pass through it, and through its parent if it has one.
+    """
+
+    def __init__(self, rate: Optional[float] = None, parent: Optional["TokenBucket"] = None):
+        """Initializes the token bucket.
+
+        Args:
+            rate (Optional[float], optional): The cap in bytes per second. Defaults to None, which doesn't cap the rate.
+            parent (Optional[TokenBucket], optional): A bucket every byte also passes through. Defaults to None.
+        """
+
+        self.parent: Optional[TokenBucket] = parent
+        self.__rate: Optional[float] = None
+        self.__burst: float = 0
+        self.__num_tokens: float = 0
+        self.__last_refill_time: float = time.monotonic()
+        self.__condition: threading.Condition = threading.Condition()
+        self.set_rate(rate)
+
+    def get_rate(self) -> Optional[float]:
+        with self.__condition:
+            return self.__rate
+
+    def set_rate(self, rate: Optional[float]):
+        """Changes the cap, including for transfers waiting on the bucket.
+
+        Args:
+            rate (Optional[float]): The cap in bytes per second, or None to lift it.
+
+        Raises:
+            ValueError: Raised if the rate isn't positive.
+        """
+
+        if rate is not None and rate <= 0:
+            raise ValueError("Rate must be positive.")
+        with self.__condition:
+            self.__refill()
+            self.__rate = rate
+            self.__burst = 0 if rate is None else rate * constants.TOKEN_BUCKET_BURST_SECONDS
+            # Lifting the cap also forgives whatever debt was run up under it
+            self.__num_tokens = 0 if rate is None else min(self.__num_tokens, self.__burst)
+            self.__condition.notify_all()
+
+    def consume(self, num_bytes: int):
+        """Takes tokens for bulk data, waiting until the bucket is out of debt.
+
+        Args:
+            num_bytes (int): The number of bytes that were or are about to be sent or received.
+        """
+
+        with self.__condition:
+            self.__refill()
+            if self.__rate is not None:
+                self.__num_tokens -= num_bytes
+            while self.__rate is not None and self.__num_tokens < 0:
+                self.__condition.wait(-self.__num_tokens / self.__rate)
+                self.__refill()
+        if self.parent is not None:
+            self.parent.consume(num_bytes)
+
+    def charge(self, num_bytes: int):
+        """Takes tokens for priority traffic without waiting.
+
+        Args:
+            num_bytes (int): The number of bytes that were sent or received.
+        """
+
+        with self.__condition:
+            self.__refill()
+            if self.__rate is not None:
+                self.__num_tokens -= num_bytes
+        if self.parent is not None:
+            self.parent.charge(num_bytes)
+
+    def __refill(self):
+        now = time.monotonic()
+        if self.__rate is not None:
+            self.__num_tokens = min(self.__burst, self.__num_tokens + (now - self.__last_refill_time) * self.__rate)
+        self.__last_refill_time = now
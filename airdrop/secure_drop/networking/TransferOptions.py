@@ -0,0 +1,206 @@
+import socket
+import threading
+from enum import Enum
+from typing import Callable, List, Optional
+
+from secure_drop import constants
+from secure_drop.networking.compression import Compression
+from secure_drop.networking.TokenBucket import TokenBucket
+from secure_drop.singletons.ChunkCache import ChunkCache
+
+
+class TransferMode(Enum):
+    STOP_AND_WAIT = "stop_and_wait"
+    PIPELINED = "pipelined"
+
+
+class TransferOptions:
+    """Describes how a file transfer is carried out on the wire.
+    """
+
+    def __init__(self, mode: TransferMode = TransferMode.PIPELINED, window_size: int = constants.TRANSFER_WINDOW_SIZE,
+                 ack_interval: int = constants.TRANSFER_ACK_INTERVAL, zero_copy: bool = True, resumable: bool = True,
+                 num_streams: int = 1, delta: bool = False, compression: Compression = Compression.NONE,
+                 compression_level: int = constants.DEFAULT_COMPRESSION_LEVEL, verify: bool = True,
+                 encrypt: bool = False, bucket: Optional[TokenBucket] = None,
+                 cancelled: Optional[threading.Event] = None, sparse: bool = True, local: bool = False,
+                 datagrams: bool = False, chunk_cache: Optional[ChunkCache] = None,
+                 check_public_key: Optional[Callable[[socket.socket, bytes], bool]] = None):
+        """Initializes the transfer options.
+
+        Args:
+            mode (TransferMode, optional): The transfer protocol to use. Defaults to TransferMode.PIPELINED.
+            window_size (int, optional): The maximum number of unacknowledged chunks in flight when pipelining.
+            ack_interval (int, optional): The number of chunks the receiver acknowledges at once when pipelining.
+            zero_copy (bool, optional): Whether the sender may use sendfile. Defaults to True.
+            resumable (bool, optional): Whether an interrupted transfer can be resumed. Defaults to True.
+            num_streams (int, optional): The number of connections the file is striped across. Defaults to 1.
+            delta (bool, optional): Whether only the difference to the receiver's earlier version is sent. Defaults to
+                False.
+            compression (Compression, optional): How the file is compressed on the wire. Defaults to Compression.NONE.
+            compression_level (int, optional): The zlib level or lzma preset, from 0 to 9.
+            verify (bool, optional): Whether chunks are verified against a Merkle manifest. Defaults to True.
+            encrypt (bool, optional): Whether chunks are encrypted with AES-GCM under a wrapped transfer key. Defaults
+                to False.
+            bucket (Optional[TokenBucket], optional): The token bucket capping this end's bandwidth. Defaults to None.
+            cancelled (Optional[threading.Event], optional): Set to make the sender give up. Defaults to None.
+            sparse (bool, optional): Whether the holes of a sparse file are skipped. Defaults to True.
+            local (bool, optional): Whether the file's descriptor is handed over a Unix domain socket. Defaults to
+                False.
+            datagrams (bool, optional): Whether the file is sent as UDP datagrams. Defaults to False.
+            chunk_cache (Optional[ChunkCache], optional): The cache of prepared chunks and hashes. Defaults to None.
+            check_public_key (Optional[Callable[[socket.socket, bytes], bool]], optional): Decides whether to trust the
+                receiver's public key. Defaults to None, which trusts any key.
+
+        Raises:
+            ValueError: Raised if the options are out of range or can't be combined.
+        """
+
+        if mode == TransferMode.STOP_AND_WAIT:
+            window_size = ack_interval = 1
+        if window_size < 1 or ack_interval < 1:
+            raise ValueError("Window size and acknowledgement interval must be positive.")
+        if ack_interval > window_size:
+            raise ValueError("Acknowledgement interval must not exceed the window size.")
+        if not 1 <= num_streams <= constants.MAX_TRANSFER_STREAMS:
+            raise ValueError(f"Number of streams must be between 1 and {constants.MAX_TRANSFER_STREAMS}.")
+        if delta and num_streams > 1:
+            raise ValueError("Delta transfers cannot be striped.")
+        if compression != Compression.NONE and (delta or num_streams > 1):
+            raise ValueError("Compressed transfers cannot be striped or sent as a delta.")
+        if datagrams and (delta or num_streams > 1 or compression != Compression.NONE):
+            raise ValueError("Datagram transfers cannot be striped, compressed or sent as a delta.")
+        if not 0 <= compression_level <= 9:
+            raise ValueError("Compression level must be between 0 and 9.")
+        self.mode: TransferMode = mode
+        self.window_size: int = window_size
+        self.ack_interval: int = ack_interval
+        self.zero_copy: bool = zero_copy
+        self.resumable: bool = resumable
+        self.num_streams: int = num_streams
+        self.delta: bool = delta
+        self.compression: Compression = compression
+        self.compression_level: int = compression_level
+        self.verify: bool = verify
+        self.encrypt: bool = encrypt
+        self.bucket: Optional[TokenBucket] = bucket
+        self.cancelled: Optional[threading.Event] = cancelled
+        self.sparse: bool = sparse
+        self.local: bool = local
+        self.datagrams: bool = datagrams
+        self.chunk_cache: Optional[ChunkCache] = chunk_cache
+        self.check_public_key: Optional[Callable[[socket.socket, bytes], bool]] = check_public_key
+
+    def is_striped(self) -> bool:
+        """Determines whether the file is split into byte ranges that are sent in parallel over extra connections.
+
+        Returns:
+            bool: True if the transfer is striped; False if it uses a single stream.
+        """
+
+        return self.num_streams > 1
+
+    def is_resumable(self) -> bool:
+        """Determines whether an interrupted transfer can be resumed.
+
+        Returns:
+            bool: True if the sender should identify the file to the receiver; False otherwise.
+        """
+
+        return self.resumable and not self.is_striped() and not self.delta and not self.datagrams
+
+    def uses_zero_copy(self) -> bool:
+        """Determines whether the file can be sent with the kernel's zero-copy sendfile.
+
+        Returns:
+            bool: True if the sender should use sendfile; False if it should use the buffered path.
+        """
+
+        return self.zero_copy and self.mode == TransferMode.PIPELINED and not self.delta and \
+            self.compression == Compression.NONE and not self.encrypt
+
+    def uses_verification(self) -> bool:
+        """Determines whether the file is verified against a Merkle manifest as it arrives.
+
+        Returns:
+            bool: True if the sender streams a manifest and the receiver verifies chunks against it; False otherwise.
+        """
+
+        return self.verify and not self.is_striped() and not self.delta and self.compression == Compression.NONE and \
+            not self.encrypt
+
+    def uses_sparse(self) -> bool:
+        """Determines whether the holes of a sparse file are skipped.
+
+        Returns:
+            bool: True if the sender sends HOLE frames in place of holes; False if it sends every byte.
+        """
+
+        return self.sparse and not self.is_striped() and not self.delta and self.compression == Compression.NONE and \
+            not self.encrypt and not self.datagrams
+
+    def uses_handover(self) -> bool:
+        """Determines whether the file is handed over as a descriptor instead of being sent.
+
+        Returns:
+            bool: True if the sender passes the descriptor of the file; False if it sends the file's bytes.
+        """
+
+        return self.local and not self.is_striped() and not self.delta and self.compression == Compression.NONE
+
+    def uses_datagrams(self) -> bool:
+        """Determines whether the file is sent as UDP datagrams.
+
+        Returns:
+            bool: True if the sender sends datagrams; False if it sends the file over the connection.
+        """
+
+        return self.datagrams and not self.uses_handover()
+
+    def seals_frames(self) -> bool:
+        """Determines whether each frame of an encrypted transfer is sealed on its own, since a compressed or delta
+        stream has no fixed positions in the file to seal chunks by.
+
+        Returns:
+            bool: True if the frames are sealed in the order they are sent; False otherwise.
+        """
+
+        return self.encrypt and (self.delta or self.compression != Compression.NONE)
+
+    def to_args(self) -> List[str]:
+        """Serializes the options into SEND_FILE request arguments.
+
+        Returns:
+            List[str]: The request arguments describing the options.
+        """
+
+        return [self.mode.value, str(self.window_size), str(self.ack_interval), str(self.num_streams),
+                str(int(self.delta)), self.compression.value, str(self.compression_level), str(int(self.verify)),
+                str(int(self.encrypt)), str(int(self.sparse)), str(int(self.local)),
+                str(int(self.datagrams))]
+
+    @staticmethod
+    def from_args(args: List[str]) -> "TransferOptions":
+        """Constructs transfer options from SEND_FILE request arguments. Missing options are off.
+
+        Args:
+            args (List[str]): The request arguments produced by `to_args`.
+
+        Returns:
+            TransferOptions: The deserialized options.
+        """
+
+        if len(args) < 3:
+            return TransferOptions(TransferMode.STOP_AND_WAIT)
+        num_streams = int(args[3]) if len(args) > 3 else 1
+        delta = len(args) > 4 and args[4] == "1"
+        compression = Compression(args[5]) if len(args) > 5 else Compression.NONE
+        compression_level = int(args[6]) if len(args) > 6 else constants.DEFAULT_COMPRESSION_LEVEL
+        verify = len(args) > 7 and args[7] == "1"
+        encrypt = len(args) > 8 and args[8] == "1"
+        sparse = len(args) > 9 and args[9] == "1"
+        local = len(args) > 10 and args[10] == "1"
+        datagrams = len(args) > 11 and args[11] == "1"
+        return TransferOptions(TransferMode(args[0]), int(args[1]), int(args[2]), num_streams=num_streams, delta=delta,
+                               compression=compression, compression_level=compression_level, verify=verify,
+                               encrypt=encrypt, sparse=sparse, local=local, datagrams=datagrams)
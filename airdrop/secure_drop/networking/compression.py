@@ -0,0 +1,136 @@
+import lzma
+import math
+import zlib
+from enum import Enum
+from typing import Any, BinaryIO, Callable
+
+from secure_drop import constants, exceptions
+
+
+class Compression(Enum):
+    NONE = "none"
+    ZLIB = "zlib"
+    LZMA = "lzma"
+
+
+class CompressionMetrics:
+    """How much a compressed transfer saved on the wire and what it cost in CPU time, to help decide whether
+    compression is worth turning on for a kind of file.
+    """
+
+    def __init__(self):
+        self.compression: Compression = Compression.NONE
+        self.sampled_entropy: float = 0
+        self.num_raw_bytes: int = 0
+        self.num_compressed_bytes: int = 0
+        self.cpu_seconds: float = 0
+        self.elapsed_seconds: float = 0
+
+    def get_ratio(self) -> float:
+        """Gets the size of the compressed data relative to the raw data; lower is better.
+        """
+
+        return self.num_compressed_bytes / self.num_raw_bytes if self.num_raw_bytes > 0 else 1
+
+    def get_wire_seconds_saved(self) -> float:
+        """Estimates how much longer the data would have spent on the wire without compression, assuming it would
+        have gone over the wire at the rate the compressed data did. Compression and sending take turns on the same
+        thread, so the time spent on the wire is the elapsed time minus the time spent compressing.
+        """
+
+        if self.num_compressed_bytes == 0:
+            return 0
+        seconds_per_byte = max(self.elapsed_seconds - self.cpu_seconds, 0) / self.num_compressed_bytes
+        return (self.num_raw_bytes - self.num_compressed_bytes) * seconds_per_byte
+
+    def get_net_seconds_saved(self) -> float:
+        """Estimates how much faster the transfer was thanks to compression; negative if compressing cost more time
+        than it saved on the wire.
+        """
+
+        return self.get_wire_seconds_saved() - self.cpu_seconds
+
+    def __str__(self) -> str:
+        return f"{self.compression.value}: ratio {self.get_ratio():.3f}, entropy {self.sampled_entropy:.2f} bits/byte, " \
+            f"CPU {self.cpu_seconds:.3f} s, wire time saved {self.get_wire_seconds_saved():.3f} s"
+
+
+class StreamDecompressor:
+    """Decompresses a transfer as its frames arrive. Output is produced in bounded pieces, so a small frame that
+    expands enormously can't exhaust memory.
+    """
+
+    def __init__(self, compression: Compression, write: Callable[[memoryview], None]):
+        """Initializes the decompressor.
+
+        Args:
+            compression (Compression): The compression the sender used.
+            write (Callable[[memoryview], None]): Writes decompressed data to the file.
+        """
+
+        self.__decompressor: Any = zlib.decompressobj() if compression == Compression.ZLIB else lzma.LZMADecompressor()
+        self.__write: Callable[[memoryview], None] = write
+
+    def write(self, data: memoryview):
+        """Decompresses a piece of the compressed stream and writes the output.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if data follows the end of the compressed stream.
+        """
+
+        if self.__decompressor.eof:
+            raise exceptions.UnexpectedFileSizeException("Received data past the end of the compressed stream")
+        if isinstance(self.__decompressor, lzma.LZMADecompressor):
+            output = self.__decompressor.decompress(data, constants.RECEIVE_BUFFER_SIZE)
+            self.__write(memoryview(output))
+            while not self.__decompressor.eof and not self.__decompressor.needs_input:
+                self.__write(memoryview(self.__decompressor.decompress(b"", constants.RECEIVE_BUFFER_SIZE)))
+        else:
+            output = self.__decompressor.decompress(data, constants.RECEIVE_BUFFER_SIZE)
+            self.__write(memoryview(output))
+            while self.__decompressor.unconsumed_tail:
+                output = self.__decompressor.decompress(self.__decompressor.unconsumed_tail,
+                                                        constants.RECEIVE_BUFFER_SIZE)
+                self.__write(memoryview(output))
+        if self.__decompressor.unused_data:
+            raise exceptions.UnexpectedFileSizeException("Received data past the end of the compressed stream")
+
+    def finish(self):
+        """Checks that the compressed stream was complete.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if the compressed stream was cut off.
+        """
+
+        if not isinstance(self.__decompressor, lzma.LZMADecompressor):
+            # zlib may still hold output that didn't fit into the last bounded piece
+            self.__write(memoryview(self.__decompressor.flush()))
+        if not self.__decompressor.eof:
+            raise exceptions.UnexpectedFileSizeException("The compressed stream ended early")
+
+
+def create_compressor(compression: Compression, level: int) -> Any:
+    if compression == Compression.ZLIB:
+        return zlib.compressobj(level)
+    return lzma.LZMACompressor(preset=level)
+
+
+def get_entropy(f: BinaryIO, offset: int) -> float:
+    """Estimates the entropy of a file from the blocks at the start of what is about to be sent. Data that is already
+    compressed or encrypted comes close to 8 bits per byte and doesn't get any smaller by compressing it again.
+
+    Args:
+        f (BinaryIO): The file to sample.
+        offset (int): The position the transfer starts at.
+
+    Returns:
+        float: The Shannon entropy of the sample in bits per byte.
+    """
+
+    f.seek(offset)
+    sample = f.read(constants.COMPRESSION_SAMPLE_SIZE)
+    if not sample:
+        return 0
+    # bytes.count runs in C, which makes 256 passes over the sample far faster than one pass in Python
+    probabilities = [count / len(sample) for count in map(sample.count, [bytes([i]) for i in range(256)]) if count]
+    return -sum(p * math.log2(p) for p in probabilities)
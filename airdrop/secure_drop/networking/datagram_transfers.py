@@ -0,0 +1,178 @@
+import functools
+import os
+import secrets
+import select
+import socket
+import struct
+import threading
+import time
+from typing import BinaryIO, Dict, List, Optional
+
+from secure_drop import constants, exceptions
+from secure_drop.networking import datagrams, encryption, framing, merkle, transfer_helpers
+from secure_drop.networking.DatagramWindow import DatagramWindow
+from secure_drop.networking.framing import FrameType
+from secure_drop.networking.IncomingDatagrams import IncomingDatagrams
+from secure_drop.networking.IncomingFile import IncomingFile
+from secure_drop.networking.TransferOptions import TransferOptions
+
+
+def send_datagrams(sock: socket.socket, f: BinaryIO, file_size: int, options: TransferOptions,
+                   file_key: Optional[str] = None):
+    """Sends the file as UDP datagrams to the port the receiver names, while a second thread takes in the receiver's
+    acknowledgements over the connection.
+
+    Raises:
+        ConnectionError: Raised if the receiver went away or didn't confirm the file.
+        exceptions.TransferCancelledException: Raised once the transfer is cancelled.
+    """
+
+    key = None
+    # The content key of a file sent to many receivers also seals the chunks of the connection's stream, whose
+    # nonces datagrams would reuse for different lengths of data => every datagram transfer has its own key
+    if options.encrypt and (key := transfer_helpers.send_transfer_key(sock, options)) is None:
+        raise ConnectionError("Connection closed while exchanging the transfer key")
+    if options.verify and not options.encrypt:
+        hash_leaf = transfer_helpers.cache_leaf_hashes(functools.partial(merkle.hash_leaf, f), options, file_key)
+        transfer_helpers.send_manifest(sock, [hash_leaf(*merkle.get_leaf(0, file_size, leaf_index))
+                                              for leaf_index in range(merkle.get_num_leaves(0, file_size))])
+    if (port := framing.recv_frame(sock, FrameType.PORT)) is None:
+        raise ConnectionError("Connection closed while waiting for the datagram port")
+    if len(port) != datagrams.PORT.size:
+        raise exceptions.MalformedFrameException("Malformed PORT frame")
+    port, token = datagrams.PORT.unpack(port)
+    data_size = datagrams.get_data_size(options.encrypt)
+    window = DatagramWindow(datagrams.get_num_datagrams(file_size, data_size), data_size, options.bucket)
+    report = {}
+    reporter = threading.Thread(target=__receive_datagram_reports, args=[sock, window, file_size, data_size, report])
+    header_size = datagrams.DATAGRAM_HEADER.size
+    buffer = memoryview(bytearray(header_size + data_size + encryption.TAG_SIZE))
+    with datagrams.create_socket(sock.family) as datagram_sock:
+        datagram_sock.connect((sock.getpeername()[0], port))
+        reporter.start()
+        try:
+            while (datagram_index := window.next_datagram()) is not None:
+                if options.cancelled is not None and options.cancelled.is_set():
+                    raise exceptions.TransferCancelledException()
+                start, end = datagrams.get_datagram(file_size, data_size, datagram_index)
+                datagrams.DATAGRAM_HEADER.pack_into(buffer, 0, token, datagram_index)
+                data = buffer[header_size:header_size + end - start]
+                if len(chunk := os.pread(f.fileno(), len(data), start)) != len(data):
+                    raise ConnectionError(f"File shrank while it was being sent: {f.name}")
+                data[:] = chunk
+                datagram_size = header_size + len(data)
+                if key is not None:
+                    encryption.encrypt_chunk(key, start, buffer[header_size:datagram_size + encryption.TAG_SIZE])
+                    datagram_size += encryption.TAG_SIZE
+                try:
+                    datagram_sock.send(buffer[:datagram_size])
+                except ConnectionRefusedError:
+                    # The receiver closed its port once it had everything => the reports tell how the transfer went
+                    pass
+        except BaseException:
+            transfer_helpers.abort(sock)
+            raise
+        finally:
+            window.fail()
+            reporter.join()
+    if not report.get("result", False):
+        raise ConnectionError("The receiver didn't confirm the file")
+
+
+def __receive_datagram_reports(sock: socket.socket, window: DatagramWindow, file_size: int, data_size: int,
+                               report: Dict[str, bool]):
+    header = memoryview(bytearray(framing.FRAME_HEADER.size))
+    try:
+        while (frame := framing.recv_frame_header(sock, header)) is not None:
+            frame_type, payload_length = frame
+            if payload_length > constants.MAX_CONTROL_FRAME_SIZE:
+                break
+            payload = memoryview(bytearray(payload_length))
+            if not framing.recv_exact_into(sock, payload):
+                break
+            if frame_type == FrameType.SACK:
+                window.ack(datagrams.unpack_sack(payload))
+            elif frame_type == FrameType.NACK and payload_length == merkle.LEAF_INDEX.size and \
+                    (leaf := merkle.get_leaf(0, file_size, merkle.LEAF_INDEX.unpack(payload)[0])) is not None:
+                window.reject(*datagrams.get_datagrams_of_range(*leaf, data_size))
+            elif frame_type == FrameType.ACK and payload_length == transfer_helpers.ACK.size:
+                (num_acked,) = transfer_helpers.ACK.unpack(payload)
+                report["result"] = window.is_complete() and num_acked == window.num_datagrams + 1
+                break
+            else:
+                break
+    except (OSError, struct.error):
+        pass
+    # Wake up the sender if it is still waiting for acknowledgements
+    window.fail()
+
+
+def receive_datagrams(sock: socket.socket, incoming_file: IncomingFile, options: TransferOptions) -> Optional[int]:
+    """Receives a file sent as UDP datagrams and acknowledges them with SACK frames.
+
+    Returns:
+        Optional[int]: The number of datagrams the file took, or None if the sender disconnected first.
+    """
+
+    key = None
+    if options.encrypt and (key := transfer_helpers.recv_transfer_key(sock)) is None:
+        return None
+    leaf_hashes = None
+    num_leaves = merkle.get_num_leaves(0, incoming_file.file_size)
+    if options.verify and not options.encrypt and \
+            (leaf_hashes := transfer_helpers.recv_manifest(sock, num_leaves)) is None:
+        return None
+    data_size = datagrams.get_data_size(options.encrypt)
+    incoming_datagrams = IncomingDatagrams(incoming_file, data_size, leaf_hashes)
+    token = secrets.token_bytes(datagrams.TOKEN_SIZE)
+    sender_host = sock.getpeername()[0]
+    header_size = datagrams.DATAGRAM_HEADER.size
+    tag_size = encryption.TAG_SIZE if key is not None else 0
+    # One byte to spare tells datagrams that are too long apart
+    buffer = memoryview(bytearray(header_size + data_size + tag_size + 1))
+    with datagrams.create_socket(sock.family) as datagram_sock:
+        datagram_sock.bind((sock.getsockname()[0], 0))
+        datagram_sock.setblocking(False)
+        framing.send_frame(sock, FrameType.PORT, datagrams.PORT.pack(datagram_sock.getsockname()[1], token))
+        next_sack_time = time.monotonic() + constants.DATAGRAM_ACK_INTERVAL_SECONDS
+        while not incoming_datagrams.is_complete():
+            readable, _, _ = select.select([datagram_sock, sock], [], [], constants.DATAGRAM_ACK_INTERVAL_SECONDS)
+            if sock in readable:
+                # The sender says nothing over the connection while it sends datagrams => it hung up
+                return None
+            for _ in range(constants.DATAGRAM_RECEIVE_BATCH_SIZE if readable else 0):
+                try:
+                    datagram_size, address = datagram_sock.recvfrom_into(buffer)
+                except BlockingIOError:
+                    break
+                if address[0] != sender_host or datagram_size < header_size:
+                    continue
+                datagram_token, datagram_index = datagrams.DATAGRAM_HEADER.unpack_from(buffer)
+                if datagram_token != token or datagram_index >= incoming_datagrams.num_datagrams:
+                    continue
+                start, end = datagrams.get_datagram(incoming_file.file_size, data_size, datagram_index)
+                if datagram_size != header_size + end - start + tag_size:
+                    continue
+                data = buffer[header_size:datagram_size]
+                if key is not None:
+                    try:
+                        encryption.decrypt_chunk(key, start, data)
+                    except exceptions.CorruptChunkException:
+                        continue
+                    data = data[:-tag_size]
+                if options.bucket is not None:
+                    options.bucket.consume(len(data))
+                if (corrupt_leaf_index := incoming_datagrams.write(datagram_index, data)) is not None:
+                    # What was acknowledged so far has to reach the sender before the rejection takes it back
+                    __send_sacks(sock, incoming_datagrams.pop_newly_received())
+                    incoming_datagrams.reject_leaf(corrupt_leaf_index)
+                    framing.send_frame(sock, FrameType.NACK, merkle.LEAF_INDEX.pack(corrupt_leaf_index))
+            if time.monotonic() >= next_sack_time or incoming_datagrams.is_complete():
+                __send_sacks(sock, incoming_datagrams.pop_newly_received())
+                next_sack_time = time.monotonic() + constants.DATAGRAM_ACK_INTERVAL_SECONDS
+    return incoming_datagrams.num_datagrams
+
+
+def __send_sacks(sock: socket.socket, datagram_indices: List[int]):
+    for payload in datagrams.pack_sacks(datagram_indices):
+        framing.send_frame(sock, FrameType.SACK, payload)
@@ -0,0 +1,91 @@
+import socket
+import struct
+from typing import Iterable, Iterator, List, Tuple
+
+from secure_drop import constants
+from secure_drop.networking import encryption
+
+# The receiver hands out a random token for each transfer, which tells its datagrams apart from stray ones
+TOKEN_SIZE = 8
+# Every datagram starts with the token and the index of the datagram
+DATAGRAM_HEADER = struct.Struct(f"!{TOKEN_SIZE}sQ")
+# A PORT frame carries the UDP port the receiver listens on and the token
+PORT = struct.Struct(f"!H{TOKEN_SIZE}s")
+# A SACK frame carries [start, end) runs of the indices of the datagrams received since the previous one
+SACK_RUN = struct.Struct("!QQ")
+
+
+def get_data_size(encrypt: bool) -> int:
+    """Gets how much of the file each datagram carries, which leaves room for the header and, if the transfer is
+    encrypted, the authentication tag within a datagram that is never fragmented.
+    """
+
+    return constants.MAX_DATAGRAM_SIZE - DATAGRAM_HEADER.size - (encryption.TAG_SIZE if encrypt else 0)
+
+
+def get_num_datagrams(file_size: int, data_size: int) -> int:
+    return -(-file_size // data_size)
+
+
+def get_datagram(file_size: int, data_size: int, datagram_index: int) -> Tuple[int, int]:
+    """Gets the [start, end) byte range of the file that a datagram carries. Only the last datagram may be short."""
+
+    start = datagram_index * data_size
+    return start, min(start + data_size, file_size)
+
+
+def get_datagrams_of_range(start: int, end: int, data_size: int) -> Tuple[int, int]:
+    """Gets the [first, last) indices of the datagrams that carry any of a byte range, such as a leaf of a manifest."""
+
+    return start // data_size, -(-end // data_size)
+
+
+def pack_sacks(datagram_indices: List[int]) -> Iterator[bytes]:
+    """Packs the indices of datagrams into the payloads of as few SACK frames as it takes. Datagrams mostly arrive in
+    order, so runs of consecutive indices keep the frames small.
+
+    Args:
+        datagram_indices (List[int]): The indices, which are sorted in place.
+
+    Yields:
+        bytes: The payload of each SACK frame.
+    """
+
+    datagram_indices.sort()
+    runs: List[bytes] = []
+    max_num_runs = constants.MAX_CONTROL_FRAME_SIZE // SACK_RUN.size
+    i = 0
+    while i < len(datagram_indices):
+        start = datagram_indices[i]
+        while i + 1 < len(datagram_indices) and datagram_indices[i + 1] == datagram_indices[i] + 1:
+            i += 1
+        runs.append(SACK_RUN.pack(start, datagram_indices[i] + 1))
+        i += 1
+        if len(runs) == max_num_runs:
+            yield b"".join(runs)
+            runs = []
+    if runs:
+        yield b"".join(runs)
+
+
+def unpack_sack(payload: memoryview) -> Iterable[range]:
+    """Unpacks the runs of datagram indices of a SACK frame.
+
+    Raises:
+        struct.error: Raised if the payload isn't made up of whole runs.
+    """
+
+    return [range(start, end) for start, end in SACK_RUN.iter_unpack(payload)]
+
+
+def create_socket(family: socket.AddressFamily) -> socket.socket:
+    """Creates a UDP socket with buffers large enough to absorb the bursts of a paced transfer."""
+
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, constants.DATAGRAM_SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, constants.DATAGRAM_SOCKET_BUFFER_SIZE)
+    except OSError:
+        # The buffers are only a hint, which the system may cap or refuse
+        pass
+    return sock
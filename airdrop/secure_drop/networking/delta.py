@@ -0,0 +1,313 @@
+import functools
+import hashlib
+import math
+import socket
+import struct
+import zlib
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from secure_drop import constants, exceptions
+from secure_drop.networking import encryption, framing, transfer_helpers
+from secure_drop.networking.framing import FrameType
+
+# The first signature frame describes how the basis file was split into blocks
+SIGNATURES_HEADER = struct.Struct("!IQ")
+# Every block is identified by a rolling weak checksum and a strong hash
+SIGNATURE = struct.Struct(f"!I{constants.DELTA_STRONG_HASH_SIZE}s")
+# A COPY frame references a run of consecutive blocks of the basis file
+COPY = struct.Struct("!QQ")
+# The weak checksum is Adler-32, which zlib computes for whole blocks and which can be rolled one byte at a time
+__ADLER_MODULUS = 65521
+
+
+class BlockSignatures:
+    """The signatures of the blocks of a basis file, indexed by weak checksum so that the sender can look up the block
+    under its rolling window in constant time.
+    """
+
+    def __init__(self, block_size: int, basis_size: int):
+        self.block_size: int = block_size
+        self.basis_size: int = basis_size
+        self.num_blocks: int = -(-basis_size // block_size)
+        self.__blocks_by_weak_checksum: Dict[int, List[Tuple[int, bytes]]] = {}
+
+    def add(self, block_index: int, weak_checksum: int, strong_hash: bytes):
+        self.__blocks_by_weak_checksum.setdefault(weak_checksum, []).append((block_index, strong_hash))
+
+    def get_block_size(self, block_index: int) -> int:
+        return min(self.block_size, self.basis_size - block_index * self.block_size)
+
+    def find(self, weak_checksum: int, block: memoryview) -> Optional[int]:
+        """Finds a block of the basis file with the same contents as a given block.
+
+        Args:
+            weak_checksum (int): The weak checksum of the block.
+            block (memoryview): The block.
+
+        Returns:
+            Optional[int]: The index of a matching block, or None if the basis file has no such block.
+        """
+
+        if (candidates := self.__blocks_by_weak_checksum.get(weak_checksum)) is None:
+            return None
+        # The strong hash is only computed once the weak checksum matches
+        strong_hash = get_strong_hash(block)
+        for block_index, candidate_strong_hash in candidates:
+            if candidate_strong_hash == strong_hash and self.get_block_size(block_index) == len(block):
+                return block_index
+        return None
+
+
+def get_block_size(basis_size: int) -> int:
+    """Picks the block size for a basis file. Like rsync, the block size grows with the square root of the file size,
+    which balances the size of the signatures against how much of a changed block has to be resent.
+
+    Args:
+        basis_size (int): The size of the basis file.
+
+    Returns:
+        int: The block size in bytes.
+    """
+
+    return max(constants.DELTA_MIN_BLOCK_SIZE, -(-math.isqrt(basis_size) // 1024) * 1024)
+
+
+def get_strong_hash(block: memoryview) -> bytes:
+    return hashlib.blake2b(block, digest_size=constants.DELTA_STRONG_HASH_SIZE).digest()
+
+
+def send_signatures(sock: socket.socket, basis: Optional[BinaryIO], key: Optional[bytes] = None) -> BlockSignatures:
+    """Sends the signatures of every block of a basis file as a sequence of DATA frames, the first of which describes
+    the blocks. An END frame marks the last signature. A missing basis file has no blocks.
+
+    Args:
+        sock (socket.socket): The socket connected to the sender of the new file.
+        basis (Optional[BinaryIO]): The basis file, or None if the receiver has no earlier version of the file.
+        key (Optional[bytes], optional): The key to seal the frames with. Defaults to None.
+
+    Returns:
+        BlockSignatures: The block layout of the basis file, without the signatures themselves.
+    """
+
+    sealer = encryption.FrameSealer(key, encryption.TO_SENDER) if key is not None else None
+    max_frame_size = constants.MAX_CONTROL_FRAME_SIZE if sealer is None else encryption.MAX_SEALED_FRAME_DATA_SIZE
+    basis_size = 0 if basis is None else basis.seek(0, 2)
+    block_size = get_block_size(basis_size)
+    __send_signature_frame(sock, SIGNATURES_HEADER.pack(block_size, basis_size), sealer)
+    if basis is not None:
+        basis.seek(0)
+        block = memoryview(bytearray(block_size))
+        signatures = bytearray()
+        while (num_bytes_read := basis.readinto(block)) > 0:
+            signatures += SIGNATURE.pack(zlib.adler32(block[:num_bytes_read]), get_strong_hash(block[:num_bytes_read]))
+            if len(signatures) + SIGNATURE.size > max_frame_size:
+                __send_signature_frame(sock, bytes(signatures), sealer)
+                signatures.clear()
+        if signatures:
+            __send_signature_frame(sock, bytes(signatures), sealer)
+    framing.send_frame(sock, FrameType.END)
+    return BlockSignatures(block_size, basis_size)
+
+
+def recv_signatures(sock: socket.socket, key: Optional[bytes] = None) -> Optional[BlockSignatures]:
+    """Receives the signatures sent by `send_signatures`.
+
+    Raises:
+        exceptions.MalformedFrameException: Raised if the signatures are malformed.
+        exceptions.CorruptChunkException: Raised if sealed signatures fail authentication.
+
+    Returns:
+        Optional[BlockSignatures]: The signatures of the basis file, or None if the connection was closed first.
+    """
+
+    opener = encryption.FrameSealer(key, encryption.TO_SENDER) if key is not None else None
+    if (payload := framing.recv_frame(sock, FrameType.DATA)) is None:
+        return None
+    if opener is not None:
+        payload = opener.open(memoryview(bytearray(payload)))
+    if len(payload) != SIGNATURES_HEADER.size:
+        raise exceptions.MalformedFrameException("Malformed block signatures header")
+    block_size, basis_size = SIGNATURES_HEADER.unpack(payload)
+    if block_size < constants.DELTA_MIN_BLOCK_SIZE:
+        raise exceptions.MalformedFrameException(f"Block size is too small: {block_size} bytes")
+    signatures = BlockSignatures(block_size, basis_size)
+    header = memoryview(bytearray(framing.FRAME_HEADER.size))
+    block_index = 0
+    while True:
+        if (frame := framing.recv_frame_header(sock, header)) is None:
+            return None
+        frame_type, payload_length = frame
+        if frame_type == FrameType.END:
+            break
+        if frame_type != FrameType.DATA or payload_length > constants.MAX_CONTROL_FRAME_SIZE:
+            raise exceptions.MalformedFrameException("Malformed block signatures")
+        payload = memoryview(bytearray(payload_length))
+        if not framing.recv_exact_into(sock, payload):
+            return None
+        if opener is not None:
+            payload = opener.open(payload)
+        if len(payload) % SIGNATURE.size != 0:
+            raise exceptions.MalformedFrameException("Malformed block signatures")
+        for weak_checksum, strong_hash in SIGNATURE.iter_unpack(payload):
+            signatures.add(block_index, weak_checksum, strong_hash)
+            block_index += 1
+    if block_index != signatures.num_blocks:
+        raise exceptions.MalformedFrameException(f"Expected {signatures.num_blocks} block signatures")
+    return signatures
+
+
+def send_delta(sock: socket.socket, f: BinaryIO, signatures: BlockSignatures,
+               key: Optional[bytes] = None) -> Iterator[int]:
+    """Sends a file as the difference to a basis file: runs of blocks the basis file already has are sent as COPY
+    frames, and everything else as literal DATA frames. A rolling checksum finds matching blocks at any offset, so
+    data inserted or removed in the middle of the file only costs about as much as the data itself. Yields after
+    every frame sent with the number of bytes of the file it covers.
+
+    Args:
+        sock (socket.socket): The socket connected to the receiver.
+        f (BinaryIO): The file to send.
+        signatures (BlockSignatures): The signatures of the receiver's basis file.
+        key (Optional[bytes], optional): The key to seal the frames with. Defaults to None.
+    """
+
+    sealer = encryption.FrameSealer(key, encryption.TO_RECEIVER) if key is not None else None
+    block_size = signatures.block_size
+    if signatures.num_blocks == 0:
+        # Nothing can match => skip the rolling checksum, which is far slower than sending the file as it is
+        while data := f.read(constants.DELTA_READ_SIZE):
+            yield from __send_literal(sock, memoryview(data), sealer)
+        return
+    buffer = bytearray()
+    view = memoryview(buffer)
+    # Unsent literal data starts at `literal_start` and the rolling window at `position`
+    literal_start = position = 0
+    copy_run: Optional[Tuple[int, int]] = None
+    weak_checksum: Optional[int] = None
+    is_eof = False
+    while True:
+        if len(buffer) - position < block_size + 1 and not is_eof:
+            # Drop everything that was already sent and top the buffer up
+            view.release()
+            del buffer[:literal_start]
+            position -= literal_start
+            literal_start = 0
+            data = f.read(constants.DELTA_READ_SIZE + block_size)
+            is_eof = len(data) == 0
+            buffer += data
+            view = memoryview(buffer)
+            continue
+        window_size = min(block_size, len(buffer) - position)
+        if window_size == 0:
+            break
+        if weak_checksum is None:
+            weak_checksum = zlib.adler32(view[position:position + window_size])
+        if (block_index := signatures.find(weak_checksum, view[position:position + window_size])) is not None:
+            if position > literal_start:
+                yield from __send_literal(sock, view[literal_start:position], sealer)
+            if copy_run is not None and copy_run[0] + copy_run[1] == block_index:
+                copy_run = (copy_run[0], copy_run[1] + 1)
+            else:
+                if copy_run is not None:
+                    yield __send_copy(sock, signatures, copy_run, sealer)
+                copy_run = (block_index, 1)
+            position += window_size
+            literal_start = position
+            weak_checksum = None
+            continue
+        if copy_run is not None:
+            yield __send_copy(sock, signatures, copy_run, sealer)
+            copy_run = None
+        if position + window_size == len(buffer):
+            # The window can't roll past the end of the file => only the basis file's short last block can still match
+            tail_size = signatures.get_block_size(signatures.num_blocks - 1) if signatures.num_blocks > 0 else 0
+            tail_start = len(buffer) - tail_size
+            if 0 < tail_size < window_size and (block_index := signatures.find(
+                    zlib.adler32(view[tail_start:]), view[tail_start:])) is not None:
+                if tail_start > literal_start:
+                    yield from __send_literal(sock, view[literal_start:tail_start], sealer)
+                yield __send_copy(sock, signatures, (block_index, 1), sealer)
+            elif len(buffer) > literal_start:
+                yield from __send_literal(sock, view[literal_start:], sealer)
+            literal_start = position = len(buffer)
+            break
+        weak_checksum = __roll(weak_checksum, window_size, buffer[position], buffer[position + window_size])
+        position += 1
+        if position - literal_start >= block_size:
+            yield from __send_literal(sock, view[literal_start:position], sealer)
+            literal_start = position
+    if copy_run is not None:
+        yield __send_copy(sock, signatures, copy_run, sealer)
+    view.release()
+
+
+def copy_blocks(basis: BinaryIO, signatures: BlockSignatures, copy_run: memoryview, buffer: memoryview,
+                write: Callable[[memoryview], None]):
+    """Copies a run of blocks referenced by a COPY frame out of the basis file.
+
+    Args:
+        basis (BinaryIO): The basis file.
+        signatures (BlockSignatures): The block layout of the basis file; only its sizes are used.
+        copy_run (memoryview): The payload of the COPY frame.
+        buffer (memoryview): A reusable buffer to copy through.
+        write (Callable[[memoryview], None]): Writes the copied data to the new file.
+
+    Raises:
+        exceptions.MalformedFrameException: Raised if the run references blocks the basis file doesn't have.
+    """
+
+    if len(copy_run) != COPY.size:
+        raise exceptions.MalformedFrameException("Malformed COPY frame")
+    first_block_index, num_blocks = COPY.unpack(copy_run)
+    if num_blocks == 0 or first_block_index + num_blocks > signatures.num_blocks:
+        raise exceptions.MalformedFrameException(f"Unknown blocks referenced: {first_block_index}+{num_blocks}")
+    start = first_block_index * signatures.block_size
+    remaining = min(num_blocks * signatures.block_size, signatures.basis_size - start)
+    basis.seek(start)
+    while remaining > 0:
+        if (num_bytes_read := basis.readinto(buffer[:min(remaining, len(buffer))])) == 0:
+            raise exceptions.UnexpectedFileSizeException("Basis file shrank while it was being copied")
+        write(buffer[:num_bytes_read])
+        remaining -= num_bytes_read
+
+
+def prepare_delta(sock: socket.socket, basis: Optional[BinaryIO], write: Callable[[memoryview], None],
+                  key: Optional[bytes] = None) -> Callable[[memoryview], None]:
+    """Sends the signatures of a basis file to the sender of a delta, sealed with `key` if given.
+
+    Returns:
+        Callable[[memoryview], None]: The handler of the COPY frames of the delta, which writes the blocks they
+            reference with `write`.
+    """
+
+    signatures = send_signatures(sock, basis, key)
+    buffer = memoryview(bytearray(constants.RECEIVE_BUFFER_SIZE))
+    return functools.partial(copy_blocks, basis, signatures, buffer=buffer, write=write)
+
+
+def __send_signature_frame(sock: socket.socket, payload: bytes, sealer: Optional[encryption.FrameSealer]):
+    framing.send_frame(sock, FrameType.DATA, sealer.seal(payload) if sealer is not None else payload)
+
+
+def __send_literal(sock: socket.socket, data: memoryview, sealer: Optional[encryption.FrameSealer]) -> Iterator[int]:
+    if sealer is not None:
+        yield from transfer_helpers.send_sealed_data(sock, data, sealer)
+        return
+    framing.send_frame_header(sock, FrameType.DATA, len(data))
+    sock.sendall(data)
+    yield len(data)
+
+
+def __send_copy(sock: socket.socket, signatures: BlockSignatures, copy_run: Tuple[int, int],
+                sealer: Optional[encryption.FrameSealer]) -> int:
+    payload = COPY.pack(*copy_run)
+    framing.send_frame(sock, FrameType.COPY, sealer.seal(payload) if sealer is not None else payload)
+    start = copy_run[0] * signatures.block_size
+    return min(copy_run[1] * signatures.block_size, signatures.basis_size - start)
+
+
+def __roll(weak_checksum: int, window_size: int, byte_out: int, byte_in: int) -> int:
+    """Slides an Adler-32 checksum one byte forward without rehashing the window."""
+
+    a = ((weak_checksum & 0xffff) - byte_out + byte_in) % __ADLER_MODULUS
+    b = ((weak_checksum >> 16) - window_size * byte_out + a - 1) % __ADLER_MODULUS
+    return (b << 16) | a
@@ -0,0 +1,228 @@
+import struct
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from Crypto.Cipher import AES
+
+from secure_drop import constants, exceptions
+
+# A key may be shared by the transfers of a file to many recipients, each of which may resume at a different offset.
+# The position of a chunk in the file is therefore its nonce: a chunk at the same position always holds the same data
+# under the same key, so no nonce is ever reused for different data.
+CHUNK_NONCE = struct.Struct("!4xQ")
+# Every encrypted chunk is followed by its GCM authentication tag
+TAG_SIZE = 16
+# The frames of a compressed or delta stream have no fixed position in the file, so they are numbered in the order they
+# are sent instead. Their nonces start with the direction the frames travel in, which keeps them apart from the
+# nonces of chunks and from each other.
+FRAME_NONCE = struct.Struct("!IQ")
+TO_RECEIVER = 1
+TO_SENDER = 2
+# A sealed frame still fits into a control frame, which is received whole
+MAX_SEALED_FRAME_DATA_SIZE = constants.MAX_CONTROL_FRAME_SIZE - TAG_SIZE
+
+
+def get_num_chunks(offset: int, file_size: int) -> int:
+    """Gets the number of encrypted chunks the part of a file that a transfer sends is split into."""
+
+    return -(-(file_size - offset) // constants.ENCRYPTION_CHUNK_SIZE)
+
+
+def get_chunk_size(offset: int, file_size: int, chunk_index: int) -> int:
+    """Gets the size of the plaintext of an encrypted chunk. Only the last chunk may be short."""
+
+    return min(constants.ENCRYPTION_CHUNK_SIZE, file_size - offset - chunk_index * constants.ENCRYPTION_CHUNK_SIZE)
+
+
+def get_chunk_position(offset: int, chunk_index: int) -> int:
+    """Gets the position in the file of an encrypted chunk of a transfer."""
+
+    return offset + chunk_index * constants.ENCRYPTION_CHUNK_SIZE
+
+
+def encrypt_chunk(key: bytes, chunk_position: int, chunk: memoryview):
+    """Encrypts a chunk in place and appends its authentication tag.
+
+    Args:
+        key (bytes): The transfer key.
+        chunk_position (int): The position of the chunk in the file.
+        chunk (memoryview): The plaintext followed by room for the tag.
+    """
+
+    cipher = AES.new(key, AES.MODE_GCM, nonce=CHUNK_NONCE.pack(chunk_position))
+    plaintext = chunk[:-TAG_SIZE]
+    cipher.encrypt(plaintext, output=plaintext)
+    chunk[-TAG_SIZE:] = cipher.digest()
+
+
+def seal_chunk(key: bytes, chunk_position: int, data: bytes) -> bytearray:
+    """Encrypts a copy of a chunk, followed by its authentication tag."""
+
+    chunk = bytearray(len(data) + TAG_SIZE)
+    chunk[:len(data)] = data
+    encrypt_chunk(key, chunk_position, memoryview(chunk))
+    return chunk
+
+
+def decrypt_chunk(key: bytes, chunk_position: int, chunk: memoryview):
+    """Decrypts a chunk in place once its authentication tag has been verified.
+
+    Args:
+        key (bytes): The transfer key.
+        chunk_position (int): The position of the chunk in the file.
+        chunk (memoryview): The ciphertext followed by the tag.
+
+    Raises:
+        exceptions.CorruptChunkException: Raised if the chunk was tampered with, corrupted, or reordered.
+    """
+
+    cipher = AES.new(key, AES.MODE_GCM, nonce=CHUNK_NONCE.pack(chunk_position))
+    ciphertext = chunk[:-TAG_SIZE]
+    cipher.decrypt(ciphertext, output=ciphertext)
+    try:
+        cipher.verify(chunk[-TAG_SIZE:])
+    except ValueError:
+        raise exceptions.CorruptChunkException(f"Encrypted chunk at {chunk_position} failed authentication")
+
+
+class FrameSealer:
+    """Seals or opens the frames that travel in one direction of a transfer, in the order they are sent.
+    """
+
+    def __init__(self, key: bytes, direction: int):
+        self.__key: bytes = key
+        self.__direction: int = direction
+        self.__num_frames: int = 0
+
+    def seal(self, data: bytes) -> bytearray:
+        """Encrypts a copy of the payload of the next frame, followed by its authentication tag."""
+
+        frame = bytearray(len(data) + TAG_SIZE)
+        frame[:len(data)] = data
+        cipher = self.__next_cipher()
+        view = memoryview(frame)
+        cipher.encrypt(view[:len(data)], output=view[:len(data)])
+        view[len(data):] = cipher.digest()
+        return frame
+
+    def open(self, frame: memoryview) -> memoryview:
+        """Decrypts the payload of the next frame in place.
+
+        Raises:
+            exceptions.CorruptChunkException: Raised if the frame was tampered with, corrupted, or reordered.
+
+        Returns:
+            memoryview: The plaintext.
+        """
+
+        if len(frame) < TAG_SIZE:
+            raise exceptions.CorruptChunkException("Sealed frame is too short to hold its tag")
+        cipher = self.__next_cipher()
+        plaintext = frame[:-TAG_SIZE]
+        cipher.decrypt(plaintext, output=plaintext)
+        try:
+            cipher.verify(frame[-TAG_SIZE:])
+        except ValueError:
+            raise exceptions.CorruptChunkException(f"Sealed frame {self.__num_frames - 1} failed authentication")
+        return plaintext
+
+    def __next_cipher(self):
+        cipher = AES.new(self.__key, AES.MODE_GCM, nonce=FRAME_NONCE.pack(self.__direction, self.__num_frames))
+        self.__num_frames += 1
+        return cipher
+
+
+class StreamDecryptor:
+    """Decrypts a transfer as its frames arrive. Each chunk is collected in one of two buffers and decrypted and
+    written on a background thread while the next chunk is received into the other buffer, so decryption overlaps
+    with I/O. Only chunks whose authentication tag checks out are ever written.
+    """
+
+    def __init__(self, key: bytes, offset: int, file_size: int, write: Callable[[memoryview], None]):
+        """Initializes the decryptor.
+
+        Args:
+            key (bytes): The transfer key.
+            offset (int): The position the transfer starts at.
+            file_size (int): The size of the file.
+            write (Callable[[memoryview], None]): Writes decrypted data to the file.
+        """
+
+        self.__key: bytes = key
+        self.__offset: int = offset
+        self.__file_size: int = file_size
+        self.__write: Callable[[memoryview], None] = write
+        self.__num_chunks: int = get_num_chunks(offset, file_size)
+        self.__chunk_index: int = 0
+        self.__num_bytes_buffered: int = 0
+        self.__buffers: List[memoryview] = [memoryview(bytearray(constants.ENCRYPTION_CHUNK_SIZE + TAG_SIZE))
+                                            for _ in range(2)]
+        self.__decrypting: List[Optional[Future]] = [None, None]
+        # Once a chunk fails, nothing after it is written, so the file only ever holds authenticated data in order
+        self.__is_failed: bool = False
+        self.__executor: ThreadPoolExecutor = ThreadPoolExecutor(1, thread_name_prefix="StreamDecryptor")
+
+    def write(self, data: memoryview):
+        """Collects a piece of the encrypted stream and hands every completed chunk to the background thread.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if data follows the last chunk.
+            exceptions.CorruptChunkException: Raised if an earlier chunk failed authentication.
+        """
+
+        while len(data) > 0:
+            if self.__chunk_index == self.__num_chunks:
+                raise exceptions.UnexpectedFileSizeException("Received data past the end of the encrypted stream")
+            buffer_index = self.__chunk_index % 2
+            if self.__num_bytes_buffered == 0:
+                # The buffer is only reused once the chunk that was last collected in it has been written
+                self.__wait(buffer_index)
+            buffer = self.__buffers[buffer_index]
+            sealed_size = get_chunk_size(self.__offset, self.__file_size, self.__chunk_index) + TAG_SIZE
+            num_bytes = min(len(data), sealed_size - self.__num_bytes_buffered)
+            buffer[self.__num_bytes_buffered:self.__num_bytes_buffered + num_bytes] = data[:num_bytes]
+            self.__num_bytes_buffered += num_bytes
+            data = data[num_bytes:]
+            if self.__num_bytes_buffered == sealed_size:
+                self.__decrypting[buffer_index] = self.__executor.submit(self.__open, self.__chunk_index,
+                                                                         buffer[:sealed_size])
+                self.__chunk_index += 1
+                self.__num_bytes_buffered = 0
+
+    def finish(self):
+        """Waits for every chunk to be written and checks that the encrypted stream was complete.
+
+        Raises:
+            exceptions.UnexpectedFileSizeException: Raised if the encrypted stream was cut off.
+            exceptions.CorruptChunkException: Raised if a chunk failed authentication.
+        """
+
+        self.__wait(0)
+        self.__wait(1)
+        if self.__chunk_index != self.__num_chunks or self.__num_bytes_buffered != 0:
+            raise exceptions.UnexpectedFileSizeException("The encrypted stream ended early")
+
+    def close(self):
+        """Waits for the background thread to stop writing, without raising whatever went wrong, which the transfer
+        has already been told about if it matters.
+        """
+
+        for decrypting in self.__decrypting:
+            if decrypting is not None:
+                decrypting.exception()
+        self.__executor.shutdown()
+
+    def __open(self, chunk_index: int, chunk: memoryview):
+        if self.__is_failed:
+            return
+        try:
+            decrypt_chunk(self.__key, get_chunk_position(self.__offset, chunk_index), chunk)
+            self.__write(chunk[:-TAG_SIZE])
+        except BaseException:
+            self.__is_failed = True
+            raise
+
+    def __wait(self, buffer_index: int):
+        if (decrypting := self.__decrypting[buffer_index]) is not None:
+            self.__decrypting[buffer_index] = None
+            decrypting.result()
@@ -0,0 +1,182 @@
+import os
+import socket
+import struct
+from enum import Enum
+from typing import Optional, Tuple
+
+from secure_drop import constants, exceptions
+
+# Every frame starts with its type and the length of the payload that follows it
+FRAME_HEADER = struct.Struct("!BI")
+# Not every platform can cork a socket for a single send
+MSG_MORE = getattr(socket, "MSG_MORE", 0)
+
+
+class FrameType(Enum):
+    REQUEST = 0
+    RESPONSE = 1
+    DATA = 2
+    END = 3
+    ACK = 4
+    COPY = 5
+    ENTRY = 6
+    HASH = 7
+    ROOT = 8
+    NACK = 9
+    REPAIR = 10
+    KEY = 11
+    HOLE = 12
+    HANDOVER = 13
+    PIECE = 14
+    HAVE = 15
+    WANT = 16
+    BITFIELD = 17
+    PORT = 18
+    SACK = 19
+
+
+def send_frame(sock: socket.socket, frame_type: FrameType, payload: bytes = b"", corked: bool = False):
+    """Sends a complete frame.
+
+    Args:
+        sock (socket.socket): The socket to send the frame over.
+        frame_type (FrameType): The type of the frame.
+        payload (bytes, optional): The payload of the frame. Defaults to an empty payload.
+        corked (bool, optional): Whether to hold the frame back so that it leaves in the same segment as whatever is
+            sent next. Defaults to False.
+    """
+
+    sock.sendall(FRAME_HEADER.pack(frame_type.value, len(payload)) + payload, MSG_MORE if corked else 0)
+
+
+def send_frame_header(sock: socket.socket, frame_type: FrameType, payload_length: int):
+    """Sends only the header of a frame so that its payload can be streamed separately. The header is corked so that
+    it leaves in the same segment as the start of the payload.
+
+    Args:
+        sock (socket.socket): The socket to send the header over.
+        frame_type (FrameType): The type of the frame.
+        payload_length (int): The number of payload bytes that will follow the header.
+    """
+
+    sock.sendall(FRAME_HEADER.pack(frame_type.value, payload_length), MSG_MORE)
+
+
+def send_frame_with_fd(sock: socket.socket, frame_type: FrameType, fd: int):
+    """Sends an empty frame along with a file descriptor, which the kernel duplicates into the receiving process. Only
+    a peer connected over a Unix domain socket can receive descriptors.
+
+    Args:
+        sock (socket.socket): The Unix domain socket to send the frame over.
+        frame_type (FrameType): The type of the frame.
+        fd (int): The file descriptor to pass.
+    """
+
+    header = FRAME_HEADER.pack(frame_type.value, 0)
+    # The descriptor travels with the first byte, so whatever wasn't sent along with it follows on its own
+    num_bytes_sent = socket.send_fds(sock, [header], [fd])
+    sock.sendall(header[num_bytes_sent:])
+
+
+def recv_frame_with_fd(sock: socket.socket, expected_type: FrameType) -> Optional[int]:
+    """Receives an empty frame of a given type sent by `send_frame_with_fd`, along with its file descriptor.
+
+    Args:
+        sock (socket.socket): The Unix domain socket to receive the frame from.
+        expected_type (FrameType): The type the frame must have.
+
+    Raises:
+        exceptions.MalformedFrameException: Raised if the frame has an unexpected type or a payload, or doesn't carry
+            exactly one descriptor.
+
+    Returns:
+        Optional[int]: The received file descriptor, which the caller must close, or None if the connection was closed
+            first.
+    """
+
+    header = bytearray(FRAME_HEADER.size)
+    data, fds, _, _ = socket.recv_fds(sock, len(header), 1)
+    try:
+        header[:len(data)] = data
+        if not data or not recv_exact_into(sock, memoryview(header)[len(data):]):
+            return None
+        frame_type_value, payload_length = FRAME_HEADER.unpack(header)
+        if frame_type_value != expected_type.value or payload_length != 0 or len(fds) != 1:
+            raise exceptions.MalformedFrameException(f"Expected a {expected_type.name} frame carrying a descriptor")
+        return fds.pop()
+    finally:
+        # Descriptors that aren't handed to the caller would otherwise leak
+        for fd in fds:
+            os.close(fd)
+
+
+def recv_frame_header(sock: socket.socket, header: memoryview) -> Optional[Tuple[FrameType, int]]:
+    """Receives the header of the next frame into a reusable buffer without reading any of its payload.
+
+    Args:
+        sock (socket.socket): The socket to receive the header from.
+        header (memoryview): A buffer exactly `FRAME_HEADER.size` bytes long.
+
+    Raises:
+        exceptions.MalformedFrameException: Raised if the header names an unknown frame type.
+
+    Returns:
+        Optional[Tuple[FrameType, int]]: The type of the frame and the length of its payload, or None if the
+            connection was closed before a header arrived.
+    """
+
+    if not recv_exact_into(sock, header):
+        return None
+    frame_type_value, payload_length = FRAME_HEADER.unpack_from(header)
+    try:
+        return FrameType(frame_type_value), payload_length
+    except ValueError:
+        raise exceptions.MalformedFrameException(f"Received unknown frame type: {frame_type_value}")
+
+
+def recv_frame(sock: socket.socket, expected_type: FrameType) -> Optional[bytes]:
+    """Receives a complete frame of a given type. This is meant for small control frames; payloads are capped at
+    `constants.MAX_CONTROL_FRAME_SIZE` bytes.
+
+    Args:
+        sock (socket.socket): The socket to receive the frame from.
+        expected_type (FrameType): The type the frame must have.
+
+    Raises:
+        exceptions.MalformedFrameException: Raised if the frame has an unexpected type or an oversized payload.
+
+    Returns:
+        Optional[bytes]: The payload of the frame, or None if the connection was closed first.
+    """
+
+    if (frame := recv_frame_header(sock, memoryview(bytearray(FRAME_HEADER.size)))) is None:
+        return None
+    frame_type, payload_length = frame
+    if frame_type != expected_type:
+        raise exceptions.MalformedFrameException(f"Expected a {expected_type.name} frame but received {frame_type.name}")
+    if payload_length > constants.MAX_CONTROL_FRAME_SIZE:
+        raise exceptions.MalformedFrameException(f"Control frame payload is too large: {payload_length} bytes")
+    payload = bytearray(payload_length)
+    if not recv_exact_into(sock, memoryview(payload)):
+        return None
+    return bytes(payload)
+
+
+def recv_exact_into(sock: socket.socket, view: memoryview) -> bool:
+    """Fills a buffer with exactly as many bytes as it can hold, never reading past its end.
+
+    Args:
+        sock (socket.socket): The socket to receive from.
+        view (memoryview): The buffer to fill.
+
+    Returns:
+        bool: True if the buffer was filled; False if the connection was closed first.
+    """
+
+    num_bytes_received = 0
+    while num_bytes_received < len(view):
+        packet_size = sock.recv_into(view[num_bytes_received:])
+        if packet_size == 0:
+            return False
+        num_bytes_received += packet_size
+    return True
@@ -0,0 +1,86 @@
+import hashlib
+import struct
+from typing import Any, BinaryIO, List, Optional, Tuple
+
+from secure_drop import constants, exceptions
+
+# Leaves and the root are SHA-256 hashes
+HASH_SIZE = hashlib.sha256().digest_size
+# A HASH frame carries the index of a leaf of the manifest and the hash of the leaf's data
+LEAF_HASH = struct.Struct(f"!Q{HASH_SIZE}s")
+# NACK and REPAIR frames start with the index of the leaf they refer to
+LEAF_INDEX = struct.Struct("!Q")
+# Leaves and inner nodes are hashed with different prefixes so that one can never be passed off as the other
+__LEAF_PREFIX = b"\x00"
+__NODE_PREFIX = b"\x01"
+
+
+def create_leaf_hasher() -> Any:
+    """Creates a hasher for the data of a leaf, which can be fed the leaf in pieces as it arrives."""
+
+    return hashlib.sha256(__LEAF_PREFIX)
+
+
+def get_num_leaves(offset: int, file_size: int) -> int:
+    """Gets the number of leaves of the manifest of the part of a file that a transfer sends. A transfer that resumes
+    at an offset only covers the data from that offset onwards.
+    """
+
+    return -(-(file_size - offset) // constants.MERKLE_LEAF_SIZE)
+
+
+def get_leaf(offset: int, file_size: int, leaf_index: int) -> Optional[Tuple[int, int]]:
+    """Gets the byte range covered by a leaf of the manifest.
+
+    Args:
+        offset (int): The position the transfer starts at.
+        file_size (int): The size of the file.
+        leaf_index (int): The index of the leaf.
+
+    Returns:
+        Optional[Tuple[int, int]]: The [start, end) byte range of the leaf, or None if there is no such leaf.
+    """
+
+    if not 0 <= leaf_index < get_num_leaves(offset, file_size):
+        return None
+    start = offset + leaf_index * constants.MERKLE_LEAF_SIZE
+    return start, min(start + constants.MERKLE_LEAF_SIZE, file_size)
+
+
+def hash_leaf(f: BinaryIO, start: int, end: int) -> bytes:
+    """Hashes a leaf of a file. hashlib releases the GIL while it hashes large buffers, so this can run on a
+    background thread while the file is being sent.
+
+    Raises:
+        exceptions.UnexpectedFileSizeException: Raised if the file shrank while it was being hashed.
+    """
+
+    hasher = create_leaf_hasher()
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        if not (data := f.read(min(remaining, constants.MERKLE_READ_SIZE))):
+            raise exceptions.UnexpectedFileSizeException(f"File shrank while it was being hashed: {f.name}")
+        hasher.update(data)
+        remaining -= len(data)
+    return hasher.digest()
+
+
+def get_root(leaf_hashes: List[bytes]) -> bytes:
+    """Computes the root of the Merkle tree over the hashes of the leaves. A node without a sibling is promoted to the
+    next level as it is.
+
+    Args:
+        leaf_hashes (List[bytes]): The hashes of the leaves in order.
+
+    Returns:
+        bytes: The root hash. A manifest without leaves has the hash of no data as its root.
+    """
+
+    if not leaf_hashes:
+        return hashlib.sha256().digest()
+    level = leaf_hashes
+    while len(level) > 1:
+        level = [hashlib.sha256(__NODE_PREFIX + level[i] + level[i + 1]).digest() if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+    return level[0]
@@ -1,5 +1,6 @@
 import json
 import uuid
+from typing import Optional
 
 from secure_drop import exceptions
 from secure_drop.networking.messages.Message import Message
@@ -9,17 +10,25 @@ class BroadcastMessage(Message):
     UUID_FIELD_NAME = "uuid"
     SERVER_IP_FIELD_NAME = "server_ip"
     SERVER_PORT_FIELD_NAME = "server_port"
+    HOST_ID_FIELD_NAME = "host_id"
+    LOCAL_SOCKET_PATH_FIELD_NAME = "local_socket_path"
 
-    def __init__(self, app_uuid: uuid.UUID, server_ip: str, server_port: int):
+    def __init__(self, app_uuid: uuid.UUID, server_ip: str, server_port: int, host_id: Optional[str] = None,
+                 local_socket_path: Optional[str] = None):
         self.app_uuid: uuid.UUID = app_uuid
         self.server_ip: str = server_ip
         self.server_port: int = server_port
+        # Instances on the same host can also connect over the Unix domain socket the server listens on
+        self.host_id: Optional[str] = host_id
+        self.local_socket_path: Optional[str] = local_socket_path
 
     def to_bytes(self) -> bytes:
         return json.dumps({
             f"{self.UUID_FIELD_NAME}": f"{self.app_uuid}",
             f"{self.SERVER_IP_FIELD_NAME}": f"{self.server_ip}",
-            f"{self.SERVER_PORT_FIELD_NAME}": self.server_port
+            f"{self.SERVER_PORT_FIELD_NAME}": self.server_port,
+            f"{self.HOST_ID_FIELD_NAME}": self.host_id,
+            f"{self.LOCAL_SOCKET_PATH_FIELD_NAME}": self.local_socket_path
         }).encode()
 
     @classmethod
@@ -32,4 +41,7 @@ class BroadcastMessage(Message):
         other_uuid = uuid.UUID(json_data[BroadcastMessage.UUID_FIELD_NAME])
         other_server_ip = json_data[BroadcastMessage.SERVER_IP_FIELD_NAME]
         other_server_port = json_data[BroadcastMessage.SERVER_PORT_FIELD_NAME]
-        return BroadcastMessage(other_uuid, other_server_ip, other_server_port)
+        # Instances that predate the same-host fast path don't announce a host ID
+        other_host_id = json_data.get(BroadcastMessage.HOST_ID_FIELD_NAME)
+        other_local_socket_path = json_data.get(BroadcastMessage.LOCAL_SOCKET_PATH_FIELD_NAME)
+        return BroadcastMessage(other_uuid, other_server_ip, other_server_port, other_host_id, other_local_socket_path)
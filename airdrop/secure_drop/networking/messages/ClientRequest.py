@@ -12,6 +12,10 @@ class ClientRequestType(Enum):
     HAS_ADDED = 2
     SEND_FILE_CONSENT = 3
     SEND_FILE = 4
+    SEND_FILE_STRIPE = 5
+    SEND_ARCHIVE = 6
+    SEND_SWARM = 7
+    FETCH_SWARM_PIECES = 8
 
 
 class ClientRequest(Message):
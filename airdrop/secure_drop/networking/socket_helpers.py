@@ -1,48 +1,79 @@
+import copy
+import functools
+import hashlib
 import os
 import socket
-from typing import Optional
+import stat
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
 
-from secure_drop import constants
+from secure_drop import constants, exceptions
+from secure_drop.networking import (compression, datagram_transfers, delta, encryption, framing, merkle, sparse,
+                                    striped_transfers, transfer_helpers)
+from secure_drop.networking.ChunkSizer import ChunkSizer
+from secure_drop.networking.ChunkVerifier import ChunkVerifier
+from secure_drop.networking.compression import Compression, CompressionMetrics
+from secure_drop.networking.framing import FrameType
+from secure_drop.networking.IncomingArchive import ENTRY_HEADER, IncomingArchive
+from secure_drop.networking.IncomingFile import IncomingFile
 from secure_drop.networking.messages.ClientRequest import (ClientRequest,
                                                            ClientRequestType)
 from secure_drop.networking.messages.ServerResponse import ServerResponse
+from secure_drop.networking.SharedFileReader import SharedFileView
+from secure_drop.networking.TransferOptions import TransferOptions
+from secure_drop.singletons.BandwidthManager import Direction
 from secure_drop.singletons.LoginManager import LoginManager
 
+# The pid, uid and gid of the process at the other end of a Unix domain socket
+PEER_CREDENTIALS = struct.Struct("=iII")
 
-def is_connected_to(sock: socket.socket) -> bool:
+
+def is_connected_to(sock: socket.socket, timeout: Optional[float] = None) -> bool:
     try:
         req = ClientRequest(ClientRequestType.PING)
-        sock.sendall(req.to_bytes())
-        _ = sock.recv(1024)
-    except OSError: 
-        return False 
-    return True
+        return transfer_helpers.send_req(sock, req, timeout) is not None
+    except (OSError, exceptions.MalformedFrameException):
+        return False
 
 
-def get_email(sock: socket.socket) -> Optional[str]:
+def get_email(sock: socket.socket, timeout: Optional[float] = None) -> Optional[str]:
     try:
         req = ClientRequest(ClientRequestType.EMAIL)
-        sock.sendall(req.to_bytes())
-        data = sock.recv(1024)
-        res = ServerResponse.from_bytes(data)
+        if (res := transfer_helpers.send_req(sock, req, timeout)) is None:
+            return None
         return res.str_res
-    except OSError:
+    except (OSError, exceptions.MalformedFrameException):
         return None
 
 
-def has_added_user(sock: socket.socket, email: str) -> Optional[bool]:
+def has_added_user(sock: socket.socket, email: str, timeout: Optional[float] = None) -> Optional[bool]:
     try:
         args = [email]
         req = ClientRequest(ClientRequestType.HAS_ADDED, args)
-        sock.sendall(req.to_bytes())
-        data = sock.recv(1024)
-        res = ServerResponse.from_bytes(data)
+        if (res := transfer_helpers.send_req(sock, req, timeout)) is None:
+            return None
         return res.bool_res
-    except OSError:
+    except (OSError, exceptions.MalformedFrameException):
         return None
 
 
-def consents_to_receive_file(sock: socket.socket) -> bool:
+def consents_to_receive_file(sock: socket.socket, timeout: Optional[float] = None,
+                             cancelled: Optional[threading.Event] = None) -> bool:
+    """Asks a server whether its user accepts a file from the logged in user.
+
+    Args:
+        sock (socket.socket): The socket connected to the server.
+        timeout (Optional[float], optional): How long the server has to answer, in seconds. Defaults to None.
+        cancelled (Optional[threading.Event], optional): Set to stop waiting for the answer. Defaults to None.
+
+    Returns:
+        bool: True if the user accepted the file; False otherwise.
+    """
+
     try:
         logged_in_user_credentials = LoginManager().get_logged_in_user_credentials()
         if not logged_in_user_credentials:
@@ -50,79 +81,506 @@ def consents_to_receive_file(sock: socket.socket) -> bool:
         # Send the logged in user's email so the connection so they know who the file is coming from
         args = [logged_in_user_credentials.email]
         req = ClientRequest(ClientRequestType.SEND_FILE_CONSENT, args)
-        sock.sendall(req.to_bytes())
-        data = sock.recv(1024)
-        res = ServerResponse.from_bytes(data)
+        if (res := transfer_helpers.send_req(sock, req, timeout, cancelled)) is None:
+            return False
         return res.bool_res
-    except OSError:
+    except (OSError, exceptions.MalformedFrameException, exceptions.TransferCancelledException):
         return False
 
 
-def send_file(sock: socket.socket, file_path: str) -> bool:
+def recv_req(sock: socket.socket) -> Optional[ClientRequest]:
+    """Receives the next request sent by a client.
+
+    Raises:
+        exceptions.MalformedFrameException: Raised if the next frame is not a request.
+
+    Returns:
+        Optional[ClientRequest]: The request, or None if the client disconnected.
+    """
+
+    if (payload := framing.recv_frame(sock, FrameType.REQUEST)) is None:
+        return None
+    transfer_helpers.charge_control(len(payload), Direction.RECEIVE)
+    return ClientRequest.from_bytes(payload)
+
+
+def send_file(sock: socket.socket, file_path: str, options: Optional[TransferOptions] = None,
+              metrics: Optional[CompressionMetrics] = None, shared_file: Optional[SharedFileView] = None) -> bool:
+    """Streams a file to a connected server the way the options ask for.
+
+    Args:
+        sock (socket.socket): The socket connected to the receiving server.
+        file_path (str): The path to the file to send.
+        options (Optional[TransferOptions], optional): The protocol to follow. Defaults to a pipelined transfer.
+        metrics (Optional[CompressionMetrics], optional): Filled in with what compression saved and cost. Defaults to
+            None.
+        shared_file (Optional[SharedFileView], optional): The view to read the file through when it is sent to many
+            servers at once. Defaults to None.
+
+    Raises:
+        FileNotFoundError: Raised if the file does not exist.
+
+    Returns:
+        bool: True if the file was sent successfully; False if it was rejected or the transfer failed.
+    """
+
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"Unable to find file: {file_path}")
+    if options is None:
+        options = TransferOptions()
+    if shared_file is not None and options.zero_copy:
+        # sendfile would read the file again straight from the page cache instead of taking the shared reads
+        options = copy.copy(options)
+        options.zero_copy = False
+    if options.local and (sock.family != getattr(socket, "AF_UNIX", None) or not __is_peer_own_user(sock)):
+        # Descriptors can only be passed over a Unix domain socket, and only to a server run by this user, who can
+        # read the file anyway => encryption is moot
+        options = copy.copy(options)
+        options.local = False
+    if options.datagrams and sock.family not in [socket.AF_INET, socket.AF_INET6]:
+        # Datagrams are sent to the address the connection goes to, which only an IP connection has
+        options = copy.copy(options)
+        options.datagrams = False
     try:
-        args = [file_path]
-        req = ClientRequest(ClientRequestType.SEND_FILE, args)
-        sock.sendall(req.to_bytes())
-        chunks = []
-        with open(file_path, "rb") as f:
-            while True:
-                chunk = f.read(constants.FILE_CHUNK_SIZE)
-                if not chunk:
-                    break
-                chunks.append(chunk)
-        for chunk in chunks:
-            sock.sendall(chunk)
-            # Wait for an acknowledgement from the server
-            _ = sock.recv(1024)
-        sock.sendall(b"done sending")
-    except OSError:
+        with open(file_path, "rb") if shared_file is None else shared_file as f:
+            file_stat = os.fstat(f.fileno())
+            file_key = transfer_helpers.get_file_key(file_path, file_stat, options)
+            if options.compression != Compression.NONE:
+                options = __sample_compression(f, options, metrics or CompressionMetrics())
+            transfer_id = __get_transfer_id(file_path, file_stat) if options.is_resumable() else ""
+            args = [os.path.basename(file_path), str(file_stat.st_size), transfer_id] + options.to_args()
+            req = ClientRequest(ClientRequestType.SEND_FILE, args)
+            if (res := transfer_helpers.send_req(sock, req, cancelled=options.cancelled)) is None or not res.bool_res:
+                return False
+            if options.is_striped():
+                # The server answers a striped transfer with the token that the extra connections claim stripes with
+                return striped_transfers.send_stripes(sock, file_path, file_stat.st_size, res.str_res, options)
+            if options.delta:
+                # The server follows up a delta transfer with the signatures of its earlier version of the file, which
+                # are sealed like the delta itself
+                key = transfer_helpers.send_fresh_key(sock, options)
+                if (signatures := delta.recv_signatures(sock, key)) is None:
+                    return False
+                transfer_helpers.send_frames(sock, delta.send_delta(sock, f, signatures, key), options)
+                return True
+            # A resumed transfer only sends what the server doesn't already have
+            offset = int(res.str_res or 0)
+            if not 0 <= offset <= file_stat.st_size:
+                return False
+            if options.uses_handover():
+                transfer_helpers.send_frames(sock, __hand_over_file(sock, f), options)
+            elif options.uses_datagrams():
+                datagram_transfers.send_datagrams(sock, f, file_stat.st_size, options, file_key)
+            elif options.compression != Compression.NONE:
+                # An encrypted stream is compressed first, since ciphertext doesn't compress
+                key = transfer_helpers.send_fresh_key(sock, options)
+                __send_compressed_chunks(sock, f, offset, file_stat.st_size, options, metrics or CompressionMetrics(),
+                                         file_key, key)
+            elif options.encrypt:
+                # A file sent to many servers at once is encrypted once under a content key that all of them share.
+                # Any other file is encrypted under the content key kept for it, if any, so that its sealed chunks are
+                # cached for the next time it's sent.
+                content_key = shared_file.encryption_key if shared_file is not None else \
+                    transfer_helpers.get_content_key(file_stat, options, file_key, constants.ENCRYPTION_CHUNK_SIZE)
+                if (key := transfer_helpers.send_transfer_key(sock, options, content_key)) is None:
+                    return False
+                if content_key is None:
+                    frames = transfer_helpers.send_encrypted_chunks(sock, f, offset, file_stat.st_size, key)
+                elif shared_file is not None:
+                    frames = transfer_helpers.send_encrypted_chunks(sock, f, offset, file_stat.st_size, key,
+                                                                    shared_file.read_encrypted_chunk)
+                else:
+                    frames = transfer_helpers.send_encrypted_chunks(sock, f, offset, file_stat.st_size, key,
+                                                                    chunk_cache=options.chunk_cache, file_key=file_key)
+                transfer_helpers.send_frames(sock, frames, options)
+            elif options.uses_verification():
+                __send_verified_chunks(sock, f, offset, file_stat.st_size, options,
+                                       shared_file.hash_leaf if shared_file is not None else None, file_key)
+            else:
+                transfer_helpers.send_chunks(sock, f, offset, file_stat.st_size, options)
+    except (OSError, exceptions.MalformedFrameException, exceptions.UnexpectedFileSizeException,
+            exceptions.CorruptChunkException):
+        return False
+    except exceptions.TransferCancelledException:
+        transfer_helpers.abort(sock)
         return False
     return True
 
 
-def receive_file(sock: socket.socket, file_path: str) -> bool:
+def receive_file(sock: socket.socket, incoming_file: IncomingFile, options: Optional[TransferOptions] = None) -> bool:
+    """Accepts a file announced in a SEND_FILE request and receives it into the space reserved for it.
+
+    Args:
+        sock (socket.socket): The socket connected to the sending client.
+        incoming_file (IncomingFile): The file to receive into.
+        options (Optional[TransferOptions], optional): The protocol the sender announced. Defaults to a pipelined
+            transfer.
+
+    Returns:
+        bool: True if the file was received successfully; False otherwise.
+    """
+
+    if options is None:
+        options = TransferOptions()
+    verifier: Optional[ChunkVerifier] = None
+    decryptor: Optional[encryption.StreamDecryptor] = None
     try:
-        res = ServerResponse(str_res="acknowledgement")
-        chunks = []
-        while True:
-            chunk = sock.recv(constants.FILE_CHUNK_SIZE)
-            if not chunk or chunk == b"done sending":
-                break
-            chunks.append(chunk)
-            # Send an acknowledgement to the client
-            sock.sendall(res.to_bytes())
-        with open(file_path, "wb") as f:
-            for chunk in chunks:
-                f.write(chunk)
-    except OSError:
+        try:
+            # Tell the sender where to start, which is past whatever an interrupted transfer of the file already
+            # received
+            res = ServerResponse(str_res=str(incoming_file.offset), bool_res=True)
+            framing.send_frame(sock, FrameType.RESPONSE, res.to_bytes())
+            if options.uses_handover():
+                if not __receive_handover(sock, incoming_file, options):
+                    incoming_file.suspend()
+                    return False
+                incoming_file.commit()
+                transfer_helpers.send_final_ack(sock, 1)
+                return True
+            if options.uses_datagrams():
+                num_datagrams_received = datagram_transfers.receive_datagrams(sock, incoming_file, options)
+                if num_datagrams_received is None:
+                    incoming_file.discard()
+                    return False
+                incoming_file.commit()
+                transfer_helpers.send_final_ack(sock, num_datagrams_received)
+                return True
+            write = incoming_file.write
+            key = None
+            if options.encrypt:
+                if (key := transfer_helpers.recv_transfer_key(sock)) is None:
+                    incoming_file.suspend()
+                    return False
+                if not options.seals_frames():
+                    decryptor = encryption.StreamDecryptor(key, incoming_file.offset, incoming_file.file_size,
+                                                           incoming_file.write)
+                    write = decryptor.write
+            if options.uses_verification():
+                verifier = ChunkVerifier(sock, incoming_file)
+
+                def write(data: memoryview):
+                    verifier.update(data)
+                    incoming_file.write(data)
+            if options.compression != Compression.NONE:
+                decompressor = compression.StreamDecompressor(options.compression, incoming_file.write)
+                write = decompressor.write
+            basis_path = os.path.join(incoming_file.directory, incoming_file.file_name)
+            with open(basis_path, "rb") if options.delta and os.path.isfile(basis_path) else nullcontext() as basis:
+                handlers = None
+                if options.delta:
+                    handlers = {FrameType.COPY: delta.prepare_delta(sock, basis, incoming_file.write, key)}
+                if options.uses_sparse():
+                    handlers = {FrameType.HOLE: functools.partial(__receive_hole, incoming_file, verifier)}
+                if options.seals_frames():
+                    write, handlers = transfer_helpers.open_sealed_frames(key, write, handlers)
+                num_chunks_received = transfer_helpers.receive_chunks(sock, write, options.ack_interval, handlers,
+                                                                      verifier, options.bucket)
+            if num_chunks_received is None:
+                # Chunks that are still being decrypted have to be written before what was received can be kept
+                if decryptor is not None:
+                    decryptor.close()
+                incoming_file.suspend(__get_num_bytes_verified(verifier))
+                return False
+            if options.compression != Compression.NONE:
+                decompressor.finish()
+            if decryptor is not None:
+                decryptor.finish()
+            if verifier is not None:
+                verifier.finish()
+            # A delta replaces the version it was applied to, so the next delta is taken against the newest version
+            incoming_file.commit(replace=options.delta)
+            transfer_helpers.send_final_ack(sock, num_chunks_received)
+        finally:
+            # Nothing may still be hashing or writing the file once it is kept or discarded below
+            if verifier is not None:
+                verifier.close()
+            if decryptor is not None:
+                decryptor.close()
+    except (OSError, exceptions.MalformedFrameException):
+        # Whatever made it to the disk can be used to resume the transfer, as long as it wasn't found to be corrupt
+        incoming_file.suspend(__get_num_bytes_verified(verifier))
+        return False
+    except (exceptions.UnexpectedFileSizeException, exceptions.CorruptChunkException):
+        incoming_file.discard()
         return False
     return True
 
 
-def send_ping_res(sock: socket.socket) -> bool:
+def send_archive(sock: socket.socket, files: List[Tuple[str, str]], options: Optional[TransferOptions] = None) -> bool:
+    """Streams many files to a connected server as one archive, under a single request.
+
+    Args:
+        sock (socket.socket): The socket connected to the receiving server.
+        files (List[Tuple[str, str]]): The path of each file along with the relative path to unpack it to.
+        options (Optional[TransferOptions], optional): The protocol to follow. Defaults to a pipelined transfer.
+
+    Returns:
+        bool: True if every file was sent successfully; False otherwise.
+    """
+
+    if options is None:
+        options = TransferOptions()
     try:
-        res = ServerResponse(str_res="ping")
-        sock.sendall(res.to_bytes())
-        return True
-    except OSError:
+        total_size = sum(os.path.getsize(file_path) for file_path, _ in files)
+        args = [str(len(files)), str(total_size)] + options.to_args()
+        req = ClientRequest(ClientRequestType.SEND_ARCHIVE, args)
+        if (res := transfer_helpers.send_req(sock, req, cancelled=options.cancelled)) is None or not res.bool_res:
+            return False
+        # The entries and the data of every file are sealed one frame at a time, in the order they are sent
+        key = transfer_helpers.send_fresh_key(sock, options)
+        sizer = transfer_helpers.create_chunk_sizer(options) if key is None else None
+        frames = __send_archive_entries(sock, files, options.uses_zero_copy(), sizer, key)
+        transfer_helpers.send_frames(sock, frames, options, sizer=sizer)
+    except (OSError, exceptions.MalformedFrameException):
+        return False
+    except exceptions.TransferCancelledException:
+        transfer_helpers.abort(sock)
         return False
+    return True
 
 
-def send_email_res(sock: socket.socket, email: str) -> bool:
+def receive_archive(sock: socket.socket, incoming_archive: IncomingArchive,
+                    options: Optional[TransferOptions] = None) -> bool:
+    """Accepts an archive announced in a SEND_ARCHIVE request and unpacks each file as it arrives.
+
+    Args:
+        sock (socket.socket): The socket connected to the sending client.
+        incoming_archive (IncomingArchive): The archive to unpack.
+        options (Optional[TransferOptions], optional): The protocol the sender announced. Defaults to a pipelined
+            transfer.
+
+    Returns:
+        bool: True if every file was received successfully; False otherwise.
+    """
+
+    if options is None:
+        options = TransferOptions()
     try:
-        res = ServerResponse(str_res=email)
-        sock.sendall(res.to_bytes())
-        return True
-    except OSError:
+        framing.send_frame(sock, FrameType.RESPONSE, ServerResponse(bool_res=True).to_bytes())
+        write = incoming_archive.write
+        handlers = {FrameType.ENTRY: incoming_archive.start_entry}
+        if options.encrypt:
+            if (key := transfer_helpers.recv_transfer_key(sock)) is None:
+                incoming_archive.discard()
+                return False
+            write, handlers = transfer_helpers.open_sealed_frames(key, write, handlers)
+        if (num_chunks_received := transfer_helpers.receive_chunks(sock, write, options.ack_interval, handlers,
+                                                                   bucket=options.bucket)) is None:
+            incoming_archive.discard()
+            return False
+        incoming_archive.commit()
+        transfer_helpers.send_final_ack(sock, num_chunks_received)
+    except (OSError, exceptions.MalformedFrameException, exceptions.UnexpectedFileSizeException,
+            exceptions.CorruptChunkException):
+        incoming_archive.discard()
         return False
+    return True
 
 
-def send_bool_res(sock: socket.socket, boolean: bool) -> bool:
+def __send_archive_entries(sock: socket.socket, files: List[Tuple[str, str]], zero_copy: bool,
+                           sizer: Optional[ChunkSizer], key: Optional[bytes] = None) -> Iterator[int]:
+    sealer = encryption.FrameSealer(key, encryption.TO_RECEIVER) if key is not None else None
+    for file_path, name in files:
+        with open(file_path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            entry = ENTRY_HEADER.pack(file_size) + name.encode()
+            # Cork the header so that a small file leaves in the same segment as its header
+            framing.send_frame(sock, FrameType.ENTRY, sealer.seal(entry) if sealer is not None else entry, corked=True)
+            yield 0
+            if sealer is not None:
+                remaining = file_size
+                while remaining > 0:
+                    if not (data := f.read(min(remaining, encryption.MAX_SEALED_FRAME_DATA_SIZE))):
+                        raise ConnectionError(f"File shrank while it was being sent: {f.name}")
+                    remaining -= len(data)
+                    yield from transfer_helpers.send_sealed_data(sock, data, sealer)
+            elif zero_copy:
+                yield from transfer_helpers.send_zero_copy_chunks(sock, f, 0, file_size)
+            else:
+                yield from transfer_helpers.send_buffered_chunks(sock, f, 0, file_size, sizer)
+
+
+def __get_transfer_id(file_path: str, file_stat: os.stat_result) -> str:
+    """Derives a transfer ID that only stays the same for as long as the file is unchanged.
+    """
+
+    identity = f"{os.path.realpath(file_path)}:{file_stat.st_size}:{file_stat.st_mtime_ns}:{file_stat.st_ino}"
+    return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+
+def __is_peer_own_user(sock: socket.socket) -> bool:
+    if not hasattr(socket, "SO_PEERCRED"):
+        return False
     try:
-        res = ServerResponse(bool_res=boolean)
-        sock.sendall(res.to_bytes())
-        return True
+        _, uid, _ = PEER_CREDENTIALS.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                            PEER_CREDENTIALS.size))
     except OSError:
         return False
+    return uid == os.getuid()
+
+
+def __hand_over_file(sock: socket.socket, f: BinaryIO) -> Iterator[int]:
+    framing.send_frame_with_fd(sock, FrameType.HANDOVER, f.fileno())
+    yield 0
+
+
+def __receive_handover(sock: socket.socket, incoming_file: IncomingFile, options: TransferOptions) -> bool:
+    if (fd := framing.recv_frame_with_fd(sock, FrameType.HANDOVER)) is None:
+        return False
+    with open(fd, "rb") as source:
+        source_stat = os.fstat(fd)
+        if not stat.S_ISREG(source_stat.st_mode):
+            raise exceptions.MalformedFrameException("Handed over a descriptor that isn't a regular file")
+        if source_stat.st_size < incoming_file.file_size:
+            raise exceptions.UnexpectedFileSizeException("The file shrank before it was handed over")
+        if options.sparse:
+            extents = sparse.get_extents(source, incoming_file.offset, incoming_file.file_size)
+        else:
+            extents = iter([(incoming_file.offset, incoming_file.file_size, True)])
+        for start, end, is_data in extents:
+            if is_data:
+                incoming_file.copy_from(fd, start, end - start)
+            else:
+                incoming_file.skip(end - start)
+    return framing.recv_frame(sock, FrameType.END) is not None
+
+
+def __send_verified_chunks(sock: socket.socket, f: BinaryIO, offset: int, file_size: int, options: TransferOptions,
+                           hash_leaf: Optional[Callable[[int, int], bytes]] = None, file_key: Optional[str] = None):
+    """Sends the file along with its manifest, hashing each leaf on a background thread while it is sent.
+    """
+
+    # The background thread reads the file through its own handle, so it never moves the position of `f`
+    with open(f.name, "rb") if hash_leaf is None else nullcontext() as manifest_file, \
+            ThreadPoolExecutor(1, thread_name_prefix="Manifest") as executor:
+        if hash_leaf is None:
+            hash_leaf = functools.partial(merkle.hash_leaf, manifest_file)
+        hash_leaf = transfer_helpers.cache_leaf_hashes(hash_leaf, options, file_key)
+
+        sizer = transfer_helpers.create_chunk_sizer(options)
+
+        def send_leaves() -> Iterator[int]:
+            leaf_hashes: List[bytes] = []
+            for leaf_index in range(merkle.get_num_leaves(offset, file_size)):
+                start, end = merkle.get_leaf(offset, file_size, leaf_index)
+                leaf_hash = executor.submit(hash_leaf, start, end)
+                yield from transfer_helpers.send_range(sock, f, start, end, options, sizer)
+                leaf_hashes.append(leaf_hash.result())
+                framing.send_frame(sock, FrameType.HASH, merkle.LEAF_HASH.pack(leaf_index, leaf_hashes[-1]))
+                yield 0
+            framing.send_frame(sock, FrameType.ROOT, merkle.get_root(leaf_hashes))
+            yield 0
+
+        def send_repair(nack: memoryview):
+            if len(nack) != merkle.LEAF_INDEX.size or \
+                (leaf := merkle.get_leaf(offset, file_size, merkle.LEAF_INDEX.unpack(nack)[0])) is None:
+                raise exceptions.MalformedFrameException("Malformed NACK frame")
+            position = f.tell()
+            f.seek(leaf[0])
+            data = f.read(leaf[1] - leaf[0])
+            f.seek(position)
+            framing.send_frame(sock, FrameType.REPAIR, bytes(nack) + data)
+
+        transfer_helpers.send_frames(sock, send_leaves(), options, send_repair, sizer)
+
+
+def __sample_compression(f: BinaryIO, options: TransferOptions, metrics: CompressionMetrics) -> TransferOptions:
+    metrics.sampled_entropy = compression.get_entropy(f, 0)
+    if metrics.sampled_entropy <= constants.COMPRESSION_MAX_ENTROPY_BITS:
+        metrics.compression = options.compression
+        return options
+    options = copy.copy(options)
+    options.compression = Compression.NONE
+    return options
+
+
+def __send_compressed_chunks(sock: socket.socket, f: BinaryIO, offset: int, file_size: int, options: TransferOptions,
+                             metrics: CompressionMetrics, file_key: Optional[str] = None,
+                             key: Optional[bytes] = None):
+    """Sends the file as a single compressed stream, taking the chunks that the chunk cache has from it. The chunks
+    are cached before they are sealed, so a cached chunk can go out under any key.
+    """
+
+    compressor = None
+    kind = f"{options.compression.value}_{options.compression_level}_{constants.COMPRESSION_READ_SIZE}"
+    chunk_cache = options.chunk_cache if file_key is not None and offset == 0 else None
+    sealer = encryption.FrameSealer(key, encryption.TO_RECEIVER) if key is not None else None
+    start = time.perf_counter()
+
+    def send_compressed(data: bytes) -> Iterator[int]:
+        metrics.num_compressed_bytes += len(data)
+        return transfer_helpers.send_sealed_data(sock, data, sealer)
+
+    def read(read_size: int) -> bytes:
+        if len(data := f.read(read_size)) != read_size:
+            raise ConnectionError(f"File shrank while it was being sent: {f.name}")
+        return data
+
+    # Compresses the next read of the file, or flushes the compressor if there is nothing left to read
+    def compress(chunk_index: int, read_size: Optional[int]) -> bytes:
+        nonlocal compressor
+        if compressor is None and chunk_cache is not None and \
+                (compressed := chunk_cache.get(file_key, kind, chunk_index)) is not None:
+            return compressed
+        if compressor is None:
+            compressor = compression.create_compressor(options.compression, options.compression_level)
+            f.seek(offset)
+            for _ in range(chunk_index):
+                data = read(constants.COMPRESSION_READ_SIZE)
+                cpu_start = time.thread_time()
+                compressor.compress(data)
+                metrics.cpu_seconds += time.thread_time() - cpu_start
+        data = read(read_size) if read_size is not None else b""
+        cpu_start = time.thread_time()
+        compressed = compressor.compress(data) if read_size is not None else compressor.flush()
+        metrics.cpu_seconds += time.thread_time() - cpu_start
+        if chunk_cache is not None:
+            chunk_cache.put(file_key, kind, chunk_index, compressed)
+        return compressed
+
+    def compress_chunks() -> Iterator[int]:
+        remaining = file_size - offset
+        chunk_index = 0
+        while remaining > 0:
+            read_size = min(remaining, constants.COMPRESSION_READ_SIZE)
+            compressed = compress(chunk_index, read_size)
+            remaining -= read_size
+            metrics.num_raw_bytes += read_size
+            chunk_index += 1
+            # The compressor buffers small inputs => only frames that carry data are sent
+            if compressed:
+                yield from send_compressed(compressed)
+        yield from send_compressed(compress(chunk_index, None))
+
+    transfer_helpers.send_frames(sock, compress_chunks(), options)
+    metrics.elapsed_seconds = time.perf_counter() - start
+
+
+def __receive_hole(incoming_file: IncomingFile, verifier: Optional[ChunkVerifier], hole: memoryview):
+    if len(hole) != sparse.HOLE.size:
+        raise exceptions.MalformedFrameException("Malformed HOLE frame")
+    hole_size = sparse.HOLE.unpack(hole)[0]
+    incoming_file.skip(hole_size)
+    if verifier is not None:
+        zeros = memoryview(bytes(min(hole_size, constants.MERKLE_LEAF_SIZE)))
+        for position in range(0, hole_size, len(zeros)):
+            verifier.update(zeros[:hole_size - position])
+
+
+def __get_num_bytes_verified(verifier: Optional[ChunkVerifier]) -> Optional[int]:
+    return verifier.get_num_bytes_verified() if verifier is not None else None
+
+
+def send_ping_res(sock: socket.socket) -> bool:
+    res = ServerResponse(str_res="ping")
+    return transfer_helpers.send_res(sock, res)
+
+
+def send_email_res(sock: socket.socket, email: str) -> bool:
+    res = ServerResponse(str_res=email)
+    return transfer_helpers.send_res(sock, res)
+
+
+def send_bool_res(sock: socket.socket, boolean: bool) -> bool:
+    res = ServerResponse(bool_res=boolean)
+    return transfer_helpers.send_res(sock, res)
@@ -0,0 +1,112 @@
+import logging
+import socket
+from typing import Optional
+
+from secure_drop import constants
+
+logger = logging.getLogger(__name__)
+
+# The legacy type-of-service bits, which most stacks still map onto a DSCP class
+__IPTOS_LOWDELAY = getattr(socket, "IPTOS_LOWDELAY", 0x10)
+__IPTOS_THROUGHPUT = getattr(socket, "IPTOS_THROUGHPUT", 0x08)
+# The largest buffers a socket may ask for on Linux, beyond which a request is silently capped
+__BUFFER_SIZE_LIMIT_PATHS = {
+    socket.SO_SNDBUF: "/proc/sys/net/core/wmem_max",
+    socket.SO_RCVBUF: "/proc/sys/net/core/rmem_max",
+}
+
+
+def tune_listening_socket(sock: socket.socket):
+    """Tunes a server socket before it listens. Accepted connections inherit its buffers, and the TCP window scale is
+    agreed on during the handshake, so fixed buffers have to be in place before any connection is accepted.
+    """
+
+    __set_buffer_sizes(sock)
+
+
+def tune_connection(sock: socket.socket):
+    """Tunes a connection between two instances, which carries requests and responses that someone is waiting on as
+    well as the files sent over it. Small frames leave at once instead of waiting for the previous segment to be
+    acknowledged, which would otherwise stall the last frame of every exchange until the peer's delayed ACK fires.
+    """
+
+    __set_no_delay(sock)
+    __set_type_of_service(sock, __IPTOS_LOWDELAY)
+    __set_buffer_sizes(sock)
+    __log_tuning(sock, "connection")
+
+
+def tune_bulk_connection(sock: socket.socket):
+    """Tunes a connection that only carries file data, such as a stripe or the pieces fetched from a swarm peer.
+    Acknowledgements still leave at once, and the traffic is marked as bulk so that it queues behind interactive
+    traffic along the way.
+    """
+
+    __set_no_delay(sock)
+    __set_type_of_service(sock, __IPTOS_THROUGHPUT)
+    __set_buffer_sizes(sock)
+    __log_tuning(sock, "bulk connection")
+
+
+def __is_ip(sock: socket.socket) -> bool:
+    return sock.family in [socket.AF_INET, socket.AF_INET6] and sock.type == socket.SOCK_STREAM
+
+
+def __set_no_delay(sock: socket.socket):
+    if __is_ip(sock):
+        __set_option(sock, socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def __set_type_of_service(sock: socket.socket, type_of_service: int):
+    if sock.family == socket.AF_INET:
+        __set_option(sock, socket.IPPROTO_IP, socket.IP_TOS, type_of_service)
+    elif sock.family == socket.AF_INET6 and hasattr(socket, "IPV6_TCLASS"):
+        __set_option(sock, socket.IPPROTO_IPV6, socket.IPV6_TCLASS, type_of_service)
+
+
+def __set_buffer_sizes(sock: socket.socket):
+    if (buffer_size := constants.TCP_SOCKET_BUFFER_SIZE) is None:
+        return
+    for option, limit_path in __BUFFER_SIZE_LIMIT_PATHS.items():
+        # A capped buffer would be smaller than the one autotuning grows it to, and stop it from growing at that
+        if (limit := __read_buffer_size_limit(limit_path)) is not None and limit < buffer_size:
+            logger.debug(f"Leaving socket buffers to autotuning, since {limit_path} is below {buffer_size} B")
+            continue
+        try:
+            # Buffers that the system already made larger are left alone
+            if sock.getsockopt(socket.SOL_SOCKET, option) < buffer_size:
+                sock.setsockopt(socket.SOL_SOCKET, option, buffer_size)
+                logger.debug(f"Set socket buffer to {sock.getsockopt(socket.SOL_SOCKET, option)} B")
+        except OSError:
+            pass
+
+
+def __read_buffer_size_limit(limit_path: str) -> Optional[int]:
+    try:
+        with open(limit_path) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        # Not Linux => the system caps the buffer itself, which the read back size shows
+        return None
+
+
+def __set_option(sock: socket.socket, level: int, option: int, value: int):
+    try:
+        sock.setsockopt(level, option, value)
+    except OSError:
+        # Every option is only a hint, which the system or the kind of socket may not support
+        pass
+
+
+def __log_tuning(sock: socket.socket, kind: str):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    try:
+        send_buffer_size = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        receive_buffer_size = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        no_delay = __is_ip(sock) and bool(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        peer_address = sock.getpeername()
+    except OSError:
+        return
+    logger.debug(f"Tuned {kind} to {peer_address}: send buffer {send_buffer_size} B, receive buffer "
+                 f"{receive_buffer_size} B, no delay {no_delay}")
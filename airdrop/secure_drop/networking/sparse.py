@@ -0,0 +1,60 @@
+import errno
+import os
+import struct
+from typing import BinaryIO, Iterator, Tuple
+
+# A HOLE frame carries the length of a run of the file that holds no data
+HOLE = struct.Struct("!Q")
+
+
+def get_extents(f: BinaryIO, start: int, end: int) -> Iterator[Tuple[int, int, bool]]:
+    """Splits a byte range of a file into the extents that hold data and the holes between them. Holes read as zeros
+    but take up no disk space, so they don't have to be read or sent. A file system that can't report holes is treated
+    as if the file held data throughout.
+
+    Args:
+        f (BinaryIO): The file, whose position is left where it was.
+        start (int): The start of the range.
+        end (int): The end of the range.
+
+    Yields:
+        Tuple[int, int, bool]: The [start, end) range of each extent in order, and whether it holds data.
+    """
+
+    if not hasattr(os, "SEEK_DATA"):
+        if start < end:
+            yield start, end, True
+        return
+    fd = f.fileno()
+    position = start
+    while position < end:
+        data_start, data_end = __find_data(fd, position, end)
+        if data_start > position:
+            yield position, data_start, False
+        if data_end > data_start:
+            yield data_start, data_end, True
+        position = data_end
+
+
+def __find_data(fd: int, position: int, end: int) -> Tuple[int, int]:
+    """Finds the first extent that holds data at or after a position, up to the end of a range. Buffered file objects
+    assume they are the only ones that move the position of their descriptor, so it is put back afterwards.
+
+    Returns:
+        Tuple[int, int]: The [start, end) range of the extent, which is empty if only a hole is left in the range.
+    """
+
+    saved_position = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        data_start = min(os.lseek(fd, position, os.SEEK_DATA), end)
+        if data_start == end:
+            return end, end
+        return data_start, min(os.lseek(fd, data_start, os.SEEK_HOLE), end)
+    except OSError as e:
+        if e.errno == errno.ENXIO:
+            # There is no data past the position => the rest of the file is a hole
+            return end, end
+        # The file system can't report holes
+        return position, end
+    finally:
+        os.lseek(fd, saved_position, os.SEEK_SET)
@@ -0,0 +1,147 @@
+import socket
+import threading
+from typing import Optional, Tuple
+
+from secure_drop import exceptions
+from secure_drop.networking import encryption, framing, transfer_helpers
+from secure_drop.networking.framing import FrameType
+from secure_drop.networking.messages.ClientRequest import (ClientRequest,
+                                                           ClientRequestType)
+from secure_drop.networking.messages.ServerResponse import ServerResponse
+from secure_drop.networking.StripedTransfer import StripedTransfer
+from secure_drop.networking.TransferOptions import TransferOptions
+
+
+def receive_striped_file(sock: socket.socket, striped_transfer: StripedTransfer) -> bool:
+    """Accepts a striped file and commits it once the sender has sent every stripe over extra connections.
+
+    Args:
+        sock (socket.socket): The socket connected to the sending client.
+        striped_transfer (StripedTransfer): The transfer.
+
+    Returns:
+        bool: False if the connection can't be used any further; True otherwise.
+    """
+
+    incoming_file = striped_transfer.incoming_file
+    try:
+        res = ServerResponse(str_res=striped_transfer.token, bool_res=True)
+        framing.send_frame(sock, FrameType.RESPONSE, res.to_bytes())
+        if striped_transfer.options.encrypt:
+            key = None
+            try:
+                key = transfer_helpers.recv_transfer_key(sock)
+            finally:
+                # The stripes wait for the key, and are refused if there is none
+                striped_transfer.set_key(key)
+            if key is None:
+                incoming_file.discard()
+                return False
+        if framing.recv_frame(sock, FrameType.END) is None:
+            incoming_file.discard()
+            return False
+        if not striped_transfer.is_complete():
+            incoming_file.discard()
+            return transfer_helpers.send_res(sock, ServerResponse(bool_res=False))
+        incoming_file.commit()
+    except (OSError, exceptions.MalformedFrameException, exceptions.UnexpectedFileSizeException):
+        incoming_file.discard()
+        return False
+    return transfer_helpers.send_res(sock, ServerResponse(bool_res=True))
+
+
+def receive_file_stripe(sock: socket.socket, striped_transfer: StripedTransfer, stripe_index: int) -> bool:
+    """Receives one stripe of a striped transfer into its place in the file.
+
+    Args:
+        sock (socket.socket): The socket connected to the sending client.
+        striped_transfer (StripedTransfer): The transfer the stripe belongs to.
+        stripe_index (int): The index of the stripe.
+
+    Returns:
+        bool: True if the stripe was received or refused; False otherwise.
+    """
+
+    if (stripe := striped_transfer.claim_stripe(stripe_index)) is None:
+        return transfer_helpers.send_res(sock, ServerResponse(bool_res=False))
+    key = striped_transfer.wait_for_key() if striped_transfer.options.encrypt else None
+    if striped_transfer.options.encrypt and key is None:
+        return transfer_helpers.send_res(sock, ServerResponse(bool_res=False))
+    position, end = stripe
+    decryptor: Optional[encryption.StreamDecryptor] = None
+
+    def write(data: memoryview):
+        nonlocal position
+        if position + len(data) > end:
+            raise exceptions.UnexpectedFileSizeException(f"Received data past the end of stripe {stripe_index}")
+        striped_transfer.incoming_file.write_at(position, data)
+        position += len(data)
+
+    try:
+        framing.send_frame(sock, FrameType.RESPONSE, ServerResponse(bool_res=True).to_bytes())
+        if key is not None:
+            # Chunks are sealed by their position in the file, which no other stripe covers
+            decryptor = encryption.StreamDecryptor(key, stripe[0], end, write)
+        num_chunks_received = transfer_helpers.receive_chunks(sock, decryptor.write if decryptor is not None else write,
+                                                              striped_transfer.options.ack_interval,
+                                                              bucket=striped_transfer.options.bucket)
+        if num_chunks_received is None:
+            return False
+        if decryptor is not None:
+            decryptor.finish()
+        if position != end:
+            raise exceptions.UnexpectedFileSizeException(f"Received too little data for stripe {stripe_index}")
+        striped_transfer.complete_stripe(stripe_index)
+        transfer_helpers.send_final_ack(sock, num_chunks_received)
+    except (OSError, exceptions.MalformedFrameException, exceptions.UnexpectedFileSizeException,
+            exceptions.CorruptChunkException):
+        return False
+    finally:
+        if decryptor is not None:
+            decryptor.close()
+    return True
+
+
+def send_stripes(sock: socket.socket, file_path: str, file_size: int, token: str, options: TransferOptions) -> bool:
+    """Sends every stripe in parallel, each over its own connection, and waits for the server to confirm the file.
+    """
+
+    # Every stripe is sealed under the same key, which is exchanged over this connection before any stripe starts
+    key = transfer_helpers.send_fresh_key(sock, options)
+    server_address = sock.getpeername()
+    stripes = StripedTransfer.get_stripes(file_size, options.num_streams)
+    results = [False] * len(stripes)
+
+    def send_stripe(stripe_index: int):
+        results[stripe_index] = __send_stripe(server_address, file_path, token, stripe_index, stripes[stripe_index],
+                                              options, key)
+
+    threads = [threading.Thread(target=send_stripe, args=[stripe_index]) for stripe_index in range(len(stripes))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The server discards the file itself if any stripe went missing
+    framing.send_frame(sock, FrameType.END)
+    if (payload := framing.recv_frame(sock, FrameType.RESPONSE)) is None:
+        return False
+    return all(results) and ServerResponse.from_bytes(payload).bool_res
+
+
+def __send_stripe(server_address: Tuple[str, int], file_path: str, token: str, stripe_index: int,
+                  stripe: Tuple[int, int], options: TransferOptions, key: Optional[bytes]) -> bool:
+    try:
+        with transfer_helpers.connect_to_server(server_address) as stripe_sock, open(file_path, "rb") as f:
+            req = ClientRequest(ClientRequestType.SEND_FILE_STRIPE, [token, str(stripe_index)])
+            res = transfer_helpers.send_req(stripe_sock, req, cancelled=options.cancelled)
+            if res is None or not res.bool_res:
+                return False
+            start, end = stripe
+            if key is not None:
+                frames = transfer_helpers.send_encrypted_chunks(stripe_sock, f, start, end, key)
+                transfer_helpers.send_frames(stripe_sock, frames, options)
+            else:
+                transfer_helpers.send_chunks(stripe_sock, f, start, end, options)
+    except (OSError, exceptions.MalformedFrameException, exceptions.TransferCancelledException):
+        return False
+    return True
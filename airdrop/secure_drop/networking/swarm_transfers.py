@@ -0,0 +1,383 @@
+import contextlib
+import functools
+import ipaddress
+import json
+import os
+import secrets
+import select
+import socket
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from Crypto.Random import get_random_bytes
+
+from secure_drop import constants, exceptions
+from secure_drop.networking import encryption, framing, merkle, transfer_helpers
+from secure_drop.networking.framing import FrameType
+from secure_drop.networking.messages.ClientRequest import (ClientRequest,
+                                                           ClientRequestType)
+from secure_drop.networking.messages.ServerResponse import ServerResponse
+from secure_drop.networking.SwarmSeeder import SwarmSeeder
+from secure_drop.networking.SwarmTransfer import PeerAddress, SwarmTransfer
+from secure_drop.networking.TokenBucket import TokenBucket
+from secure_drop.networking.TransferOptions import TransferOptions
+
+
+def send_swarm(socks: List[socket.socket], file_path: str, options: Optional[TransferOptions] = None) -> List[bool]:
+    """Sends a file to many servers at once as a swarm. Each piece is seeded to a single server and the servers
+    exchange the rest, verifying what they get against the manifest they are sent up front.
+
+    Args:
+        socks (List[socket.socket]): The sockets connected to the servers, whose addresses the servers have to be able
+            to reach each other at.
+        file_path (str): The path to the file to send.
+        options (Optional[TransferOptions], optional): The token bucket, cancellation and encryption of the transfer.
+            Defaults to an uncapped transfer.
+
+    Raises:
+        FileNotFoundError: Raised if the file does not exist.
+
+    Returns:
+        List[bool]: Whether each server received the whole file, in the order of the sockets.
+    """
+
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"Unable to find file: {file_path}")
+    if options is None:
+        options = TransferOptions()
+    content_key = None
+    with open(file_path, "rb") as f, contextlib.ExitStack() as stack:
+        file_stat = os.fstat(f.fileno())
+        file_size = file_stat.st_size
+        file_key = transfer_helpers.get_file_key(file_path, file_stat, options)
+        if not options.encrypt:
+            read_piece = functools.partial(__read_piece, f)
+            hash_leaf = transfer_helpers.cache_leaf_hashes(functools.partial(merkle.hash_leaf, f), options, file_key)
+        elif (content_key := transfer_helpers.get_content_key(file_stat, options, file_key,
+                                                              constants.MERKLE_LEAF_SIZE)) is not None:
+            # The pieces are sealed the same way every time the file is swarmed => they are cached sealed, along with
+            # their hashes
+            read_piece = transfer_helpers.cache_sealed_chunks(functools.partial(__seal_piece, f, content_key), options,
+                                                              file_key, content_key, constants.MERKLE_LEAF_SIZE)
+            kind = f"hash_{transfer_helpers.get_sealed_cache_kind(content_key, constants.MERKLE_LEAF_SIZE)}"
+            hash_leaf = transfer_helpers.cache_leaf_hashes(functools.partial(__hash_sealed_piece, read_piece),
+                                                           options, file_key, kind)
+        else:
+            content_key = get_random_bytes(constants.TRANSFER_KEY_SIZE)
+            # The pieces sealed to hash them are kept until they are seeded, so that each is only sealed once
+            read_piece = __spool_sealed_pieces(functools.partial(__seal_piece, f, content_key),
+                                               stack.enter_context(tempfile.TemporaryFile()))
+            hash_leaf = functools.partial(__hash_sealed_piece, read_piece)
+        piece_hashes = [hash_leaf(*merkle.get_leaf(0, file_size, piece_index))
+                        for piece_index in range(merkle.get_num_leaves(0, file_size))]
+        seeder = SwarmSeeder(file_size, len(socks))
+        addresses = [__get_peer_address(sock) for sock in socks]
+        swarm_id = secrets.token_hex(16)
+        results = [False] * len(socks)
+
+        def seed(receiver_index: int):
+            # An address only reachable from this host is of no use to a server elsewhere
+            is_on_this_host = __is_on_this_host(addresses[receiver_index])
+            peer_addresses = [address for peer_index, address in enumerate(addresses)
+                              if peer_index != receiver_index and (is_on_this_host or not __is_on_this_host(address))]
+            args = [os.path.basename(file_path), str(file_size), swarm_id, json.dumps(peer_addresses),
+                    str(int(content_key is not None))]
+            results[receiver_index] = __seed_swarm(socks[receiver_index], receiver_index, read_piece, args,
+                                                   piece_hashes, seeder, options, content_key)
+
+        threads = [threading.Thread(target=seed, args=[receiver_index]) for receiver_index in range(len(socks))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return results
+
+
+def receive_swarm(sock: socket.socket, swarm_transfer: SwarmTransfer) -> bool:
+    """Accepts a file announced in a SEND_SWARM request. Pieces are seeded over this connection while a thread per
+    peer fetches the rest, and the file is committed once the sender ends the swarm.
+
+    Args:
+        sock (socket.socket): The socket connected to the sending client.
+        swarm_transfer (SwarmTransfer): The transfer.
+
+    Returns:
+        bool: False if the connection can't be used any further; True otherwise.
+    """
+
+    incoming_file = swarm_transfer.incoming_file
+    try:
+        framing.send_frame(sock, FrameType.RESPONSE, ServerResponse(bool_res=True).to_bytes())
+        if swarm_transfer.encrypt:
+            if (key := transfer_helpers.recv_transfer_key(sock)) is None:
+                incoming_file.discard()
+                return False
+            swarm_transfer.key = key
+        if not __receive_swarm_manifest(sock, swarm_transfer):
+            incoming_file.discard()
+            return False
+        fetchers = [threading.Thread(target=__fetch_swarm_pieces, args=[swarm_transfer, peer_index])
+                    for peer_index in range(len(swarm_transfer.peer_addresses))]
+        for fetcher in fetchers:
+            fetcher.start()
+        try:
+            is_ended = __receive_seeded_pieces(sock, swarm_transfer)
+        finally:
+            swarm_transfer.end()
+            for fetcher in fetchers:
+                fetcher.join()
+        if not is_ended:
+            incoming_file.discard()
+            return False
+        if not swarm_transfer.is_complete():
+            incoming_file.discard()
+            return transfer_helpers.send_res(sock, ServerResponse(bool_res=False))
+        incoming_file.commit()
+    except (OSError, exceptions.MalformedFrameException, exceptions.UnexpectedFileSizeException):
+        incoming_file.discard()
+        return False
+    return transfer_helpers.send_res(sock, ServerResponse(bool_res=True))
+
+
+def serve_swarm_pieces(sock: socket.socket, swarm_transfer: SwarmTransfer,
+                       bucket: Optional[TokenBucket] = None) -> bool:
+    """Serves the pieces this server has to another server in the same swarm until the swarm ends.
+
+    Args:
+        sock (socket.socket): The socket connected to the other server.
+        swarm_transfer (SwarmTransfer): The transfer whose pieces are served.
+        bucket (Optional[TokenBucket], optional): Caps the pieces served. Defaults to None.
+
+    Returns:
+        bool: True if the swarm ended; False if the other server disconnected first.
+    """
+
+    header = memoryview(bytearray(framing.FRAME_HEADER.size))
+    want = memoryview(bytearray(merkle.LEAF_INDEX.size))
+    try:
+        framing.send_frame(sock, FrameType.RESPONSE, ServerResponse(bool_res=True).to_bytes())
+        while not swarm_transfer.is_ended():
+            readable, _, _ = select.select([sock], [], [], constants.SWARM_POLL_INTERVAL_SECONDS)
+            if not readable:
+                continue
+            if (frame := framing.recv_frame_header(sock, header)) is None:
+                return False
+            frame_type, payload_length = frame
+            if frame_type == FrameType.BITFIELD and payload_length == 0:
+                framing.send_frame(sock, FrameType.BITFIELD, swarm_transfer.get_bitfield())
+            elif frame_type == FrameType.WANT and payload_length == len(want):
+                if not framing.recv_exact_into(sock, want):
+                    return False
+                data = swarm_transfer.read_piece(merkle.LEAF_INDEX.unpack(want)[0]) or b""
+                if bucket is not None:
+                    bucket.consume(len(data))
+                __send_piece(sock, bytes(want), data)
+            else:
+                raise exceptions.MalformedFrameException(f"Unexpected {frame_type.name} frame while serving a swarm")
+    except (OSError, exceptions.MalformedFrameException):
+        return False
+    return True
+
+
+def __seed_swarm(sock: socket.socket, receiver_index: int, read_piece: Callable[[int, int], bytes], args: List[str],
+                 piece_hashes: List[bytes], seeder: SwarmSeeder, options: TransferOptions,
+                 content_key: Optional[bytes]) -> bool:
+    report = {}
+    reporter = threading.Thread(target=__receive_swarm_reports, args=[sock, receiver_index, seeder, report])
+    try:
+        req = ClientRequest(ClientRequestType.SEND_SWARM, args)
+        if (res := transfer_helpers.send_req(sock, req, cancelled=options.cancelled)) is None or not res.bool_res:
+            seeder.fail(receiver_index)
+            return False
+        if content_key is not None and transfer_helpers.send_transfer_key(sock, options, content_key) is None:
+            seeder.fail(receiver_index)
+            return False
+        transfer_helpers.send_manifest(sock, piece_hashes)
+        reporter.start()
+        while (piece_index := seeder.next_piece(receiver_index)) is not None:
+            if options.cancelled is not None and options.cancelled.is_set():
+                raise exceptions.TransferCancelledException()
+            data = read_piece(*seeder.get_piece(piece_index))
+            if options.bucket is not None:
+                options.bucket.consume(len(data))
+            __send_piece(sock, merkle.LEAF_INDEX.pack(piece_index), data)
+        if "result" in report:
+            # The server dropped out, which is why there was nothing left to seed to it
+            return False
+        framing.send_frame(sock, FrameType.END)
+    except (OSError, exceptions.MalformedFrameException, exceptions.TransferCancelledException):
+        seeder.fail(receiver_index)
+        transfer_helpers.abort(sock)
+        return False
+    finally:
+        if reporter.is_alive():
+            reporter.join()
+    return report.get("result", False)
+
+
+def __receive_swarm_reports(sock: socket.socket, receiver_index: int, seeder: SwarmSeeder, report: Dict[str, bool]):
+    """Takes in the HAVE and NACK frames of a server until it responds to the end of the swarm.
+    """
+
+    header = memoryview(bytearray(framing.FRAME_HEADER.size))
+    piece_index = memoryview(bytearray(merkle.LEAF_INDEX.size))
+    try:
+        while (frame := framing.recv_frame_header(sock, header)) is not None:
+            frame_type, payload_length = frame
+            if frame_type == FrameType.RESPONSE and payload_length <= constants.MAX_CONTROL_FRAME_SIZE:
+                payload = memoryview(bytearray(payload_length))
+                if framing.recv_exact_into(sock, payload):
+                    report["result"] = ServerResponse.from_bytes(bytes(payload)).bool_res
+                break
+            if frame_type not in [FrameType.HAVE, FrameType.NACK] or payload_length != len(piece_index) or \
+                    not framing.recv_exact_into(sock, piece_index):
+                break
+            if not 0 <= (index := merkle.LEAF_INDEX.unpack(piece_index)[0]) < seeder.num_pieces:
+                break
+            if frame_type == FrameType.HAVE:
+                seeder.add_piece(receiver_index, index)
+            else:
+                seeder.reject_piece(receiver_index, index)
+    except (OSError, ValueError, exceptions.MalformedFrameException, exceptions.MissingFieldsException):
+        pass
+    report.setdefault("result", False)
+    # Nothing more is heard from a server that stopped reporting => the other servers can't count on its pieces
+    seeder.fail(receiver_index)
+
+
+def __receive_swarm_manifest(sock: socket.socket, swarm_transfer: SwarmTransfer) -> bool:
+    if (piece_hashes := transfer_helpers.recv_manifest(sock, swarm_transfer.num_pieces)) is None:
+        return False
+    for piece_index, piece_hash in enumerate(piece_hashes):
+        swarm_transfer.set_piece_hash(piece_index, piece_hash)
+    return True
+
+
+def __receive_seeded_pieces(sock: socket.socket, swarm_transfer: SwarmTransfer) -> bool:
+    header = memoryview(bytearray(framing.FRAME_HEADER.size))
+    buffer = memoryview(bytearray(merkle.LEAF_INDEX.size + constants.MERKLE_LEAF_SIZE + encryption.TAG_SIZE))
+    while (piece := __recv_piece(sock, header, buffer, FrameType.END)) is not None:
+        if piece == FrameType.END:
+            return True
+        piece_index, data = piece
+        if not data or not swarm_transfer.write_piece(piece_index, data):
+            swarm_transfer.send_to_sender(FrameType.NACK, merkle.LEAF_INDEX.pack(piece_index))
+    return False
+
+
+def __fetch_swarm_pieces(swarm_transfer: SwarmTransfer, peer_index: int):
+    """Fetches the pieces this server lacks from one peer, rarest first, until the swarm ends.
+    """
+
+    header = memoryview(bytearray(framing.FRAME_HEADER.size))
+    buffer = memoryview(bytearray(merkle.LEAF_INDEX.size + constants.MERKLE_LEAF_SIZE + encryption.TAG_SIZE))
+    address = swarm_transfer.peer_addresses[peer_index]
+    while not swarm_transfer.is_ended() and not swarm_transfer.is_complete():
+        try:
+            with transfer_helpers.connect_to_server(address) as peer_sock:
+                req = ClientRequest(ClientRequestType.FETCH_SWARM_PIECES, [swarm_transfer.swarm_id])
+                if (res := transfer_helpers.send_req(peer_sock, req)) is not None and res.bool_res:
+                    __fetch_swarm_pieces_from(peer_sock, swarm_transfer, peer_index, header, buffer)
+        except (OSError, exceptions.MalformedFrameException):
+            # The peer went away => it may still come back while the swarm lasts
+            pass
+        swarm_transfer.wait_until_ended(constants.SWARM_PEER_RETRY_SECONDS)
+
+
+def __fetch_swarm_pieces_from(peer_sock: socket.socket, swarm_transfer: SwarmTransfer, peer_index: int,
+                              header: memoryview, buffer: memoryview):
+    bitfield = b""
+    while not swarm_transfer.is_ended() and not swarm_transfer.is_complete():
+        if (piece_index := swarm_transfer.claim_piece(peer_index, bitfield)) is None:
+            # Ask again which pieces the peer has only once none of those it had is left to fetch
+            if bitfield and swarm_transfer.wait_until_ended(constants.SWARM_POLL_INTERVAL_SECONDS):
+                return
+            framing.send_frame(peer_sock, FrameType.BITFIELD)
+            if (bitfield := framing.recv_frame(peer_sock, FrameType.BITFIELD)) is None:
+                return
+            continue
+        try:
+            framing.send_frame(peer_sock, FrameType.WANT, merkle.LEAF_INDEX.pack(piece_index))
+            if (piece := __recv_piece(peer_sock, header, buffer)) is None:
+                return
+            if piece[0] != piece_index:
+                raise exceptions.MalformedFrameException(f"Expected piece {piece_index} but received {piece[0]}")
+            # A corrupt piece is simply fetched again, from this or another peer
+            if piece[1]:
+                swarm_transfer.write_piece(piece_index, piece[1])
+        finally:
+            swarm_transfer.release_piece(piece_index)
+
+
+def __recv_piece(sock: socket.socket, header: memoryview, buffer: memoryview,
+                 end_type: Optional[FrameType] = None) -> Optional[Union[Tuple[int, memoryview], FrameType]]:
+    """Receives a PIECE frame into a reusable buffer.
+
+    Returns:
+        Optional[Union[Tuple[int, memoryview], FrameType]]: The index and data of the piece, which is empty if the peer
+            doesn't have it; `end_type` if that arrived instead; or None if the connection was closed first.
+    """
+
+    if (frame := framing.recv_frame_header(sock, header)) is None:
+        return None
+    frame_type, payload_length = frame
+    if frame_type == end_type and payload_length == 0:
+        return end_type
+    if frame_type != FrameType.PIECE or not merkle.LEAF_INDEX.size <= payload_length <= len(buffer):
+        raise exceptions.MalformedFrameException(f"Unexpected {frame_type.name} frame while receiving pieces")
+    if not framing.recv_exact_into(sock, buffer[:payload_length]):
+        return None
+    piece_index = merkle.LEAF_INDEX.unpack_from(buffer)[0]
+    return piece_index, buffer[merkle.LEAF_INDEX.size:payload_length]
+
+
+def __send_piece(sock: socket.socket, piece_index: bytes, data: bytes):
+    framing.send_frame_header(sock, FrameType.PIECE, len(piece_index) + len(data))
+    sock.sendall(piece_index, framing.MSG_MORE)
+    sock.sendall(data)
+
+
+def __get_peer_address(sock: socket.socket) -> PeerAddress:
+    address = sock.getpeername()
+    return address if isinstance(address, str) else (address[0], address[1])
+
+
+def __is_on_this_host(address: PeerAddress) -> bool:
+    return isinstance(address, str) or ipaddress.ip_address(address[0]).is_loopback
+
+
+def __read_piece(f: BinaryIO, start: int, end: int) -> bytes:
+    if len(data := os.pread(f.fileno(), end - start, start)) != end - start:
+        raise ConnectionError(f"File shrank while it was being sent: {f.name}")
+    return data
+
+
+def __seal_piece(f: BinaryIO, key: bytes, start: int, end: int) -> bytes:
+    return bytes(encryption.seal_chunk(key, start, __read_piece(f, start, end)))
+
+
+def __hash_sealed_piece(seal_piece: Callable[[int, int], bytes], start: int, end: int) -> bytes:
+    hasher = merkle.create_leaf_hasher()
+    hasher.update(seal_piece(start, end))
+    return hasher.digest()
+
+
+def __spool_sealed_pieces(seal_piece: Callable[[int, int], bytes], spool: BinaryIO) -> Callable[[int, int], bytes]:
+    """Makes a function that seals each piece the first time it's asked for and writes it to a spool, from which it's
+    read every time after that.
+    """
+
+    spooled_starts: Set[int] = set()
+
+    def read_sealed_piece(start: int, end: int) -> bytes:
+        # Each piece is followed by its tag in the spool
+        position = start + start // constants.MERKLE_LEAF_SIZE * encryption.TAG_SIZE
+        if start in spooled_starts:
+            return os.pread(spool.fileno(), end - start + encryption.TAG_SIZE, position)
+        data = seal_piece(start, end)
+        os.pwrite(spool.fileno(), data, position)
+        spooled_starts.add(start)
+        return data
+
+    return read_sealed_piece
@@ -0,0 +1,630 @@
+import hashlib
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from Crypto.Random import get_random_bytes
+
+from secure_drop import constants, crypto, exceptions
+from secure_drop.networking import encryption, framing, merkle, socket_tuning, sparse
+from secure_drop.networking.ChunkSizer import ChunkSizer
+from secure_drop.networking.ChunkVerifier import ChunkVerifier
+from secure_drop.networking.framing import FrameType
+from secure_drop.networking.messages.ClientRequest import (ClientRequest,
+                                                           ClientRequestType)
+from secure_drop.networking.messages.ServerResponse import ServerResponse
+from secure_drop.networking.SwarmTransfer import PeerAddress
+from secure_drop.networking.TokenBucket import TokenBucket
+from secure_drop.networking.TransferOptions import TransferMode, TransferOptions
+from secure_drop.singletons.BandwidthManager import BandwidthManager, Direction
+from secure_drop.singletons.ChunkCache import ChunkCache
+
+# Receivers acknowledge file chunks with a cumulative chunk count
+ACK = struct.Struct("!Q")
+# The chunk cache keeps the hashes of leaves under this kind; compressed chunks are kept under the compression used
+__LEAF_HASH_CACHE_KIND = "leaf_hash"
+# Content keys are kept in the chunk cache under this kind followed by the size of the chunks they seal
+__CONTENT_KEY_CACHE_KIND = "content_key"
+
+# How long a server has to answer each type of request before it's given up on, which callers may change. Requests of
+# any other type start transfers and are given constants.TRANSFER_REQUEST_TIMEOUT_SECONDS. Asking for consent waits on
+# the server's user, who the server gives a while to answer.
+REQUEST_TIMEOUTS_SECONDS: Dict[ClientRequestType, float] = {
+    ClientRequestType.PING: constants.PING_TIMEOUT_SECONDS,
+    ClientRequestType.EMAIL: constants.CONTROL_REQUEST_TIMEOUT_SECONDS,
+    ClientRequestType.HAS_ADDED: constants.CONTROL_REQUEST_TIMEOUT_SECONDS,
+    ClientRequestType.SEND_FILE_CONSENT: constants.SEND_FILE_CONSENT_TIMEOUT_SECONDS +
+    constants.CONTROL_REQUEST_TIMEOUT_SECONDS,
+}
+
+
+def connect_to_server(address: PeerAddress, timeout: float = constants.CONNECT_TIMEOUT_SECONDS) -> socket.socket:
+    """Opens an extra connection to another instance's server, such as for a single transfer or for a swarm peer.
+
+    Args:
+        address (PeerAddress): The address of the server, or the path of its Unix domain socket on this host.
+        timeout (float, optional): How long to wait for the connection, in seconds. Defaults to
+            constants.CONNECT_TIMEOUT_SECONDS.
+
+    Raises:
+        OSError: Raised if the server can't be reached in time.
+
+    Returns:
+        socket.socket: The connected, blocking socket.
+    """
+
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+    else:
+        sock = socket.create_connection(address, timeout)
+    sock.settimeout(None)
+    socket_tuning.tune_bulk_connection(sock)
+    return sock
+
+
+def abort(sock: socket.socket):
+    """Hangs up in the middle of a transfer, which leaves the connection unusable.
+    """
+
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # The server has already gone away
+        pass
+
+
+def create_chunk_sizer(options: TransferOptions) -> Optional[ChunkSizer]:
+    # A stop-and-wait transfer deliberately sends one chunk of a fixed size per round trip, and sendfile already sends
+    # chunks as large as chunks get
+    if options.mode != TransferMode.PIPELINED or options.uses_zero_copy():
+        return None
+    return ChunkSizer(options.window_size)
+
+
+def get_file_key(file_path: str, file_stat: os.stat_result, options: TransferOptions) -> Optional[str]:
+    return ChunkCache.get_file_key(file_path, file_stat) if options.chunk_cache is not None else None
+
+
+def cache_leaf_hashes(hash_leaf: Callable[[int, int], bytes], options: TransferOptions, file_key: Optional[str],
+                      kind: str = __LEAF_HASH_CACHE_KIND) -> Callable[[int, int], bytes]:
+    """Makes a function that hashes leaves go through the options' chunk cache, if any.
+    """
+
+    if options.chunk_cache is None or file_key is None:
+        return hash_leaf
+    chunk_cache = options.chunk_cache
+
+    def hash_cached_leaf(start: int, end: int) -> bytes:
+        if start % constants.MERKLE_LEAF_SIZE != 0:
+            return hash_leaf(start, end)
+        leaf_index = start // constants.MERKLE_LEAF_SIZE
+        if (leaf_hash := chunk_cache.get(file_key, kind, leaf_index)) is None:
+            leaf_hash = hash_leaf(start, end)
+            chunk_cache.put(file_key, kind, leaf_index, leaf_hash)
+        return leaf_hash
+
+    return hash_cached_leaf
+
+
+def cache_sealed_chunks(seal_chunk: Callable[[int, int], bytes], options: TransferOptions, file_key: Optional[str],
+                        key: bytes, chunk_size: int) -> Callable[[int, int], bytes]:
+    """Makes a function that seals chunks of a given size under a key go through the options' chunk cache, if any.
+    """
+
+    if options.chunk_cache is None or file_key is None:
+        return seal_chunk
+    chunk_cache = options.chunk_cache
+    kind = get_sealed_cache_kind(key, chunk_size)
+
+    def seal_cached_chunk(start: int, end: int) -> bytes:
+        if start % chunk_size != 0:
+            return seal_chunk(start, end)
+        chunk_index = start // chunk_size
+        if (sealed := chunk_cache.get(file_key, kind, chunk_index)) is None or \
+                len(sealed) != end - start + encryption.TAG_SIZE:
+            sealed = seal_chunk(start, end)
+            chunk_cache.put(file_key, kind, chunk_index, sealed)
+        return sealed
+
+    return seal_cached_chunk
+
+
+def get_content_key(file_stat: os.stat_result, options: TransferOptions, file_key: Optional[str],
+                    chunk_size: int) -> Optional[bytes]:
+    """Gets the key that a file's chunks of a given size are sealed under every time it's sent, so that they can be
+    cached sealed. The key is kept in the options' chunk cache, which holds what it seals in the clear anyway when the
+    file is compressed. A file gets a key per chunk size, since chunks of different sizes start at the same positions,
+    which are their nonces.
+
+    Returns:
+        Optional[bytes]: The key, or None if the options have no chunk cache or the file was modified too recently.
+    """
+
+    if options.chunk_cache is None or file_key is None or \
+            time.time() - file_stat.st_mtime < constants.CONTENT_KEY_MIN_FILE_AGE_SECONDS:
+        return None
+    kind = f"{__CONTENT_KEY_CACHE_KIND}_{chunk_size}"
+    if (key := options.chunk_cache.get(file_key, kind, 0)) is None or len(key) != constants.TRANSFER_KEY_SIZE:
+        key = get_random_bytes(constants.TRANSFER_KEY_SIZE)
+        options.chunk_cache.put(file_key, kind, 0, key)
+    return key
+
+
+def get_sealed_cache_kind(key: bytes, chunk_size: int) -> str:
+    """Gets the kind that the chunk cache keeps chunks of a given size under once they are sealed under a key, which
+    tells them apart from chunks sealed under a key that was since replaced.
+    """
+
+    return f"sealed_{chunk_size}_{hashlib.sha256(key).hexdigest()[:16]}"
+
+
+def send_chunks(sock: socket.socket, f: BinaryIO, offset: int, file_size: int, options: TransferOptions):
+    sizer = create_chunk_sizer(options)
+    send_frames(sock, send_range(sock, f, offset, file_size, options, sizer), options, sizer=sizer)
+
+
+def send_range(sock: socket.socket, f: BinaryIO, start: int, end: int, options: TransferOptions,
+               sizer: Optional[ChunkSizer]) -> Iterator[int]:
+    """Sends a byte range of the file the way the options ask for. Yields after every frame sent.
+    """
+
+    if options.uses_sparse():
+        return __send_sparse_chunks(sock, f, start, end, options.uses_zero_copy(), sizer)
+    if options.uses_zero_copy():
+        return send_zero_copy_chunks(sock, f, start, end)
+    return send_buffered_chunks(sock, f, start, end, sizer)
+
+
+def __send_sparse_chunks(sock: socket.socket, f: BinaryIO, start: int, end: int, zero_copy: bool,
+                         sizer: Optional[ChunkSizer]) -> Iterator[int]:
+    """Sends the data of a byte range as DATA frames and its holes as HOLE frames. Yields after every frame sent.
+    """
+
+    for extent_start, extent_end, is_data in sparse.get_extents(f, start, end):
+        if is_data and zero_copy:
+            yield from send_zero_copy_chunks(sock, f, extent_start, extent_end)
+        elif is_data:
+            yield from send_buffered_chunks(sock, f, extent_start, extent_end, sizer)
+        else:
+            framing.send_frame(sock, FrameType.HOLE, sparse.HOLE.pack(extent_end - extent_start))
+            yield 0
+
+
+def send_manifest(sock: socket.socket, leaf_hashes: List[bytes]):
+    """Sends the hash of every leaf followed by their root, for transfers whose pieces arrive out of order.
+    """
+
+    for leaf_index, leaf_hash in enumerate(leaf_hashes):
+        framing.send_frame(sock, FrameType.HASH, merkle.LEAF_HASH.pack(leaf_index, leaf_hash), corked=True)
+    framing.send_frame(sock, FrameType.ROOT, merkle.get_root(leaf_hashes))
+
+
+def recv_manifest(sock: socket.socket, num_leaves: int) -> Optional[List[bytes]]:
+    """Receives a manifest sent with `send_manifest`.
+
+    Raises:
+        exceptions.MalformedFrameException: Raised if the hashes don't match the root.
+
+    Returns:
+        Optional[List[bytes]]: The hash of every leaf, or None if the sender disconnected first.
+    """
+
+    leaf_hashes: List[Optional[bytes]] = [None] * num_leaves
+    for _ in range(num_leaves):
+        if (payload := framing.recv_frame(sock, FrameType.HASH)) is None:
+            return None
+        if len(payload) != merkle.LEAF_HASH.size:
+            raise exceptions.MalformedFrameException("Malformed HASH frame")
+        leaf_index, leaf_hash = merkle.LEAF_HASH.unpack(payload)
+        if not 0 <= leaf_index < num_leaves:
+            raise exceptions.MalformedFrameException(f"Received the hash of an unknown leaf: {leaf_index}")
+        leaf_hashes[leaf_index] = leaf_hash
+    if (root := framing.recv_frame(sock, FrameType.ROOT)) is None:
+        return None
+    if None in leaf_hashes or root != merkle.get_root(leaf_hashes):
+        raise exceptions.MalformedFrameException("The manifest doesn't match its root")
+    return leaf_hashes
+
+
+def send_transfer_key(sock: socket.socket, options: TransferOptions, key: Optional[bytes] = None) -> Optional[bytes]:
+    """Wraps the key of an encrypted transfer with the public key the receiver sent, once it passes the options'
+    `check_public_key`.
+
+    Returns:
+        Optional[bytes]: The key, which is `key` if given, or None if the receiver disconnected first or its public key
+            was refused.
+    """
+
+    if (public_key_pem := framing.recv_frame(sock, FrameType.KEY)) is None:
+        return None
+    if options.check_public_key is not None and not options.check_public_key(sock, bytes(public_key_pem)):
+        # The receiver may be someone posing as the contact => nothing is sent to it
+        abort(sock)
+        return None
+    if key is None:
+        key = get_random_bytes(constants.TRANSFER_KEY_SIZE)
+    try:
+        wrapped_key = crypto.wrap_key(key, bytes(public_key_pem))
+    except ValueError:
+        raise exceptions.MalformedFrameException("Malformed public key")
+    framing.send_frame(sock, FrameType.KEY, wrapped_key)
+    return key
+
+
+def recv_transfer_key(sock: socket.socket) -> Optional[bytes]:
+    """Sends the receiver's public key and unwraps the transfer key the sender answers with.
+
+    Returns:
+        Optional[bytes]: The transfer key, or None if the sender disconnected first.
+    """
+
+    framing.send_frame(sock, FrameType.KEY, crypto.get_public_key_pem())
+    if (wrapped_key := framing.recv_frame(sock, FrameType.KEY)) is None:
+        return None
+    try:
+        key = crypto.decrypt_RSA(bytes(wrapped_key))
+    except ValueError:
+        raise exceptions.MalformedFrameException("Unable to unwrap the transfer key")
+    if len(key) != constants.TRANSFER_KEY_SIZE:
+        raise exceptions.MalformedFrameException("Malformed transfer key")
+    return key
+
+
+def send_fresh_key(sock: socket.socket, options: TransferOptions) -> Optional[bytes]:
+    """Exchanges a key of a transfer's own, such as for one whose frames are sealed one by one, if the options ask
+    for encryption.
+
+    Raises:
+        ConnectionError: Raised if the receiver disconnected first or its public key was refused.
+    """
+
+    if not options.encrypt:
+        return None
+    if (key := send_transfer_key(sock, options)) is None:
+        raise ConnectionError("Connection closed while exchanging the transfer key")
+    return key
+
+
+def send_sealed_data(sock: socket.socket, data: bytes, sealer: Optional[encryption.FrameSealer]) -> Iterator[int]:
+    """Sends data as a DATA frame, or as many sealed ones if `sealer` is given. Yields after every frame sent.
+    """
+
+    if sealer is None:
+        framing.send_frame(sock, FrameType.DATA, data)
+        yield len(data)
+        return
+    view = memoryview(data)
+    for start in range(0, len(view), encryption.MAX_SEALED_FRAME_DATA_SIZE):
+        piece = view[start:start + encryption.MAX_SEALED_FRAME_DATA_SIZE]
+        framing.send_frame(sock, FrameType.DATA, sealer.seal(piece))
+        yield len(piece)
+
+
+def open_sealed_frames(key: bytes, write: Callable[[memoryview], None],
+                       handlers: Optional[Dict[FrameType, Callable[[memoryview], None]]]
+                       ) -> Tuple[Callable[[memoryview], None], Dict[FrameType, Callable[[memoryview], None]]]:
+    """Wraps the write function and handlers of a transfer whose frames are sealed one by one. Every sealed frame
+    fits into a control frame, so DATA frames are received whole by a handler too.
+
+    Returns:
+        Tuple[Callable[[memoryview], None], Dict[FrameType, Callable[[memoryview], None]]]: The write function, which
+            refuses DATA frames too large to be sealed, and the handlers, which open each frame before handling it.
+    """
+
+    opener = encryption.FrameSealer(key, encryption.TO_RECEIVER)
+
+    def open_with(handler: Callable[[memoryview], None]) -> Callable[[memoryview], None]:
+        return lambda payload: handler(opener.open(payload))
+
+    def refuse(_: memoryview):
+        raise exceptions.MalformedFrameException("Sealed frame is too large")
+
+    sealed_handlers = {frame_type: open_with(handler) for frame_type, handler in (handlers or {}).items()}
+    sealed_handlers[FrameType.DATA] = open_with(write)
+    return refuse, sealed_handlers
+
+
+def send_frames(sock: socket.socket, frames: Iterator[int], options: TransferOptions,
+                repair: Optional[Callable[[memoryview], None]] = None, sizer: Optional[ChunkSizer] = None):
+    """Drives a generator that sends a frame each time it's advanced, keeping at most a window of frames
+    unacknowledged, and ends the file with an END frame. NACK frames are handed to `repair`, if given.
+    """
+
+    header = memoryview(bytearray(framing.FRAME_HEADER.size))
+    ack = memoryview(bytearray(ACK.size))
+    num_chunks_sent = 0
+    num_chunks_acked = 0
+    for num_bytes_sent in frames:
+        num_chunks_sent += 1
+        if options.cancelled is not None and options.cancelled.is_set():
+            raise exceptions.TransferCancelledException()
+        if options.bucket is not None:
+            options.bucket.consume(num_bytes_sent)
+        if sizer is not None:
+            sizer.on_sent(num_bytes_sent)
+        while num_chunks_sent - num_chunks_acked >= options.window_size:
+            __wait_for_ack(sock, options)
+            num_chunks_acked = __recv_ack(sock, header, ack, repair)
+            if sizer is not None:
+                sizer.on_acked(num_chunks_acked)
+    framing.send_frame(sock, FrameType.END)
+    # The final acknowledgement confirms that every chunk has been written. It also counts the END frame, which
+    # tells it apart from a periodic acknowledgement of the last chunk.
+    while num_chunks_acked <= num_chunks_sent:
+        __wait_for_ack(sock, options)
+        num_chunks_acked = __recv_ack(sock, header, ack, repair)
+
+
+def __wait_for_ack(sock: socket.socket, options: TransferOptions):
+    if options.cancelled is None:
+        return
+    timeout = sock.gettimeout()
+    __wait_until_readable(sock, time.monotonic() + timeout if timeout is not None else None, options.cancelled)
+
+
+def send_buffered_chunks(sock: socket.socket, f: BinaryIO, offset: int, file_size: int,
+                         sizer: Optional[ChunkSizer] = None) -> Iterator[int]:
+    """Sends each chunk through a reusable buffer behind its frame header. Yields after every chunk sent.
+    """
+
+    header_size = framing.FRAME_HEADER.size
+    buffer = memoryview(bytearray(header_size + constants.FILE_CHUNK_SIZE))
+    f.seek(offset)
+    remaining = file_size - offset
+    while remaining > 0:
+        chunk_size = sizer.chunk_size if sizer is not None else constants.FILE_CHUNK_SIZE
+        if len(buffer) < header_size + chunk_size:
+            buffer = memoryview(bytearray(header_size + chunk_size))
+        if (num_bytes_read := f.readinto(buffer[header_size:header_size + min(remaining, chunk_size)])) == 0:
+            raise ConnectionError(f"File shrank while it was being sent: {f.name}")
+        framing.FRAME_HEADER.pack_into(buffer, 0, FrameType.DATA.value, num_bytes_read)
+        sock.sendall(buffer[:header_size + num_bytes_read])
+        remaining -= num_bytes_read
+        yield num_bytes_read
+
+
+def send_encrypted_chunks(sock: socket.socket, f: BinaryIO, offset: int, file_size: int, key: bytes,
+                          read_encrypted_chunk: Optional[Callable[[int], Optional[memoryview]]] = None,
+                          chunk_cache: Optional[ChunkCache] = None, file_key: Optional[str] = None) -> Iterator[int]:
+    """Seals each chunk with AES-GCM on a background thread while the previous one is sent, unless the shared reads
+    or the chunk cache already have it sealed. Yields after every chunk sent.
+    """
+
+    header_size = framing.FRAME_HEADER.size
+    buffers = [memoryview(bytearray(header_size + constants.ENCRYPTION_CHUNK_SIZE + encryption.TAG_SIZE))
+               for _ in range(2)]
+    num_chunks = encryption.get_num_chunks(offset, file_size)
+    kind = get_sealed_cache_kind(key, constants.ENCRYPTION_CHUNK_SIZE)
+
+    def seal(chunk_index: int) -> memoryview:
+        buffer = buffers[chunk_index % 2]
+        chunk_size = encryption.get_chunk_size(offset, file_size, chunk_index)
+        position = encryption.get_chunk_position(offset, chunk_index)
+        # The chunks of a resumed transfer may not start where the cached ones do
+        cache_index = position // constants.ENCRYPTION_CHUNK_SIZE \
+            if chunk_cache is not None and file_key is not None and position % constants.ENCRYPTION_CHUNK_SIZE == 0 \
+            else None
+        encrypted_chunk = read_encrypted_chunk(position) if read_encrypted_chunk is not None else None
+        if encrypted_chunk is None and cache_index is not None:
+            encrypted_chunk = chunk_cache.get(file_key, kind, cache_index)
+        if encrypted_chunk is not None and len(encrypted_chunk) == chunk_size + encryption.TAG_SIZE:
+            buffer[header_size:header_size + len(encrypted_chunk)] = encrypted_chunk
+            # Later chunks that aren't covered by the shared reads are read from where this one ends
+            f.seek(position + chunk_size)
+        else:
+            if f.readinto(buffer[header_size:header_size + chunk_size]) != chunk_size:
+                raise ConnectionError(f"File shrank while it was being sent: {f.name}")
+            encryption.encrypt_chunk(key, position, buffer[header_size:header_size + chunk_size + encryption.TAG_SIZE])
+            if cache_index is not None:
+                chunk_cache.put(file_key, kind, cache_index,
+                                bytes(buffer[header_size:header_size + chunk_size + encryption.TAG_SIZE]))
+        framing.FRAME_HEADER.pack_into(buffer, 0, FrameType.DATA.value, chunk_size + encryption.TAG_SIZE)
+        return buffer[:header_size + chunk_size + encryption.TAG_SIZE]
+
+    f.seek(offset)
+    with ThreadPoolExecutor(1, thread_name_prefix="Encryption") as executor:
+        sealing = executor.submit(seal, 0) if num_chunks > 0 else None
+        for chunk_index in range(num_chunks):
+            frame = sealing.result()
+            # The other buffer is free again => seal the next chunk into it while this one is sent
+            if chunk_index + 1 < num_chunks:
+                sealing = executor.submit(seal, chunk_index + 1)
+            sock.sendall(frame)
+            yield len(frame) - header_size - encryption.TAG_SIZE
+
+
+def send_zero_copy_chunks(sock: socket.socket, f: BinaryIO, offset: int, file_size: int) -> Iterator[int]:
+    """Sends the file with sendfile. Yields after every chunk sent.
+    """
+
+    while offset < file_size:
+        chunk_size = min(constants.ZERO_COPY_CHUNK_SIZE, file_size - offset)
+        framing.send_frame_header(sock, FrameType.DATA, chunk_size)
+        if sock.sendfile(f, offset, chunk_size) != chunk_size:
+            raise ConnectionError(f"File shrank while it was being sent: {f.name}")
+        offset += chunk_size
+        yield chunk_size
+
+
+def receive_chunks(sock: socket.socket, write: Callable[[memoryview], None], ack_interval: int,
+                   handlers: Optional[Dict[FrameType, Callable[[memoryview], None]]] = None,
+                   verifier: Optional[ChunkVerifier] = None, bucket: Optional[TokenBucket] = None) -> Optional[int]:
+    """Receives the frames sent by `send_frames` and acknowledges every `ack_interval` of them. The payloads of
+    other frame types are handed to the handler for their type. The final acknowledgement is left to the caller.
+
+    Returns:
+        Optional[int]: The number of chunks received, or None if the sender disconnected first.
+    """
+
+    header = memoryview(bytearray(framing.FRAME_HEADER.size))
+    ack = memoryview(bytearray(framing.FRAME_HEADER.size + ACK.size))
+    buffers = [memoryview(bytearray(constants.RECEIVE_BUFFER_SIZE // 2)) for _ in range(2)]
+    num_pieces_received = 0
+    if verifier is not None:
+        handlers = {**(handlers or {}), FrameType.HASH: verifier.check_leaf, FrameType.ROOT: verifier.set_root}
+    num_chunks_received = 0
+    is_end_received = False
+    while True:
+        if is_end_received and not verifier.has_pending_repairs():
+            return num_chunks_received
+        if (frame := framing.recv_frame_header(sock, header)) is None:
+            return None
+        frame_type, remaining = frame
+        if frame_type == FrameType.END:
+            # A verified transfer isn't over until every leaf that was requested again has arrived
+            is_end_received = True
+            if verifier is None:
+                return num_chunks_received
+            continue
+        if frame_type == FrameType.REPAIR and verifier is not None:
+            if not __receive_repair(sock, verifier, remaining):
+                return None
+            continue
+        if is_end_received:
+            raise exceptions.MalformedFrameException(f"Unexpected {frame_type.name} frame after the end of the file")
+        if handlers is not None and frame_type in handlers and remaining <= constants.MAX_CONTROL_FRAME_SIZE:
+            payload = memoryview(bytearray(remaining))
+            if not framing.recv_exact_into(sock, payload):
+                return None
+            handlers[frame_type](payload)
+            remaining = 0
+        elif frame_type != FrameType.DATA:
+            raise exceptions.MalformedFrameException(f"Unexpected {frame_type.name} frame during file transfer")
+        while remaining > 0:
+            buffer = buffers[num_pieces_received % 2]
+            num_bytes_received = sock.recv_into(buffer, min(remaining, len(buffer)))
+            if num_bytes_received == 0:
+                return None
+            write(buffer[:num_bytes_received])
+            remaining -= num_bytes_received
+            num_pieces_received += 1
+            if bucket is not None:
+                bucket.consume(num_bytes_received)
+        num_chunks_received += 1
+        if num_chunks_received % ack_interval == 0:
+            __send_ack(sock, ack, num_chunks_received)
+
+
+def __receive_repair(sock: socket.socket, verifier: ChunkVerifier, payload_length: int) -> bool:
+    if payload_length < merkle.LEAF_INDEX.size:
+        raise exceptions.MalformedFrameException("Malformed REPAIR frame")
+    # The receive buffers may still be being hashed => repairs, which are rare, get a buffer of their own
+    buffer = memoryview(bytearray(constants.RECEIVE_BUFFER_SIZE))
+    leaf_index = buffer[:merkle.LEAF_INDEX.size]
+    if not framing.recv_exact_into(sock, leaf_index):
+        return False
+    remaining = payload_length - len(leaf_index)
+    if verifier.start_repair(leaf_index) != remaining:
+        raise exceptions.MalformedFrameException("REPAIR frame doesn't match the size of its leaf")
+    while remaining > 0:
+        num_bytes_received = sock.recv_into(buffer, min(remaining, len(buffer)))
+        if num_bytes_received == 0:
+            return False
+        verifier.repair(buffer[:num_bytes_received])
+        remaining -= num_bytes_received
+    verifier.finish_repair()
+    return True
+
+
+def __send_ack(sock: socket.socket, ack: memoryview, num_chunks_received: int):
+    framing.FRAME_HEADER.pack_into(ack, 0, FrameType.ACK.value, ACK.size)
+    ACK.pack_into(ack, framing.FRAME_HEADER.size, num_chunks_received)
+    sock.sendall(ack)
+
+
+def send_final_ack(sock: socket.socket, num_chunks_received: int):
+    __send_ack(sock, memoryview(bytearray(framing.FRAME_HEADER.size + ACK.size)), num_chunks_received + 1)
+
+
+def __recv_ack(sock: socket.socket, header: memoryview, ack: memoryview,
+               repair: Optional[Callable[[memoryview], None]] = None) -> int:
+    if (frame := framing.recv_frame_header(sock, header)) is None:
+        raise ConnectionError("Connection closed while waiting for an acknowledgement")
+    while repair is not None and frame[0] == FrameType.NACK and frame[1] <= constants.MAX_CONTROL_FRAME_SIZE:
+        nack = memoryview(bytearray(frame[1]))
+        if not framing.recv_exact_into(sock, nack):
+            raise ConnectionError("Connection closed while waiting for an acknowledgement")
+        repair(nack)
+        if (frame := framing.recv_frame_header(sock, header)) is None:
+            raise ConnectionError("Connection closed while waiting for an acknowledgement")
+    if frame != (FrameType.ACK, ACK.size):
+        raise exceptions.MalformedFrameException(f"Expected an acknowledgement but received {frame[0].name}")
+    if not framing.recv_exact_into(sock, ack):
+        raise ConnectionError("Connection closed while waiting for an acknowledgement")
+    (num_chunks_acked,) = ACK.unpack_from(ack)
+    return num_chunks_acked
+
+
+def send_req(sock: socket.socket, req: ClientRequest, timeout: Optional[float] = None,
+             cancelled: Optional[threading.Event] = None) -> Optional[ServerResponse]:
+    """Sends a request and waits for the response for no longer than REQUEST_TIMEOUTS_SECONDS allows, unless
+    `timeout` is given. A late response would be taken for the next one, so the connection is shut down on timeout.
+
+    Raises:
+        socket.timeout: Raised if the server didn't answer in time.
+        exceptions.TransferCancelledException: Raised once the wait is cancelled.
+
+    Returns:
+        Optional[ServerResponse]: The response, or None if the server disconnected first.
+    """
+
+    if timeout is None:
+        timeout = REQUEST_TIMEOUTS_SECONDS.get(req.type, constants.TRANSFER_REQUEST_TIMEOUT_SECONDS)
+    deadline = time.monotonic() + timeout
+    previous_timeout = sock.gettimeout()
+    try:
+        payload = req.to_bytes()
+        sock.settimeout(timeout)
+        framing.send_frame(sock, FrameType.REQUEST, payload)
+        charge_control(len(payload), Direction.SEND)
+        __wait_until_readable(sock, deadline, cancelled)
+        # The rest of the response only gets whatever is left of the deadline
+        sock.settimeout(max(deadline - time.monotonic(), constants.CANCELLATION_POLL_INTERVAL_SECONDS))
+        if (payload := framing.recv_frame(sock, FrameType.RESPONSE)) is None:
+            return None
+    except (socket.timeout, exceptions.TransferCancelledException):
+        abort(sock)
+        raise
+    finally:
+        sock.settimeout(previous_timeout)
+    charge_control(len(payload), Direction.RECEIVE)
+    return ServerResponse.from_bytes(payload)
+
+
+def __wait_until_readable(sock: socket.socket, deadline: Optional[float], cancelled: Optional[threading.Event]):
+    while True:
+        if cancelled is not None and cancelled.is_set():
+            raise exceptions.TransferCancelledException()
+        wait = constants.CANCELLATION_POLL_INTERVAL_SECONDS if cancelled is not None else None
+        if deadline is not None:
+            if (remaining := deadline - time.monotonic()) <= 0:
+                raise socket.timeout("Timed out waiting for the other end")
+            wait = remaining if wait is None else min(wait, remaining)
+        readable, _, _ = select.select([sock], [], [], wait)
+        if readable:
+            return
+
+
+def send_res(sock: socket.socket, res: ServerResponse) -> bool:
+    try:
+        payload = res.to_bytes()
+        framing.send_frame(sock, FrameType.RESPONSE, payload)
+        charge_control(len(payload), Direction.SEND)
+        return True
+    except OSError:
+        return False
+
+
+def charge_control(num_bytes: int, direction: Direction):
+    BandwidthManager().charge_control(framing.FRAME_HEADER.size + num_bytes, direction)
@@ -0,0 +1,87 @@
+import threading
+from enum import Enum
+from typing import Dict, Optional, Tuple
+
+from secure_drop.networking.TokenBucket import TokenBucket
+
+
+class Direction(Enum):
+    SEND = "send"
+    RECEIVE = "receive"
+
+
+class BandwidthManager:
+    """A thread-safe singleton that holds the bandwidth caps. Each direction has a global token bucket, and each
+    contact with a cap of its own has a bucket per direction that passes every byte on to the global one. Caps are
+    changed on the existing buckets, so transfers that are already running follow the new caps right away.
+    """
+
+    _instance: Optional["BandwidthManager"] = None
+    _lock: threading.Lock = threading.Lock()
+    _global_buckets: Dict[Direction, TokenBucket] = {direction: TokenBucket() for direction in Direction}
+    _contact_buckets: Dict[Tuple[str, Direction], TokenBucket] = {}
+
+    def __new__(cls):
+        """This method definition makes the class a singleton.
+        """
+
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(BandwidthManager, cls).__new__(cls)
+            return cls._instance
+
+    def get_bucket(self, email: Optional[str], direction: Direction) -> TokenBucket:
+        """Gets the bucket that a transfer with a contact has to pass through.
+
+        Args:
+            email (Optional[str]): The email of the contact, or None if it isn't known.
+            direction (Direction): Whether the transfer sends or receives.
+
+        Returns:
+            TokenBucket: The contact's bucket, which also passes through the global bucket; or the global bucket if
+                the contact isn't known.
+        """
+
+        with self._lock:
+            if email is None:
+                return self._global_buckets[direction]
+            if (bucket := self._contact_buckets.get((email, direction))) is None:
+                # Every contact gets a bucket, so that a cap set later also applies to transfers already running
+                bucket = TokenBucket(parent=self._global_buckets[direction])
+                self._contact_buckets[(email, direction)] = bucket
+            return bucket
+
+    def set_limit(self, email: Optional[str], rate: Optional[float], direction: Optional[Direction] = None):
+        """Caps the bandwidth of a contact, or of all transfers together.
+
+        Args:
+            email (Optional[str]): The email of the contact, or None for the global cap.
+            rate (Optional[float]): The cap in bytes per second, or None to lift it.
+            direction (Optional[Direction], optional): The direction to cap. Defaults to None, which caps both.
+
+        Raises:
+            ValueError: Raised if the rate isn't positive.
+        """
+
+        for bucket_direction in [direction] if direction is not None else list(Direction):
+            self.get_bucket(email, bucket_direction).set_rate(rate)
+
+    def get_limits(self) -> Dict[Tuple[Optional[str], Direction], float]:
+        """Gets every cap that is in place.
+
+        Returns:
+            Dict[Tuple[Optional[str], Direction], float]: The caps in bytes per second, keyed by the email of the
+                contact, or None for the global caps, and the direction.
+        """
+
+        with self._lock:
+            buckets = {(None, direction): bucket for direction, bucket in self._global_buckets.items()}
+            buckets.update(self._contact_buckets)
+        return {key: rate for key, bucket in buckets.items() if (rate := bucket.get_rate()) is not None}
+
+    def charge_control(self, num_bytes: int, direction: Direction):
+        """Counts a control message against the global cap without holding it back, so that control traffic keeps
+        flowing while bulk data is capped.
+        """
+
+        self.get_bucket(None, direction).charge(num_bytes)
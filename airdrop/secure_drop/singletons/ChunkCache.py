@@ -0,0 +1,193 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from secure_drop import constants
+
+
+class ChunkCacheStats:
+    """How well the chunk cache has served the transfers since it was last cleared.
+    """
+
+    def __init__(self, num_hits: int, num_misses: int, num_entries: int, size: int):
+        self.num_hits: int = num_hits
+        self.num_misses: int = num_misses
+        self.num_entries: int = num_entries
+        self.size: int = size
+
+    def get_hit_ratio(self) -> float:
+        num_lookups = self.num_hits + self.num_misses
+        return self.num_hits / num_lookups if num_lookups > 0 else 0
+
+
+class ChunkCache:
+    """A thread-safe singleton that keeps chunks prepared for sending on disk, evicting the least recently used ones
+    once it outgrows constants.CHUNK_CACHE_MAX_SIZE.
+    """
+
+    _instance: Optional["ChunkCache"] = None
+    _lock: threading.Lock = threading.Lock()
+    # The directory the entries below were loaded from, which is reloaded if it changes
+    _directory: Optional[str] = None
+    # The size of every entry by its file name, least recently used first
+    _entries: "OrderedDict[str, int]" = OrderedDict()
+    _size: int = 0
+    _num_hits: int = 0
+    _num_misses: int = 0
+
+    def __new__(cls):
+        """This method definition makes the class a singleton.
+        """
+
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(ChunkCache, cls).__new__(cls)
+            return cls._instance
+
+    @staticmethod
+    def get_file_key(file_path: str, file_stat: os.stat_result) -> str:
+        """Gets the identity of a file as the cache knows it, which changes whenever the file does.
+
+        Args:
+            file_path (str): The path to the file.
+            file_stat (os.stat_result): The status of the file.
+
+        Returns:
+            str: The identity of the file.
+        """
+
+        return f"{os.path.realpath(file_path)}:{file_stat.st_size}:{file_stat.st_mtime_ns}:{file_stat.st_ino}"
+
+    def get(self, file_key: str, kind: str, chunk_index: int) -> Optional[bytes]:
+        """Gets a chunk from the cache.
+
+        Args:
+            file_key (str): The identity of the file, as returned by `get_file_key`.
+            kind (str): How the chunk was prepared, such as the compression it went through.
+            chunk_index (int): The index of the chunk.
+
+        Returns:
+            Optional[bytes]: The chunk, or None if it isn't cached or its entry turned out to be corrupt.
+        """
+
+        entry_name = ChunkCache.__get_entry_name(file_key, kind, chunk_index)
+        with self._lock:
+            self.__load()
+            directory = self._directory
+            is_cached = entry_name in self._entries
+            if is_cached:
+                self._entries.move_to_end(entry_name)
+        data = ChunkCache.__read_entry(os.path.join(directory, entry_name)) if is_cached else None
+        with self._lock:
+            if data is None:
+                self._num_misses += 1
+                if is_cached and directory == self._directory and entry_name in self._entries:
+                    # The entry is corrupt, or its file went missing
+                    self.__remove_entry(entry_name)
+            else:
+                self._num_hits += 1
+        return data
+
+    def put(self, file_key: str, kind: str, chunk_index: int, data: bytes):
+        """Adds a chunk to the cache, unless it can't be written.
+
+        Args:
+            file_key (str): The identity of the file, as returned by `get_file_key`.
+            kind (str): How the chunk was prepared.
+            chunk_index (int): The index of the chunk.
+            data (bytes): The chunk.
+        """
+
+        entry_name = ChunkCache.__get_entry_name(file_key, kind, chunk_index)
+        size = hashlib.sha256().digest_size + len(data)
+        if size > constants.CHUNK_CACHE_MAX_SIZE:
+            return
+        with self._lock:
+            self.__load()
+            directory = self._directory
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # The entry only appears under its name once it's complete, so a reader never sees half of it
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(hashlib.sha256(data).digest())
+                    f.write(data)
+                os.replace(temp_path, os.path.join(directory, entry_name))
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except OSError:
+            return
+        with self._lock:
+            if directory != self._directory:
+                return
+            self._size += size - self._entries.pop(entry_name, 0)
+            self._entries[entry_name] = size
+            while self._size > constants.CHUNK_CACHE_MAX_SIZE:
+                self.__remove_entry(next(iter(self._entries)))
+
+    def get_stats(self) -> ChunkCacheStats:
+        with self._lock:
+            self.__load()
+            return ChunkCacheStats(self._num_hits, self._num_misses, len(self._entries), self._size)
+
+    def clear(self):
+        """Removes every chunk from the cache and resets its counters.
+        """
+
+        with self._lock:
+            self.__load()
+            for entry_name in list(self._entries):
+                self.__remove_entry(entry_name)
+            self._num_hits = self._num_misses = 0
+
+    def __load(self):
+        """Picks up the entries that are already on disk. Must be called with the lock held.
+        """
+
+        if self._directory == constants.CHUNK_CACHE_DIR:
+            return
+        self._directory = constants.CHUNK_CACHE_DIR
+        self._entries = OrderedDict()
+        self._size = 0
+        try:
+            with os.scandir(self._directory) as dir_entries:
+                entries = [(dir_entry.stat().st_mtime_ns, dir_entry.name, dir_entry.stat().st_size)
+                           for dir_entry in dir_entries if dir_entry.is_file() and not dir_entry.name.startswith(".")]
+        except OSError:
+            # Nothing was cached yet
+            return
+        for _, entry_name, size in sorted(entries):
+            self._entries[entry_name] = size
+            self._size += size
+
+    @staticmethod
+    def __read_entry(entry_path: str) -> Optional[bytes]:
+        try:
+            with open(entry_path, "rb") as f:
+                digest, data = f.read(hashlib.sha256().digest_size), f.read()
+            # The order of the entries is kept on disk too, for the next time the app starts
+            os.utime(entry_path)
+        except OSError:
+            # The entry was evicted in the meantime
+            return None
+        return data if hashlib.sha256(data).digest() == digest else None
+
+    def __remove_entry(self, entry_name: str):
+        """Removes an entry, which must be in the cache. Must be called with the lock held.
+        """
+
+        self._size -= self._entries.pop(entry_name)
+        try:
+            os.remove(os.path.join(self._directory, entry_name))
+        except OSError:
+            # The entry is already gone
+            pass
+
+    @staticmethod
+    def __get_entry_name(file_key: str, kind: str, chunk_index: int) -> str:
+        return hashlib.sha256(f"{file_key}\0{kind}\0{chunk_index}".encode()).hexdigest()
@@ -1,7 +1,7 @@
 import threading
 from typing import Optional
 
-from secure_drop import constants, exceptions, utils
+from secure_drop import constants, crypto, exceptions, utils
 from secure_drop.types.Contact import Contact
 from secure_drop.types.ContactList import ContactList
 
@@ -12,6 +12,8 @@ class ContactManager:
 
     _instance: Optional["ContactManager"] = None
     _lock: threading.Lock = threading.Lock()
+    # Guards reading the contacts file, changing a contact and writing it back
+    _contacts_lock: threading.Lock = threading.Lock()
 
     def __new__(cls):
         """This method definition makes the class a singleton.
@@ -52,6 +54,29 @@ class ContactManager:
 
         return self.__read_contacts_from_file()
 
+    def trust_public_key(self, email: str, public_key_pem: bytes) -> bool:
+        """Determines whether a public key presented by a contact can be trusted to wrap the key of a transfer to
+        them with. The first key a contact presents is pinned, and every later transfer must present the same key.
+
+        Args:
+            email (str): The email of the contact.
+            public_key_pem (bytes): The public key in PEM format.
+
+        Returns:
+            bool: True if the key is the contact's pinned key, or was just pinned; False if it differs from the pinned
+                key or the email isn't a contact's.
+        """
+
+        fingerprint = crypto.get_public_key_fingerprint(public_key_pem)
+        with self._contacts_lock:
+            contacts = self.get_contacts()
+            if (contact := contacts.get_contact_by_email(email)) is None:
+                return False
+            if contact.public_key_fingerprint is None:
+                contact.public_key_fingerprint = fingerprint
+                self.__write_contacts_to_file(contacts)
+            return contact.public_key_fingerprint == fingerprint
+
     def clear(self):
         """Deletes the singleton instance.
         """
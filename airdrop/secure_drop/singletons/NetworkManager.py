@@ -1,11 +1,12 @@
 import threading
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from secure_drop import constants
 from secure_drop.networking.Broadcaster import Broadcaster
 from secure_drop.networking.BroadcastListener import BroadcastListener
 from secure_drop.networking.messages.BroadcastMessage import BroadcastMessage
 from secure_drop.networking.TCPServer import TCPServer
+from secure_drop.networking.TransferOptions import TransferOptions
 from secure_drop.types.Contact import Contact
 
 
@@ -29,7 +30,8 @@ class NetworkManager:
         self._tcp_server.start()
         while (server_port := self._tcp_server.get_port()) is None:
             pass
-        broadcast_message = BroadcastMessage(constants.APP_UUID, constants.SERVER_IP, server_port)
+        broadcast_message = BroadcastMessage(constants.APP_UUID, constants.SERVER_IP, server_port, constants.HOST_ID,
+                                             self._tcp_server.get_local_socket_path())
         self._broadcaster.set_message(broadcast_message)
         self._broadcaster.start()
         self._broadcast_listener.start()
@@ -47,8 +49,26 @@ class NetworkManager:
     def contact_has_reciprocated(self, contact: Contact) -> bool:
         return self._broadcast_listener.contact_has_reciprocated(contact)
 
-    def send_file(self, contact: Contact, file_path: str) -> bool:
-        return self._broadcast_listener.send_file(contact, file_path)
+    def contacts_have_reciprocated(self, contacts: List[Contact]) -> List[bool]:
+        return self._broadcast_listener.contacts_have_reciprocated(contacts)
+
+    def send_file(self, contact: Contact, file_path: str, options: Optional[TransferOptions] = None) -> bool:
+        return self._broadcast_listener.send_file(contact, file_path, options)
+
+    def send_archive(self, contact: Contact, files: List[Tuple[str, str]], options: Optional[TransferOptions] = None) -> bool:
+        return self._broadcast_listener.send_archive(contact, files, options)
+
+    def send_file_to_many(self, contacts: List[Contact], file_path: str,
+                          options: Optional[TransferOptions] = None) -> List[bool]:
+        return self._broadcast_listener.send_file_to_many(contacts, file_path, options)
+
+    def swarm_file_to_many(self, contacts: List[Contact], file_path: str,
+                           options: Optional[TransferOptions] = None) -> List[bool]:
+        return self._broadcast_listener.swarm_file_to_many(contacts, file_path, options)
+
+    def send_archive_to_many(self, contacts: List[Contact], files: List[Tuple[str, str]],
+                             options: Optional[TransferOptions] = None) -> List[bool]:
+        return self._broadcast_listener.send_archive_to_many(contacts, files, options)
 
     def is_waiting_for_send_file_consent(self) -> bool:
         return self._tcp_server.is_waiting_for_send_file_consent()
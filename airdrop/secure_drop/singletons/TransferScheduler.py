@@ -0,0 +1,163 @@
+import itertools
+import logging
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from secure_drop import constants
+from secure_drop.types.ScheduledTransfer import ScheduledTransfer, TransferStatus
+
+logger = logging.getLogger(__name__)
+
+
+class TransferScheduler:
+    """A thread-safe singleton that runs sends in the background, so that the REPL stays responsive while files are
+    being sent. Queued transfers are run by a bounded pool of workers in the order of their sort key. A transfer only
+    starts once none of its contacts is already at its limit of concurrent transfers, and the workers move on to the
+    next transfer that can start in the meantime, so transfers to different contacts run side by side.
+    """
+
+    _instance: Optional["TransferScheduler"] = None
+    _lock: threading.Lock = threading.Lock()
+    _condition: threading.Condition = threading.Condition()
+    _transfers: Dict[int, ScheduledTransfer] = {}
+    _queue: List[ScheduledTransfer] = []
+    _num_running_by_email: Dict[str, int] = {}
+    _workers: List[threading.Thread] = []
+    _transfer_ids: Iterator[int] = itertools.count(1)
+
+    def __new__(cls):
+        """This method definition makes the class a singleton.
+        """
+
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(TransferScheduler, cls).__new__(cls)
+            return cls._instance
+
+    def submit(self, transfer: ScheduledTransfer) -> int:
+        """Queues a transfer to be run in the background.
+
+        Args:
+            transfer (ScheduledTransfer): The transfer to queue.
+
+        Returns:
+            int: The ID the transfer was given.
+        """
+
+        with self._condition:
+            transfer.transfer_id = next(self._transfer_ids)
+            self._transfers[transfer.transfer_id] = transfer
+            self._queue.append(transfer)
+            # The workers are started with the first transfer, so that nothing runs in the background before then
+            while len(self._workers) < constants.MAX_CONCURRENT_TRANSFERS:
+                worker = threading.Thread(target=self.__work, name="TransferScheduler", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._condition.notify_all()
+        return transfer.transfer_id
+
+    def cancel(self, transfer_id: int) -> bool:
+        """Cancels a transfer. A queued transfer is taken out of the queue, while a running one gives up at the next
+        chunk it sends.
+
+        Args:
+            transfer_id (int): The ID of the transfer.
+
+        Returns:
+            bool: True if the transfer was cancelled; False if there is no such transfer or it is already over.
+        """
+
+        with self._condition:
+            if (transfer := self._transfers.get(transfer_id)) is None or transfer.is_finished():
+                return False
+            transfer.cancelled.set()
+            if transfer.status == TransferStatus.QUEUED:
+                self._queue.remove(transfer)
+                self.__finish(transfer, [False] * len(transfer.contacts))
+        return True
+
+    def cancel_all(self) -> int:
+        """Cancels every transfer that isn't over yet.
+
+        Returns:
+            int: The number of transfers that were cancelled.
+        """
+
+        with self._condition:
+            transfer_ids = list(self._transfers)
+        return sum(self.cancel(transfer_id) for transfer_id in transfer_ids)
+
+    def get_transfers(self) -> List[ScheduledTransfer]:
+        """Gets every transfer that was submitted, in the order they were submitted in.
+        """
+
+        with self._condition:
+            return sorted(self._transfers.values(), key=lambda transfer: transfer.transfer_id)
+
+    def get_queue(self) -> List[ScheduledTransfer]:
+        """Gets the transfers that are running, followed by those that are queued in the order they will run in.
+        """
+
+        with self._condition:
+            running = [transfer for transfer in self._transfers.values() if transfer.status == TransferStatus.RUNNING]
+            return sorted(running, key=lambda transfer: transfer.transfer_id) + \
+                sorted(self._queue, key=ScheduledTransfer.get_sort_key)
+
+    def __work(self):
+        while True:
+            with self._condition:
+                while (transfer := self.__get_next_transfer()) is None:
+                    self._condition.wait()
+                self._queue.remove(transfer)
+                transfer.status = TransferStatus.RUNNING
+                transfer.started_time = time.monotonic()
+                for contact in transfer.contacts:
+                    self._num_running_by_email[contact.email] = self._num_running_by_email.get(contact.email, 0) + 1
+            results = [False] * len(transfer.contacts)
+            failed = False
+            try:
+                results = transfer.send(transfer.cancelled)
+            except OSError:
+                # The file went missing or became unreadable while the transfer was queued
+                failed = True
+            except Exception:
+                # Whatever went wrong only fails this transfer; the worker goes on with the next one
+                logger.exception("Transfer %d failed unexpectedly", transfer.transfer_id)
+                failed = True
+            finally:
+                with self._condition:
+                    for contact in transfer.contacts:
+                        self._num_running_by_email[contact.email] -= 1
+                    # A contact is free again => a transfer that was waiting on it may start
+                    self._condition.notify_all()
+                    self.__finish(transfer, results, failed)
+
+    def __get_next_transfer(self) -> Optional[ScheduledTransfer]:
+        """Gets the queued transfer that should run next among those whose contacts are all below their limit of
+        concurrent transfers. Must be called with the condition held.
+        """
+
+        startable = [transfer for transfer in self._queue
+                     if all(self._num_running_by_email.get(contact.email, 0) < constants.MAX_TRANSFERS_PER_CONTACT
+                            for contact in transfer.contacts)]
+        return min(startable, key=ScheduledTransfer.get_sort_key, default=None)
+
+    @staticmethod
+    def __finish(transfer: ScheduledTransfer, results: List[bool], failed: bool = False):
+        transfer.results = results
+        if failed:
+            transfer.status = TransferStatus.FAILED
+        elif all(results):
+            transfer.status = TransferStatus.SUCCEEDED
+        elif transfer.cancelled.is_set():
+            transfer.status = TransferStatus.CANCELLED
+        else:
+            transfer.status = TransferStatus.FAILED
+        transfer.finished_time = time.monotonic()
+        transfer.finished.set()
+        if transfer.on_finish is not None:
+            try:
+                transfer.on_finish(transfer)
+            except Exception:
+                logger.exception("Reporting the end of transfer %d failed", transfer.transfer_id)
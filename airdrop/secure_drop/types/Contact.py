@@ -1,7 +1,13 @@
+from typing import Optional
+
+
 class Contact:
-    def __init__(self, name: str, email: str):
+    def __init__(self, name: str, email: str, public_key_fingerprint: Optional[str] = None):
         self.name: str = name
         self.email: str = email
+        # The fingerprint of the public key the contact presented when it was first sent an encrypted file, which it
+        # must present again
+        self.public_key_fingerprint: Optional[str] = public_key_fingerprint
 
     def __eq__(self, other: object) -> bool:
         """Determines if a given object is equal to the contact.
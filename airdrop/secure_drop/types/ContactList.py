@@ -51,7 +51,7 @@ class ContactList:
 
         contacts_dicts = [vars(contact) for contact in self.contacts]
         contacts_json = json.dumps(contacts_dicts)
-        return crypto.encrypt_RSA(contacts_json.encode())
+        return crypto.encrypt_hybrid(contacts_json.encode())
 
     @staticmethod
     def from_encrypted_json(encrypted_json: bytes) -> "ContactList":
@@ -64,7 +64,7 @@ class ContactList:
             ContactList: The newly constructed contact list.
         """
 
-        contacts_json = crypto.decrypt_RSA(encrypted_json)
+        contacts_json = crypto.decrypt_hybrid(encrypted_json)
         contacts_dicts = json.loads(contacts_json)
         contacts = [Contact(**data) for data in contacts_dicts]
         contact_list = ContactList()
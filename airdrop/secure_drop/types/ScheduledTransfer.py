@@ -0,0 +1,61 @@
+import threading
+import time
+from enum import Enum
+from typing import Callable, List, Optional, Tuple
+
+from secure_drop.types.Contact import Contact
+
+
+class TransferStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class ScheduledTransfer:
+    """A send of a file or archive to one or more contacts that waits in the transfer scheduler's queue until one of
+    its workers runs it.
+    """
+
+    def __init__(self, path: str, contacts: List[Contact], size: int,
+                 send: Callable[[threading.Event], List[bool]], priority: int = 0,
+                 on_finish: Optional[Callable[["ScheduledTransfer"], None]] = None):
+        """Initializes the transfer.
+
+        Args:
+            path (str): The file, directory or glob pattern to send.
+            contacts (List[Contact]): The contacts to send to.
+            size (int): The number of bytes to send to each contact.
+            send (Callable[[threading.Event], List[bool]]): Sends to every contact, giving up once the event is set,
+                and returns whether each send succeeded.
+            priority (int, optional): Transfers with a higher priority run first. Defaults to 0.
+            on_finish (Optional[Callable[[ScheduledTransfer], None]], optional): Called once the transfer is over.
+                Defaults to None.
+        """
+
+        self.transfer_id: int = 0
+        self.path: str = path
+        self.contacts: List[Contact] = contacts
+        self.size: int = size
+        self.send: Callable[[threading.Event], List[bool]] = send
+        self.priority: int = priority
+        self.on_finish: Optional[Callable[["ScheduledTransfer"], None]] = on_finish
+        self.status: TransferStatus = TransferStatus.QUEUED
+        self.results: List[bool] = []
+        self.cancelled: threading.Event = threading.Event()
+        self.finished: threading.Event = threading.Event()
+        self.queued_time: float = time.monotonic()
+        self.started_time: Optional[float] = None
+        self.finished_time: Optional[float] = None
+
+    def get_sort_key(self) -> Tuple[int, int, int]:
+        """Gets the key transfers are run in the order of: higher priorities first, then smaller transfers, so that a
+        large transfer doesn't hold up many small ones, and then the order they were queued in.
+        """
+
+        return -self.priority, self.size, self.transfer_id
+
+    def is_finished(self) -> bool:
+        return self.status in [TransferStatus.SUCCEEDED, TransferStatus.FAILED, TransferStatus.CANCELLED]
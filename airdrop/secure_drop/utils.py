@@ -1,5 +1,7 @@
+import glob
 import os
 import re
+from typing import List, Optional, Tuple
 
 from secure_drop import constants
 
@@ -35,3 +37,88 @@ def is_valid_email(string: str) -> bool:
     """
 
     return re.match(constants.EMAIL_REGEX, string)
+
+
+def is_glob_pattern(string: str) -> bool:
+    """Determines whether a given string is a glob pattern rather than a plain path.
+
+    Args:
+        string (str): The string to check.
+
+    Returns:
+        bool: True if the given string contains glob wildcards; False otherwise.
+    """
+
+    return any(wildcard in string for wildcard in "*?[")
+
+
+def get_files_to_send(path: str) -> List[Tuple[str, str]]:
+    """Lists the files that a directory or glob pattern refers to, along with the relative path each one is unpacked
+    to on the receiving end. A directory's files keep their place under the directory's name; files matched by a glob
+    pattern are unpacked under their own names, and directories it matches are sent whole.
+
+    Args:
+        path (str): A file, directory or glob pattern.
+
+    Returns:
+        List[Tuple[str, str]]: The path of each file along with its relative path, in a stable order.
+    """
+
+    files: List[Tuple[str, str]] = []
+    for match in sorted(glob.glob(path, recursive=True)) if is_glob_pattern(path) else [path]:
+        if os.path.isfile(match):
+            files.append((match, os.path.basename(match)))
+        elif os.path.isdir(match):
+            root_name = os.path.basename(os.path.normpath(os.path.abspath(match)))
+            for directory, subdirectories, file_names in os.walk(match):
+                subdirectories.sort()
+                relative_directory = os.path.relpath(directory, match)
+                for file_name in sorted(file_names):
+                    if os.path.isfile(file_path := os.path.join(directory, file_name)):
+                        relative_path = os.path.normpath(os.path.join(root_name, relative_directory, file_name))
+                        files.append((file_path, relative_path.replace(os.sep, "/")))
+    return files
+
+
+def parse_byte_rate(string: str) -> Optional[float]:
+    """Parses a rate in bytes per second, optionally with a binary K, M or G suffix, such as "512k" or "10M".
+
+    Args:
+        string (str): The string to parse.
+
+    Returns:
+        Optional[float]: The rate in bytes per second, or None if the string isn't a positive rate.
+    """
+
+    if (match := re.fullmatch(r"(\d+(?:\.\d+)?)([kmg]?)b?(?:/s)?", string.strip().lower())) is None:
+        return None
+    rate = float(match.group(1)) * 1024 ** " kmg".index(match.group(2) or " ")
+    return rate if rate > 0 else None
+
+
+def format_byte_rate(rate: float) -> str:
+    """Formats a rate in bytes per second with the largest binary suffix that keeps it at least 1.
+
+    Args:
+        rate (float): The rate in bytes per second.
+
+    Returns:
+        str: The formatted rate, such as "1.5 MiB/s".
+    """
+
+    return f"{format_size(rate)}/s"
+
+
+def format_size(num_bytes: float) -> str:
+    """Formats a number of bytes with the largest binary suffix that keeps it at least 1.
+
+    Args:
+        num_bytes (float): The number of bytes.
+
+    Returns:
+        str: The formatted size, such as "1.5 MiB".
+    """
+
+    for exponent, unit in reversed(list(enumerate(["B", "KiB", "MiB", "GiB"]))):
+        if num_bytes >= 1024 ** exponent or exponent == 0:
+            return f"{num_bytes / 1024 ** exponent:.4g} {unit}"
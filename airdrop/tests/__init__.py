@@ -0,0 +1,13 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+from secure_drop import constants
+
+# The key pair, user and contacts files that the tests create go to a directory of their own instead of the working
+# directory, where they would clobber a real user's files or end up committed
+__user_files_dir = tempfile.mkdtemp(prefix="secure_drop-tests-")
+atexit.register(shutil.rmtree, __user_files_dir, ignore_errors=True)
+for __name in ["USER_FILE_PATH", "PUBLIC_KEY_FILE_PATH", "PRIVATE_KEY_FILE_PATH", "CONTACTS_FILE_PATH"]:
+    setattr(constants, __name, os.path.join(__user_files_dir, os.path.basename(getattr(constants, __name))))
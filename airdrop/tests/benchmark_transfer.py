@@ -0,0 +1,211 @@
+import filecmp
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from typing import Optional, Tuple, Union
+from unittest import mock
+
+from secure_drop import constants
+from secure_drop.networking import datagrams, socket_helpers
+from secure_drop.networking.compression import Compression, CompressionMetrics
+from secure_drop.networking.TransferOptions import TransferMode, TransferOptions
+from tests.test_transfer import (LatencyRelay, LossyDatagramSocket, create_log_file, create_loopback_pair,
+                                 create_random_file, receive, start_server, transfer)
+
+# Benchmarks that report throughput and CPU time over loopback. They take long and mostly print numbers, so they're
+# kept out of the test suite. Run them with: python -m unittest -v tests.benchmark_transfer
+
+# The payload of a TCP segment on Ethernet, which is what a lost packet takes out of a connection's stream
+SEGMENT_SIZE = 1448
+# How long a lost segment takes to arrive again: a fast retransmit, about a round trip on a wireless LAN
+RETRANSMIT_DELAY_SECONDS = 0.005
+
+
+class LossyStreamRelay:
+    """Forwards traffic between two loopback sockets, losing a given share of the segments from the sender at random
+    and sending each lost one again after a delay. Everything behind a lost segment waits for it, since a connection
+    delivers in order. The relay doesn't shrink the sender's congestion window on loss the way a lossy link does, so it
+    flatters the connection."""
+
+    def __init__(self, loss_rate: float):
+        self.__loss_rate: float = loss_rate
+        self.__random: random.Random = random.Random(0)
+        self.__threads = []
+        self.__sockets = []
+
+    def create_pair(self) -> Tuple[socket.socket, socket.socket]:
+        """Creates a pair of connected sockets whose traffic passes through the relay."""
+
+        sender_sock, relay_in = create_loopback_pair()
+        relay_out, receiver_sock = create_loopback_pair()
+        self.__sockets += [relay_in, relay_out]
+        for source, destination, loss_rate in [(relay_in, relay_out, self.__loss_rate), (relay_out, relay_in, 0)]:
+            thread = threading.Thread(target=self.__forward, args=(source, destination, loss_rate))
+            self.__threads.append(thread)
+            thread.start()
+        return sender_sock, receiver_sock
+
+    def join(self):
+        for thread in self.__threads:
+            thread.join()
+        for sock in self.__sockets:
+            sock.close()
+
+    def __forward(self, source: socket.socket, destination: socket.socket, loss_rate: float):
+        try:
+            while data := source.recv(256 * 1024):
+                sent = 0
+                for offset in range(0, len(data), SEGMENT_SIZE):
+                    if self.__random.random() < loss_rate:
+                        destination.sendall(data[sent:offset])
+                        sent = offset
+                        time.sleep(RETRANSMIT_DELAY_SECONDS)
+                destination.sendall(data[sent:])
+            # Propagate the end of the stream
+            destination.shutdown(socket.SHUT_WR)
+        except OSError:
+            # The other end of the relay has already gone away
+            pass
+
+
+class TransferBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def __measure_throughput(self, options: TransferOptions, file_size: int,
+                             relay: Optional[Union[LatencyRelay, LossyStreamRelay]] = None) -> float:
+        """Transfers a file over loopback TCP, through a relay if given, and returns the throughput in MB/s."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        sender_sock, receiver_sock = relay.create_pair() if relay else create_loopback_pair()
+        with sender_sock, receiver_sock:
+            start = time.perf_counter()
+            received_path = transfer(sender_sock, receiver_sock, source_path, self.temp_dir.name, options)
+            elapsed = time.perf_counter() - start
+        if relay:
+            relay.join()
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        os.remove(received_path)
+        return file_size / elapsed / 1e6
+
+    def __compare(self, file_size: int, one_way_delay_seconds: float):
+        def create_relay() -> Optional[LatencyRelay]:
+            return LatencyRelay(one_way_delay_seconds) if one_way_delay_seconds > 0 else None
+
+        stop_and_wait = self.__measure_throughput(TransferOptions(TransferMode.STOP_AND_WAIT), file_size,
+                                                  create_relay())
+        pipelined = self.__measure_throughput(TransferOptions(), file_size, create_relay())
+        rtt_ms = 2 * one_way_delay_seconds * 1000
+        print(f"\nLoopback throughput (RTT +{rtt_ms:.0f} ms): stop-and-wait {stop_and_wait:.1f} MB/s, "
+              f"pipelined {pipelined:.1f} MB/s")
+        return stop_and_wait, pipelined
+
+    def test_throughput_over_loopback(self):
+        """Report pipelined and stop-and-wait throughput over bare loopback, where the RTT is negligible."""
+
+        self.__compare(32 * 1024 * 1024, 0)
+
+    def test_zero_copy_cpu_time(self):
+        """Report the sender's CPU time per GB with and without the zero-copy sendfile path."""
+
+        file_size = 64 * 1024 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        cpu_seconds_per_gb = {}
+        for zero_copy in [False, True]:
+            sender_sock, receiver_sock = create_loopback_pair()
+            cpu_seconds = {}
+
+            def send():
+                start = time.thread_time()
+                cpu_seconds["sent"] = socket_helpers.send_file(sender_sock, source_path,
+                                                               TransferOptions(zero_copy=zero_copy))
+                cpu_seconds["elapsed"] = time.thread_time() - start
+
+            with sender_sock, receiver_sock:
+                sender_thread = threading.Thread(target=send)
+                sender_thread.start()
+                received_path = receive(receiver_sock, self.temp_dir.name)
+                sender_thread.join()
+            self.assertTrue(cpu_seconds["sent"])
+            self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+            os.remove(received_path)
+            cpu_seconds_per_gb[zero_copy] = cpu_seconds["elapsed"] / (file_size / 1e9)
+        print(f"\nSender CPU time: buffered {cpu_seconds_per_gb[False]:.2f} s/GB, "
+              f"zero-copy {cpu_seconds_per_gb[True]:.2f} s/GB")
+        self.assertLess(cpu_seconds_per_gb[True], cpu_seconds_per_gb[False])
+
+    def test_pipelined_outperforms_stop_and_wait_with_latency(self):
+        """Test that pipelining hides the round-trip time that bounds stop-and-wait transfers."""
+
+        stop_and_wait, pipelined = self.__compare(2 * 1024 * 1024, 0.001)
+        self.assertGreater(pipelined, 2 * stop_and_wait)
+
+    def test_compression_metrics(self):
+        """Report the compression ratio and CPU time against the wire time saved for text and random data."""
+
+        source_paths = [create_log_file(self.temp_dir.name, "app.log", 200000),
+                        create_random_file(self.temp_dir.name, "random.bin", 16 * 1024 * 1024)]
+        report = []
+        for source_path in source_paths:
+            for compression, compression_level in [(Compression.ZLIB, 1), (Compression.ZLIB, 6), (Compression.LZMA, 1)]:
+                metrics = CompressionMetrics()
+                sender_sock, receiver_sock = create_loopback_pair()
+                with sender_sock, receiver_sock:
+                    sender_thread = threading.Thread(target=socket_helpers.send_file, args=[
+                        sender_sock, source_path, TransferOptions(compression=compression,
+                                                                  compression_level=compression_level), metrics])
+                    sender_thread.start()
+                    received_path = receive(receiver_sock, self.temp_dir.name)
+                    sender_thread.join()
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                os.remove(received_path)
+                report.append(f"{os.path.basename(source_path)} {compression.value} level {compression_level} -> "
+                              f"{metrics}")
+        print("\nCompression over loopback:\n" + "\n".join(report))
+
+    def test_striped_throughput_by_stream_count(self):
+        """Report how the throughput of a transfer to a server over loopback scales with the number of streams."""
+
+        file_size = 64 * 1024 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        received_dir = os.path.join(self.temp_dir.name, "received")
+        server = start_server(self, received_dir)
+        throughputs = []
+        with socket.create_connection((constants.SERVER_IP, server.get_port())) as sock:
+            for num_streams in [1, 2, 4, 8]:
+                start = time.perf_counter()
+                self.assertTrue(socket_helpers.send_file(sock, source_path, TransferOptions(num_streams=num_streams)))
+                throughputs.append(f"{num_streams} streams {file_size / (time.perf_counter() - start) / 1e6:.1f} MB/s")
+                received_path = os.path.join(received_dir, "source.bin")
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                os.remove(received_path)
+        print(f"\nStriped throughput over loopback ({os.cpu_count()} CPUs): {', '.join(throughputs)}")
+
+    def test_datagram_throughput_with_loss(self):
+        """Report the throughput of the stream and of datagram transfers as more and more packets are lost. The stream
+        goes through a relay that loses segments, since loss can't be injected into a loopback connection without
+        netem, while datagrams are lost by the socket that sends them."""
+
+        file_size = 32 * 1024 * 1024
+        report = []
+        throughputs = {}
+        for loss_rate in [0, 0.01, 0.05, 0.1]:
+            def create_socket(family: socket.AddressFamily) -> LossyDatagramSocket:
+                return LossyDatagramSocket(family, loss_rate)
+
+            stream = self.__measure_throughput(TransferOptions(), file_size, LossyStreamRelay(loss_rate))
+            with mock.patch.object(datagrams, "create_socket", create_socket):
+                throughputs[loss_rate] = self.__measure_throughput(TransferOptions(datagrams=True), file_size)
+            report.append(f"{loss_rate:.0%} loss: stream {stream:.1f} MB/s, datagrams {throughputs[loss_rate]:.1f} MB/s")
+        print("\nLoopback throughput with loss:\n" + "\n".join(report))
+        self.assertGreater(throughputs[0.05], throughputs[0] / 2)
+
+if __name__ == '__main__':
+    unittest.main()
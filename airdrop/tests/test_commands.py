@@ -0,0 +1,142 @@
+import filecmp
+import io
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from typing import List
+from unittest import mock
+
+from secure_drop import commands, constants
+from secure_drop.networking import encryption, socket_helpers
+from secure_drop.networking.compression import Compression
+from secure_drop.networking.TransferOptions import TransferOptions
+from secure_drop.singletons.ChunkCache import ChunkCache
+from secure_drop.singletons.NetworkManager import NetworkManager
+from secure_drop.singletons.TransferScheduler import TransferScheduler
+from secure_drop.types.Contact import Contact
+from secure_drop.types.ScheduledTransfer import ScheduledTransfer
+from tests.test_transfer import receive
+
+
+class TestSendCommand(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.temp_dir.name, "source.log")
+        with open(self.source_path, "wb") as f:
+            f.write(b"".join(f"{line} GET /index.html 200\n".encode() for line in range(10000)))
+        self.contact = Contact("Bob", "bob@example.com")
+        self.sent_options: List[TransferOptions] = []
+        # Transfers run right away instead of on the scheduler's workers, and go nowhere
+        patches = [mock.patch.object(commands, "__get_target_contacts", return_value=[self.contact]),
+                   mock.patch.object(TransferScheduler, "submit", side_effect=self.__run),
+                   mock.patch.object(NetworkManager, "send_file", side_effect=self.__send_file),
+                   mock.patch.object(NetworkManager, "send_archive", side_effect=self.__send_file)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    @staticmethod
+    def __run(transfer: ScheduledTransfer) -> int:
+        transfer.results = transfer.send(transfer.cancelled)
+        return 1
+
+    def __send_file(self, contact: Contact, file_path: str, options: TransferOptions) -> bool:
+        self.sent_options.append(options)
+        return True
+
+    def __send_over_socket(self, contact: Contact, file_path: str, options: TransferOptions) -> bool:
+        self.sent_options.append(options)
+        received_dir = os.path.join(self.temp_dir.name, "received")
+        os.makedirs(received_dir, exist_ok=True)
+        results = {}
+        sender_sock, receiver_sock = socket.socketpair()
+        with sender_sock, receiver_sock:
+            receiver_thread = threading.Thread(target=lambda: results.update(
+                received_path=receive(receiver_sock, received_dir)))
+            receiver_thread.start()
+            is_sent = socket_helpers.send_file(sender_sock, file_path, options)
+            receiver_thread.join()
+        self.assertTrue(is_sent)
+        self.assertTrue(filecmp.cmp(file_path, results["received_path"], shallow=False))
+        os.remove(results["received_path"])
+        return is_sent
+
+    def __send(self, *args, **kwargs) -> str:
+        output = io.StringIO()
+        with redirect_stdout(output):
+            commands.send_file([self.contact.email], self.source_path, *args, **kwargs)
+        return output.getvalue()
+
+    def test_compressed_file_is_encrypted(self):
+        """Test that a compressed file is still encrypted, and that each send gets its own cancellation."""
+
+        self.__send(compression=Compression.LZMA, compression_level=9)
+        self.__send(compression=Compression.LZMA, compression_level=9)
+        self.assertEqual(len(self.sent_options), 2)
+        for options in self.sent_options:
+            self.assertTrue(options.encrypt)
+            self.assertTrue(options.seals_frames())
+            self.assertEqual((options.compression, options.compression_level), (Compression.LZMA, 9))
+        self.assertIsNot(self.sent_options[0].cancelled, self.sent_options[1].cancelled)
+
+    def test_delta_is_encrypted(self):
+        """Test that a delta is still encrypted."""
+
+        self.__send(delta=True)
+        self.assertEqual(len(self.sent_options), 1)
+        self.assertTrue(self.sent_options[0].delta)
+        self.assertTrue(self.sent_options[0].seals_frames())
+
+    def test_striped_file_is_encrypted(self):
+        """Test that a striped file is still encrypted."""
+
+        self.__send(num_streams=4)
+        self.assertEqual(len(self.sent_options), 1)
+        self.assertTrue(self.sent_options[0].encrypt)
+        self.assertEqual(self.sent_options[0].num_streams, 4)
+
+    def test_archive_is_encrypted(self):
+        """Test that the files of a directory are encrypted like a single file."""
+
+        with redirect_stdout(io.StringIO()):
+            commands.send_files([self.contact.email], self.temp_dir.name)
+        self.assertEqual(len(self.sent_options), 1)
+        self.assertTrue(self.sent_options[0].encrypt)
+
+    def test_options_that_cant_be_combined_are_refused(self):
+        """Test that nothing is queued for options that can't be combined."""
+
+        for kwargs in [{"datagrams": True, "compression": Compression.ZLIB}, {"delta": True, "num_streams": 2},
+                       {"num_streams": 0}]:
+            self.assertIn("Unable to send file", self.__send(**kwargs))
+        self.assertEqual(self.sent_options, [])
+        TransferScheduler.submit.assert_not_called()
+
+    def test_second_send_streams_from_cache(self):
+        """Test that sending the same file again takes every sealed chunk from the chunk cache, sealing nothing."""
+
+        patcher = mock.patch.object(constants, "CHUNK_CACHE_DIR", os.path.join(self.temp_dir.name, "cache"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ChunkCache().clear()
+        self.addCleanup(ChunkCache().clear)
+        # The file is given a content key only once it's old enough not to change unnoticed
+        os.utime(self.source_path, (time.time() - 60, time.time() - 60))
+        num_chunks = encryption.get_num_chunks(0, os.path.getsize(self.source_path))
+        with mock.patch.object(NetworkManager, "send_file", side_effect=self.__send_over_socket), \
+                mock.patch.object(encryption, "encrypt_chunk", wraps=encryption.encrypt_chunk) as encrypt_chunk:
+            self.__send()
+            self.assertEqual(encrypt_chunk.call_count, num_chunks)
+            self.assertEqual(ChunkCache().get_stats().num_hits, 0)
+            self.__send()
+            self.assertEqual(encrypt_chunk.call_count, num_chunks)
+        # The content key is taken from the cache too
+        self.assertEqual(len(self.sent_options), 2)
+        self.assertEqual(ChunkCache().get_stats().num_hits, num_chunks + 1)
@@ -1,7 +1,8 @@
 import unittest
 
-from secure_drop import constants, exceptions
+from secure_drop import constants, crypto, exceptions
 from secure_drop.singletons.ContactManager import ContactManager
+from secure_drop.types.Contact import Contact
 from tests import test_constants, test_utils
 
 
@@ -50,6 +51,25 @@ class TestContactManagement(unittest.TestCase):
         with self.assertRaises(exceptions.ContactAlreadyAddedException):
             self.contact_manager.add_contact(contact_to_add)
 
+    def test_public_key_is_pinned(self):
+        """Test that a contact's first public key is trusted and pinned, and that any other key is then refused."""
+
+        contact = test_constants.TEST_CONTACT
+        self.contact_manager.add_contact(contact)
+        self.assertTrue(self.contact_manager.trust_public_key(contact.email, b"first key"))
+        self.assertTrue(self.contact_manager.trust_public_key(contact.email, b"first key"))
+        self.assertFalse(self.contact_manager.trust_public_key(contact.email, b"second key"))
+        self.assertFalse(self.contact_manager.trust_public_key("stranger@test.test", b"first key"))
+        pinned_contact = self.contact_manager.get_contacts().get_contact_by_email(contact.email)
+        self.assertEqual(pinned_contact.public_key_fingerprint, crypto.get_public_key_fingerprint(b"first key"))
+
+    def test_many_contacts_are_stored(self):
+        """Test that the contacts file holds more contacts than a single RSA block would."""
+
+        for contact_index in range(5):
+            self.contact_manager.add_contact(Contact(f"Contact {contact_index}", f"contact{contact_index}@test.test"))
+        self.assertEqual(len(list(self.contact_manager.get_contacts())), 5)
+
 
 if __name__ == '__main__':
     unittest.main()
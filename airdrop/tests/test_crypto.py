@@ -1,11 +1,11 @@
 import unittest
-import filecmp
 import os
 
+from secure_drop import constants, crypto, exceptions
+from secure_drop.networking import encryption
 from secure_drop.types.ContactList import ContactList
 from secure_drop.types.Credentials import Credentials
 from tests import test_constants
-# from secure_drop.crypto import encrypt_AES, decrypt_AES
 
 
 class TestCrypto(unittest.TestCase):
@@ -29,53 +29,39 @@ class TestCrypto(unittest.TestCase):
             # Ensure that each contact in the decrypted contact list is present in the original contact list
             self.assertTrue(contact_list.contains(decrypted_contact))
 
-    
-    # TODO
-    # def test_aes_encryption_decryption(self):
-    #     """Test AES encryption and decryption of a large file for essentially testing speed."""
+    def test_legacy_contact_list_decryption(self):
+        """Verifies that contact lists encrypted with RSA alone, as earlier versions stored them, can still be read."""
 
-    #     original_file_path = 'test_file.txt'
-    #     encrypted_file_path = 'test_file.txt.aes'
-    #     decrypted_file_path = 'test_file_decrypted.txt'  # Changed decrypted file path
-
-    #     # Create a test file
-    #     with open(original_file_path, 'wb') as f:
-    #         f.write(os.urandom(50 * 1024 * 1024))  # Creates a 50MB test file 
-
-    #     # Encrypt the file
-    #     encrypted_aes_key, encrypted_file = encrypt_AES(original_file_path)
-        
-    #     # Decrypt the file
-    #     decrypt_AES(encrypted_file, encrypted_aes_key)  # The decrypted file is saved as 'test_file_decrypted.txt'
-
-    #     # Compare original and decrypted files
-    #     self.assertTrue(filecmp.cmp(original_file_path, decrypted_file_path),
-    #                     "Decrypted file does not match the original.")
-
-    #     # Cleanup
-    #     os.remove(original_file_path)
-    #     os.remove(encrypted_file)
-    #     os.remove(decrypted_file_path)
-
-    # def test_aes_encryption_decryption_with_image(self):
-    #     """Test AES encryption and decryption of an image file."""
-
-    #     original_file_path = 'tests\assets\test_picture.jpg'
-    #     encrypted_file_path = original_file_path + '.aes'
-
-    #     # Encrypt the file
-    #     encrypted_aes_key, encrypted_file = encrypt_AES(original_file_path)
-        
-    #     # Decrypt the file
-    #     decrypted_file_path = decrypt_AES(encrypted_file, encrypted_aes_key)
-
-    #     # Compare original and decrypted files
-    #     self.assertTrue(filecmp.cmp(original_file_path, decrypted_file_path),
-    #                     "Decrypted file does not match the original.")
-
-    #     # Cleanup: remove the encrypted and decrypted files
-    #     os.remove(encrypted_file)
-    #     os.remove(decrypted_file_path)
+        encrypted_contact_list = crypto.encrypt_RSA(b'[{"name": "Bob", "email": "bob@test.test"}]')
+        decrypted_contact_list = ContactList.from_encrypted_json(encrypted_contact_list)
+        self.assertTrue(decrypted_contact_list.contains(test_constants.TEST_CONTACT))
+
+    def test_key_wrapping(self):
+        """Verifies that a transfer key wrapped with a public key is recovered with the matching private key."""
+
+        key = os.urandom(constants.TRANSFER_KEY_SIZE)
+        wrapped_key = crypto.wrap_key(key, crypto.get_public_key_pem())
+        self.assertNotEqual(wrapped_key, key)
+        self.assertEqual(crypto.decrypt_RSA(wrapped_key), key)
+
+    def test_chunk_encryption(self):
+        """Verifies that chunks are encrypted in place, decrypt back to their plaintext, and fail authentication when
+        tampered with or decrypted as a different chunk."""
+
+        key = os.urandom(constants.TRANSFER_KEY_SIZE)
+        plaintext = os.urandom(1000)
+        chunk = memoryview(bytearray(plaintext + bytes(encryption.TAG_SIZE)))
+        encryption.encrypt_chunk(key, 7 * constants.ENCRYPTION_CHUNK_SIZE, chunk)
+        self.assertNotEqual(bytes(chunk[:-encryption.TAG_SIZE]), plaintext)
+        sealed = bytes(chunk)
+        encryption.decrypt_chunk(key, 7 * constants.ENCRYPTION_CHUNK_SIZE, chunk)
+        self.assertEqual(bytes(chunk[:-encryption.TAG_SIZE]), plaintext)
+        with self.assertRaises(exceptions.CorruptChunkException):
+            encryption.decrypt_chunk(key, 8 * constants.ENCRYPTION_CHUNK_SIZE, memoryview(bytearray(sealed)))
+        tampered = bytearray(sealed)
+        tampered[0] ^= 1
+        with self.assertRaises(exceptions.CorruptChunkException):
+            encryption.decrypt_chunk(key, 7 * constants.ENCRYPTION_CHUNK_SIZE, memoryview(tampered))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,91 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from secure_drop import exceptions
+from secure_drop.networking import framing, socket_helpers
+from secure_drop.networking.framing import FrameType
+from secure_drop.networking.messages.ClientRequest import (ClientRequest,
+                                                           ClientRequestType)
+
+
+class TestFraming(unittest.TestCase):
+    def setUp(self):
+        self.client_sock, self.server_sock = socket.socketpair()
+
+    def tearDown(self):
+        self.client_sock.close()
+        self.server_sock.close()
+
+    def test_coalesced_frames(self):
+        """Test that frames sent back to back are parsed one at a time."""
+
+        requests = [ClientRequest(ClientRequestType.PING), ClientRequest(ClientRequestType.HAS_ADDED, ["a@b.c"])]
+        # Send both requests in a single segment
+        self.client_sock.sendall(b"".join(
+            framing.FRAME_HEADER.pack(FrameType.REQUEST.value, len(req.to_bytes())) + req.to_bytes()
+            for req in requests
+        ))
+        for req in requests:
+            received_req = socket_helpers.recv_req(self.server_sock)
+            self.assertEqual(received_req.type, req.type.value)
+            self.assertEqual(received_req.args, req.args)
+
+    def test_split_frame(self):
+        """Test that a frame split across many segments is reassembled."""
+
+        payload = ClientRequest(ClientRequestType.EMAIL).to_bytes()
+        frame = framing.FRAME_HEADER.pack(FrameType.REQUEST.value, len(payload)) + payload
+
+        def trickle():
+            for i in range(len(frame)):
+                self.client_sock.sendall(frame[i:i + 1])
+
+        sender_thread = threading.Thread(target=trickle)
+        sender_thread.start()
+        self.assertEqual(framing.recv_frame(self.server_sock, FrameType.REQUEST), payload)
+        sender_thread.join()
+
+    def test_frame_is_not_over_read(self):
+        """Test that receiving a frame leaves the bytes of the next frame in the stream."""
+
+        framing.send_frame(self.client_sock, FrameType.RESPONSE, b"first")
+        framing.send_frame(self.client_sock, FrameType.DATA, b"second")
+        self.assertEqual(framing.recv_frame(self.server_sock, FrameType.RESPONSE), b"first")
+        header = memoryview(bytearray(framing.FRAME_HEADER.size))
+        self.assertEqual(framing.recv_frame_header(self.server_sock, header), (FrameType.DATA, len(b"second")))
+
+    def test_unexpected_frame_type(self):
+        """Test that a frame of the wrong type is rejected."""
+
+        framing.send_frame(self.client_sock, FrameType.DATA, b"data")
+        with self.assertRaises(exceptions.MalformedFrameException):
+            framing.recv_frame(self.server_sock, FrameType.REQUEST)
+
+    def test_frame_with_descriptor(self):
+        """Test that a file descriptor passed along with a frame opens the same file, and that a frame without one is
+        rejected."""
+
+        with tempfile.TemporaryFile() as f:
+            f.write(b"handed over")
+            f.flush()
+            framing.send_frame_with_fd(self.client_sock, FrameType.HANDOVER, f.fileno())
+            fd = framing.recv_frame_with_fd(self.server_sock, FrameType.HANDOVER)
+            with open(fd, "rb") as received:
+                self.assertEqual(os.pread(received.fileno(), 64, 0), b"handed over")
+        framing.send_frame(self.client_sock, FrameType.HANDOVER)
+        with self.assertRaises(exceptions.MalformedFrameException):
+            framing.recv_frame_with_fd(self.server_sock, FrameType.HANDOVER)
+
+    def test_closed_connection(self):
+        """Test that a connection closed mid-frame is reported as closed."""
+
+        self.client_sock.sendall(framing.FRAME_HEADER.pack(FrameType.REQUEST.value, 10) + b"short")
+        self.client_sock.close()
+        self.assertIsNone(framing.recv_frame(self.server_sock, FrameType.REQUEST))
+
+
+if __name__ == '__main__':
+    unittest.main()
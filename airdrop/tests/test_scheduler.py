@@ -0,0 +1,104 @@
+import threading
+import time
+import unittest
+from typing import List
+from unittest import mock
+
+from secure_drop import constants
+from secure_drop.singletons import TransferScheduler as transfer_scheduler
+from secure_drop.singletons.TransferScheduler import TransferScheduler
+from secure_drop.types.Contact import Contact
+from secure_drop.types.ScheduledTransfer import ScheduledTransfer, TransferStatus
+
+
+class TestTransferScheduler(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.started: List[str] = []
+        self.started_lock = threading.Lock()
+
+    def tearDown(self):
+        self.release.set()
+
+    def __submit(self, name: str, email: str, size: int = 0, priority: int = 0,
+                 block: bool = False) -> ScheduledTransfer:
+        def send(cancelled: threading.Event) -> List[bool]:
+            with self.started_lock:
+                self.started.append(name)
+            if block:
+                # Wait until the test lets the transfer go on or cancels it
+                while not self.release.wait(0.01) and not cancelled.is_set():
+                    pass
+            return [not cancelled.is_set()]
+
+        transfer = ScheduledTransfer(name, [Contact(name, email)], size, send, priority)
+        TransferScheduler().submit(transfer)
+        return transfer
+
+    def __wait_until_started(self, name: str):
+        for _ in range(500):
+            with self.started_lock:
+                if name in self.started:
+                    return
+            time.sleep(0.01)
+        self.fail(f"{name} never started")
+
+    def test_transfers_run_by_priority_then_size(self):
+        """Test that transfers to a busy contact wait, and then run by priority, then smallest first."""
+
+        email = "priority@example.com"
+        first = self.__submit("first", email, block=True)
+        self.__wait_until_started("first")
+        transfers = [self.__submit("large", email, size=1000), self.__submit("small", email, size=10),
+                     self.__submit("urgent", email, size=5000, priority=1)]
+        self.assertEqual(TransferScheduler().get_queue()[1:], [transfers[2], transfers[1], transfers[0]])
+        self.release.set()
+        for transfer in [first] + transfers:
+            self.assertTrue(transfer.finished.wait(5))
+            self.assertEqual(transfer.status, TransferStatus.SUCCEEDED)
+        self.assertEqual(self.started, ["first", "urgent", "small", "large"])
+
+    def test_transfers_to_different_contacts_run_concurrently(self):
+        """Test that a busy contact doesn't hold up transfers to other contacts."""
+
+        blocked = self.__submit("blocked", "busy@example.com", block=True)
+        waiting = self.__submit("waiting", "busy@example.com")
+        other = self.__submit("other", "idle@example.com")
+        self.assertTrue(other.finished.wait(5))
+        self.assertEqual(waiting.status, TransferStatus.QUEUED)
+        self.release.set()
+        self.assertTrue(blocked.finished.wait(5) and waiting.finished.wait(5))
+
+    def test_cancel_transfers(self):
+        """Test that a queued transfer never runs once cancelled, and that a running one is told to give up."""
+
+        running = self.__submit("running", "cancel@example.com", block=True)
+        self.__wait_until_started("running")
+        queued = self.__submit("queued", "cancel@example.com")
+        self.assertTrue(TransferScheduler().cancel(queued.transfer_id))
+        self.assertEqual(queued.status, TransferStatus.CANCELLED)
+        self.assertTrue(TransferScheduler().cancel(running.transfer_id))
+        self.assertTrue(running.finished.wait(5))
+        self.assertEqual(running.status, TransferStatus.CANCELLED)
+        self.assertFalse(TransferScheduler().cancel(running.transfer_id))
+        self.assertNotIn("queued", self.started)
+
+    def test_failing_transfers_leave_workers_running(self):
+        """Test that a transfer that raises is marked as failed and frees its contact, and that the workers go on
+        running transfers afterwards."""
+
+        def fail(cancelled: threading.Event) -> List[bool]:
+            raise ValueError("Malformed frame")
+
+        email = "failing@example.com"
+        failing = [ScheduledTransfer(f"failing{index}", [Contact("failing", email)], 0, fail)
+                   for index in range(constants.MAX_CONCURRENT_TRANSFERS + 1)]
+        with mock.patch.object(transfer_scheduler.logger, "exception"):
+            for transfer in failing:
+                TransferScheduler().submit(transfer)
+            for transfer in failing:
+                self.assertTrue(transfer.finished.wait(5))
+                self.assertEqual(transfer.status, TransferStatus.FAILED)
+        after = self.__submit("after", email)
+        self.assertTrue(after.finished.wait(5))
+        self.assertEqual(after.status, TransferStatus.SUCCEEDED)
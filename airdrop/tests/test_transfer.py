@@ -0,0 +1,1802 @@
+import filecmp
+import hashlib
+import os
+import queue
+import random
+import select
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+import uuid
+from typing import Callable, List, Optional, Tuple
+from unittest import mock
+
+from secure_drop import constants, crypto, utils
+from secure_drop.networking import (datagrams, encryption, framing, merkle, socket_helpers, socket_tuning, swarm_transfers,
+                                    transfer_helpers)
+from secure_drop.networking.BroadcastListener import BroadcastListener
+from secure_drop.networking.ChunkSizer import ChunkSizer
+from secure_drop.networking.Connection import Connection
+from secure_drop.networking.compression import Compression, CompressionMetrics
+from secure_drop.networking.framing import FrameType
+from secure_drop.networking.IncomingArchive import ENTRY_HEADER, IncomingArchive
+from secure_drop.networking.IncomingFile import IncomingFile
+from secure_drop.networking.messages.ClientRequest import (ClientRequest,
+                                                           ClientRequestType)
+from secure_drop.networking.messages.ServerResponse import ServerResponse
+from secure_drop.networking.SharedFileReader import SharedFileReader
+from secure_drop.networking.StripedTransfer import StripedTransfer
+from secure_drop.networking.SwarmSeeder import SwarmSeeder
+from secure_drop.networking.SwarmTransfer import parse_peer_addresses
+from secure_drop.networking.TCPServer import TCPServer
+from secure_drop.networking.TokenBucket import TokenBucket
+from secure_drop.networking.TransferOptions import (TransferMode,
+                                                    TransferOptions)
+from secure_drop.singletons.BandwidthManager import BandwidthManager, Direction
+from secure_drop.singletons.ChunkCache import ChunkCache
+from secure_drop.singletons.ContactManager import ContactManager
+from secure_drop.singletons.LoginManager import LoginManager
+from secure_drop.types.Contact import Contact
+from secure_drop.types.ContactList import ContactList
+from secure_drop.types.Credentials import Credentials
+
+
+def create_random_file(directory: str, name: str, size: int) -> str:
+    """Creates a file of a given size filled with random bytes and returns its path."""
+
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            block = os.urandom(min(remaining, 1024 * 1024))
+            f.write(block)
+            remaining -= len(block)
+    return path
+
+
+def create_log_file(directory: str, name: str, num_lines: int) -> str:
+    """Creates a text file resembling an application log, which compresses well, and returns its path."""
+
+    path = os.path.join(directory, name)
+    rng = random.Random(0)
+    with open(path, "w") as f:
+        for i in range(num_lines):
+            f.write(f"2026-01-01 12:{i // 60 % 60:02d}:{i % 60:02d} INFO worker-{i % 8} handled request "
+                    f"{rng.randrange(10 ** 6)} in {rng.random():.3f}s\n")
+    return path
+
+
+def receive(receiver_sock: socket.socket, target_dir: str) -> Optional[str]:
+    """Handles a SEND_FILE request the same way the server does and returns the path of the received file, or None if
+    the file was rejected or the transfer failed."""
+
+    req = socket_helpers.recv_req(receiver_sock)
+    incoming_file = IncomingFile(target_dir, req.args[0], int(req.args[1]), req.args[2])
+    options = TransferOptions.from_args(req.args[3:])
+    if not incoming_file.reserve(preallocate=not options.uses_sparse() and not options.uses_handover()):
+        socket_helpers.send_bool_res(receiver_sock, False)
+        return None
+    if not socket_helpers.receive_file(receiver_sock, incoming_file, options):
+        return None
+    return incoming_file.final_path
+
+
+def receive_files(receiver_sock: socket.socket, target_dir: str) -> Optional[List[str]]:
+    """Handles a SEND_ARCHIVE request the same way the server does and returns the paths of the received files, or
+    None if the archive was rejected or the transfer failed."""
+
+    req = socket_helpers.recv_req(receiver_sock)
+    incoming_archive = IncomingArchive(target_dir, int(req.args[0]), int(req.args[1]))
+    if not incoming_archive.reserve():
+        socket_helpers.send_bool_res(receiver_sock, False)
+        return None
+    if not socket_helpers.receive_archive(receiver_sock, incoming_archive, TransferOptions.from_args(req.args[2:])):
+        return None
+    return incoming_archive.final_paths
+
+
+def transfer(sender_sock: socket.socket, receiver_sock: socket.socket, source_path: str, target_dir: str,
+             options: Optional[TransferOptions] = None) -> Optional[str]:
+    """Sends a file from one connected socket to another and returns the path of the received file, or None if either
+    end reported a failure."""
+
+    results = {}
+
+    def send():
+        results["sent"] = socket_helpers.send_file(sender_sock, source_path, options)
+
+    sender_thread = threading.Thread(target=send)
+    sender_thread.start()
+    received_path = receive(receiver_sock, target_dir)
+    if received_path is None:
+        # Hang up like the server does, so that a sender still waiting for an acknowledgement gives up
+        receiver_sock.shutdown(socket.SHUT_RDWR)
+    sender_thread.join()
+    return received_path if results["sent"] else None
+
+
+def start_server(test_case: unittest.TestCase, received_dir: str) -> TCPServer:
+    """Starts a server that receives files into a given directory for the duration of a test and waits for it to be
+    bound to a port."""
+
+    patcher = mock.patch.object(constants, "RECEIVED_FILES_DIR", received_dir)
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+    server = TCPServer()
+    server.start()
+    test_case.addCleanup(server.stop)
+    while server.get_port() is None:
+        time.sleep(0.01)
+    return server
+
+
+def create_loopback_pair() -> Tuple[socket.socket, socket.socket]:
+    """Creates a pair of TCP sockets connected over the loopback interface."""
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        client_sock = socket.create_connection(listener.getsockname())
+        server_sock, _ = listener.accept()
+    return client_sock, server_sock
+
+
+class LatencyRelay:
+    """Forwards traffic between two loopback sockets after a fixed one-way delay, emulating a link with a real RTT."""
+
+    def __init__(self, one_way_delay_seconds: float):
+        self.__delay: float = one_way_delay_seconds
+        self.__threads = []
+        self.__sockets = []
+
+    def create_pair(self) -> Tuple[socket.socket, socket.socket]:
+        """Creates a pair of connected sockets whose traffic passes through the relay."""
+
+        sender_sock, relay_in = create_loopback_pair()
+        relay_out, receiver_sock = create_loopback_pair()
+        self.__sockets += [relay_in, relay_out]
+        self.__forward(relay_in, relay_out)
+        self.__forward(relay_out, relay_in)
+        return sender_sock, receiver_sock
+
+    def join(self):
+        for thread in self.__threads:
+            thread.join()
+        for sock in self.__sockets:
+            sock.close()
+
+    def __forward(self, source: socket.socket, destination: socket.socket):
+        packets: queue.Queue = queue.Queue()
+
+        def read():
+            while data := self.__recv(source):
+                packets.put((time.monotonic() + self.__delay, data))
+            packets.put((0, b""))
+
+        def deliver():
+            try:
+                while True:
+                    deliver_at, data = packets.get()
+                    if not data:
+                        # Propagate the end of the stream
+                        destination.shutdown(socket.SHUT_WR)
+                        return
+                    time.sleep(max(0, deliver_at - time.monotonic()))
+                    destination.sendall(data)
+            except OSError:
+                # The other end of the relay has already gone away
+                pass
+
+        for target in [read, deliver]:
+            thread = threading.Thread(target=target)
+            self.__threads.append(thread)
+            thread.start()
+
+    @staticmethod
+    def __recv(sock: socket.socket) -> bytes:
+        try:
+            return sock.recv(256 * 1024)
+        except OSError:
+            return b""
+
+
+class DisconnectingRelay:
+    """Forwards traffic between two socket pairs and cuts the connection once a given number of bytes has been
+    forwarded from the sender to the receiver, emulating a link that drops part of the way through a transfer. The
+    bytes at the given offsets of the sender's stream are flipped, emulating corruption that slips past TCP. The
+    sender's stream can also be recorded to inspect what went over the wire."""
+
+    def __init__(self, num_bytes_before_disconnect: int, corrupted_offsets: Tuple[int, ...] = (),
+                 record: bool = False):
+        self.num_bytes_forwarded: int = 0
+        self.forwarded_data: bytearray = bytearray()
+        self.__record: bool = record
+        self.__num_bytes_before_disconnect: int = num_bytes_before_disconnect
+        self.__corrupted_offsets: Tuple[int, ...] = corrupted_offsets
+        self.__thread: Optional[threading.Thread] = None
+
+    def create_pair(self) -> Tuple[socket.socket, socket.socket]:
+        """Creates a pair of connected sockets whose traffic passes through the relay."""
+
+        sender_sock, relay_in = socket.socketpair()
+        relay_out, receiver_sock = socket.socketpair()
+        self.__thread = threading.Thread(target=self.__forward, args=(relay_in, relay_out))
+        self.__thread.start()
+        return sender_sock, receiver_sock
+
+    def join(self):
+        self.__thread.join()
+
+    def __forward(self, relay_in: socket.socket, relay_out: socket.socket):
+        with relay_in, relay_out:
+            try:
+                while True:
+                    readable, _, _ = select.select([relay_in, relay_out], [], [])
+                    if relay_out in readable:
+                        if not (data := relay_out.recv(64 * 1024)):
+                            return
+                        relay_in.sendall(data)
+                    if relay_in in readable:
+                        budget = self.__num_bytes_before_disconnect - self.num_bytes_forwarded
+                        if not (data := relay_in.recv(min(64 * 1024, budget))):
+                            return
+                        data = bytearray(data)
+                        for offset in self.__corrupted_offsets:
+                            if 0 <= offset - self.num_bytes_forwarded < len(data):
+                                data[offset - self.num_bytes_forwarded] ^= 0xff
+                        relay_out.sendall(data)
+                        if self.__record:
+                            self.forwarded_data += data
+                        self.num_bytes_forwarded += len(data)
+                        if self.num_bytes_forwarded >= self.__num_bytes_before_disconnect:
+                            return
+            except OSError:
+                # Either end has already gone away
+                pass
+
+
+class LossyDatagramSocket(socket.socket):
+    """A UDP socket that drops a given share of the datagrams sent through it at random, emulating a lossy wireless
+    link, and flips the last byte of the datagrams with the given indices the first time they are sent."""
+
+    def __init__(self, family: socket.AddressFamily, loss_rate: float, corrupted_indices: Tuple[int, ...] = ()):
+        super().__init__(family, socket.SOCK_DGRAM)
+        self.num_datagrams_sent: int = 0
+        self.__loss_rate: float = loss_rate
+        self.__corrupted_indices: List[int] = list(corrupted_indices)
+        self.__random: random.Random = random.Random(0)
+
+    def send(self, data: memoryview, flags: int = 0) -> int:
+        self.num_datagrams_sent += 1
+        if self.__random.random() < self.__loss_rate:
+            return len(data)
+        _, datagram_index = datagrams.DATAGRAM_HEADER.unpack_from(data)
+        if datagram_index in self.__corrupted_indices:
+            self.__corrupted_indices.remove(datagram_index)
+            data = bytearray(data)
+            data[-1] ^= 0xff
+        return super().send(data, flags)
+
+
+class TestFileTransfer(unittest.TestCase):
+    def setUp(self):
+        # Give each test its own scratch directories for source and received files
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.received_dir = os.path.join(self.temp_dir.name, "received")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def __transfer(self, source_path: str, options: Optional[TransferOptions] = None) -> Optional[str]:
+        sender_sock, receiver_sock = socket.socketpair()
+        with sender_sock, receiver_sock:
+            return transfer(sender_sock, receiver_sock, source_path, self.received_dir, options)
+
+    def __transfer_counting_bytes(self, source_path: str, options: TransferOptions) -> Tuple[Optional[str], int]:
+        relay = DisconnectingRelay(2 ** 62)
+        sender_sock, receiver_sock = relay.create_pair()
+        with sender_sock, receiver_sock:
+            received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir, options)
+        relay.join()
+        return received_path, relay.num_bytes_forwarded
+
+    def test_transfer_round_trip(self):
+        """Test that a streamed file arrives intact with both transfer protocols."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 256 * 1024 + 123)
+        all_options = [
+            TransferOptions(TransferMode.STOP_AND_WAIT),
+            TransferOptions(window_size=4, ack_interval=3, zero_copy=False),
+            TransferOptions(window_size=4, ack_interval=3, zero_copy=True),
+        ]
+        for options in all_options:
+            received_path = self.__transfer(source_path, options)
+            self.assertIsNotNone(received_path)
+            self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+    def test_transfer_empty_file(self):
+        """Test that an empty file can be transferred."""
+
+        source_path = create_random_file(self.temp_dir.name, "empty.bin", 0)
+        received_path = self.__transfer(source_path)
+        self.assertIsNotNone(received_path)
+        self.assertEqual(os.path.getsize(received_path), 0)
+
+    def test_transfer_payload_resembling_end_marker(self):
+        """Test that file contents are never mistaken for the end of the transfer."""
+
+        source_path = os.path.join(self.temp_dir.name, "source.bin")
+        with open(source_path, "wb") as f:
+            f.write(b"done sending" + os.urandom(1000) + b"done sending")
+        for mode in TransferMode:
+            received_path = self.__transfer(source_path, TransferOptions(mode, zero_copy=False))
+            self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+    def test_receive_fragmented_stream(self):
+        """Test that chunk headers and payloads split into tiny segments are reassembled."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 10 * 1024 + 7)
+        sender_sock, relay_sock = socket.socketpair()
+        relay_out, receiver_sock = socket.socketpair()
+
+        def trickle():
+            # Forward the sender's stream three bytes at a time
+            while data := relay_sock.recv(3):
+                relay_out.sendall(data)
+                time.sleep(0)
+
+        def relay_acks():
+            while data := relay_out.recv(1024):
+                relay_sock.sendall(data)
+
+        with sender_sock, relay_sock, relay_out, receiver_sock:
+            for target in [trickle, relay_acks]:
+                threading.Thread(target=target, daemon=True).start()
+            received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                     TransferOptions(zero_copy=False))
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+    def test_transfer_memory_is_bounded(self):
+        """Test that peak memory during a transfer does not grow with the size of the file."""
+
+        peaks = []
+        for size in [1024 * 1024, 16 * 1024 * 1024]:
+            source_path = create_random_file(self.temp_dir.name, f"source_{size}.bin", size)
+            tracemalloc.start()
+            try:
+                received_path = self.__transfer(source_path)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            peaks.append(peak)
+            self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+        # A 16x larger file must not cost noticeably more memory, and neither transfer may hold the file in memory
+        small_peak, large_peak = peaks
+        self.assertLess(large_peak, 1024 * 1024)
+        self.assertLess(large_peak, small_peak + 64 * 1024)
+
+    def test_same_named_file_is_not_overwritten(self):
+        """Test that receiving a file with the name of an already received file keeps both."""
+
+        first_path = self.__transfer(create_random_file(self.temp_dir.name, "report.txt", 1000))
+        first_contents = open(first_path, "rb").read()
+        second_path = self.__transfer(create_random_file(self.temp_dir.name, "report.txt", 2000))
+        self.assertEqual(os.path.basename(first_path), "report.txt")
+        self.assertEqual(os.path.basename(second_path), "report (1).txt")
+        self.assertEqual(open(first_path, "rb").read(), first_contents)
+        self.assertEqual(os.path.getsize(second_path), 2000)
+
+    def test_file_is_rejected_when_disk_is_full(self):
+        """Test that a file that doesn't fit on the disk is rejected before any of it is sent."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 64 * 1024)
+        full_disk = shutil._ntuple_diskusage(total=1024 ** 3, used=1024 ** 3, free=0)
+        with mock.patch("shutil.disk_usage", return_value=full_disk), \
+                mock.patch("socket.socket.sendfile") as sendfile:
+            self.assertIsNone(self.__transfer(source_path))
+        sendfile.assert_not_called()
+        self.assertEqual(os.listdir(self.received_dir), [])
+
+    def test_interrupted_transfer_leaves_no_partial_file(self):
+        """Test that a transfer cut off part of the way through leaves nothing behind in the received files."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 256 * 1024)
+        sender_sock, receiver_sock = socket.socketpair()
+        with sender_sock, receiver_sock:
+            with open(source_path, "rb") as f:
+                req = ClientRequest(ClientRequestType.SEND_FILE, ["source.bin", str(256 * 1024), ""] +
+                                    TransferOptions().to_args())
+                framing.send_frame(sender_sock, FrameType.REQUEST, req.to_bytes())
+                framing.send_frame(sender_sock, FrameType.DATA, f.read(100 * 1024))
+            sender_sock.shutdown(socket.SHUT_WR)
+            self.assertIsNone(receive(receiver_sock, self.received_dir))
+        self.assertEqual(os.listdir(self.received_dir), [])
+
+    def test_delta_transfer_scales_with_change(self):
+        """Test that a delta transfer of a modified file only sends about as much as was changed, wherever the change
+        shifts the rest of the file."""
+
+        file_size = 8 * 1024 * 1024
+        basis_path = create_random_file(self.temp_dir.name, "basis.bin", file_size)
+        os.makedirs(self.received_dir)
+        with open(basis_path, "rb") as f:
+            basis = f.read()
+        edits = {
+            "unchanged": basis,
+            "overwritten": basis[:1000] + b"x" * 10 + basis[1010:5000000] + b"y" + basis[5000001:],
+            "inserted": basis[:3000000] + os.urandom(777) + basis[3000000:],
+            "deleted": basis[:6000000] + basis[6001000:],
+            "appended": basis + os.urandom(5000),
+        }
+        for edit, data in edits.items():
+            # Each delta replaces the earlier version => every edit starts from the basis again
+            shutil.copy(basis_path, os.path.join(self.received_dir, "source.bin"))
+            source_path = os.path.join(self.temp_dir.name, "source.bin")
+            with open(source_path, "wb") as f:
+                f.write(data)
+            received_path, num_bytes_sent = self.__transfer_counting_bytes(source_path, TransferOptions(delta=True))
+            self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False), edit)
+            self.assertLess(num_bytes_sent, file_size // 100, edit)
+
+    def test_delta_transfer_replaces_earlier_version(self):
+        """Test that each delta replaces the version it was applied to, so that the next one is taken against the
+        newest version instead of piling up copies that all differ from the first one."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 2 * 1024 * 1024)
+        self.__transfer(source_path, TransferOptions(delta=True))
+        for revision in range(3):
+            with open(source_path, "ab") as f:
+                f.write(os.urandom(1024 * 1024))
+            received_path, num_bytes_sent = self.__transfer_counting_bytes(source_path, TransferOptions(delta=True))
+            self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False), revision)
+            self.assertEqual(os.listdir(self.received_dir), ["source.bin"])
+            self.assertLess(num_bytes_sent, 1024 * 1024 + 100 * 1024, revision)
+
+    def test_delta_transfer_without_earlier_version(self):
+        """Test that a delta transfer sends the whole file when the receiver has no earlier version of it."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 1024 * 1024 + 5)
+        received_path, num_bytes_sent = self.__transfer_counting_bytes(source_path, TransferOptions(delta=True))
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertGreater(num_bytes_sent, 1024 * 1024)
+
+    def test_encrypted_delta_transfer(self):
+        """Test that an encrypted delta only sends about as much as was changed, without the changes being readable
+        off the wire."""
+
+        file_size = 4 * 1024 * 1024
+        basis_path = create_random_file(self.temp_dir.name, "basis.bin", file_size)
+        os.makedirs(self.received_dir)
+        shutil.copy(basis_path, os.path.join(self.received_dir, "source.bin"))
+        inserted = os.urandom(10000)
+        with open(basis_path, "rb") as basis, open(os.path.join(self.temp_dir.name, "source.bin"), "wb") as f:
+            data = basis.read()
+            f.write(data[:1000000] + inserted + data[1000000:])
+        relay = DisconnectingRelay(2 ** 62, record=True)
+        sender_sock, receiver_sock = relay.create_pair()
+        with sender_sock, receiver_sock:
+            received_path = transfer(sender_sock, receiver_sock, f.name, self.received_dir,
+                                     TransferOptions(delta=True, encrypt=True))
+        relay.join()
+        self.assertTrue(filecmp.cmp(f.name, received_path, shallow=False))
+        self.assertLess(relay.num_bytes_forwarded, file_size // 100)
+        self.assertNotIn(inserted[:100], relay.forwarded_data)
+
+    def test_compressed_round_trip(self):
+        """Test that compressed transfers arrive intact and take fewer bytes on the wire."""
+
+        source_path = create_log_file(self.temp_dir.name, "app.log", 20000)
+        file_size = os.path.getsize(source_path)
+        for compression in [Compression.ZLIB, Compression.LZMA]:
+            for compression_level in [0, 1, 9]:
+                options = TransferOptions(compression=compression, compression_level=compression_level)
+                received_path, num_bytes_sent = self.__transfer_counting_bytes(source_path, options)
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                if compression_level > 0:
+                    self.assertLess(num_bytes_sent, file_size // 2)
+                os.remove(received_path)
+
+    def test_compressed_empty_file(self):
+        """Test that an empty file can be sent compressed."""
+
+        source_path = create_random_file(self.temp_dir.name, "empty.bin", 0)
+        received_path = self.__transfer(source_path, TransferOptions(compression=Compression.ZLIB))
+        self.assertEqual(os.path.getsize(received_path), 0)
+
+    def test_incompressible_file_is_sent_uncompressed(self):
+        """Test that compression is skipped for a file whose sample looks incompressible."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 1024 * 1024)
+        metrics = CompressionMetrics()
+        sender_sock, receiver_sock = socket.socketpair()
+        with sender_sock, receiver_sock:
+            results = {}
+            sender_thread = threading.Thread(target=lambda: results.update(sent=socket_helpers.send_file(
+                sender_sock, source_path, TransferOptions(compression=Compression.LZMA), metrics)))
+            sender_thread.start()
+            received_path = receive(receiver_sock, self.received_dir)
+            sender_thread.join()
+        self.assertTrue(results["sent"])
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertEqual(metrics.compression, Compression.NONE)
+        self.assertGreater(metrics.sampled_entropy, constants.COMPRESSION_MAX_ENTROPY_BITS)
+
+    def test_consecutive_transfers_ending_on_ack_interval(self):
+        """Test that the final acknowledgement isn't mistaken for a periodic one when the number of chunks is a
+        multiple of the acknowledgement interval, which would leave a stale acknowledgement in the stream."""
+
+        options = TransferOptions(window_size=4, ack_interval=2, zero_copy=False)
+        sender_sock, receiver_sock = socket.socketpair()
+        with sender_sock, receiver_sock:
+            for name in ["first.bin", "second.bin"]:
+                source_path = create_random_file(self.temp_dir.name, name, 4 * 4096)
+                received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir, options)
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+    def test_resume_after_disconnects_at_random_offsets(self):
+        """Test that a transfer cut off repeatedly at random offsets resumes where it stopped each time instead of
+        starting over, even though the receiver starts from scratch for every attempt."""
+
+        file_size = 4 * 1024 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        rng = random.Random(7)
+        num_bytes_sent = 0
+        num_bytes_sent_from_scratch = 0
+        for attempt in range(20):
+            # The last attempt is allowed to complete
+            num_bytes_before_disconnect = rng.randint(1, file_size) if attempt < 4 else 2 * file_size
+            relay = DisconnectingRelay(num_bytes_before_disconnect)
+            sender_sock, receiver_sock = relay.create_pair()
+            with sender_sock, receiver_sock:
+                received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir)
+            relay.join()
+            num_bytes_sent += relay.num_bytes_forwarded
+            num_bytes_sent_from_scratch += min(num_bytes_before_disconnect, file_size)
+            if received_path is not None:
+                break
+            # Only hidden temporary files are left behind by an interrupted transfer
+            self.assertTrue(all(name.startswith(".") for name in os.listdir(self.received_dir)))
+        self.assertIsNotNone(received_path)
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertEqual(os.listdir(self.received_dir), ["source.bin"])
+        self.assertLess(num_bytes_sent, num_bytes_sent_from_scratch)
+
+    def test_corrupt_chunks_are_repaired(self):
+        """Test that chunks corrupted on the way are detected by the manifest and sent again, including one in the
+        last leaf, whose repair is only requested after the sender has finished the file."""
+
+        file_size = 3 * 1024 * 1024 + 512 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        # The request and frame headers are tiny, so both offsets land in the payload of a DATA frame
+        relay = DisconnectingRelay(2 ** 62, corrupted_offsets=(512 * 1024, 3 * 1024 * 1024 + 256 * 1024))
+        sender_sock, receiver_sock = relay.create_pair()
+        with sender_sock, receiver_sock:
+            received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir)
+        relay.join()
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        # Only the two corrupt leaves were sent again
+        self.assertGreater(relay.num_bytes_forwarded, file_size + constants.MERKLE_LEAF_SIZE + 512 * 1024)
+        self.assertLess(relay.num_bytes_forwarded, file_size + 2 * constants.MERKLE_LEAF_SIZE)
+
+    def test_chunk_that_stays_corrupt_fails_transfer(self):
+        """Test that a transfer gives up on a chunk that fails verification every time it is sent."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 2 * 1024 * 1024)
+        results = {}
+        sender_sock, receiver_sock = socket.socketpair()
+        with mock.patch.object(merkle, "hash_leaf", return_value=bytes(merkle.HASH_SIZE)):
+
+            def send():
+                results["sent"] = socket_helpers.send_file(sender_sock, source_path)
+
+            sender_thread = threading.Thread(target=send)
+            sender_thread.start()
+            with receiver_sock:
+                self.assertIsNone(receive(receiver_sock, self.received_dir))
+            sender_thread.join()
+        sender_sock.close()
+        self.assertFalse(results["sent"])
+        self.assertEqual(os.listdir(self.received_dir), [])
+
+    def test_unverified_round_trip(self):
+        """Test that a transfer without a manifest still arrives intact."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 1024 * 1024 + 17)
+        received_path = self.__transfer(source_path, TransferOptions(verify=False))
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+    def test_encrypted_round_trip(self):
+        """Test that encrypted files of various sizes arrive intact without any scratch file being left behind on
+        either end."""
+
+        sizes = [0, 1, constants.ENCRYPTION_CHUNK_SIZE, 3 * constants.ENCRYPTION_CHUNK_SIZE + 123]
+        for options in [TransferOptions(encrypt=True), TransferOptions(TransferMode.STOP_AND_WAIT, encrypt=True)]:
+            for size in sizes:
+                with self.subTest(mode=options.mode, size=size):
+                    source_path = create_random_file(self.temp_dir.name, "source.bin", size)
+                    received_path = self.__transfer(source_path, options)
+                    self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                    os.remove(received_path)
+                    self.assertEqual(os.listdir(self.received_dir), [])
+                    self.assertEqual(os.listdir(self.temp_dir.name), ["received", "source.bin"])
+
+    def test_untrusted_public_key_is_refused(self):
+        """Test that no transfer key is wrapped with a public key that the sender doesn't trust."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 1000)
+        presented_keys = []
+
+        def check_public_key(_: socket.socket, public_key_pem: bytes) -> bool:
+            presented_keys.append(public_key_pem)
+            return False
+
+        sender_sock, receiver_sock = create_loopback_pair()
+        with sender_sock, receiver_sock, mock.patch("secure_drop.crypto.wrap_key") as wrap_key:
+            options = TransferOptions(encrypt=True, check_public_key=check_public_key)
+            self.assertIsNone(transfer(sender_sock, receiver_sock, source_path, self.received_dir, options))
+        self.assertEqual(presented_keys, [crypto.get_public_key_pem()])
+        wrap_key.assert_not_called()
+        self.assertNotIn("source.bin", os.listdir(self.received_dir))
+
+    def test_encrypted_transfer_hides_plaintext(self):
+        """Test that none of the file's contents can be read off the wire."""
+
+        source_path = create_log_file(self.temp_dir.name, "source.log", 10000)
+        with open(source_path, "rb") as f:
+            first_line = f.readline()
+        relay = DisconnectingRelay(2 ** 62, record=True)
+        sender_sock, receiver_sock = relay.create_pair()
+        with sender_sock, receiver_sock:
+            received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                     TransferOptions(encrypt=True))
+        relay.join()
+        wire = relay.forwarded_data
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertGreater(len(wire), os.path.getsize(source_path))
+        self.assertNotIn(first_line, wire)
+
+    def test_tampered_encrypted_chunk_fails_transfer(self):
+        """Test that a chunk changed on the way fails authentication and nothing is kept of the file."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 4 * constants.ENCRYPTION_CHUNK_SIZE)
+        # The request and key exchange are small, so the offset lands in the payload of the second chunk
+        relay = DisconnectingRelay(2 ** 62, corrupted_offsets=(100 * 1024,))
+        sender_sock, receiver_sock = relay.create_pair()
+        with sender_sock, receiver_sock:
+            self.assertIsNone(transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                       TransferOptions(encrypt=True)))
+        relay.join()
+        self.assertEqual(os.listdir(self.received_dir), [])
+
+    def test_encrypted_compressed_round_trip(self):
+        """Test that an encrypted file is compressed before it is sealed, so it still takes fewer bytes on the wire
+        without any of it being readable off the wire."""
+
+        source_path = create_log_file(self.temp_dir.name, "source.log", 20000)
+        with open(source_path, "rb") as f:
+            first_line = f.readline()
+        for compression in [Compression.ZLIB, Compression.LZMA]:
+            with self.subTest(compression=compression):
+                relay = DisconnectingRelay(2 ** 62, record=True)
+                sender_sock, receiver_sock = relay.create_pair()
+                with sender_sock, receiver_sock:
+                    received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                             TransferOptions(compression=compression, encrypt=True))
+                relay.join()
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                self.assertLess(relay.num_bytes_forwarded, os.path.getsize(source_path) // 2)
+                self.assertNotIn(first_line, relay.forwarded_data)
+                os.remove(received_path)
+
+    def test_tampered_sealed_frame_fails_transfer(self):
+        """Test that a compressed frame changed on the way fails authentication and nothing is kept of the file."""
+
+        source_path = create_log_file(self.temp_dir.name, "source.log", 20000)
+        relay = DisconnectingRelay(2 ** 62, corrupted_offsets=(2000,))
+        sender_sock, receiver_sock = relay.create_pair()
+        with sender_sock, receiver_sock:
+            self.assertIsNone(transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                       TransferOptions(compression=Compression.ZLIB, encrypt=True)))
+        relay.join()
+        self.assertEqual(os.listdir(self.received_dir), [])
+
+    def test_resume_encrypted_transfer(self):
+        """Test that an interrupted encrypted transfer resumes where it stopped under a new transfer key."""
+
+        file_size = 1024 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        relay = DisconnectingRelay(file_size // 2)
+        sender_sock, receiver_sock = relay.create_pair()
+        with sender_sock, receiver_sock:
+            self.assertIsNone(transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                       TransferOptions(encrypt=True)))
+        relay.join()
+        received_path, num_bytes_sent = self.__transfer_counting_bytes(source_path, TransferOptions(encrypt=True))
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertLess(num_bytes_sent, file_size * 3 // 4)
+
+    def test_changed_file_is_not_resumed(self):
+        """Test that an interrupted transfer isn't resumed once the file has changed."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 1024 * 1024)
+        relay = DisconnectingRelay(512 * 1024)
+        sender_sock, receiver_sock = relay.create_pair()
+        with sender_sock, receiver_sock:
+            self.assertIsNone(transfer(sender_sock, receiver_sock, source_path, self.received_dir))
+        relay.join()
+        create_random_file(self.temp_dir.name, "source.bin", 1024 * 1024)
+        received_path = self.__transfer(source_path)
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+    def test_sparse_file_skips_holes(self):
+        """Test that only the data of a sparse file goes over the wire and takes up disk space on the receiver, with
+        holes at its start, in its middle and at its end."""
+
+        file_size = 64 * 1024 * 1024
+        data_size = 2 * 256 * 1024
+        source_path = os.path.join(self.temp_dir.name, "disk.img")
+        with open(source_path, "wb") as f:
+            f.truncate(file_size)
+            for position in [1024 * 1024, 40 * 1024 * 1024 + 123]:
+                f.seek(position)
+                f.write(os.urandom(data_size // 2))
+        if os.stat(source_path).st_blocks * 512 >= file_size:
+            self.skipTest("The file system doesn't support sparse files")
+        all_options = [TransferOptions(), TransferOptions(zero_copy=False), TransferOptions(verify=False)]
+        for options in all_options:
+            with self.subTest(zero_copy=options.zero_copy, verify=options.verify):
+                received_path, num_bytes_forwarded = self.__transfer_counting_bytes(source_path, options)
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                self.assertLess(num_bytes_forwarded, data_size + 64 * 1024)
+                self.assertLess(os.stat(received_path).st_blocks * 512, 8 * data_size)
+                os.remove(received_path)
+        received_path, num_bytes_forwarded = self.__transfer_counting_bytes(source_path, TransferOptions(sparse=False))
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertGreater(num_bytes_forwarded, file_size)
+
+    def test_local_handover(self):
+        """Test that a file handed over to a receiver on the same host arrives intact without any of it being sent, and
+        that the holes of a sparse file are kept."""
+
+        sparse_path = os.path.join(self.temp_dir.name, "sparse.img")
+        with open(sparse_path, "wb") as f:
+            f.truncate(16 * 1024 * 1024)
+            f.seek(5 * 1024 * 1024)
+            f.write(os.urandom(1024))
+        paths = [create_random_file(self.temp_dir.name, f"source{size}.bin", size)
+                 for size in [0, 1, 3 * 1024 * 1024 + 5]]
+        # Data that was sent would have to be written by the receiver
+        with mock.patch.object(IncomingFile, "write", side_effect=AssertionError("Data was sent")):
+            for source_path in paths + [sparse_path]:
+                with self.subTest(size=os.path.getsize(source_path)):
+                    received_path = self.__transfer(source_path, TransferOptions(local=True, encrypt=True))
+                    self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertLess(os.stat(received_path).st_blocks * 512, 1024 * 1024)
+
+    def test_local_handover_needs_unix_socket(self):
+        """Test that a file is sent as usual over a connection that can't pass descriptors."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 1024 * 1024 + 3)
+        sender_sock, receiver_sock = create_loopback_pair()
+        with sender_sock, receiver_sock:
+            received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                     TransferOptions(local=True))
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+    @unittest.skipUnless(hasattr(socket, "SO_PEERCRED"), "Peer credentials are needed to hand files over")
+    def test_local_handover_needs_same_user(self):
+        """Test that a file is encrypted and sent as usual to a server run by another user on the same host."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 1024 * 1024 + 3)
+        with mock.patch("os.getuid", return_value=os.getuid() + 1), \
+                mock.patch.object(framing, "send_frame_with_fd", side_effect=AssertionError("Handed over")):
+            received_path = self.__transfer(source_path, TransferOptions(local=True, encrypt=True))
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+    def test_local_server_socket_is_private(self):
+        """Test that only the user running a server can connect to its Unix domain socket."""
+
+        server = start_server(self, self.received_dir)
+        if (local_socket_path := server.get_local_socket_path()) is None:
+            self.skipTest("The platform has no Unix domain sockets")
+        self.assertEqual(stat.S_IMODE(os.stat(local_socket_path).st_mode), 0o600)
+
+
+class TestDatagramTransfer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.received_dir = os.path.join(self.temp_dir.name, "received")
+        self.sockets: List[LossyDatagramSocket] = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def __transfer(self, source_path: str, options: TransferOptions, loss_rate: float = 0,
+                   corrupted_indices: Tuple[int, ...] = ()) -> Optional[str]:
+        def create_socket(family: socket.AddressFamily) -> LossyDatagramSocket:
+            self.sockets.append(LossyDatagramSocket(family, loss_rate, corrupted_indices))
+            return self.sockets[-1]
+
+        sender_sock, receiver_sock = create_loopback_pair()
+        with sender_sock, receiver_sock, mock.patch.object(datagrams, "create_socket", create_socket):
+            return transfer(sender_sock, receiver_sock, source_path, self.received_dir, options)
+
+    def test_datagram_round_trip(self):
+        """Test that a file sent as datagrams arrives intact, verified, unverified or encrypted."""
+
+        all_options = [TransferOptions(datagrams=True), TransferOptions(datagrams=True, verify=False),
+                       TransferOptions(datagrams=True, encrypt=True)]
+        for file_size in [0, 1, 3 * 1024 * 1024 + 123]:
+            source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+            for options in all_options:
+                with self.subTest(file_size=file_size, verify=options.verify, encrypt=options.encrypt):
+                    received_path = self.__transfer(source_path, options)
+                    self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                    os.remove(received_path)
+
+    def test_lost_datagrams_are_sent_again(self):
+        """Test that datagrams lost on the way are sent again, and only those."""
+
+        file_size = 4 * 1024 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        received_path = self.__transfer(source_path, TransferOptions(datagrams=True), loss_rate=0.1)
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        num_datagrams = datagrams.get_num_datagrams(file_size, datagrams.get_data_size(False))
+        num_datagrams_sent = sum(sock.num_datagrams_sent for sock in self.sockets)
+        self.assertGreater(num_datagrams_sent, num_datagrams)
+        self.assertLess(num_datagrams_sent, num_datagrams * 1.5)
+
+    def test_corrupt_datagrams_are_sent_again(self):
+        """Test that corrupt datagrams are sent again, whether they fail their leaf or their authentication."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 3 * 1024 * 1024)
+        for options in [TransferOptions(datagrams=True), TransferOptions(datagrams=True, encrypt=True)]:
+            with self.subTest(encrypt=options.encrypt):
+                # The second datagram ends in the middle of a leaf, and the other straddles two leaves
+                received_path = self.__transfer(source_path, options, corrupted_indices=(1, 720))
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                os.remove(received_path)
+
+    def test_datagrams_need_ip_connection(self):
+        """Test that a transfer over a connection without an IP address to send datagrams to uses the connection."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 1024 * 1024 + 3)
+        sender_sock, receiver_sock = socket.socketpair()
+        with sender_sock, receiver_sock:
+            received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                     TransferOptions(datagrams=True))
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+
+class TestBandwidthLimit(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.received_dir = os.path.join(self.temp_dir.name, "received")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_capped_transfer_keeps_to_rate(self):
+        """Test that a capped transfer takes at least as long as the cap allows, whichever end is capped."""
+
+        file_size = 512 * 1024
+        rate = 2 * 1024 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        for capped_end in ["sender", "receiver"]:
+            with self.subTest(capped_end=capped_end):
+                global_bucket = TokenBucket(rate)
+                bucket = TokenBucket(parent=global_bucket)
+                sender_sock, receiver_sock = socket.socketpair()
+                with sender_sock, receiver_sock:
+                    start = time.monotonic()
+                    if capped_end == "sender":
+                        received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                                 TransferOptions(bucket=bucket))
+                    else:
+                        received_path = self.__transfer_capping_receiver(sender_sock, receiver_sock, source_path,
+                                                                         bucket)
+                    elapsed = time.monotonic() - start
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                os.remove(received_path)
+                self.assertGreater(elapsed, file_size / rate * 0.8)
+
+    def test_cap_is_changed_during_transfer(self):
+        """Test that lifting the cap speeds up a transfer that is already running."""
+
+        file_size = 4 * 1024 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        # At this rate the transfer would take 40 seconds
+        bucket = TokenBucket(100 * 1024)
+        threading.Timer(0.5, bucket.set_rate, (None,)).start()
+        sender_sock, receiver_sock = socket.socketpair()
+        start = time.monotonic()
+        with sender_sock, receiver_sock:
+            received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                     TransferOptions(bucket=bucket))
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_cancelled_transfer_can_be_resumed(self):
+        """Test that a cancelled transfer gives up without the whole file being sent, and resumes where it stopped."""
+
+        file_size = 4 * 1024 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        cancelled = threading.Event()
+        threading.Timer(0.3, cancelled.set).start()
+        sender_sock, receiver_sock = socket.socketpair()
+        with sender_sock, receiver_sock:
+            self.assertIsNone(transfer(sender_sock, receiver_sock, source_path, self.received_dir,
+                                       TransferOptions(bucket=TokenBucket(file_size), cancelled=cancelled)))
+        sender_sock, receiver_sock = socket.socketpair()
+        with sender_sock, receiver_sock:
+            received_path = transfer(sender_sock, receiver_sock, source_path, self.received_dir)
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+
+    def test_control_traffic_is_not_held_back(self):
+        """Test that control traffic goes through a bucket in debt at once, while bulk data waits."""
+
+        bucket = TokenBucket(1024 * 1024, parent=TokenBucket(1024 * 1024))
+        start = time.monotonic()
+        bucket.charge(512 * 1024)
+        self.assertLess(time.monotonic() - start, 0.1)
+        bucket.consume(1)
+        self.assertGreater(time.monotonic() - start, 0.4)
+        with self.assertRaises(ValueError):
+            bucket.set_rate(0)
+
+    def test_parse_byte_rate(self):
+        """Test that rates are read with binary units and invalid rates are rejected."""
+
+        self.assertEqual(utils.parse_byte_rate("512"), 512)
+        self.assertEqual(utils.parse_byte_rate("64k"), 64 * 1024)
+        self.assertEqual(utils.parse_byte_rate("1.5MB/s"), 1.5 * 1024 * 1024)
+        for rate in ["0", "-1k", "fast", ""]:
+            self.assertIsNone(utils.parse_byte_rate(rate))
+        self.assertEqual(utils.format_byte_rate(1.5 * 1024 * 1024), "1.5 MiB/s")
+
+    def __transfer_capping_receiver(self, sender_sock: socket.socket, receiver_sock: socket.socket,
+                                    source_path: str, bucket: TokenBucket) -> Optional[str]:
+        sender_thread = threading.Thread(target=socket_helpers.send_file, args=(sender_sock, source_path))
+        sender_thread.start()
+        req = socket_helpers.recv_req(receiver_sock)
+        incoming_file = IncomingFile(self.received_dir, req.args[0], int(req.args[1]), req.args[2])
+        self.assertTrue(incoming_file.reserve())
+        options = TransferOptions.from_args(req.args[3:])
+        # The server caps a transfer by the bucket of the contact it comes from
+        options.bucket = bucket
+        received = socket_helpers.receive_file(receiver_sock, incoming_file, options)
+        sender_thread.join()
+        return incoming_file.final_path if received else None
+
+class TestFanOutTransfer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def __fan_out(self, source_path: str, options: TransferOptions,
+                  receiver_buckets: List[Optional[TokenBucket]]) -> List[Tuple[Optional[str], float]]:
+        """Sends a file to one receiver per bucket through a shared reader, and returns the path each receiver received
+        the file at along with how long it took."""
+
+        content_key = os.urandom(constants.TRANSFER_KEY_SIZE) if options.encrypt else None
+        reader = SharedFileReader(source_path, len(receiver_buckets), content_key)
+        results: List[Tuple[Optional[str], float]] = [(None, 0)] * len(receiver_buckets)
+        start = time.monotonic()
+
+        def send(view_index: int):
+            with reader.views[view_index] as view:
+                socket_helpers.send_file(sender_socks[view_index], source_path, options, shared_file=view)
+
+        def receive_capped(view_index: int):
+            target_dir = os.path.join(self.temp_dir.name, f"received{view_index}")
+            req = socket_helpers.recv_req(receiver_socks[view_index])
+            incoming_file = IncomingFile(target_dir, req.args[0], int(req.args[1]), req.args[2])
+            incoming_file.reserve()
+            receive_options = TransferOptions.from_args(req.args[3:])
+            receive_options.bucket = receiver_buckets[view_index]
+            if socket_helpers.receive_file(receiver_socks[view_index], incoming_file, receive_options):
+                results[view_index] = (incoming_file.final_path, time.monotonic() - start)
+
+        socket_pairs = [socket.socketpair() for _ in receiver_buckets]
+        sender_socks = [pair[0] for pair in socket_pairs]
+        receiver_socks = [pair[1] for pair in socket_pairs]
+        threads = [threading.Thread(target=target, args=[view_index]) for view_index in range(len(receiver_buckets))
+                   for target in [send, receive_capped]]
+        reader.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        reader.close()
+        for sender_sock, receiver_sock in socket_pairs:
+            sender_sock.close()
+            receiver_sock.close()
+        return results
+
+    def test_fan_out_round_trip(self):
+        """Test that a file read once arrives intact at every receiver with each kind of transfer."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 3 * 1024 * 1024 + 123)
+        all_options = [TransferOptions(), TransferOptions(verify=False), TransferOptions(encrypt=True),
+                       TransferOptions(TransferMode.STOP_AND_WAIT)]
+        for options in all_options:
+            with self.subTest(verify=options.verify, encrypt=options.encrypt, mode=options.mode):
+                for received_path, _ in self.__fan_out(source_path, options, [None] * 3):
+                    self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                    os.remove(received_path)
+
+    def test_slow_receiver_does_not_stall_others(self):
+        """Test that receivers that keep up finish long before one that is capped, which still gets the whole file."""
+
+        file_size = 16 * 1024 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        # The capped receiver takes two seconds
+        results = self.__fan_out(source_path, TransferOptions(), [None, TokenBucket(file_size / 2), None])
+        for received_path, _ in results:
+            self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertGreater(results[1][1], 1.5)
+        self.assertLess(max(results[0][1], results[2][1]), 1)
+
+    def test_late_view_does_not_hold_up_others(self):
+        """Test that the shared reads start with the first view, and that a view that starts late still reads the
+        whole file."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 4 * 1024 * 1024)
+        with open(source_path, "rb") as f:
+            data = f.read()
+        reader = SharedFileReader(source_path, 2)
+        reader.start()
+        try:
+            first_view, late_view = reader.views
+            reading = threading.Thread(target=lambda: self.assertEqual(first_view.read(), data))
+            reading.start()
+            reading.join(5)
+            self.assertFalse(reading.is_alive())
+            first_view.close()
+            self.assertEqual(late_view.read(), data)
+            late_view.close()
+        finally:
+            for view in reader.views:
+                view.close()
+            reader.close()
+
+    def test_file_is_read_once(self):
+        """Test that receivers that keep up take every block and every leaf hash from the shared reads."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 4 * 1024 * 1024)
+        shared_read_into = SharedFileReader.read_into
+        num_private_reads = 0
+
+        def read_into(reader: SharedFileReader, *args) -> Optional[int]:
+            nonlocal num_private_reads
+            if (num_bytes := shared_read_into(reader, *args)) is None:
+                num_private_reads += 1
+            return num_bytes
+
+        with mock.patch.object(SharedFileReader, "read_into", read_into), \
+                mock.patch("secure_drop.networking.merkle.hash_leaf", side_effect=merkle.hash_leaf) as hash_leaf:
+            for received_path, _ in self.__fan_out(source_path, TransferOptions(), [None] * 3):
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertEqual(num_private_reads, 0)
+        hash_leaf.assert_not_called()
+
+    def test_file_is_encrypted_once(self):
+        """Test that a file sent to many receivers is encrypted once under a content key each of them unwraps."""
+
+        file_size = 2 * 1024 * 1024 + 123
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        with mock.patch("secure_drop.networking.encryption.encrypt_chunk",
+                        side_effect=encryption.encrypt_chunk) as encrypt_chunk:
+            for received_path, _ in self.__fan_out(source_path, TransferOptions(encrypt=True), [None] * 4):
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertEqual(encrypt_chunk.call_count, encryption.get_num_chunks(0, file_size))
+
+
+class TestArchiveTransfer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_dir = os.path.join(self.temp_dir.name, "photos")
+        self.received_dir = os.path.join(self.temp_dir.name, "received")
+        os.makedirs(os.path.join(self.source_dir, "2026", "january"))
+        os.makedirs(os.path.join(self.source_dir, "empty"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def __send_files(self, files: List[Tuple[str, str]], options: Optional[TransferOptions] = None,
+                     relay: Optional[DisconnectingRelay] = None) -> Tuple[Optional[List[str]], int]:
+        """Sends files as an archive and returns the paths of the received files along with the number of bytes the
+        sender sent."""
+
+        relay = relay or DisconnectingRelay(2 ** 62)
+        sender_sock, receiver_sock = relay.create_pair()
+        results = {}
+        with sender_sock, receiver_sock:
+            sender_thread = threading.Thread(target=lambda: results.update(
+                sent=socket_helpers.send_archive(sender_sock, files, options)))
+            sender_thread.start()
+            received_paths = receive_files(receiver_sock, self.received_dir)
+            if received_paths is None:
+                # Hang up like the server does, so that a sender still waiting for an acknowledgement gives up
+                receiver_sock.shutdown(socket.SHUT_RDWR)
+            sender_thread.join()
+        relay.join()
+        return received_paths if results["sent"] else None, relay.num_bytes_forwarded
+
+    def test_directory_round_trip(self):
+        """Test that a directory tree arrives intact under its own name, including empty and large files."""
+
+        create_random_file(self.source_dir, "large.bin", 3 * 1024 * 1024 + 7)
+        create_random_file(self.source_dir, "empty.bin", 0)
+        for i in range(50):
+            create_random_file(os.path.join(self.source_dir, "2026", "january"), f"{i}.jpg", i * 100)
+        files = utils.get_files_to_send(self.source_dir)
+        self.assertEqual(len(files), 52)
+        for options in [TransferOptions(), TransferOptions(zero_copy=False),
+                        TransferOptions(TransferMode.STOP_AND_WAIT)]:
+            received_paths, _ = self.__send_files(files, options)
+            self.assertEqual(len(received_paths), len(files))
+            for file_path, relative_path in files:
+                received_path = os.path.join(self.received_dir, *relative_path.split("/"))
+                self.assertTrue(filecmp.cmp(file_path, received_path, shallow=False))
+            shutil.rmtree(self.received_dir)
+
+    def test_encrypted_archive_round_trip(self):
+        """Test that neither the names nor the contents of the files in an encrypted archive can be read off the
+        wire, and that a tampered frame fails the archive."""
+
+        create_random_file(self.source_dir, "large.bin", 3 * 1024 * 1024 + 7)
+        log_path = create_log_file(os.path.join(self.source_dir, "2026"), "secret-plans.log", 1000)
+        with open(log_path, "rb") as f:
+            first_line = f.readline()
+        files = utils.get_files_to_send(self.source_dir)
+        for options in [TransferOptions(encrypt=True), TransferOptions(TransferMode.STOP_AND_WAIT, encrypt=True)]:
+            relay = DisconnectingRelay(2 ** 62, record=True)
+            received_paths, _ = self.__send_files(files, options, relay)
+            self.assertEqual(len(received_paths), len(files))
+            for file_path, relative_path in files:
+                received_path = os.path.join(self.received_dir, *relative_path.split("/"))
+                self.assertTrue(filecmp.cmp(file_path, received_path, shallow=False))
+            self.assertNotIn(b"secret-plans", relay.forwarded_data)
+            self.assertNotIn(first_line, relay.forwarded_data)
+            shutil.rmtree(self.received_dir)
+        received_paths, _ = self.__send_files(files, TransferOptions(encrypt=True),
+                                              DisconnectingRelay(2 ** 62, corrupted_offsets=(100 * 1024,)))
+        self.assertIsNone(received_paths)
+        # Entries that were committed before the tampered frame are kept, but nothing of the tampered one is
+        kept_paths = [os.path.join(self.received_dir, *relative_path.split("/")) for _, relative_path in files]
+        kept_files = [(file_path, kept_path) for (file_path, _), kept_path in zip(files, kept_paths)
+                      if os.path.exists(kept_path)]
+        self.assertLess(len(kept_files), len(files))
+        self.assertTrue(all(filecmp.cmp(file_path, kept_path, shallow=False) for file_path, kept_path in kept_files))
+
+    def test_glob_pattern(self):
+        """Test that the files matched by a glob pattern are sent under their own names."""
+
+        for name in ["a.log", "b.log", "c.txt"]:
+            create_random_file(self.source_dir, name, 10)
+        files = utils.get_files_to_send(os.path.join(self.source_dir, "*.log"))
+        self.assertEqual([relative_path for _, relative_path in files], ["a.log", "b.log"])
+
+    def test_per_file_overhead_is_small(self):
+        """Test that each small file only costs a few bytes of header on top of its contents."""
+
+        num_files = 1000
+        for i in range(num_files):
+            create_random_file(self.source_dir, f"{i:04}.txt", 100)
+        files = utils.get_files_to_send(self.source_dir)
+        received_paths, num_bytes_sent = self.__send_files(files)
+        self.assertEqual(len(received_paths), num_files)
+        # An ENTRY frame and a DATA frame header per file, plus the relative path
+        overhead_per_file = (num_bytes_sent - num_files * 100) / num_files
+        max_overhead_per_file = 2 * framing.FRAME_HEADER.size + ENTRY_HEADER.size + len("photos/0000.txt")
+        self.assertLess(overhead_per_file, max_overhead_per_file + 4)
+
+    def test_unsafe_entry_name_is_rejected(self):
+        """Test that an entry can't be unpacked outside of the received files directory."""
+
+        for name in ["../escaped.bin", "/tmp/escaped.bin", "a/../../escaped.bin"]:
+            sender_sock, receiver_sock = socket.socketpair()
+            with sender_sock, receiver_sock:
+                req = ClientRequest(ClientRequestType.SEND_ARCHIVE, ["1", "4"] + TransferOptions().to_args())
+                framing.send_frame(sender_sock, FrameType.REQUEST, req.to_bytes())
+                framing.send_frame(sender_sock, FrameType.ENTRY, ENTRY_HEADER.pack(4) + name.encode())
+                framing.send_frame(sender_sock, FrameType.DATA, b"evil")
+                framing.send_frame(sender_sock, FrameType.END)
+                self.assertIsNone(receive_files(receiver_sock, self.received_dir))
+            self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, "escaped.bin")))
+            self.assertFalse(os.path.exists("/tmp/escaped.bin"))
+
+
+class TestStripedTransfer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.received_dir = os.path.join(self.temp_dir.name, "received")
+        server = start_server(self, self.received_dir)
+        self.sock = socket.create_connection((constants.SERVER_IP, server.get_port()))
+
+    def tearDown(self):
+        self.sock.close()
+        self.temp_dir.cleanup()
+
+    def test_stripes_cover_file(self):
+        """Test that the stripes of a file are contiguous, don't overlap, and start on chunk boundaries."""
+
+        for file_size in [0, 1, constants.FILE_CHUNK_SIZE, 10 * constants.FILE_CHUNK_SIZE + 1, 3 * 1024 * 1024]:
+            for num_streams in [1, 3, 8]:
+                stripes = StripedTransfer.get_stripes(file_size, num_streams)
+                self.assertLessEqual(len(stripes), num_streams)
+                self.assertEqual(sum(end - start for start, end in stripes), file_size)
+                self.assertTrue(all(stripes[i][1] == stripes[i + 1][0] for i in range(len(stripes) - 1)))
+                self.assertTrue(all(start % constants.FILE_CHUNK_SIZE == 0 and start < end for start, end in stripes))
+
+    def test_striped_round_trip(self):
+        """Test that a file striped across several connections is reassembled intact."""
+
+        for num_streams in [2, 5]:
+            for zero_copy in [False, True]:
+                source_path = create_random_file(self.temp_dir.name, "source.bin", 3 * 1024 * 1024 + 123)
+                options = TransferOptions(zero_copy=zero_copy, num_streams=num_streams)
+                self.assertTrue(socket_helpers.send_file(self.sock, source_path, options))
+                received_path = os.path.join(self.received_dir, "source.bin")
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                os.remove(received_path)
+
+    def test_striped_empty_file(self):
+        """Test that an empty file, which has no stripes, is still received."""
+
+        source_path = create_random_file(self.temp_dir.name, "empty.bin", 0)
+        self.assertTrue(socket_helpers.send_file(self.sock, source_path, TransferOptions(num_streams=4)))
+        self.assertEqual(os.path.getsize(os.path.join(self.received_dir, "empty.bin")), 0)
+
+    def test_encrypted_striped_round_trip(self):
+        """Test that every stripe of an encrypted file is sealed, and that the file is reassembled intact."""
+
+        for file_size in [3 * 1024 * 1024 + 123, 0]:
+            with self.subTest(file_size=file_size):
+                source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+                with mock.patch("secure_drop.networking.encryption.encrypt_chunk",
+                                wraps=encryption.encrypt_chunk) as seal:
+                    self.assertTrue(socket_helpers.send_file(self.sock, source_path,
+                                                             TransferOptions(num_streams=3, encrypt=True)))
+                stripes = StripedTransfer.get_stripes(file_size, 3)
+                self.assertEqual(seal.call_count, sum(encryption.get_num_chunks(start, end) for start, end in stripes))
+                received_path = os.path.join(self.received_dir, "source.bin")
+                self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+                os.remove(received_path)
+
+    def test_unknown_stripe_is_refused(self):
+        """Test that a stripe can't be claimed without the token of a transfer in progress."""
+
+        req = ClientRequest(ClientRequestType.SEND_FILE_STRIPE, ["0" * 32, "0"])
+        framing.send_frame(self.sock, FrameType.REQUEST, req.to_bytes())
+        res = ServerResponse.from_bytes(framing.recv_frame(self.sock, FrameType.RESPONSE))
+        self.assertFalse(res.bool_res)
+
+
+class TestSwarmTransfer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.received_dir = os.path.join(self.temp_dir.name, "received")
+        servers = [start_server(self, self.received_dir) for _ in range(4)]
+        self.socks = [socket.create_connection((constants.SERVER_IP, server.get_port())) for server in servers]
+
+    def tearDown(self):
+        for sock in self.socks:
+            sock.close()
+        self.temp_dir.cleanup()
+
+    def test_swarm_round_trip(self):
+        """Test that every receiver gets the file intact while the sender's uplink carries it about once, and that the
+        time to reach every receiver is far below that of sending it to each in turn."""
+
+        file_size = 8 * 1024 * 1024 + 123
+        rate = 8 * 1024 * 1024
+        source_path = create_random_file(self.temp_dir.name, "source.bin", file_size)
+        bucket = TokenBucket(rate)
+        consume = bucket.consume
+        num_bytes_seeded = 0
+
+        def count_consumed(num_bytes: int):
+            nonlocal num_bytes_seeded
+            num_bytes_seeded += num_bytes
+            consume(num_bytes)
+
+        bucket.consume = count_consumed
+        start = time.monotonic()
+        results = swarm_transfers.send_swarm(self.socks, source_path, TransferOptions(bucket=bucket))
+        elapsed = time.monotonic() - start
+        self.assertEqual(results, [True] * len(self.socks))
+        received_paths = [os.path.join(self.received_dir, name) for name in os.listdir(self.received_dir)]
+        self.assertEqual(len(received_paths), len(self.socks))
+        for received_path in received_paths:
+            self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        self.assertLess(num_bytes_seeded, 1.5 * file_size)
+        self.assertLess(elapsed, len(self.socks) * file_size / rate / 2)
+
+    def test_dropped_receiver_pieces_are_seeded_again(self):
+        """Test that pieces only a receiver that dropped out had are seeded again, and that the swarm then finishes."""
+
+        seeder = SwarmSeeder(3 * constants.MERKLE_LEAF_SIZE, 2)
+        pieces = [seeder.next_piece(0) for _ in range(3)]
+        self.assertEqual(pieces, [0, 1, 2])
+        for piece_index in pieces:
+            seeder.add_piece(0, piece_index)
+        seeder.add_piece(1, 1)
+        seeder.fail(0)
+        self.assertEqual([seeder.next_piece(1), seeder.next_piece(1)], [0, 2])
+        seeder.add_piece(1, 0)
+        seeder.reject_piece(1, 2)
+        self.assertEqual(seeder.next_piece(1), 2)
+        seeder.add_piece(1, 2)
+        self.assertIsNone(seeder.next_piece(1))
+        self.assertIsNone(seeder.next_piece(0))
+
+    def test_encrypted_swarm_round_trip(self):
+        """Test that every receiver of an encrypted swarm gets the file intact while no piece is seeded in the
+        clear, and that each piece is sealed once for both the manifest and seeding."""
+
+        source_path = create_log_file(self.temp_dir.name, "source.log", 100000)
+        with open(source_path, "rb") as f:
+            first_line = f.readline()
+        seeded_pieces = []
+        send_piece = getattr(swarm_transfers, "__send_piece")
+
+        def record_piece(sock: socket.socket, piece_index: bytes, data: bytes):
+            seeded_pieces.append(bytes(data))
+            send_piece(sock, piece_index, data)
+
+        seal_piece = getattr(swarm_transfers, "__seal_piece")
+        with mock.patch.object(swarm_transfers, "__send_piece", record_piece), \
+                mock.patch.object(swarm_transfers, "__seal_piece", wraps=seal_piece) as seal:
+            results = swarm_transfers.send_swarm(self.socks, source_path, TransferOptions(encrypt=True))
+        self.assertEqual(results, [True] * len(self.socks))
+        self.assertEqual(seal.call_count, merkle.get_num_leaves(0, os.path.getsize(source_path)))
+        for name in os.listdir(self.received_dir):
+            self.assertTrue(filecmp.cmp(source_path, os.path.join(self.received_dir, name), shallow=False))
+        self.assertTrue(seeded_pieces)
+        self.assertFalse(any(first_line in piece for piece in seeded_pieces))
+
+    def test_encrypted_swarm_piece_hashes_are_cached(self):
+        """Test that swarming a file again takes the hashes of its sealed pieces from the chunk cache, and the sealed
+        pieces themselves."""
+
+        patcher = mock.patch.object(constants, "CHUNK_CACHE_DIR", os.path.join(self.temp_dir.name, "cache"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ChunkCache().clear()
+        self.addCleanup(ChunkCache().clear)
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 3 * constants.MERKLE_LEAF_SIZE + 5)
+        # The file is given a content key only once it's old enough not to change unnoticed
+        os.utime(source_path, (time.time() - 60, time.time() - 60))
+        options = TransferOptions(encrypt=True, chunk_cache=ChunkCache())
+        hash_sealed_piece, seal_piece = getattr(swarm_transfers, "__hash_sealed_piece"), \
+            getattr(swarm_transfers, "__seal_piece")
+        with mock.patch.object(swarm_transfers, "__hash_sealed_piece", wraps=hash_sealed_piece) as hash_piece, \
+                mock.patch.object(swarm_transfers, "__seal_piece", wraps=seal_piece) as seal:
+            for _ in range(2):
+                self.assertEqual(swarm_transfers.send_swarm(self.socks, source_path, options), [True] * len(self.socks))
+        self.assertEqual((hash_piece.call_count, seal.call_count), (4, 4))
+        for name in os.listdir(self.received_dir):
+            self.assertTrue(filecmp.cmp(source_path, os.path.join(self.received_dir, name), shallow=False))
+
+    def test_peer_addresses_are_validated(self):
+        """Test that peers must be IP addresses and ports, and that paths are only kept for a sender on this host."""
+
+        self.assertEqual(parse_peer_addresses('[["127.0.0.1", 5000], "/tmp/peer.sock"]', False), [("127.0.0.1", 5000)])
+        self.assertEqual(parse_peer_addresses('["/tmp/peer.sock"]', True), ["/tmp/peer.sock"])
+        for peer_addresses_json in ["not json", "{}", '[["example.com", 5000]]', '[["127.0.0.1", 0]]',
+                                    '[["127.0.0.1", "5000"]]', '[["127.0.0.1", 5000, 1]]', "[null]"]:
+            with self.subTest(peer_addresses_json=peer_addresses_json):
+                self.assertIsNone(parse_peer_addresses(peer_addresses_json, True))
+
+    def test_malformed_peer_addresses_are_refused(self):
+        """Test that a swarm announced with malformed peers is refused without dropping the connection."""
+
+        req = ClientRequest(ClientRequestType.SEND_SWARM, ["source.bin", "1", "0" * 32, "not json", "0"])
+        framing.send_frame(self.socks[0], FrameType.REQUEST, req.to_bytes())
+        res = ServerResponse.from_bytes(framing.recv_frame(self.socks[0], FrameType.RESPONSE))
+        self.assertFalse(res.bool_res)
+        self.assertTrue(socket_helpers.is_connected_to(self.socks[0]))
+        self.assertFalse(os.path.exists(self.received_dir) and os.listdir(self.received_dir))
+
+    def test_unknown_swarm_is_refused(self):
+        """Test that pieces can't be fetched without the ID of a swarm in progress."""
+
+        req = ClientRequest(ClientRequestType.FETCH_SWARM_PIECES, ["0" * 32])
+        framing.send_frame(self.socks[0], FrameType.REQUEST, req.to_bytes())
+        res = ServerResponse.from_bytes(framing.recv_frame(self.socks[0], FrameType.RESPONSE))
+        self.assertFalse(res.bool_res)
+
+
+class TestDataConnections(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.received_dir = os.path.join(self.temp_dir.name, "received")
+        # The server both answers for and consents on behalf of a user who added the sender as a contact
+        contacts = ContactList()
+        contacts.add_contact(Contact("Sender", "sender@example.com"))
+        for patcher in [mock.patch.object(ContactManager, "get_contacts", return_value=contacts),
+                        mock.patch.object(LoginManager, "get_logged_in_user_credentials",
+                                          return_value=Credentials("Sender", "sender@example.com", "password"))]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.server = start_server(self, self.received_dir)
+        is_done = threading.Event()
+        self.addCleanup(is_done.set)
+
+        def consent():
+            while not is_done.wait(0.01):
+                if self.server.is_waiting_for_send_file_consent():
+                    self.server.consent_to_receive_file()
+
+        threading.Thread(target=consent, daemon=True).start()
+        self.contact = Contact("Receiver", "receiver@example.com")
+        self.listener = BroadcastListener()
+        address = (constants.SERVER_IP, self.server.get_port())
+        connection = Connection(uuid.uuid4(), self.contact.email, socket.create_connection(address), address)
+        self.listener._BroadcastListener__add_connection(connection)
+        # Hold transfers to a rate at which they take a while
+        BandwidthManager().set_limit(self.contact.email, 4 * 1024 * 1024, Direction.SEND)
+        self.addCleanup(BandwidthManager().set_limit, self.contact.email, None, Direction.SEND)
+
+    def tearDown(self):
+        self.listener.stop()
+        self.temp_dir.cleanup()
+
+    def __send_in_background(self, source_path: str) -> Tuple[threading.Thread, dict]:
+        results = {}
+
+        def send():
+            results["sent"] = self.listener.send_file(self.contact, source_path)
+
+        sender_thread = threading.Thread(target=send)
+        sender_thread.start()
+        # Wait for the transfer to be under way
+        while not os.path.isdir(self.received_dir) or not os.listdir(self.received_dir):
+            time.sleep(0.01)
+        return sender_thread, results
+
+    def test_control_requests_are_answered_during_transfer(self):
+        """Test that presence checks are answered within milliseconds while a file is being sent to the same contact,
+        and that neither gets in the way of the other."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 4 * 1024 * 1024)
+        sender_thread, results = self.__send_in_background(source_path)
+        latencies: List[float] = []
+        while sender_thread.is_alive():
+            start = time.perf_counter()
+            self.assertTrue(self.listener.contact_has_reciprocated(self.contact))
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.05)
+        sender_thread.join()
+        self.assertTrue(results["sent"])
+        self.assertTrue(filecmp.cmp(source_path, os.path.join(self.received_dir, "source.bin"), shallow=False))
+        self.assertGreater(len(latencies), 5)
+        self.assertLess(max(latencies), 0.1)
+
+    def test_stopping_cuts_off_running_transfer(self):
+        """Test that a transfer running over its own connection gives up as soon as the listener stops."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 16 * 1024 * 1024)
+        sender_thread, results = self.__send_in_background(source_path)
+        self.listener.stop()
+        sender_thread.join(1)
+        self.assertFalse(sender_thread.is_alive())
+        self.assertFalse(results["sent"])
+
+
+class TestTimeouts(unittest.TestCase):
+    def setUp(self):
+        # The server end of the pair never answers anything
+        self.client_sock, self.server_sock = create_loopback_pair()
+        self.addCleanup(self.client_sock.close)
+        self.addCleanup(self.server_sock.close)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        # Servers answer for a user who added the sender as a contact, but never consent on their behalf
+        contacts = ContactList()
+        contacts.add_contact(Contact("Sender", "sender@example.com"))
+        for patcher in [mock.patch.object(ContactManager, "get_contacts", return_value=contacts),
+                        mock.patch.object(LoginManager, "get_logged_in_user_credentials",
+                                          return_value=Credentials("Sender", "sender@example.com", "password"))]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def __assert_is_answered_within(self, max_seconds: float, request: Callable[[], object], expected: object):
+        start = time.monotonic()
+        self.assertEqual(request(), expected)
+        self.assertLess(time.monotonic() - start, max_seconds)
+
+    def test_unresponsive_server_times_out(self):
+        """Test that every request/response helper gives up on a server that never answers by its deadline."""
+
+        for request, expected in [(lambda: socket_helpers.is_connected_to(self.client_sock, 0.2), False),
+                                  (lambda: socket_helpers.get_email(self.client_sock, 0.2), None),
+                                  (lambda: socket_helpers.has_added_user(self.client_sock, "a@example.com", 0.2), None),
+                                  (lambda: socket_helpers.consents_to_receive_file(self.client_sock, 0.2), False)]:
+            with self.subTest(expected=expected):
+                self.client_sock, self.server_sock = create_loopback_pair()
+                self.addCleanup(self.client_sock.close)
+                self.addCleanup(self.server_sock.close)
+                self.__assert_is_answered_within(1, request, expected)
+
+    def test_timeouts_are_configured_per_request_type(self):
+        """Test that a request without a timeout of its own is given the one configured for its type, and that the
+        connection it timed out on is not used any further, since a late response would be mistaken for the next."""
+
+        with mock.patch.dict(transfer_helpers.REQUEST_TIMEOUTS_SECONDS, {ClientRequestType.PING: 0.2}):
+            self.__assert_is_answered_within(1, lambda: socket_helpers.is_connected_to(self.client_sock), False)
+        self.assertIsNotNone(framing.recv_frame(self.server_sock, FrameType.REQUEST))
+        framing.send_frame(self.server_sock, FrameType.RESPONSE, ServerResponse(str_res="ping").to_bytes())
+        self.__assert_is_answered_within(1, lambda: socket_helpers.get_email(self.client_sock), None)
+
+    def test_consent_wait_is_cancelled(self):
+        """Test that waiting for a contact's consent gives up as soon as the transfer is cancelled."""
+
+        cancelled = threading.Event()
+        threading.Timer(0.2, cancelled.set).start()
+        self.__assert_is_answered_within(
+            1, lambda: socket_helpers.consents_to_receive_file(self.client_sock, cancelled=cancelled), False)
+
+    def test_server_rejects_unanswered_consent(self):
+        """Test that a server whose user doesn't answer in time rejects the file for them, as it does once the
+        sender stops waiting."""
+
+        with mock.patch.object(constants, "SEND_FILE_CONSENT_TIMEOUT_SECONDS", 0.3):
+            server = start_server(self, self.temp_dir.name)
+            with socket.create_connection((constants.SERVER_IP, server.get_port())) as sock:
+                self.__assert_is_answered_within(2, lambda: socket_helpers.consents_to_receive_file(sock), False)
+                self.assertFalse(server.is_waiting_for_send_file_consent())
+            with socket.create_connection((constants.SERVER_IP, server.get_port())) as sock:
+                self.assertFalse(socket_helpers.consents_to_receive_file(sock, 0.1))
+                time.sleep(3 * constants.SERVER_POLL_INTERVAL_SECONDS)
+                self.assertFalse(server.is_waiting_for_send_file_consent())
+
+    def test_server_drops_stalled_request(self):
+        """Test that a server hangs up on a client that stops halfway through a request."""
+
+        with mock.patch.object(constants, "SERVER_REQUEST_TIMEOUT_SECONDS", 0.2):
+            server = start_server(self, self.temp_dir.name)
+            with socket.create_connection((constants.SERVER_IP, server.get_port())) as sock:
+                sock.sendall(framing.FRAME_HEADER.pack(FrameType.REQUEST.value, 64)[:-1])
+                sock.settimeout(2)
+                self.__assert_is_answered_within(2, lambda: sock.recv(1), b"")
+
+    def test_server_refuses_malformed_request(self):
+        """Test that a request with missing or malformed arguments is refused without dropping the connection."""
+
+        server = start_server(self, self.temp_dir.name)
+        with socket.create_connection((constants.SERVER_IP, server.get_port())) as sock:
+            for req in [ClientRequest(ClientRequestType.SEND_FILE, ["source.bin", "many", ""]),
+                        ClientRequest(ClientRequestType.SEND_FILE, ["source.bin"]),
+                        ClientRequest(ClientRequestType.SEND_ARCHIVE, ["1", "4", "not a mode", "1", "1"]),
+                        ClientRequest(ClientRequestType.SEND_ARCHIVE, [])]:
+                with self.subTest(req=req.to_bytes()):
+                    framing.send_frame(sock, FrameType.REQUEST, req.to_bytes())
+                    res = ServerResponse.from_bytes(framing.recv_frame(sock, FrameType.RESPONSE))
+                    self.assertFalse(res.bool_res)
+            self.assertTrue(socket_helpers.is_connected_to(sock))
+
+
+class TestChunkCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.received_dir = os.path.join(self.temp_dir.name, "received")
+        os.mkdir(self.received_dir)
+        patcher = mock.patch.object(constants, "CHUNK_CACHE_DIR", os.path.join(self.temp_dir.name, "cache"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = ChunkCache()
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+
+    def __transfer(self, source_path: str, options: TransferOptions) -> Tuple[str, CompressionMetrics]:
+        metrics = CompressionMetrics()
+        sender_sock, receiver_sock = socket.socketpair()
+        with sender_sock, receiver_sock:
+            results = {}
+            sender_thread = threading.Thread(target=lambda: results.update(sent=socket_helpers.send_file(
+                sender_sock, source_path, options, metrics)))
+            sender_thread.start()
+            received_path = receive(receiver_sock, self.received_dir)
+            sender_thread.join()
+        self.assertTrue(results["sent"])
+        self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+        os.remove(received_path)
+        return received_path, metrics
+
+    def test_chunks_are_counted_and_evicted_least_recently_used_first(self):
+        """Test that the cache counts its hits and misses, and evicts the chunks used longest ago once it's full."""
+
+        entry_size = hashlib.sha256().digest_size + 100
+        with mock.patch.object(constants, "CHUNK_CACHE_MAX_SIZE", 2 * entry_size):
+            self.cache.put("file", "kind", 0, b"0" * 100)
+            self.cache.put("file", "kind", 1, b"1" * 100)
+            self.assertEqual(self.cache.get("file", "kind", 0), b"0" * 100)
+            self.cache.put("file", "kind", 2, b"2" * 100)
+            self.assertIsNone(self.cache.get("file", "kind", 1))
+            self.assertIsNone(self.cache.get("file", "other kind", 0))
+            self.assertEqual(self.cache.get("file", "kind", 2), b"2" * 100)
+        stats = self.cache.get_stats()
+        self.assertEqual((stats.num_hits, stats.num_misses, stats.num_entries, stats.size), (2, 2, 2, 2 * entry_size))
+        self.cache.clear()
+        stats = self.cache.get_stats()
+        self.assertEqual((stats.num_hits, stats.num_misses, stats.num_entries, stats.size), (0, 0, 0, 0))
+        self.assertEqual(os.listdir(constants.CHUNK_CACHE_DIR), [])
+
+    def test_corrupt_chunk_is_a_miss(self):
+        """Test that a chunk whose entry was damaged on disk is not used."""
+
+        self.cache.put("file", "kind", 0, b"chunk")
+        (entry_name,) = os.listdir(constants.CHUNK_CACHE_DIR)
+        with open(os.path.join(constants.CHUNK_CACHE_DIR, entry_name), "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"!")
+        self.assertIsNone(self.cache.get("file", "kind", 0))
+        self.assertEqual(self.cache.get_stats().num_entries, 0)
+
+    def test_compressed_resend_streams_from_cache(self):
+        """Test that sending a file compressed again takes every compressed chunk from the cache, without compressing
+        anything, and that a stream whose early chunks were evicted is picked up by compressing from there."""
+
+        source_path = create_log_file(self.temp_dir.name, "app.log", 50000)
+        options = TransferOptions(compression=Compression.ZLIB, chunk_cache=self.cache)
+        _, first_metrics = self.__transfer(source_path, options)
+        num_chunks = self.cache.get_stats().num_entries
+        self.assertGreater(num_chunks, 2)
+        self.assertGreater(first_metrics.cpu_seconds, 0)
+        _, second_metrics = self.__transfer(source_path, options)
+        stats = self.cache.get_stats()
+        self.assertEqual(stats.num_hits, num_chunks)
+        self.assertEqual(second_metrics.cpu_seconds, 0)
+        self.assertEqual(second_metrics.num_compressed_bytes, first_metrics.num_compressed_bytes)
+        # Use the first two chunks again, so that the third is evicted first
+        file_key = ChunkCache.get_file_key(source_path, os.stat(source_path))
+        kind = f"zlib_{constants.DEFAULT_COMPRESSION_LEVEL}_{constants.COMPRESSION_READ_SIZE}"
+        for chunk_index in range(2):
+            self.assertIsNotNone(self.cache.get(file_key, kind, chunk_index))
+        with mock.patch.object(constants, "CHUNK_CACHE_MAX_SIZE", stats.size - 1):
+            self.cache.put("other file", "kind", 0, b"")
+        _, third_metrics = self.__transfer(source_path, options)
+        self.assertEqual(self.cache.get_stats().num_hits, num_chunks + 4)
+        self.assertEqual(third_metrics.num_compressed_bytes, first_metrics.num_compressed_bytes)
+
+    def test_leaf_hashes_are_cached_until_file_changes(self):
+        """Test that a verified transfer takes the hashes of the file's leaves from the cache the second time, and
+        that none are used once the file changed."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 3 * constants.MERKLE_LEAF_SIZE + 5)
+        options = TransferOptions(zero_copy=False, chunk_cache=self.cache)
+        self.__transfer(source_path, options)
+        self.__transfer(source_path, options)
+        self.assertEqual((self.cache.get_stats().num_hits, self.cache.get_stats().num_misses), (4, 4))
+        with open(source_path, "r+b") as f:
+            f.write(b"changed")
+        os.utime(source_path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        self.__transfer(source_path, options)
+        self.assertEqual((self.cache.get_stats().num_hits, self.cache.get_stats().num_misses), (4, 8))
+
+    def test_content_key_is_kept_for_unchanged_file(self):
+        """Test that a file is given the same content key every time until it changes, a key per chunk size, and none
+        while it was modified too recently to tell whether it changed."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 100)
+        options = TransferOptions(encrypt=True, chunk_cache=self.cache)
+
+        def get_content_key(chunk_size: int) -> Optional[bytes]:
+            file_stat = os.stat(source_path)
+            return transfer_helpers.get_content_key(file_stat, options, ChunkCache.get_file_key(source_path, file_stat),
+                                                    chunk_size)
+
+        self.assertIsNone(get_content_key(constants.ENCRYPTION_CHUNK_SIZE))
+        os.utime(source_path, (time.time() - 60, time.time() - 60))
+        key = get_content_key(constants.ENCRYPTION_CHUNK_SIZE)
+        self.assertEqual(len(key), constants.TRANSFER_KEY_SIZE)
+        self.assertEqual(get_content_key(constants.ENCRYPTION_CHUNK_SIZE), key)
+        self.assertNotEqual(get_content_key(constants.MERKLE_LEAF_SIZE), key)
+        os.utime(source_path, (time.time() - 30, time.time() - 30))
+        self.assertNotEqual(get_content_key(constants.ENCRYPTION_CHUNK_SIZE), key)
+
+
+class TestSocketTuning(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    @staticmethod
+    def __simulate_chunk_sizer(throughput: float, rtt: float, duration: float) -> ChunkSizer:
+        """Feeds a chunk sizer the frames of a pipelined transfer over a link of a given throughput and round-trip
+        time, acknowledged the way the receiver does, and returns it."""
+
+        window_size, ack_interval = constants.TRANSFER_WINDOW_SIZE, constants.TRANSFER_ACK_INTERVAL
+        clock = [0.0]
+        send_times: List[float] = []
+        with mock.patch.object(time, "monotonic", lambda: clock[0]):
+            sizer = ChunkSizer(window_size)
+            num_chunks_acked = 0
+            while clock[0] < duration:
+                # The window stays full, so every chunk acknowledged lets another one be sent
+                while len(send_times) - num_chunks_acked < window_size:
+                    clock[0] += sizer.chunk_size / throughput
+                    sizer.on_sent(sizer.chunk_size)
+                    send_times.append(clock[0])
+                num_chunks_acked += ack_interval
+                clock[0] = max(clock[0], send_times[num_chunks_acked - 1] + rtt)
+                sizer.on_acked(num_chunks_acked)
+        return sizer
+
+    def test_chunks_grow_with_throughput(self):
+        """Test that a fast transfer grows its chunks, up to the largest allowed size."""
+
+        sizer = self.__simulate_chunk_sizer(1e9, 0.0005, 2)
+        self.assertEqual(sizer.chunk_size, constants.MAX_FILE_CHUNK_SIZE)
+
+    def test_chunks_grow_when_window_holds_transfer_back(self):
+        """Test that chunks grow on a link with latency whose throughput the window alone holds back."""
+
+        sizer = self.__simulate_chunk_sizer(1e9, 0.05, 5)
+        self.assertGreater(sizer.chunk_size * constants.TRANSFER_WINDOW_SIZE, 1e9 * 0.05 / 2)
+
+    def test_slow_transfer_keeps_small_chunks(self):
+        """Test that a transfer held to a low rate, such as by a bandwidth cap, keeps its chunks small."""
+
+        sizer = self.__simulate_chunk_sizer(256 * 1024, 0.0005, 5)
+        self.assertEqual(sizer.chunk_size, constants.FILE_CHUNK_SIZE)
+
+    def test_buffers_are_left_to_autotuning(self):
+        """Test that tuning a connection doesn't fix the size of its buffers unless a size is configured."""
+
+        sender_sock, receiver_sock = create_loopback_pair()
+        with sender_sock, receiver_sock:
+            options = [socket.SO_SNDBUF, socket.SO_RCVBUF]
+            buffer_sizes = [sender_sock.getsockopt(socket.SOL_SOCKET, option) for option in options]
+            socket_tuning.tune_connection(sender_sock)
+            self.assertEqual([sender_sock.getsockopt(socket.SOL_SOCKET, option) for option in options], buffer_sizes)
+
+    def test_buffers_are_only_fixed_within_system_limits(self):
+        """Test that a configured buffer size is only set if the system allows buffers that large."""
+
+        buffer_size = 1024 * 1024
+        for limit, is_fixed in [(buffer_size // 2, False), (buffer_size, True), (None, True)]:
+            with self.subTest(limit=limit), mock.patch.object(constants, "TCP_SOCKET_BUFFER_SIZE", buffer_size), \
+                    mock.patch.object(socket_tuning, "__read_buffer_size_limit", return_value=limit):
+                sender_sock, receiver_sock = create_loopback_pair()
+                with sender_sock, receiver_sock:
+                    socket_tuning.tune_connection(sender_sock)
+                    receive_buffer_size = sender_sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+                    self.assertEqual(receive_buffer_size >= buffer_size, is_fixed)
+
+    def test_small_transfer_is_not_delayed(self):
+        """Test that a small file sent over a tuned connection isn't held back waiting for delayed acknowledgements."""
+
+        source_path = create_random_file(self.temp_dir.name, "source.bin", 5000)
+        elapsed: List[float] = []
+        for _ in range(5):
+            sender_sock, receiver_sock = create_loopback_pair()
+            with sender_sock, receiver_sock:
+                socket_tuning.tune_connection(sender_sock)
+                socket_tuning.tune_connection(receiver_sock)
+                self.assertEqual(sender_sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), 1)
+                start = time.perf_counter()
+                received_path = transfer(sender_sock, receiver_sock, source_path, self.temp_dir.name)
+                elapsed.append(time.perf_counter() - start)
+            self.assertTrue(filecmp.cmp(source_path, received_path, shallow=False))
+            os.remove(received_path)
+        # Waiting on a delayed acknowledgement would cost about 40 ms on every transfer
+        self.assertLess(sorted(elapsed)[len(elapsed) // 2], 0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()